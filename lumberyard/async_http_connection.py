@@ -0,0 +1,606 @@
+# -*- coding: utf-8 -*-
+"""
+async_http_connection.py
+
+asyncio counterparts of HTTPConnection and UnAuthHTTPConnection
+
+Requests are signed exactly as HTTPConnection signs them, are retried under
+the same RetryPolicy, and failures raise the same LumberyardHTTPError and
+LumberyardRetryableHTTPError exceptions.
+Each connection object keeps a pool of keep-alive streams, so many requests
+can be in flight at once::
+
+    connection = AsyncHTTPConnection(hostname, user_name, auth_key, auth_id)
+    response = await connection.request("GET", uri)
+    data = await response.read()
+    await connection.close()
+
+Requires Python 3.5 or later.
+"""
+import asyncio
+from http.client import HTTPConnection as _PlainHTTPConnection
+from http.client import OK
+from http.client import SERVICE_UNAVAILABLE
+from http.client import INTERNAL_SERVER_ERROR
+from http.client import NO_CONTENT
+from http.client import NOT_MODIFIED
+import logging
+from urllib.parse import unquote_plus
+
+from lumberyard.http_connection import LumberyardHTTPError, \
+    LumberyardRetryableHTTPError, \
+    CircuitOpenError, \
+    parse_retry_after, \
+    _base_class, \
+    _timeout
+from lumberyard.retry_policy import default_retry_policy
+from lumberyard.tls_session_cache import default_ssl_context
+from lumberyard.http_util import current_timestamp, \
+    compute_authentication_string, \
+    compute_body_length
+
+# follow HTTPConnection: NIMBUS_IO_SERVICE_SSL=0 selects plain HTTP
+_use_ssl = _base_class is not _PlainHTTPConnection
+
+_max_streams = 8
+_body_block_size = 64 * 1024
+_max_header_lines = 100
+_agent = "lumberyard/1.0"
+
+class _Stream(object):
+    """
+    one keep-alive socket connection
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        self.writer.close()
+
+class AsyncHTTPResponse(object):
+    """
+    the response to an AsyncHTTPConnection request
+
+    The body is read incrementally from the stream. When it has been read
+    completely (or the response is released) the stream goes back to the
+    connection's pool.
+    """
+    def __init__(self, connection, stream, method, timeout):
+        self._connection = connection
+        self._stream = stream
+        self._method = method
+        self._timeout = timeout
+        self.status = None
+        self.reason = None
+        self.version = None
+        self._headers = list()
+        self._remaining = None
+        self._chunked = False
+        self._chunk_remaining = 0
+        self.will_close = False
+        self._complete = False
+
+    async def _readline(self):
+        return await asyncio.wait_for(self._stream.reader.readline(),
+                                      self._timeout)
+
+    async def _begin(self):
+        status_line = await self._readline()
+        if len(status_line) == 0:
+            raise ConnectionResetError("connection closed by server")
+        try:
+            version, status, reason = \
+                status_line.decode("iso-8859-1").rstrip("\r\n").split(" ", 2)
+            self.status = int(status)
+        except ValueError:
+            raise LumberyardHTTPError(INTERNAL_SERVER_ERROR, "BadStatusLine")
+        self.version = version
+        self.reason = reason
+
+        for _ in range(_max_header_lines):
+            line = await self._readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, value = line.decode("iso-8859-1").split(":", 1)
+            self._headers.append((name.strip(), value.strip(), ))
+        else:
+            raise LumberyardHTTPError(INTERNAL_SERVER_ERROR,
+                                      "too many headers")
+
+        connection_header = self.getheader("Connection", "").lower()
+        self.will_close = (connection_header == "close" or \
+                           (version == "HTTP/1.0" and \
+                            connection_header != "keep-alive"))
+
+        if self._method == "HEAD" or \
+            self.status in (NO_CONTENT, NOT_MODIFIED, ) or \
+            100 <= self.status < 200:
+            self._remaining = 0
+        elif self.getheader("Transfer-Encoding", "").lower() == "chunked":
+            self._chunked = True
+        else:
+            content_length = self.getheader("Content-Length")
+            if content_length is not None:
+                self._remaining = int(content_length)
+            else:
+                # the body is delimited by the server closing the connection
+                self.will_close = True
+
+        if self._remaining == 0:
+            self._finish()
+
+    def getheader(self, name, default=None):
+        """
+        return the value of the named header, or default
+        """
+        name = name.lower()
+        values = [v for (n, v) in self._headers if n.lower() == name]
+        if len(values) == 0:
+            return default
+        return ", ".join(values)
+
+    def getheaders(self):
+        return list(self._headers)
+
+    def isclosed(self):
+        return self._complete
+
+    def _finish(self):
+        if self._complete:
+            return
+        self._complete = True
+        stream, self._stream = self._stream, None
+        self._connection._release_stream(stream, reuse=not self.will_close)
+
+    def _abort(self):
+        if self._complete:
+            return
+        self._complete = True
+        stream, self._stream = self._stream, None
+        self._connection._release_stream(stream, reuse=False)
+
+    async def _read_chunk_size(self):
+        line = await self._readline()
+        size = int(line.split(b";")[0].strip(), 16)
+        if size == 0:
+            # skip trailers up to the terminating blank line
+            while True:
+                line = await self._readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+        return size
+
+    async def _read_some(self, amt):
+        """
+        return up to amt bytes of body, b"" at the end
+        """
+        reader = self._stream.reader
+        if self._chunked:
+            if self._chunk_remaining == 0:
+                self._chunk_remaining = await self._read_chunk_size()
+                if self._chunk_remaining == 0:
+                    self._finish()
+                    return b""
+            data = await asyncio.wait_for(
+                reader.read(min(amt, self._chunk_remaining)), self._timeout)
+            if len(data) == 0:
+                raise ConnectionResetError("incomplete chunked body")
+            self._chunk_remaining -= len(data)
+            if self._chunk_remaining == 0:
+                # the CRLF that ends the chunk
+                await self._readline()
+            return data
+
+        if self._remaining is None:
+            data = await asyncio.wait_for(reader.read(amt), self._timeout)
+            if len(data) == 0:
+                self._finish()
+            return data
+
+        data = await asyncio.wait_for(reader.read(min(amt, self._remaining)),
+                                      self._timeout)
+        if len(data) == 0:
+            raise ConnectionResetError("incomplete body")
+        self._remaining -= len(data)
+        if self._remaining == 0:
+            self._finish()
+        return data
+
+    async def read(self, amt=None):
+        """
+        read up to amt bytes of the body, or all of it if amt is None
+        return b"" when the body is exhausted
+        """
+        if self._complete:
+            return b""
+        try:
+            if amt is not None:
+                return await self._read_some(amt)
+            parts = list()
+            while not self._complete:
+                data = await self._read_some(_body_block_size)
+                if len(data) == 0:
+                    break
+                parts.append(data)
+            return b"".join(parts)
+        except BaseException:
+            self._abort()
+            raise
+
+    async def iter_chunks(self, chunk_size=_body_block_size):
+        """
+        an async generator of body chunks, for streaming large bodies
+        """
+        while True:
+            data = await self.read(chunk_size)
+            if len(data) == 0:
+                break
+            yield data
+
+    def __aiter__(self):
+        return self.iter_chunks()
+
+    async def release(self):
+        """
+        discard the rest of the body so the stream can be reused
+        """
+        while not self._complete:
+            await self.read(_body_block_size)
+
+    def close(self):
+        """
+        give up on the rest of the body and close the stream
+        """
+        self._abort()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.release()
+        else:
+            self.close()
+
+def _is_async_iterable(body):
+    return hasattr(body, "__aiter__")
+
+async def _iterate_body(body):
+    """
+    yield the request body as bytes in blocks
+    """
+    if _is_async_iterable(body):
+        async for data in body:
+            yield data
+    elif hasattr(body, "read"):
+        while True:
+            data = body.read(_body_block_size)
+            if len(data) == 0:
+                break
+            yield data
+    else:
+        for data in body:
+            yield data
+
+class AsyncUnAuthHTTPConnection(object):
+    """
+    base_address
+        A hostname or address that should resolve to a socket connection on a
+        server.
+
+        For example ``nimbus.io`` or ``127.0.0.1:8088``
+
+    max_streams
+        the maximum number of requests in flight at once
+
+    timeout
+        default per-request timeout in seconds, None for no timeout
+
+    retry_policy
+        the RetryPolicy deciding when a failed request is sent again;
+        default_retry_policy() if None
+
+    asyncio wrapper for an unauthenticated nimbus.io connection
+    """
+    def __init__(self,
+                 base_address,
+                 max_streams=_max_streams,
+                 timeout=_timeout,
+                 retry_policy=None):
+        self._log = logging.getLogger("AsyncUnAuthHTTPConnection")
+        self._base_address = base_address
+        if retry_policy is None:
+            retry_policy = default_retry_policy()
+        self._retry_policy = retry_policy
+        host, _, port = base_address.partition(":")
+        self._host = host
+        default_port = (443 if _use_ssl else 80)
+        self._port = (int(port) if port else default_port)
+        self._host_header = (host if self._port == default_port \
+                             else "{0}:{1}".format(host, self._port))
+        self._timeout = timeout
+        self._idle_streams = list()
+        self._semaphore = asyncio.Semaphore(max_streams)
+        self._ssl_context = None
+
+    async def _open_stream(self, timeout):
+        ssl_context = None
+        if _use_ssl:
+            if self._ssl_context is None:
+                self._ssl_context = default_ssl_context()
+            ssl_context = self._ssl_context
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self._host, self._port, ssl=ssl_context),
+            timeout)
+        return _Stream(reader, writer)
+
+    def _release_stream(self, stream, reuse=True):
+        if stream is None:
+            return
+        if reuse and not stream.reader.at_eof():
+            self._idle_streams.append(stream)
+        else:
+            stream.close()
+        self._semaphore.release()
+
+    def _sign(self, method, uri, headers):
+        headers["agent"] = _agent
+
+    def _request_headers(self, method, uri, body, headers):
+        if headers is None:
+            headers = dict()
+        else:
+            headers = dict(headers)
+        self._sign(method, uri, headers)
+
+        header_names = set(name.lower() for name in headers)
+        if "host" not in header_names:
+            headers["Host"] = self._host_header
+        if "content-length" not in header_names and \
+            "transfer-encoding" not in header_names:
+            if body is None:
+                if method in ("PUT", "POST", ):
+                    headers["Content-Length"] = "0"
+            else:
+                content_length = compute_body_length(body)
+                if content_length is None:
+                    headers["Transfer-Encoding"] = "chunked"
+                else:
+                    headers["Content-Length"] = str(content_length)
+        return headers
+
+    async def _send(self, stream, method, uri, body, headers, timeout):
+        lines = ["{0} {1} HTTP/1.1".format(method, uri)]
+        for name, value in headers.items():
+            lines.append("{0}: {1}".format(name, value))
+        head = ("\r\n".join(lines) + "\r\n\r\n").encode("iso-8859-1")
+
+        writer = stream.writer
+        if body is None or \
+            isinstance(body, (bytes, bytearray, memoryview, str, )):
+            if isinstance(body, str):
+                body = body.encode("iso-8859-1")
+            writer.write(head if body is None else head + bytes(body))
+            await asyncio.wait_for(writer.drain(), timeout)
+            return
+
+        writer.write(head)
+        chunked = "chunked" in [v.lower() for (n, v) in headers.items() \
+                                if n.lower() == "transfer-encoding"]
+        async for data in _iterate_body(body):
+            if len(data) == 0:
+                continue
+            if chunked:
+                writer.write("{0:x}\r\n".format(len(data)).encode("ascii"))
+                writer.write(data)
+                writer.write(b"\r\n")
+            else:
+                writer.write(data)
+            await asyncio.wait_for(writer.drain(), timeout)
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+        await asyncio.wait_for(writer.drain(), timeout)
+
+    async def _exchange(self, stream, method, uri, body, headers, timeout):
+        await self._send(stream, method, uri, body, headers, timeout)
+        response = AsyncHTTPResponse(self, stream, method, timeout)
+        await response._begin()
+        return response
+
+    async def request(self,
+                      method,
+                      uri,
+                      body=None,
+                      headers=None,
+                      expected_status=OK,
+                      timeout=None):
+        """
+        method
+            one of GET, PUT, POST, DELETE, HEAD
+
+        uri
+            the REST command for this request
+
+        body
+            if present, bytes, a str, a file object, an iterable of bytes
+            or an async iterable of bytes. Bodies of unknown length are
+            sent with chunked transfer encoding.
+
+        headers
+            a dictionary of key/value pairs to be added to the HTTP headers
+
+        expected_status
+            status indicating a successful result, for example 201 CREATED
+
+        timeout
+            seconds allowed for each network operation of this request,
+            overriding the connection's default
+
+        send an HTTP request over a pooled stream, retrying transient
+        failures as the retry policy allows
+        return an AsyncHTTPResponse object, or raise an exception
+        """
+        retry = self._retry_policy.begin(self._base_address, method, body)
+        while True:
+            if not retry.before_attempt():
+                raise CircuitOpenError(self._base_address)
+            try:
+                response = await self._request_once(retry,
+                                                    method,
+                                                    uri,
+                                                    body,
+                                                    headers,
+                                                    expected_status,
+                                                    timeout)
+            except Exception as instance:
+                delay = retry.next_delay(instance)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            retry.succeeded()
+            return response
+
+    async def _request_once(self,
+                            retry,
+                            method,
+                            uri,
+                            body,
+                            headers,
+                            expected_status,
+                            timeout):
+        """
+        send the request once
+        """
+        if timeout is None:
+            timeout = self._timeout
+        headers = self._request_headers(method, uri, body, headers)
+        # a stale keep-alive stream may be closed by the server; we can only
+        # resend when the body can be sent again
+        replayable = body is None or \
+            isinstance(body, (bytes, bytearray, memoryview, str, ))
+
+        await self._semaphore.acquire()
+        response = None
+        try:
+            while response is None:
+                reused = len(self._idle_streams) > 0
+                if reused:
+                    stream = self._idle_streams.pop()
+                else:
+                    stream = await self._open_stream(timeout)
+                retry.request_sent = True
+                try:
+                    response = await self._exchange(stream,
+                                                     method,
+                                                     uri,
+                                                     body,
+                                                     headers,
+                                                     timeout)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    stream.close()
+                    if reused and replayable:
+                        self._log.debug("retrying on a fresh stream")
+                        continue
+                    raise
+                except BaseException:
+                    stream.close()
+                    raise
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+        if response.status != expected_status:
+            self._log.error("request failed {0} {1}".format(response.status,
+                                                            response.reason))
+            try:
+                await response.read()
+            except Exception:
+                pass
+            response.close()
+
+            # if we got 503 service unavailable
+            # and there is a retry_after header with a usable value
+            # give the caller a chance to retry
+            if response.status == SERVICE_UNAVAILABLE:
+                seconds = parse_retry_after(
+                    response.getheader("RETRY-AFTER", None))
+                if seconds is not None:
+                    raise LumberyardRetryableHTTPError(seconds)
+
+            raise LumberyardHTTPError(response.status, response.reason)
+
+        return response
+
+    async def close(self):
+        """
+        close every idle stream
+        """
+        while len(self._idle_streams) > 0:
+            self._idle_streams.pop().close()
+
+class AsyncHTTPConnection(AsyncUnAuthHTTPConnection):
+    """
+    base_address
+        A hostname or address that should resolve to a socket connection on a
+        server.
+
+        For example ``nimbus.io`` or ``127.0.0.1:8088``
+
+    user_name
+        name of a valid nimbus.io user
+
+    auth_key
+        an authentication key valid for the user
+
+    auth_id
+        the id number of the authentication key
+
+    max_streams
+        the maximum number of requests in flight at once
+
+    timeout
+        default per-request timeout in seconds, None for no timeout
+
+    retry_policy
+        the RetryPolicy deciding when a failed request is sent again;
+        default_retry_policy() if None
+
+    asyncio wrapper for an authenticated nimbus.io connection.
+    Requests are signed the same way HTTPConnection signs them.
+    """
+    def __init__(self,
+                 base_address,
+                 user_name,
+                 auth_key,
+                 auth_id,
+                 max_streams=_max_streams,
+                 timeout=_timeout,
+                 retry_policy=None):
+        AsyncUnAuthHTTPConnection.__init__(self,
+                                           base_address,
+                                           max_streams=max_streams,
+                                           timeout=timeout,
+                                           retry_policy=retry_policy)
+        self._log = logging.getLogger("AsyncHTTPConnection")
+        self._user_name = user_name
+        self._auth_key = auth_key
+        self._auth_id = auth_id
+
+    def _sign(self, method, uri, headers):
+        timestamp = current_timestamp()
+        authentication_string = compute_authentication_string(
+            self._auth_id,
+            self._auth_key,
+            self._user_name,
+            method,
+            timestamp,
+            unquote_plus(uri)
+        )
+
+        headers.update({
+            "Authorization"         : authentication_string,
+            "x-nimbus-io-timestamp" : str(timestamp),
+            "agent"                 : _agent
+        })
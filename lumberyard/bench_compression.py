@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+bench_compression.py
+
+effective MiB/s of compressed uploads and retrieves, for compressible and
+incompressible inputs
+
+Effective MiB/s is the uncompressed size over the time taken, so it is
+comparable with sending the bytes raw. Each codec is run as one stream
+("serial"), and on a pool of --workers threads ("pool"). Each row reports:
+
+    compress    reading through a CompressingReader, with nothing sent
+    upload      archive_stream to a local StandInServer
+    retrieve    a DownloadSink through a DecompressingWriter
+    ratio       uncompressed bytes over compressed bytes
+
+"raw" uploads and retrieves the input as it is, for comparison. The stand
+in server is local, so the network costs nothing unless it is limited:
+--upload-rate and --download-rate (bytes per second) stand in for a WAN
+link, which is where compression pays.
+
+The compressible input is generated log lines; the incompressible input
+is random bytes.
+
+    python -m lumberyard.bench_compression --size-mib 64 --workers 4
+    python -m lumberyard.bench_compression --upload-rate 12500000
+"""
+from __future__ import print_function
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.compression import CompressingReader, \
+    DecompressingWriter, \
+    codec_names, \
+    compression_meta
+from lumberyard.connection_pool import ConnectionPool
+from lumberyard.download_sink import DownloadSink
+from lumberyard.http_util import compute_uri
+from lumberyard.multipart_upload import MultipartUploader
+from lumberyard.ncl.identity import identity_template
+from lumberyard.rate_limiter import RateLimiter, set_default_rate_limiter
+from lumberyard.stand_in_server import StandInServer
+
+_identity = identity_template(user_name="bench-user",
+                              auth_key_id="1",
+                              auth_key="bench-key")
+_levels = ["INFO", "INFO", "INFO", "DEBUG", "WARNING", "ERROR", ]
+
+def _log_lines(size):
+    """
+    return about size bytes of log lines, with enough variety that they
+    compress as real logs do
+    """
+    rng = random.Random(1)
+    lines = list()
+    total = 0
+    while total < size:
+        line = "2024-01-{0:02} {1:02}:{2:02}:{3:02}.{4:03} {5:7} " \
+               "worker-{6} request {7:08x} {8} /data/key-{9} {10} " \
+               "{11} ms\n".format(
+                   rng.randint(1, 28), rng.randint(0, 23),
+                   rng.randint(0, 59), rng.randint(0, 59),
+                   rng.randint(0, 999), rng.choice(_levels),
+                   rng.randint(1, 16), rng.getrandbits(32),
+                   rng.choice(["GET", "POST", "DELETE"]),
+                   rng.randint(0, 5000), rng.choice([200, 200, 200, 404]),
+                   rng.randint(1, 900)).encode("ascii")
+        lines.append(line)
+        total += len(line)
+    return b"".join(lines)[:size]
+
+def _compress(data, codec, executor):
+    reader = CompressingReader(io.BytesIO(data), codec, executor=executor)
+    buffer = bytearray(1024 * 1024)
+    start_time = time.time()
+    while reader.readinto(buffer) > 0:
+        pass
+    return time.time() - start_time, reader.stats()["ratio"]
+
+def _upload(pool, server, data, codec, executor):
+    uploader = MultipartUploader(pool, server.base_address, _identity)
+    source = io.BytesIO(data)
+    meta = None
+    if codec is not None:
+        source = CompressingReader(source, codec, executor=executor)
+        meta = compression_meta(codec)
+    start_time = time.time()
+    uploader.archive_stream("bench", source, meta=meta)
+    return time.time() - start_time
+
+def _retrieve(pool, server, codec, size):
+    written = [0]
+    def _count(view):
+        written[0] += len(view)
+    destination = _count
+    if codec is not None:
+        destination = DecompressingWriter(_count, codec)
+    start_time = time.time()
+    with pool.connection(server.base_address, _identity) as http_connection:
+        response = http_connection.request("GET", compute_uri("data",
+                                                              "bench"))
+        DownloadSink(destination).drain(response)
+    if codec is not None:
+        destination.close()
+    elapsed_seconds = time.time() - start_time
+    if written[0] != size:
+        raise AssertionError("retrieved {0} of {1} bytes".format(written[0],
+                                                                size))
+    return elapsed_seconds
+
+def _parse_commandline():
+    parser = argparse.ArgumentParser(
+        description="benchmark streaming compression")
+    parser.add_argument("--size-mib", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="threads for the pool rows")
+    parser.add_argument("--codec", type=str, action="append",
+                        choices=codec_names,
+                        help="codecs to run; by default all of them")
+    parser.add_argument("--upload-rate", type=float, default=None,
+                        help="limit uploads to this many bytes per second")
+    parser.add_argument("--download-rate", type=float, default=None,
+                        help="limit retrieves to this many bytes per second")
+    return parser.parse_args()
+
+def main():
+    args = _parse_commandline()
+    size = args.size_mib * 1024 * 1024
+    inputs = [("compressible", _log_lines(size), ),
+              ("incompressible", os.urandom(size), ), ]
+    codecs = (args.codec or codec_names)
+    if args.upload_rate is not None or args.download_rate is not None:
+        set_default_rate_limiter(RateLimiter(
+            upload_bytes_per_second=args.upload_rate,
+            download_bytes_per_second=args.download_rate))
+
+    server = StandInServer({_identity.user_name : (_identity.auth_key_id,
+                                                   _identity.auth_key)})
+    server.start()
+    pool = ConnectionPool()
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    mib = float(size) / (1024 * 1024)
+    try:
+        print("{0:16} {1:6} {2:8} {3:>7} {4:>12} {5:>12} {6:>12}".format(
+            "input", "codec", "mode", "ratio", "compress", "upload",
+            "retrieve"))
+        for input_name, data in inputs:
+            upload_seconds = _upload(pool, server, data, None, None)
+            retrieve_seconds = _retrieve(pool, server, None, size)
+            print("{0:16} {1:6} {2:8} {3:7.2f} {4:>12} {5:12.1f} "
+                  "{6:12.1f}".format(input_name, "raw", "", 1.0, "",
+                                     mib / upload_seconds,
+                                     mib / retrieve_seconds))
+            for codec in codecs:
+                for mode, mode_executor in [("serial", None, ),
+                                            ("pool", executor, )]:
+                    compress_seconds, ratio = _compress(data,
+                                                        codec,
+                                                        mode_executor)
+                    upload_seconds = _upload(pool,
+                                             server,
+                                             data,
+                                             codec,
+                                             mode_executor)
+                    retrieve_seconds = _retrieve(pool, server, codec, size)
+                    print("{0:16} {1:6} {2:8} {3:7.2f} {4:12.1f} {5:12.1f} "
+                          "{6:12.1f}".format(input_name,
+                                             codec,
+                                             mode,
+                                             ratio,
+                                             mib / compress_seconds,
+                                             mib / upload_seconds,
+                                             mib / retrieve_seconds))
+    finally:
+        executor.shutdown()
+        pool.close_all()
+        server.stop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
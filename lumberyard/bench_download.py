@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+bench_download.py
+
+retrieve a large key from a local StandInServer and report throughput,
+reads, the memory allocated for the body, and the peak RSS of the retrieving
+process
+
+"read" is the loop ncl retrieve used to run: response.read(64 KiB) and
+write, which makes a new bytes object for every block. "sink" drains the
+response through a DownloadSink, reading into one reused buffer whose size
+adapts; "sink-64k" fixes that buffer at 64 KiB.
+
+The server runs in this process and holds the key in memory. Each method
+runs in its own child process, writing to os.devnull, so its peak RSS is
+the client's alone. "allocated MiB" counts the body buffers made: every
+block for "read", the one buffer for a sink.
+
+    python -m lumberyard.bench_download --size-mib 2048
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.download_sink import DownloadSink
+from lumberyard.http_connection import HTTPConnection
+from lumberyard.http_util import compute_uri
+from lumberyard.stand_in_server import StandInServer
+
+_user_name = "bench-user"
+_auth_key_id = "1"
+_auth_key = "bench-key"
+_collection_name = "default"
+_key = "bench"
+_read_buffer_size = 64 * 1024
+
+def _drain_read(response, output_file):
+    reads = 0
+    allocated = 0
+    while True:
+        data = response.read(_read_buffer_size)
+        if len(data) == 0:
+            break
+        reads += 1
+        allocated += len(data)
+        output_file.write(data)
+    return reads, allocated
+
+def _drain_sink(response, output_file, **kwargs):
+    sink = DownloadSink(output_file, **kwargs)
+    sink.drain(response)
+    stats = sink.stats()
+    return stats["reads"], stats["max_buffer_size"]
+
+def _drain_sink_64k(response, output_file):
+    return _drain_sink(response,
+                       output_file,
+                       min_buffer_size=_read_buffer_size,
+                       max_buffer_size=_read_buffer_size)
+
+_methods = {
+    "read"      : _drain_read,
+    "sink"      : _drain_sink,
+    "sink-64k"  : _drain_sink_64k,
+}
+
+def _peak_rss_kb():
+    """
+    ru_maxrss survives fork and exec on Linux, so it would include the
+    server's copy of the key; VmHWM is this process's own peak
+    """
+    try:
+        with open("/proc/self/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _child(method_name, base_address):
+    """
+    retrieve the key once and print a JSON result line
+    """
+    connection = HTTPConnection(base_address,
+                                _user_name,
+                                _auth_key,
+                                _auth_key_id)
+    try:
+        with open(os.devnull, "wb") as output_file:
+            start_time = time.time()
+            response = connection.request("GET", compute_uri("data", _key))
+            size = int(response.getheader("Content-Length"))
+            reads, allocated = _methods[method_name](response, output_file)
+            total_seconds = time.time() - start_time
+    finally:
+        connection.close()
+
+    peak_rss_kb = _peak_rss_kb()
+    print(json.dumps({
+        "method"            : method_name,
+        "bytes"             : size,
+        "reads"             : reads,
+        "allocated"         : allocated,
+        "total_seconds"     : total_seconds,
+        "peak_rss_kb"       : peak_rss_kb,
+    }))
+
+def _parse_commandline():
+    parser = argparse.ArgumentParser(
+        description="benchmark retrieving a large key")
+    parser.add_argument("--size-mib", type=int, default=2048)
+    parser.add_argument("--method", action="append", default=None,
+                        choices=sorted(_methods))
+    parser.add_argument("--child", type=str, default=None,
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--address", type=str, default=None,
+                        help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def main():
+    args = _parse_commandline()
+    if args.child is not None:
+        _child(args.child, args.address)
+        return 0
+
+    methods = (["read", "sink-64k", "sink"] if args.method is None \
+               else args.method)
+    server = StandInServer({_user_name : (_auth_key_id, _auth_key)})
+    server.start()
+    try:
+        server.set_key(_collection_name,
+                       _key,
+                       b"\0" * (args.size_mib * 1024 * 1024))
+
+        print("{0:10} {1:>8} {2:>10} {3:>10} {4:>10} {5:>14} {6:>14}".format(
+            "method", "MiB", "reads", "seconds", "MiB/s", "allocated MiB",
+            "peak RSS MiB"))
+        for method_name in methods:
+            output = subprocess.check_output([sys.executable,
+                                              "-m",
+                                              "lumberyard.bench_download",
+                                              "--child",
+                                              method_name,
+                                              "--address",
+                                              server.base_address])
+            result = json.loads(output.decode("utf-8"))
+            mib = result["bytes"] / (1024.0 * 1024.0)
+            print("{0:10} {1:8.0f} {2:10} {3:10.2f} {4:10.1f} {5:14.1f} "
+                  "{6:14.1f}".format(
+                      result["method"],
+                      mib,
+                      result["reads"],
+                      result["total_seconds"],
+                      mib / result["total_seconds"],
+                      result["allocated"] / (1024.0 * 1024.0),
+                      result["peak_rss_kb"] / 1024.0))
+    finally:
+        server.stop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+bench_json_stream.py
+
+compare JSONStream with read() + json.loads on a synthetic listing
+
+Each method runs in its own child process, so the peak RSS reported for
+one is not inflated by the other. The body is generated in chunks as it
+is read, like a response arriving from the network, so it is never held
+in memory unless the method under test holds it.
+
+    python -m lumberyard.bench_json_stream --entries 100000
+"""
+from __future__ import print_function
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from lumberyard.json_stream import JSONStream
+
+_chunk_size = 64 * 1024
+
+def _generate_body(entry_count):
+    """
+    generate the bytes of a key_data listing, a few entries at a time
+    """
+    yield b'{"key_data": ['
+    for index in range(entry_count):
+        entry = {
+            "key" : "benchmark/directory-{0:04}/key-{1:08}".format(
+                index // 1000, index),
+            "version_identifier" : "{0:032x}".format(index),
+            "timestamp" : 1349000000.0 + index,
+            "file_size" : index * 17,
+            "unified_id" : 4000000000 + index,
+            "tombstone" : False,
+        }
+        separator = (b"" if index == 0 else b", ")
+        yield separator + json.dumps(entry).encode("utf-8")
+    yield b'], "truncated": false}'
+
+class _SyntheticResponse(object):
+    """
+    a file-like body produced on demand, in the manner of HTTPResponse
+    """
+    def __init__(self, entry_count):
+        self._pieces = _generate_body(entry_count)
+        self._pending = b""
+
+    def read(self, size=None):
+        if size is None:
+            return self._pending + b"".join(self._pieces)
+        while len(self._pending) < size:
+            try:
+                self._pending += next(self._pieces)
+            except StopIteration:
+                break
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+def _run_loads(response):
+    data = response.read()
+    data_dict = json.loads(data.decode("utf-8"))
+    for entry in data_dict["key_data"]:
+        yield entry
+
+def _run_stream(response):
+    for _, entry in JSONStream(response, ["key_data"]):
+        yield entry
+
+_methods = {
+    "loads"     : _run_loads,
+    "stream"    : _run_stream,
+}
+
+def _child(method_name, entry_count):
+    """
+    run one method and print a JSON result line
+    """
+    response = _SyntheticResponse(entry_count)
+    start_time = time.time()
+    first_entry_seconds = None
+    count = 0
+    for _ in _methods[method_name](response):
+        if first_entry_seconds is None:
+            first_entry_seconds = time.time() - start_time
+        count += 1
+    total_seconds = time.time() - start_time
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "method"                : method_name,
+        "entries"               : count,
+        "first_entry_seconds"   : first_entry_seconds,
+        "total_seconds"         : total_seconds,
+        "peak_rss_kb"           : peak_rss_kb,
+    }))
+
+def _parse_commandline():
+    parser = argparse.ArgumentParser(
+        description="benchmark streaming JSON listing decode")
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--child", type=str, default=None,
+                        help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def main():
+    args = _parse_commandline()
+    if args.child is not None:
+        _child(args.child, args.entries)
+        return 0
+
+    print("{0:8} {1:>10} {2:>16} {3:>12} {4:>14}".format(
+        "method", "entries", "first entry ms", "total s", "peak RSS MiB"))
+    for method_name in sorted(_methods):
+        output = subprocess.check_output([sys.executable,
+                                          "-m",
+                                          "lumberyard.bench_json_stream",
+                                          "--entries",
+                                          str(args.entries),
+                                          "--child",
+                                          method_name])
+        result = json.loads(output.decode("utf-8"))
+        print("{0:8} {1:10} {2:16.3f} {3:12.3f} {4:14.1f}".format(
+            result["method"],
+            result["entries"],
+            result["first_entry_seconds"] * 1000.0,
+            result["total_seconds"],
+            result["peak_rss_kb"] / 1024.0))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
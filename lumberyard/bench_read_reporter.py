@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+bench_read_reporter.py
+
+reads per second through ReadReporter, in small blocks from an in memory
+file, with debug logging off
+
+The legacy reporter below is the read ReadReporter used to have: it formats
+two debug messages and calls the callback on every read.
+
+    python -m lumberyard.bench_read_reporter --block-size 4096
+"""
+from __future__ import print_function
+import argparse
+import io
+import logging
+import sys
+import time
+
+from lumberyard.read_reporter import ReadReporter
+
+class _LegacyReadReporter(object):
+    def __init__(self, file_object, callback):
+        self._log = logging.getLogger("ReadReporter")
+        self._file_object = file_object
+        self._callback = callback
+
+    def read(self, size=None):
+        self._log.debug("read({0})".format(size))
+        data = None
+        if size is None:
+            data = self._file_object.read()
+        else:
+            data = self._file_object.read(size)
+
+        self._log.debug("actual bytes read {0}".format(len(data)))
+        self._callback(len(data))
+
+        return data
+
+def _run_read(reporter, block_size, _buffer):
+    reads = 0
+    while len(reporter.read(block_size)) > 0:
+        reads += 1
+    return reads
+
+def _run_readinto(reporter, _block_size, buffer):
+    reads = 0
+    while reporter.readinto(buffer) > 0:
+        reads += 1
+    return reads
+
+_methods = [
+    ("legacy read", _LegacyReadReporter, {}, _run_read, ),
+    ("read", ReadReporter, {}, _run_read, ),
+    ("readinto", ReadReporter, {}, _run_readinto, ),
+    ("coalesced", ReadReporter, {"report_bytes" : 1024 * 1024}, _run_read, ),
+    ("readinto coalesced",
+     ReadReporter,
+     {"report_bytes" : 1024 * 1024},
+     _run_readinto, ),
+]
+
+def _time_method(reporter_class, kwargs, run_function, data, block_size):
+    reported = [0]
+    def _callback(bytes_read):
+        reported[0] += bytes_read
+    buffer = memoryview(bytearray(block_size))
+    reporter = reporter_class(io.BytesIO(data), _callback, **kwargs)
+    start_time = time.time()
+    reads = run_function(reporter, block_size, buffer)
+    elapsed_seconds = time.time() - start_time
+    if reported[0] != len(data):
+        raise AssertionError("reported {0} of {1} bytes".format(reported[0],
+                                                               len(data)))
+    return reads, elapsed_seconds
+
+def _parse_commandline():
+    parser = argparse.ArgumentParser(
+        description="benchmark ReadReporter reads")
+    parser.add_argument("--size-mib", type=int, default=256)
+    parser.add_argument("--block-size", type=int, default=4096)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="report the best of this many runs")
+    return parser.parse_args()
+
+def main():
+    args = _parse_commandline()
+    data = b"x" * (args.size_mib * 1024 * 1024)
+
+    print("{0:20} {1:>10} {2:>10} {3:>14} {4:>10}".format(
+        "method", "reads", "seconds", "reads/sec", "MiB/s"))
+    for method_name, reporter_class, kwargs, run_function in _methods:
+        results = [_time_method(reporter_class,
+                                kwargs,
+                                run_function,
+                                data,
+                                args.block_size) \
+                   for _ in range(args.repeat)]
+        reads, elapsed_seconds = min(results, key=lambda result: result[1])
+        print("{0:20} {1:10} {2:10.3f} {3:14.0f} {4:10.1f}".format(
+            method_name,
+            reads,
+            elapsed_seconds,
+            reads / elapsed_seconds,
+            args.size_mib / elapsed_seconds))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+bench_suite.py
+
+measure the client against a local StandInServer, and write the results as
+JSON so two commits can be compared
+
+    small_get, small_put
+        requests per second for a small key over one keep-alive
+        connection, with latency percentiles
+    large_upload, large_download
+        MiB per second for one large key each way
+    list_keys
+        keys per second for a paged listing through iter_keys
+    concurrency_<n>
+        small GETs per second from n threads sharing a ConnectionPool,
+        and the speedup over one thread
+
+The server runs in this process. Each case runs in its own child process,
+so the client does not share an interpreter with the server.
+
+    python -m lumberyard.bench_suite --output before.json
+    (change something)
+    python -m lumberyard.bench_suite --output after.json --compare before.json
+"""
+from __future__ import print_function
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.connection_pool import ConnectionPool
+from lumberyard.download_sink import DownloadSink
+from lumberyard.http_connection import HTTPConnection
+from lumberyard.http_util import compute_uri
+from lumberyard.key_listing import iter_keys
+from lumberyard.ncl.identity import identity_template
+from lumberyard.request_timing import LatencyHistogram
+from lumberyard.stand_in_server import StandInServer
+
+_identity = identity_template(user_name="bench-user",
+                              auth_key_id="1",
+                              auth_key="bench-key")
+_collection_name = "default"
+_small_key = "small"
+_large_key = "large"
+_listing_prefix = "listing/"
+_percents = (50, 95, 99, )
+
+def _connection(address):
+    return HTTPConnection(address,
+                          _identity.user_name,
+                          _identity.auth_key,
+                          _identity.auth_key_id)
+
+def _timed_requests(connection, seconds, method, uri, body, histogram):
+    """
+    repeat the request for seconds; return the number made
+    """
+    count = 0
+    end_time = time.time() + seconds
+    while True:
+        start_time = time.time()
+        if start_time >= end_time:
+            return count
+        connection.request(method, uri, body=body).read()
+        histogram.record(time.time() - start_time)
+        count += 1
+
+def _small_requests(args, method, body):
+    histogram = LatencyHistogram()
+    connection = _connection(args.address)
+    try:
+        start_time = time.time()
+        count = _timed_requests(connection,
+                                args.seconds,
+                                method,
+                                compute_uri("data", _small_key),
+                                body,
+                                histogram)
+        total_seconds = time.time() - start_time
+    finally:
+        connection.close()
+    result = {"value"           : count / total_seconds,
+              "unit"            : "requests/s",
+              "requests"        : count,
+              "total_seconds"   : total_seconds, }
+    for percent in _percents:
+        result["p{0}_ms".format(percent)] = \
+            histogram.percentile(percent) * 1000.0
+    return result
+
+def _small_get(args):
+    return _small_requests(args, "GET", None)
+
+def _small_put(args):
+    return _small_requests(args, "PUT", b"s" * args.small_bytes)
+
+def _large_upload(args):
+    body = b"\0" * (args.large_mib * 1024 * 1024)
+    connection = _connection(args.address)
+    try:
+        start_time = time.time()
+        connection.request("PUT",
+                           compute_uri("data", "upload"),
+                           body=io.BytesIO(body)).read()
+        total_seconds = time.time() - start_time
+    finally:
+        connection.close()
+    return {"value"             : args.large_mib / total_seconds,
+            "unit"              : "MiB/s",
+            "bytes"             : len(body),
+            "total_seconds"     : total_seconds, }
+
+def _large_download(args):
+    connection = _connection(args.address)
+    try:
+        with open(os.devnull, "wb") as output_file:
+            start_time = time.time()
+            response = connection.request("GET",
+                                          compute_uri("data", _large_key))
+            sink = DownloadSink(output_file)
+            sink.drain(response)
+            total_seconds = time.time() - start_time
+    finally:
+        connection.close()
+    byte_count = sink.stats()["bytes_written"]
+    return {"value"             : byte_count / (1024.0 * 1024.0) / \
+                                  total_seconds,
+            "unit"              : "MiB/s",
+            "bytes"             : byte_count,
+            "total_seconds"     : total_seconds, }
+
+def _list_keys(args):
+    pool = ConnectionPool()
+    try:
+        start_time = time.time()
+        count = 0
+        for _ in iter_keys(pool,
+                           args.address,
+                           _identity,
+                           prefix=_listing_prefix):
+            count += 1
+        total_seconds = time.time() - start_time
+    finally:
+        pool.close_all()
+    return {"value"             : count / total_seconds,
+            "unit"              : "keys/s",
+            "keys"              : count,
+            "total_seconds"     : total_seconds, }
+
+def _concurrency(args):
+    pool = ConnectionPool(max_connections_per_host=args.threads)
+    histogram = LatencyHistogram()
+    counts = list()
+    errors = list()
+    uri = compute_uri("data", _small_key)
+
+    def _worker():
+        try:
+            with pool.connection(args.address, _identity) as connection:
+                counts.append(_timed_requests(connection,
+                                              args.seconds,
+                                              "GET",
+                                              uri,
+                                              None,
+                                              histogram))
+        except Exception:
+            errors.append(sys.exc_info()[1])
+
+    threads = [threading.Thread(target=_worker) \
+               for _ in range(args.threads)]
+    start_time = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total_seconds = time.time() - start_time
+    pool.close_all()
+    if len(errors) > 0:
+        raise errors[0]
+
+    result = {"value"           : sum(counts) / total_seconds,
+              "unit"            : "requests/s",
+              "threads"         : args.threads,
+              "requests"        : sum(counts),
+              "total_seconds"   : total_seconds, }
+    for percent in _percents:
+        result["p{0}_ms".format(percent)] = \
+            histogram.percentile(percent) * 1000.0
+    return result
+
+_cases = {
+    "small_get"         : _small_get,
+    "small_put"         : _small_put,
+    "large_upload"      : _large_upload,
+    "large_download"    : _large_download,
+    "list_keys"         : _list_keys,
+    "concurrency"       : _concurrency,
+}
+_default_cases = ["small_get", "small_put", "large_upload", "large_download",
+                  "list_keys", "concurrency", ]
+
+def _git_commit():
+    """
+    return (commit, dirty) of the tree this module is in, or (None, None)
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                         cwd=directory,
+                                         stderr=subprocess.STDOUT)
+        status = subprocess.check_output(["git", "status", "--porcelain",
+                                          "--untracked-files=no"],
+                                         cwd=directory,
+                                         stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit.decode("utf-8").strip(), len(status.strip()) > 0
+
+def _run_child(args, case_name, threads=None):
+    command = [sys.executable,
+               "-m",
+               "lumberyard.bench_suite",
+               "--child",
+               case_name,
+               "--address",
+               args.address,
+               "--seconds",
+               str(args.seconds),
+               "--small-bytes",
+               str(args.small_bytes),
+               "--large-mib",
+               str(args.large_mib)]
+    if threads is not None:
+        command.extend(["--threads", str(threads)])
+    output = subprocess.check_output(command)
+    return json.loads(output.decode("utf-8"))
+
+def _run_cases(args):
+    """
+    return an ordered list of (result name, result dict)
+    """
+    results = list()
+    for case_name in args.case:
+        if case_name == "concurrency":
+            base_value = None
+            for threads in args.threads_list:
+                result = _run_child(args, case_name, threads)
+                if base_value is None:
+                    base_value = result["value"]
+                result["speedup"] = result["value"] / base_value
+                results.append(("concurrency_{0}".format(threads), result, ))
+            continue
+        result = _run_child(args, case_name)
+        results.append((case_name, result, ))
+    return results
+
+def _print_results(results, baseline, output):
+    print("{0:18} {1:>14} {2:12} {3:>14} {4:>8}".format(
+        "case", "value", "unit", "baseline", "change"), file=output)
+    for name, result in results:
+        line = "{0:18} {1:14.1f} {2:12}".format(name,
+                                                result["value"],
+                                                result["unit"])
+        previous = baseline.get(name)
+        if previous is not None and previous["value"] > 0:
+            line += " {0:14.1f} {1:+7.1f}%".format(
+                previous["value"],
+                (result["value"] / previous["value"] - 1.0) * 100.0)
+        print(line, file=output)
+
+def _parse_commandline():
+    parser = argparse.ArgumentParser(
+        description="benchmark the client against a local stand in server")
+    parser.add_argument("--case", action="append", default=None,
+                        choices=sorted(_cases))
+    parser.add_argument("--seconds", type=float, default=2.0,
+                        help="how long each timed case runs")
+    parser.add_argument("--small-bytes", type=int, default=1024)
+    parser.add_argument("--large-mib", type=int, default=256)
+    parser.add_argument("--listing-keys", type=int, default=20000)
+    parser.add_argument("--threads", type=str, default="1,2,4,8",
+                        help="comma separated thread counts for "
+                        "the concurrency case")
+    parser.add_argument("--output", type=str, default=None,
+                        help="write the results to this JSON file")
+    parser.add_argument("--compare", type=str, default=None,
+                        help="a JSON file from an earlier run to compare "
+                        "against")
+    parser.add_argument("--child", type=str, default=None,
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--address", type=str, default=None,
+                        help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def main():
+    args = _parse_commandline()
+    if args.child is not None:
+        args.threads = int(args.threads.split(",")[0])
+        print(json.dumps(_cases[args.child](args)))
+        return 0
+
+    if args.case is None:
+        args.case = _default_cases
+    args.threads_list = [int(n) for n in args.threads.split(",")]
+
+    baseline = dict()
+    if args.compare is not None:
+        with open(args.compare) as input_file:
+            baseline = json.load(input_file)["results"]
+
+    server = StandInServer({_identity.user_name : (_identity.auth_key_id,
+                                                   _identity.auth_key)})
+    server.start()
+    try:
+        # uploads are counted, not kept
+        server.discard_bodies = True
+        server.set_key(_collection_name,
+                       _small_key,
+                       b"s" * args.small_bytes)
+        server.set_key(_collection_name,
+                       _large_key,
+                       b"\0" * (args.large_mib * 1024 * 1024))
+        for n in range(args.listing_keys):
+            server.set_key(_collection_name,
+                           "{0}{1:08}".format(_listing_prefix, n),
+                           b"")
+        args.address = server.base_address
+        results = _run_cases(args)
+    finally:
+        server.stop()
+
+    _print_results(results, baseline, sys.stdout)
+
+    if args.output is not None:
+        commit, dirty = _git_commit()
+        report = {
+            "commit"        : commit,
+            "dirty"         : dirty,
+            "time"          : time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                            time.gmtime()),
+            "python"        : platform.python_version(),
+            "platform"      : platform.platform(),
+            "parameters"    : {
+                "seconds"       : args.seconds,
+                "small_bytes"   : args.small_bytes,
+                "large_mib"     : args.large_mib,
+                "listing_keys"  : args.listing_keys,
+                "threads"       : args.threads_list,
+            },
+            "results"       : dict(results),
+        }
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
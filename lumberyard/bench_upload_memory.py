@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+bench_upload_memory.py
+
+upload a large sparse file to a local StandInServer and report the peak
+RSS of the uploading process
+
+"stream" passes the open file as the body: its Content-Length comes from
+fstat and it is sent in blocks. "buffered" reads the whole file first, the
+old workaround; its peak RSS grows with the file, so give it a smaller
+--size.
+
+Without SSL, "stream" sends the file with os.sendfile. Run it with
+NIMBUSIO_SENDFILE=0 to compare against sending it through Python.
+
+Each method runs in its own child process, with the stand in server in the
+same process discarding what it receives, so the peak RSS covers both ends
+of the transfer.
+
+    python -m lumberyard.bench_upload_memory --size-mib 4096
+    python -m lumberyard.bench_upload_memory --size-mib 256 --method buffered
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.http_connection import HTTPConnection
+from lumberyard.http_util import compute_uri
+from lumberyard.read_reporter import ReadReporter
+from lumberyard.stand_in_server import StandInServer
+
+_user_name = "bench-user"
+_auth_key_id = "1"
+_auth_key = "bench-key"
+
+def _body_stream(input_file):
+    return ReadReporter(input_file, lambda _: None)
+
+def _body_buffered(input_file):
+    return input_file.read()
+
+_methods = {
+    "stream"    : _body_stream,
+    "buffered"  : _body_buffered,
+}
+
+def _child(method_name, path):
+    """
+    upload the file once and print a JSON result line
+    """
+    server = StandInServer({_user_name : (_auth_key_id, _auth_key)})
+    server.discard_bodies = True
+    server.start()
+    connection = HTTPConnection(server.base_address,
+                                _user_name,
+                                _auth_key,
+                                _auth_key_id)
+    try:
+        start_time = time.time()
+        with open(path, "rb") as input_file:
+            body = _methods[method_name](input_file)
+            response = connection.request("PUT",
+                                          compute_uri("data", "bench"),
+                                          body=body)
+            response.read()
+        total_seconds = time.time() - start_time
+    finally:
+        connection.close()
+        server.stop()
+
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "method"            : method_name,
+        "bytes"             : server.bytes_received,
+        "content_length"    : server.last_headers.get("Content-Length"),
+        "total_seconds"     : total_seconds,
+        "peak_rss_kb"       : peak_rss_kb,
+    }))
+
+def _parse_commandline():
+    parser = argparse.ArgumentParser(
+        description="benchmark upload memory use")
+    parser.add_argument("--size-mib", type=int, default=4096)
+    parser.add_argument("--method", action="append", default=None,
+                        choices=sorted(_methods))
+    parser.add_argument("--child", type=str, default=None,
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--path", type=str, default=None,
+                        help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def main():
+    args = _parse_commandline()
+    if args.child is not None:
+        _child(args.child, args.path)
+        return 0
+
+    methods = (["stream"] if args.method is None else args.method)
+    temp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(temp_dir, "sparse")
+        with open(path, "wb") as output_file:
+            output_file.truncate(args.size_mib * 1024 * 1024)
+
+        print("{0:10} {1:>10} {2:>16} {3:>10} {4:>10} {5:>14}".format(
+            "method", "MiB", "Content-Length", "seconds", "MiB/s",
+            "peak RSS MiB"))
+        for method_name in methods:
+            output = subprocess.check_output([sys.executable,
+                                              "-m",
+                                              "lumberyard.bench_upload_memory",
+                                              "--child",
+                                              method_name,
+                                              "--path",
+                                              path])
+            result = json.loads(output.decode("utf-8"))
+            mib = result["bytes"] / (1024.0 * 1024.0)
+            print("{0:10} {1:10.0f} {2:>16} {3:10.2f} {4:10.1f} "
+                  "{5:14.1f}".format(
+                      result["method"],
+                      mib,
+                      result["content_length"],
+                      result["total_seconds"],
+                      mib / result["total_seconds"],
+                      result["peak_rss_kb"] / 1024.0))
+    finally:
+        shutil.rmtree(temp_dir)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
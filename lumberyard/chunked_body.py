@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+chunked_body.py
+
+class ChunkedBody
+
+Send a request body of unknown length with HTTP/1.1 chunked transfer
+encoding, so an upload from a pipe or a generator can start before the
+producer has finished, without spooling the stream to disk or memory.
+
+A ChunkedBody wraps a file object, such as sys.stdin.buffer, or an
+iterable of blocks. Iterating over it gives the body already framed as
+chunks: a size line, up to chunk_size bytes of data, and a CRLF; then the
+terminating zero length chunk. Each chunk is built in one bytearray,
+allocated once, and given out as a memoryview of it, so memory stays at
+one chunk however long the stream runs. A file is read into the buffer with
+readinto; the blocks of an iterable are copied into it, small blocks
+gathered into one chunk and large ones split across several.
+
+The size line is written as eight hex digits, with leading zeros, so the
+data always starts at the same place in the buffer.
+
+Progress goes through a ReadReporter, so callback, report_bytes and
+report_seconds behave as they do for any other upload.
+
+HTTPConnection sends a body whose length can't be known (see
+compute_body_length) as a ChunkedBody of NIMBUSIO_CHUNK_SIZE bytes; pass a
+ChunkedBody to choose the chunk size or report progress. A body chunked
+from a file that can be rewound can be retried; one from a pipe or an
+iterable can not.
+"""
+import os
+
+from lumberyard.http_util import compute_body_length
+from lumberyard.read_reporter import ReadReporter
+
+_chunk_size = int(os.environ.get("NIMBUSIO_CHUNK_SIZE", str(256 * 1024)))
+_size_line_length = len(b"00000000\r\n")
+_max_chunk_size = 0xffffffff
+_last_chunk = b"0\r\n\r\n"
+
+class ChunkedBody(object):
+    """
+    source
+        a binary file object, or an iterable of bytes-like blocks
+
+    chunk_size
+        the most data bytes in each chunk
+
+    callback
+        optional function taking a single integer: bytes_read
+
+    report_bytes, report_seconds
+        as for ReadReporter
+
+    A request body sent as chunks; iterate over it to send it.
+    """
+    def __init__(self,
+                 source,
+                 chunk_size=_chunk_size,
+                 callback=None,
+                 report_bytes=0,
+                 report_seconds=0.0):
+        if not 0 < chunk_size <= _max_chunk_size:
+            raise ValueError("invalid chunk size {0}".format(chunk_size))
+        self._source = source
+        self.chunk_size = chunk_size
+        self._reporter = ReadReporter(source,
+                                      callback,
+                                      report_bytes=report_bytes,
+                                      report_seconds=report_seconds)
+        self._buffer = bytearray(_size_line_length + chunk_size + 2)
+
+    def __iter__(self):
+        view = memoryview(self._buffer)
+        data_view = view[_size_line_length:_size_line_length + self.chunk_size]
+        if hasattr(self._source, "read"):
+            fill = self._read_chunks(data_view)
+        else:
+            fill = self._copy_chunks(data_view)
+        for length in fill:
+            view[:_size_line_length] = "{0:08x}\r\n".format(length).encode(
+                "ascii")
+            end = _size_line_length + length
+            view[end:end + 2] = b"\r\n"
+            yield view[:end + 2]
+        yield _last_chunk
+
+    def _read_chunks(self, data_view):
+        """
+        generate the length of each chunk read into data_view
+        """
+        while True:
+            bytes_read = self._reporter.readinto(data_view)
+            if not bytes_read:
+                return
+            yield bytes_read
+
+    def _copy_chunks(self, data_view):
+        """
+        generate the length of each chunk copied into data_view from the
+        blocks of the iterable
+        """
+        length = 0
+        for block in self._source:
+            if isinstance(block, str):
+                # as http.client would encode it
+                block = block.encode("iso-8859-1")
+            block = memoryview(block).cast("B")
+            while len(block) > 0:
+                size = min(len(block), self.chunk_size - length)
+                data_view[length:length + size] = block[:size]
+                block = block[size:]
+                length += size
+                if length == self.chunk_size:
+                    self._reporter.report(length)
+                    yield length
+                    length = 0
+        if length > 0:
+            self._reporter.report(length)
+            yield length
+        self._reporter.report(0)
+
+    def tell(self):
+        return self._source.tell()
+
+    def seek(self, offset, whence=0):
+        return self._source.seek(offset, whence)
+
+    def stats(self):
+        """
+        return the ReadReporter stats of the data sent
+        """
+        return self._reporter.stats()
+
+def chunked_request(body, headers, content_length):
+    """
+    body, headers, content_length
+        as passed to HTTPConnection.request
+
+    return (body, headers, content_length) to send: a body whose length
+    can't be known becomes a ChunkedBody with a Transfer-Encoding header;
+    otherwise content_length is the length of the body, if it has one
+    """
+    if body is None or content_length is not None:
+        return body, headers, content_length
+    if headers is not None:
+        for name in headers:
+            if name.lower() in ("content-length", "transfer-encoding", ):
+                return body, headers, content_length
+    if not isinstance(body, ChunkedBody):
+        content_length = compute_body_length(body)
+        if content_length is not None:
+            return body, headers, content_length
+        body = ChunkedBody(body)
+    headers = dict(headers or {})
+    headers["Transfer-Encoding"] = "chunked"
+    return body, headers, None
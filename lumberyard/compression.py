@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+compression.py
+
+class CompressingReader
+class DecompressingWriter
+
+Compress keys on the way up and decompress them on the way down, as they
+stream, with the codecs of the standard library: gzip, bz2 and xz.
+
+A CompressingReader wraps a file object, as a ReadReporter does, and reads
+back the compressed stream. Its length is not known in advance, so it goes
+out with chunked transfer encoding. The callback is told of the bytes read
+from the source, before compression, so progress is in the units the
+caller knows.
+
+Given an executor, compression runs on its threads. The source is cut into
+blocks of block_size, each block is compressed on its own, and up to window
+blocks are in flight at once; the compressed blocks are read back in order.
+zlib, bz2 and lzma release the GIL while they work, so this scales with the
+threads. Each block is a complete gzip member, bz2 stream or xz stream, and
+a concatenation of them is itself a valid file of that format, so it
+decompresses the same way. The ratio is a little worse than one stream.
+
+The codec is archived with the key as metadata (compression_meta). It
+comes back in the metadata headers of a GET or HEAD of the key
+(response_meta), or with fetch_key_meta. A DecompressingWriter is a
+DownloadSink destination: it decompresses each block of the response as
+it arrives and writes the output to the real destination, at most
+_block_size at a time, so a highly compressed body never expands in
+memory.
+"""
+from collections import deque
+import bz2
+import json
+import logging
+import os
+import zlib
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+from lumberyard.download_sink import destination_writer
+from lumberyard.http_util import compute_uri, meta_prefix
+from lumberyard.read_reporter import ReadReporter
+
+_block_size = int(os.environ.get("NIMBUSIO_COMPRESS_BLOCK_SIZE",
+                                 str(1024 * 1024)))
+_window = 2 * (os.cpu_count() or 1)
+compression_meta_name = "compression"
+
+class CompressionError(Exception):
+    pass
+
+def _gzip_compressor(level):
+    return zlib.compressobj((6 if level is None else level),
+                            zlib.DEFLATED,
+                            16 + zlib.MAX_WBITS)
+
+def _bz2_compressor(level):
+    return bz2.BZ2Compressor((9 if level is None else level))
+
+def _xz_compressor(level):
+    return lzma.LZMACompressor(preset=(6 if level is None else level))
+
+_compressors = {
+    "gzip"  : _gzip_compressor,
+    "bz2"   : _bz2_compressor,
+}
+
+_decompressors = {
+    "gzip"  : lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    "bz2"   : bz2.BZ2Decompressor,
+}
+
+# python may be built without lzma
+if lzma is not None:
+    _compressors["xz"] = _xz_compressor
+    _decompressors["xz"] = lzma.LZMADecompressor
+
+codec_names = sorted(_compressors)
+
+def _check_codec(codec):
+    if not codec in _compressors:
+        raise CompressionError("unknown codec {0!r}, not one of {1}".format(
+            codec, ", ".join(codec_names)))
+
+def _compress_block(codec, level, data):
+    """
+    return data compressed as one whole stream
+    """
+    compressor = _compressors[codec](level)
+    return compressor.compress(data) + compressor.flush()
+
+def compression_meta(codec):
+    """
+    return the meta argument for MultipartUploader that records codec
+    """
+    _check_codec(codec)
+    return {meta_prefix + compression_meta_name : codec}
+
+def fetch_key_meta(connection_pool, hostname, identity, key):
+    """
+    return the dict of metadata archived with the key
+    """
+    with connection_pool.connection(hostname, identity) as http_connection:
+        response = http_connection.request("GET",
+                                           compute_uri("data",
+                                                       key,
+                                                       action="meta"))
+        return json.loads(response.read().decode("utf-8"))
+
+class CompressingReader(object):
+    """
+    file_object
+        a binary file object to compress
+
+    codec
+        one of codec_names
+
+    level
+        the compression level; None for the codec's default
+
+    callback
+        optional function taking a single integer: bytes_read, before
+        compression
+
+    report_bytes, report_seconds
+        as for ReadReporter
+
+    executor
+        optional concurrent.futures executor to compress blocks on
+
+    block_size
+        the bytes read from file_object at a time
+
+    window
+        the most blocks in flight on the executor; by default twice the
+        number of CPUs
+
+    A file-like object that reads file_object compressed.
+    """
+    def __init__(self,
+                 file_object,
+                 codec="gzip",
+                 level=None,
+                 callback=None,
+                 report_bytes=0,
+                 report_seconds=0.0,
+                 executor=None,
+                 block_size=_block_size,
+                 window=_window):
+        self._log = logging.getLogger("CompressingReader")
+        _check_codec(codec)
+        self.codec = codec
+        self._level = level
+        self._reporter = ReadReporter(file_object,
+                                      callback,
+                                      report_bytes=report_bytes,
+                                      report_seconds=report_seconds)
+        self._executor = executor
+        self._block_size = block_size
+        self._window = max(1, window)
+        self._compressor = (None if executor is not None \
+                            else _compressors[codec](level))
+        self._futures = deque()
+        self._source_finished = False
+        self._output = memoryview(b"")
+        self._finished = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _read_source(self):
+        data = self._reporter.read(self._block_size)
+        if len(data) == 0:
+            self._source_finished = True
+        self.bytes_in += len(data)
+        return data
+
+    def _next_output(self):
+        """
+        return the next compressed bytes, b"" at the end
+        """
+        if self._executor is None:
+            while not self._source_finished:
+                output = self._compressor.compress(self._read_source())
+                if len(output) > 0:
+                    return output
+            if self._compressor is None:
+                return b""
+            output = self._compressor.flush()
+            self._compressor = None
+            return output
+
+        while not self._source_finished and \
+            len(self._futures) < self._window:
+            data = self._read_source()
+            # an empty source is still one empty stream
+            if len(data) > 0 or self.bytes_in == 0:
+                self._futures.append(self._executor.submit(_compress_block,
+                                                           self.codec,
+                                                           self._level,
+                                                           data))
+        if len(self._futures) == 0:
+            return b""
+        return self._futures.popleft().result()
+
+    def readinto(self, buffer):
+        """
+        read compressed bytes into a writable buffer, returning the number
+        of bytes read
+        """
+        view = memoryview(buffer).cast("B")
+        while len(self._output) == 0:
+            if self._finished:
+                return 0
+            output = self._next_output()
+            if len(output) == 0:
+                self._finished = True
+                self._log.debug("{0} compressed {1} bytes to {2}".format(
+                    self.codec, self.bytes_in, self.bytes_out))
+                return 0
+            self.bytes_out += len(output)
+            self._output = memoryview(output)
+        size = min(len(view), len(self._output))
+        view[:size] = self._output[:size]
+        self._output = self._output[size:]
+        return size
+
+    def read(self, size=None):
+        if size is None or size < 0:
+            blocks = list()
+            while True:
+                data = self.read(self._block_size)
+                if len(data) == 0:
+                    return b"".join(blocks)
+                blocks.append(data)
+        buffer = bytearray(size)
+        bytes_read = self.readinto(buffer)
+        del buffer[bytes_read:]
+        return bytes(buffer)
+
+    def close(self):
+        for future in self._futures:
+            future.cancel()
+        self._reporter.close()
+
+    def stats(self):
+        """
+        return a dict of the ReadReporter stats of the source, with the
+        bytes in and out and their ratio
+        """
+        result = self._reporter.stats()
+        result.update({
+            "codec"     : self.codec,
+            "bytes_in"  : self.bytes_in,
+            "bytes_out" : self.bytes_out,
+            "ratio"     : (0.0 if self.bytes_out == 0 \
+                           else float(self.bytes_in) / self.bytes_out),
+        })
+        return result
+
+class DecompressingWriter(object):
+    """
+    destination
+        a binary file object, a file descriptor, or a callable taking a
+        memoryview, as for DownloadSink
+
+    codec
+        one of codec_names
+
+    A DownloadSink destination that decompresses what is written to it.
+    Call close at the end of the body, to check that the body was whole.
+    """
+    def __init__(self, destination, codec):
+        _check_codec(codec)
+        self.codec = codec
+        self._write = destination_writer(destination)
+        self._new_decompressor = _decompressors[codec]
+        self._decompressor = self._new_decompressor()
+        self._is_zlib = (codec == "gzip")
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def __call__(self, view):
+        self.bytes_in += len(view)
+        data = bytes(view)
+        while True:
+            decompressor = self._decompressor
+            if decompressor.eof:
+                # the next member, or stream, of a concatenation
+                data = decompressor.unused_data + data
+                if len(data) == 0:
+                    return
+                self._decompressor = self._new_decompressor()
+                continue
+            output = decompressor.decompress(data, _block_size)
+            if len(output) > 0:
+                self.bytes_out += len(output)
+                self._write(memoryview(output))
+            if self._is_zlib:
+                data = decompressor.unconsumed_tail
+                more = len(data) > 0 or len(output) == _block_size
+            else:
+                data = b""
+                more = not decompressor.needs_input
+            if not more and not decompressor.eof:
+                return
+
+    def close(self):
+        """
+        raise CompressionError if the body ended part way through a stream
+        """
+        if not self._decompressor.eof:
+            raise CompressionError("{0} body is truncated after {1} "
+                                   "bytes".format(self.codec, self.bytes_in))
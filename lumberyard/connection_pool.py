@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+connection_pool.py
+
+class ConnectionPool
+
+A thread-safe pool of keep-alive connections to nimbus.io.
+
+Connections are keyed by (hostname, identity), where hostname is the
+value computed by compute_collection_hostname or compute_default_hostname,
+and identity is an identity_template (or None for unauthenticated access).
+
+A connection is handed out already connected. When it is returned, any
+unread response body is drained so the socket can carry the next request.
+Connections that are broken, idle for too long, or hold an undrainable
+response are evicted.
+"""
+from contextlib import contextmanager
+import logging
+import os
+import select
+import socket
+import sys
+import threading
+import time
+
+from lumberyard.http_connection import HTTPConnection, UnAuthHTTPConnection
+
+_max_connections_per_host = int(
+    os.environ.get("NIMBUSIO_POOL_MAX_CONNECTIONS_PER_HOST", "8"))
+_max_idle_seconds = float(
+    os.environ.get("NIMBUSIO_POOL_MAX_IDLE_SECONDS", "60.0"))
+_max_drain_bytes = 1024 * 1024
+_drain_buffer_size = 64 * 1024
+
+class ConnectionPoolExhausted(Exception):
+    """
+    no connection to the host became available within the wait timeout
+    """
+    pass
+
+def _socket_is_usable(connection):
+    """
+    return True if the connection's socket is open, and the server has not
+    closed it (or sent unsolicited data) while it was idle
+    """
+    sock = connection.sock
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (socket.error, ValueError):
+        return False
+    # an idle keep-alive socket should have nothing to read; if it is
+    # readable the peer has closed it, or the stream is out of sync
+    return len(readable) == 0
+
+def _drain(connection, max_drain_bytes):
+    """
+    read any unconsumed body of the connection's last response
+    return True if the connection can be used for another request
+    """
+    response = getattr(connection, "_response", None)
+    connection._response = None
+    if response is None or response.isclosed():
+        return True
+
+    if response.will_close:
+        return False
+
+    drained = 0
+    try:
+        while drained <= max_drain_bytes:
+            data = response.read(_drain_buffer_size)
+            if len(data) == 0:
+                return True
+            drained += len(data)
+    except Exception:
+        return False
+
+    return False
+
+class ConnectionPool(object):
+    """
+    max_connections_per_host
+        the maximum number of connections (idle and in use) to one hostname
+
+    max_idle_seconds
+        an idle connection older than this is evicted instead of reused
+
+    wait_timeout
+        seconds to wait for a connection when the host is at its limit,
+        None waits forever
+
+    max_drain_bytes
+        the largest unread response body that will be drained to keep a
+        connection alive; larger bodies cause the connection to be closed
+
+    connection_kwargs
+        extra keyword arguments passed to each new connection
+
+    A thread-safe pool of keep-alive HTTPConnection and UnAuthHTTPConnection
+    objects, keyed by (hostname, identity).
+    """
+    def __init__(self,
+                 max_connections_per_host=_max_connections_per_host,
+                 max_idle_seconds=_max_idle_seconds,
+                 wait_timeout=None,
+                 max_drain_bytes=_max_drain_bytes,
+                 connection_kwargs=None):
+        self._log = logging.getLogger("ConnectionPool")
+        self._max_connections_per_host = max_connections_per_host
+        self._max_idle_seconds = max_idle_seconds
+        self._wait_timeout = wait_timeout
+        self._max_drain_bytes = max_drain_bytes
+        if connection_kwargs is None:
+            connection_kwargs = dict()
+        self._connection_kwargs = connection_kwargs
+
+        self._condition = threading.Condition(threading.Lock())
+        # (hostname, identity) -> list of (connection, idle_since)
+        self._idle = dict()
+        # hostname -> number of connections, idle or in use
+        self._host_counts = dict()
+        # id(connection) -> (hostname, identity)
+        self._checked_out = dict()
+        # ids of connections checked out when close_all was called
+        self._close_on_checkin = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _create_connection(self, hostname, identity):
+        if identity is None:
+            return UnAuthHTTPConnection(hostname, **self._connection_kwargs)
+
+        connection = HTTPConnection(hostname,
+                                    identity.user_name,
+                                    identity.auth_key,
+                                    identity.auth_key_id,
+                                    **self._connection_kwargs)
+        connection.connect()
+        return connection
+
+    def _evict(self, connection, hostname):
+        """
+        close an evicted connection. the caller must hold the lock
+        """
+        self.evictions += 1
+        self._host_counts[hostname] -= 1
+        try:
+            connection.close()
+        except Exception:
+            instance = sys.exc_info()[1]
+            self._log.debug("error closing evicted connection {0}".format(
+                instance))
+        self._condition.notify()
+
+    def _take_idle(self, key):
+        """
+        return a usable idle connection for the key, or None
+        the caller must hold the lock
+        """
+        hostname, _ = key
+        idle_list = self._idle.get(key, [])
+        current_time = time.time()
+        while len(idle_list) > 0:
+            # most recently used first: it is the least likely to have been
+            # closed by the server
+            connection, idle_since = idle_list.pop()
+            if current_time - idle_since > self._max_idle_seconds or \
+                not _socket_is_usable(connection):
+                self._evict(connection, hostname)
+                continue
+            return connection
+        return None
+
+    def _evict_any_idle(self, hostname):
+        """
+        evict one idle connection for this host held under some other
+        identity, to make room. the caller must hold the lock
+        """
+        for (idle_hostname, _), idle_list in self._idle.items():
+            if idle_hostname == hostname and len(idle_list) > 0:
+                connection, _ = idle_list.pop(0)
+                self._evict(connection, hostname)
+                return True
+        return False
+
+    def checkout(self, hostname, identity=None):
+        """
+        hostname
+            a hostname from compute_collection_hostname or
+            compute_default_hostname
+
+        identity
+            an identity_template, or None for an unauthenticated connection
+
+        return a connected HTTPConnection (or UnAuthHTTPConnection if
+        identity is None). The connection must be given back with checkin.
+        """
+        key = (hostname, identity, )
+        deadline = (None if self._wait_timeout is None \
+                    else time.time() + self._wait_timeout)
+
+        with self._condition:
+            while True:
+                connection = self._take_idle(key)
+                if connection is not None:
+                    self.hits += 1
+                    self._checked_out[id(connection)] = key
+                    return connection
+
+                host_count = self._host_counts.get(hostname, 0)
+                if host_count < self._max_connections_per_host:
+                    break
+                if self._evict_any_idle(hostname):
+                    continue
+
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise ConnectionPoolExhausted(
+                            "no connection available to {0}".format(hostname))
+                    self._condition.wait(remaining)
+
+            self.misses += 1
+            self._host_counts[hostname] = host_count + 1
+
+        # connect outside the lock; it may take a DNS lookup and a handshake
+        try:
+            connection = self._create_connection(hostname, identity)
+        except Exception:
+            with self._condition:
+                self._host_counts[hostname] -= 1
+                self._condition.notify()
+            raise
+
+        with self._condition:
+            self._checked_out[id(connection)] = key
+        return connection
+
+    def checkin(self, connection, discard=False):
+        """
+        connection
+            a connection obtained from checkout
+
+        discard
+            if True, close the connection instead of keeping it
+
+        give a connection back to the pool
+        """
+        reusable = not discard and \
+            _drain(connection, self._max_drain_bytes) and \
+            connection.sock is not None
+
+        with self._condition:
+            hostname, identity = self._checked_out.pop(id(connection))
+            if id(connection) in self._close_on_checkin:
+                self._close_on_checkin.discard(id(connection))
+                reusable = False
+            if not reusable:
+                self._evict(connection, hostname)
+                return
+            key = (hostname, identity, )
+            self._idle.setdefault(key, []).append((connection, time.time(), ))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self, hostname, identity=None):
+        """
+        context manager wrapping checkout and checkin::
+
+            with pool.connection(hostname, identity) as http_connection:
+                response = http_connection.request("GET", uri)
+                data = response.read()
+
+        A connection that raised an exception is discarded.
+        """
+        connection = self.checkout(hostname, identity)
+        try:
+            yield connection
+        except BaseException:
+            # including GeneratorExit from a caller abandoning a generator
+            # that streams from this connection
+            self.checkin(connection, discard=True)
+            raise
+        self.checkin(connection)
+
+    def close_all(self):
+        """
+        close every idle connection
+        connections currently checked out are closed when they are returned;
+        the pool can still be used afterwards
+        """
+        with self._condition:
+            self._close_on_checkin.update(self._checked_out)
+            for (hostname, _), idle_list in self._idle.items():
+                while len(idle_list) > 0:
+                    connection, _ = idle_list.pop()
+                    self._evict(connection, hostname)
+            self._idle.clear()
+
+    def stats(self):
+        """
+        return a dict of pool counters
+        """
+        with self._condition:
+            return {
+                "hits"          : self.hits,
+                "misses"        : self.misses,
+                "evictions"     : self.evictions,
+                "idle"          : sum(len(l) for l in self._idle.values()),
+                "checked_out"   : len(self._checked_out),
+            }
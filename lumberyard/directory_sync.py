@@ -0,0 +1,507 @@
+# -*- coding: utf-8 -*-
+"""
+directory_sync.py
+
+class SyncManifest
+class DirectorySync
+
+Mirror a local directory tree into a collection, moving only what changed.
+
+A manifest, in SQLite, records each file archived: its key, size,
+modification time and SHA-256 digest. A sync walks three streams in key
+order at once and merges them: the local tree, the listing of the
+collection under the key prefix, and the manifest. So nothing is held per
+file beyond the uploads in flight, and a file is only read when it has
+changed:
+
+    in the tree, the listing and the manifest, same size and mtime
+        unchanged; nothing is read
+    size or mtime differ from the manifest
+        hashed; uploaded unless the digest and size still match, in
+        which case only the manifest is updated
+    in the tree, not in the listing
+        uploaded
+    in the listing, not in the tree
+        deleted, when delete is on
+
+The tree is walked in key order without sorting it whole: each directory's
+entries are sorted with a directory named as name + "/", which is the order
+of the keys under it.
+
+Uploads and deletes run on a pool of threads over pooled connections, with
+a bounded number in flight. Deletes wait until the whole merge has
+completed, so a listing that is out of order stops the sync before anything
+is deleted. The manifest is updated as each upload completes, and committed
+every few hundred files, so an interrupted sync loses little: run again, it
+skips what was archived.
+"""
+from __future__ import print_function
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import stat
+import sys
+import threading
+import time
+
+from lumberyard.http_util import compute_uri
+from lumberyard.key_listing import iter_keys
+from lumberyard.multipart_upload import MultipartUploader
+
+_max_workers = 8
+_window_per_worker = 4
+_hash_block_size = 1024 * 1024
+_commit_rows = 500
+_commit_seconds = 1.0
+_busy_timeout_seconds = 30.0
+_manifest_batch_size = 1000
+_manifest_directory = os.path.join(os.path.expanduser("~"),
+                                   ".nimbusio",
+                                   "sync")
+
+class SyncError(Exception):
+    pass
+
+def default_manifest_path(hostname, directory, key_prefix=""):
+    """
+    return a manifest path under ~/.nimbusio/sync for syncing directory to
+    key_prefix in the collection at hostname
+    """
+    name = hashlib.sha1("\n".join([hostname,
+                                   os.path.abspath(directory),
+                                   key_prefix]).encode("utf-8")).hexdigest()
+    return os.path.join(_manifest_directory, "{0}.sqlite".format(name[:20]))
+
+def file_digest(path):
+    """
+    return the hex SHA-256 digest of a file's contents
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as input_file:
+        while True:
+            data = input_file.read(_hash_block_size)
+            if len(data) == 0:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+class _ManifestEntry(object):
+    __slots__ = ["size", "mtime_ns", "digest", ]
+
+    def __init__(self, size, mtime_ns, digest):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.digest = digest
+
+class SyncManifest(object):
+    """
+    path
+        the SQLite database file, created if it does not exist
+
+    target
+        a string naming the collection and key prefix synced; a manifest
+        made for another target is refused
+
+    The record of the files a sync has archived. Writes are batched and
+    committed every _commit_rows rows or _commit_seconds, and by flush.
+    """
+    def __init__(self, path, target):
+        directory = os.path.dirname(path)
+        if directory != "" and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path,
+                                   timeout=_busy_timeout_seconds,
+                                   check_same_thread=False)
+        self._db.execute("pragma journal_mode=wal")
+        self._db.execute("pragma synchronous=normal")
+        with self._db:
+            self._db.execute("create table if not exists files ("
+                             "key text primary key, "
+                             "size integer not null, "
+                             "mtime_ns integer not null, "
+                             "digest text not null) without rowid")
+            self._db.execute("create table if not exists state ("
+                             "name text primary key, value text)")
+            row = self._db.execute("select value from state "
+                                   "where name = 'target'").fetchone()
+            if row is None:
+                self._db.execute("insert into state (name, value) "
+                                 "values ('target', ?)",
+                                 (json.dumps(target), ))
+            elif json.loads(row[0]) != target:
+                raise SyncError("{0} is the manifest for {1}".format(
+                    path, json.loads(row[0])))
+        self._pending = 0
+        self._last_commit_time = time.time()
+
+    def iter_entries(self):
+        """
+        generate (key, _ManifestEntry) in key order, reading in batches so
+        writes may go on between them
+        """
+        after = ""
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "select key, size, mtime_ns, digest from files "
+                    "where key > ? order by key limit ?",
+                    (after, _manifest_batch_size, )).fetchall()
+            for key, size, mtime_ns, digest in rows:
+                yield key, _ManifestEntry(size, mtime_ns, digest)
+            if len(rows) < _manifest_batch_size:
+                return
+            after = rows[-1][0]
+
+    def _written(self):
+        """
+        count a write; commit if enough have built up. call with the
+        lock held
+        """
+        self._pending += 1
+        current_time = time.time()
+        if self._pending >= _commit_rows or \
+            current_time - self._last_commit_time >= _commit_seconds:
+            self._db.commit()
+            self._pending = 0
+            self._last_commit_time = current_time
+
+    def put(self, key, size, mtime_ns, digest):
+        with self._lock:
+            self._db.execute("insert or replace into files "
+                             "(key, size, mtime_ns, digest) "
+                             "values (?, ?, ?, ?)",
+                             (key, size, mtime_ns, digest, ))
+            self._written()
+
+    def remove(self, key):
+        with self._lock:
+            self._db.execute("delete from files where key = ?", (key, ))
+            self._written()
+
+    def flush(self):
+        with self._lock:
+            self._db.commit()
+            self._pending = 0
+            self._last_commit_time = time.time()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._db.close()
+
+def iter_tree(directory, key_prefix="", exclude=None):
+    """
+    generate (key, path, stat_result) for the regular files under
+    directory, in key order. Symbolic links to files are followed; those
+    to directories are not. Names that are not valid UTF-8 are skipped.
+    """
+    log = logging.getLogger("iter_tree")
+
+    def _walk(path, key_base):
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            instance = sys.exc_info()[1]
+            log.warning("unable to read {0}: {1}".format(path, instance))
+            return
+        items = list()
+        for entry in entries:
+            try:
+                entry.name.encode("utf-8")
+            except UnicodeEncodeError:
+                log.warning("skipping {0!r}: not UTF-8".format(entry.path))
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                items.append((entry.name + "/", entry, True, ))
+            else:
+                items.append((entry.name, entry, False, ))
+        items.sort(key=lambda item: item[0])
+        for name, entry, is_directory in items:
+            if is_directory:
+                for item in _walk(entry.path, key_base + name):
+                    yield item
+                continue
+            if exclude is not None and entry.path in exclude:
+                continue
+            try:
+                stat_result = entry.stat()
+            except OSError:
+                # a dangling link, or removed since the scan
+                continue
+            if stat.S_ISREG(stat_result.st_mode):
+                yield key_base + name, entry.path, stat_result
+
+    for item in _walk(directory, key_prefix):
+        yield item
+
+def _ordered(stream, name):
+    """
+    pass through (key, value) pairs, raising SyncError if the keys are not
+    strictly increasing
+    """
+    previous = None
+    for key, value in stream:
+        if previous is not None and key <= previous:
+            raise SyncError("{0} is not in key order at {1!r}".format(name,
+                                                                     key))
+        previous = key
+        yield key, value
+
+def merge_sorted(*streams):
+    """
+    streams
+        iterables of (key, value) in increasing key order
+
+    generate (key, [value or None for each stream]) over the union of the
+    keys, in key order
+    """
+    iterators = [iter(stream) for stream in streams]
+    heads = [next(iterator, None) for iterator in iterators]
+    while True:
+        keys = [head[0] for head in heads if head is not None]
+        if len(keys) == 0:
+            return
+        key = min(keys)
+        values = list()
+        for index, head in enumerate(heads):
+            if head is not None and head[0] == key:
+                values.append(head[1])
+                heads[index] = next(iterators[index], None)
+            else:
+                values.append(None)
+        yield key, values
+
+class SyncResult(object):
+    """
+    what a sync did
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.files = 0
+        self.unchanged = 0
+        self.hashed = 0
+        self.touched = 0
+        self.uploaded = 0
+        self.uploaded_bytes = 0
+        self.deleted = 0
+        self.errors = list()
+        self.elapsed_seconds = 0.0
+
+    def count(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def error(self, key, instance):
+        with self._lock:
+            self.errors.append((key, instance, ))
+
+    def as_dict(self):
+        return {
+            "files"             : self.files,
+            "unchanged"         : self.unchanged,
+            "hashed"            : self.hashed,
+            "touched"           : self.touched,
+            "uploaded"          : self.uploaded,
+            "uploaded_bytes"    : self.uploaded_bytes,
+            "deleted"           : self.deleted,
+            "errors"            : len(self.errors),
+            "elapsed_seconds"   : self.elapsed_seconds,
+        }
+
+    def report(self, output):
+        print("{0} files: {1} unchanged, {2} uploaded ({3} bytes), "
+              "{4} deleted, {5} errors in {6:.3f} seconds".format(
+                  self.files,
+                  self.unchanged + self.touched,
+                  self.uploaded,
+                  self.uploaded_bytes,
+                  self.deleted,
+                  len(self.errors),
+                  self.elapsed_seconds), file=output)
+        for key, instance in self.errors:
+            print("  {0}: {1}".format(key, instance), file=output)
+
+class DirectorySync(object):
+    """
+    connection_pool
+        a ConnectionPool
+
+    hostname
+        the collection hostname, from compute_collection_hostname
+
+    identity
+        the identity used to sign requests
+
+    manifest_path
+        the manifest file; see default_manifest_path
+
+    key_prefix
+        the files are archived under this prefix, which is also the
+        listing prefix: keys under it that are not in the tree are
+        deleted, when delete is True
+
+    delete
+        delete keys that have no file
+
+    max_workers
+        the number of files uploaded or deleted at once
+
+    Mirror a directory tree into a collection.
+    """
+    def __init__(self,
+                 connection_pool,
+                 hostname,
+                 identity,
+                 manifest_path,
+                 key_prefix="",
+                 delete=False,
+                 max_workers=_max_workers):
+        self._log = logging.getLogger("DirectorySync")
+        self._connection_pool = connection_pool
+        self._hostname = hostname
+        self._identity = identity
+        self._manifest_path = manifest_path
+        self._key_prefix = key_prefix
+        self._delete = delete
+        self._max_workers = max_workers
+        self._uploader = MultipartUploader(connection_pool,
+                                           hostname,
+                                           identity)
+
+    def _iter_listing(self):
+        for entry in iter_keys(self._connection_pool,
+                               self._hostname,
+                               self._identity,
+                               prefix=(self._key_prefix or None)):
+            yield entry["key"], entry
+
+    def _upload(self, manifest, result, key, path, stat_result, remote,
+                manifest_entry):
+        """
+        hash the changed file; archive it unless the manifest shows its
+        contents are already in the collection
+        """
+        digest = file_digest(path)
+        result.count("hashed")
+        if manifest_entry is not None and remote is not None and \
+            manifest_entry.digest == digest and \
+            manifest_entry.size == stat_result.st_size and \
+            remote.get("size", stat_result.st_size) == stat_result.st_size:
+            # touched, not changed
+            manifest.put(key, stat_result.st_size, stat_result.st_mtime_ns,
+                         digest)
+            result.count("touched")
+            return
+
+        self._uploader.archive(key, [path])
+        result.count("uploaded")
+        result.count("uploaded_bytes", stat_result.st_size)
+
+        # a file changed while it was read is archived again next time
+        after = os.stat(path)
+        if after.st_size == stat_result.st_size and \
+            after.st_mtime_ns == stat_result.st_mtime_ns:
+            manifest.put(key, stat_result.st_size, stat_result.st_mtime_ns,
+                         digest)
+
+    def _remove_key(self, manifest, result, key):
+        with self._connection_pool.connection(self._hostname,
+                                              self._identity) \
+            as http_connection:
+            response = http_connection.request("DELETE",
+                                               compute_uri("data", key))
+            response.read()
+        manifest.remove(key)
+        result.count("deleted")
+
+    def sync(self, directory):
+        """
+        make the collection match the directory tree; return a SyncResult
+        """
+        result = SyncResult()
+        start_time = time.time()
+        directory = os.path.abspath(directory)
+        manifest = SyncManifest(self._manifest_path,
+                                "{0}/{1}".format(self._hostname,
+                                                 self._key_prefix))
+        window = max(1, self._max_workers * _window_per_worker)
+        pending = deque()
+        deletions = list()
+
+        def _run(key, function, *args):
+            try:
+                function(manifest, result, key, *args)
+            except Exception:
+                instance = sys.exc_info()[1]
+                self._log.error("{0}: {1}".format(key, instance))
+                result.error(key, instance)
+
+        def _complete_oldest():
+            pending.popleft().result()
+
+        local = ((key, (path, stat_result, ), ) \
+                 for (key, path, stat_result) in \
+                 iter_tree(directory,
+                           self._key_prefix,
+                           exclude=set([
+                               os.path.abspath(self._manifest_path)])))
+        try:
+            with ThreadPoolExecutor(max_workers=self._max_workers) \
+                as executor:
+                try:
+                    for key, (local_file, remote, manifest_entry) in \
+                        merge_sorted(_ordered(local, "the tree"),
+                                     _ordered(self._iter_listing(),
+                                              "the listing"),
+                                     manifest.iter_entries()):
+                        if local_file is None:
+                            if remote is not None and self._delete:
+                                deletions.append(key)
+                            elif manifest_entry is not None:
+                                manifest.remove(key)
+                            continue
+
+                        result.files += 1
+                        path, stat_result = local_file
+                        if remote is not None and \
+                            manifest_entry is not None and \
+                            manifest_entry.size == stat_result.st_size and \
+                            manifest_entry.mtime_ns == \
+                                stat_result.st_mtime_ns and \
+                            remote.get("size", stat_result.st_size) == \
+                                stat_result.st_size:
+                            result.unchanged += 1
+                            continue
+
+                        while len(pending) >= window:
+                            _complete_oldest()
+                        pending.append(executor.submit(_run,
+                                                       key,
+                                                       self._upload,
+                                                       path,
+                                                       stat_result,
+                                                       remote,
+                                                       manifest_entry))
+                finally:
+                    while len(pending) > 0:
+                        _complete_oldest()
+
+                for key in deletions:
+                    while len(pending) >= window:
+                        _complete_oldest()
+                    pending.append(executor.submit(_run,
+                                                   key,
+                                                   self._remove_key))
+                while len(pending) > 0:
+                    _complete_oldest()
+        finally:
+            manifest.close()
+
+        result.elapsed_seconds = time.time() - start_time
+        return result
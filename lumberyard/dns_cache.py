@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+dns_cache.py
+
+class DNSCache
+
+A process-wide cache of hostname lookups for the connection classes.
+
+Every collection has its own hostname (see compute_collection_hostname), so
+without a cache each new connection starts with a resolver lookup.
+
+- A successful lookup is kept for positive_ttl seconds.
+- A failed lookup is kept for negative_ttl seconds, and raises the same
+  error again without asking the resolver.
+- For stale_seconds after an entry expires, it is still returned, and a
+  background thread refreshes it. A failed refresh keeps the stale entry.
+- Concurrent lookups of the same name share one resolver call.
+
+prefetch resolves many names at once, for example every collection a
+script will touch::
+
+    cache = default_dns_cache()
+    cache.prefetch_collections(["photos", "backups"])
+
+stats() reports hits, misses and the time spent in the resolver, so the
+saving can be measured.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+from lumberyard.http_util import compute_collection_hostname
+
+_positive_ttl = float(os.environ.get("NIMBUSIO_DNS_POSITIVE_TTL", "60.0"))
+_negative_ttl = float(os.environ.get("NIMBUSIO_DNS_NEGATIVE_TTL", "5.0"))
+_stale_seconds = float(os.environ.get("NIMBUSIO_DNS_STALE_SECONDS", "300.0"))
+_prefetch_workers = 16
+
+def _split_hostname(hostname, default_port):
+    """
+    split "host:port" into (host, port)
+    """
+    host, _, port = hostname.rpartition(":")
+    if host and port.isdigit():
+        return host, int(port)
+    return hostname, default_port
+
+class _Entry(object):
+    """
+    the result of one lookup: a list of addrinfo tuples, or an error
+    """
+    def __init__(self, addresses, error, ttl):
+        self.addresses = addresses
+        self.error = error
+        self.expires = time.time() + ttl
+        self.refreshing = False
+
+class DNSCache(object):
+    """
+    positive_ttl
+        seconds a successful lookup is used before it is refreshed
+
+    negative_ttl
+        seconds a failed lookup is remembered
+
+    stale_seconds
+        seconds after expiry during which an entry is still used while a
+        background refresh runs; 0 disables stale use
+
+    resolver
+        the lookup function, with the signature of socket.getaddrinfo
+    """
+    def __init__(self,
+                 positive_ttl=_positive_ttl,
+                 negative_ttl=_negative_ttl,
+                 stale_seconds=_stale_seconds,
+                 resolver=socket.getaddrinfo):
+        self._log = logging.getLogger("DNSCache")
+        self._positive_ttl = positive_ttl
+        self._negative_ttl = negative_ttl
+        self._stale_seconds = stale_seconds
+        self._resolver = resolver
+
+        self._lock = threading.Lock()
+        # (host, port) -> _Entry
+        self._entries = dict()
+        # (host, port) -> threading.Event set when the lookup finishes
+        self._pending = dict()
+
+        self._counters = {
+            "hits"              : 0,
+            "stale_hits"        : 0,
+            "negative_hits"     : 0,
+            "misses"            : 0,
+            "refreshes"         : 0,
+            "failures"          : 0,
+            "lookups"           : 0,
+            "lookup_seconds"    : 0.0,
+            "max_lookup_seconds": 0.0,
+        }
+
+    def _lookup(self, key):
+        """
+        call the resolver and store the result
+        return the new _Entry
+        """
+        host, port = key
+        start_time = time.time()
+        try:
+            addresses = self._resolver(host, port, 0, socket.SOCK_STREAM)
+        except socket.gaierror:
+            entry = _Entry(None, sys.exc_info()[1], self._negative_ttl)
+        else:
+            entry = _Entry(addresses, None, self._positive_ttl)
+        elapsed_seconds = time.time() - start_time
+
+        with self._lock:
+            self._counters["lookups"] += 1
+            self._counters["lookup_seconds"] += elapsed_seconds
+            self._counters["max_lookup_seconds"] = max(
+                self._counters["max_lookup_seconds"], elapsed_seconds)
+            previous = self._entries.get(key)
+            if entry.error is not None:
+                self._counters["failures"] += 1
+                if previous is not None and previous.error is None and \
+                    previous.refreshing:
+                    # keep serving the stale addresses; try again later
+                    self._log.warning("refresh of {0} failed: {1}".format(
+                        host, entry.error))
+                    previous.refreshing = False
+                    return previous
+            self._entries[key] = entry
+        return entry
+
+    def _refresh(self, key):
+        try:
+            self._lookup(key)
+        except Exception:
+            instance = sys.exc_info()[1]
+            self._log.exception("refresh of {0}: {1}".format(key, instance))
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.refreshing = False
+
+    def resolve(self, host, port):
+        """
+        return a list of getaddrinfo tuples for a stream connection to
+        (host, port), or raise socket.gaierror
+        """
+        key = (host, port, )
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                current_time = time.time()
+                if entry is not None and current_time < entry.expires:
+                    if entry.error is not None:
+                        self._counters["negative_hits"] += 1
+                        raise entry.error
+                    self._counters["hits"] += 1
+                    return entry.addresses
+
+                if entry is not None and entry.error is None and \
+                    current_time < entry.expires + self._stale_seconds:
+                    self._counters["stale_hits"] += 1
+                    if not entry.refreshing:
+                        entry.refreshing = True
+                        self._counters["refreshes"] += 1
+                        thread = threading.Thread(target=self._refresh,
+                                                  args=(key, ),
+                                                  name="DNSRefresh")
+                        thread.daemon = True
+                        thread.start()
+                    return entry.addresses
+
+                event = self._pending.get(key)
+                if event is None:
+                    event = threading.Event()
+                    self._pending[key] = event
+                    self._counters["misses"] += 1
+                    break
+
+            # another thread is looking this name up; use its result
+            event.wait()
+
+        try:
+            entry = self._lookup(key)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            event.set()
+
+        if entry.error is not None:
+            raise entry.error
+        return entry.addresses
+
+    def invalidate(self, host, port):
+        """
+        forget a name, for example when none of its addresses accept a
+        connection
+        """
+        with self._lock:
+            self._entries.pop((host, port, ), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def prefetch(self, hostnames, default_port=443, max_workers=None):
+        """
+        hostnames
+            names to resolve, each "host" or "host:port"
+
+        resolve the names concurrently so later connections find them in
+        the cache. return a dict of hostname -> error for the names that
+        failed
+        """
+        if max_workers is None:
+            max_workers = _prefetch_workers
+        hostnames = list(set(hostnames))
+        if len(hostnames) == 0:
+            return dict()
+
+        def _prefetch_one(hostname):
+            host, port = _split_hostname(hostname, default_port)
+            try:
+                self.resolve(host, port)
+            except socket.gaierror:
+                return sys.exc_info()[1]
+            return None
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(_prefetch_one, hostnames)
+            return dict((hostname, error, ) \
+                        for (hostname, error) in zip(hostnames, results) \
+                        if error is not None)
+
+    def prefetch_collections(self, collection_names, max_workers=None):
+        """
+        prefetch the hostnames of these collections
+        """
+        return self.prefetch(
+            [compute_collection_hostname(name) for name in collection_names],
+            max_workers=max_workers)
+
+    def create_connection(self,
+                          address,
+                          timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                          source_address=None):
+        """
+        socket.create_connection, using the cache to resolve the host;
+        connection classes use this as their _create_connection
+        """
+        host, port = address
+        error = None
+        for family, socktype, proto, _, sockaddr in self.resolve(host, port):
+            sock = None
+            try:
+                sock = socket.socket(family, socktype, proto)
+                if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(timeout)
+                if source_address is not None:
+                    sock.bind(source_address)
+                sock.connect(sockaddr)
+                return sock
+            except socket.error:
+                error = sys.exc_info()[1]
+                if sock is not None:
+                    sock.close()
+
+        # the addresses may be out of date; look the name up next time
+        self.invalidate(host, port)
+        if error is None:
+            error = socket.error("getaddrinfo returns an empty list")
+        raise error
+
+    def stats(self):
+        """
+        return a dict of cache counters; lookup_seconds is the total time
+        spent in the resolver
+        """
+        with self._lock:
+            result = dict(self._counters)
+            result["entries"] = len(self._entries)
+        lookups = result["lookups"]
+        result["mean_lookup_seconds"] = \
+            (result["lookup_seconds"] / lookups if lookups > 0 else 0.0)
+        return result
+
+_default_dns_cache = None
+_default_dns_cache_lock = threading.Lock()
+
+def default_dns_cache():
+    """
+    return the cache shared by connections that are not given one
+    """
+    global _default_dns_cache
+    with _default_dns_cache_lock:
+        if _default_dns_cache is None:
+            _default_dns_cache = DNSCache()
+        return _default_dns_cache
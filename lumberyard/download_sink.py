@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+download_sink.py
+
+class DownloadSink
+
+Copy a response body to a destination through one reused buffer.
+
+The buffer is a bytearray allocated once, at the largest size the sink will
+use. Each block of the body is read into it with readinto and written out
+from a memoryview of it, so no bytes object is made per block.
+
+How much of the buffer each read uses adapts to the throughput. A read that
+fills its window in well under _target_read_seconds doubles the window, and
+a read that takes much longer halves it. The window stays between
+min_buffer_size and max_buffer_size. A fast transfer makes few large
+reads; a slow one still reports progress often.
+
+The destination may be:
+
+- a binary file object (anything with write), such as sys.stdout.buffer
+- an open file descriptor
+- a callable taking a memoryview of the block; the view is only valid
+  during the call
+
+Progress goes through a ReadReporter wrapped around the response, so the
+callback, report_bytes, report_seconds and total_bytes behave as they do
+for uploads.
+"""
+import logging
+import os
+import time
+
+from lumberyard.read_reporter import ReadReporter
+
+_min_buffer_size = int(os.environ.get("NIMBUSIO_DOWNLOAD_MIN_BUFFER",
+                                      str(64 * 1024)))
+_max_buffer_size = int(os.environ.get("NIMBUSIO_DOWNLOAD_MAX_BUFFER",
+                                      str(4 * 1024 * 1024)))
+_target_read_seconds = 0.05
+
+def _fd_writer(fd):
+    def _write(view):
+        while len(view) > 0:
+            view = view[os.write(fd, view):]
+    return _write
+
+def _file_writer(output_file):
+    def _write(view):
+        while len(view) > 0:
+            written = output_file.write(view)
+            # a raw file may write less than it was given
+            if written is None or written >= len(view):
+                return
+            view = view[written:]
+    return _write
+
+def destination_writer(destination):
+    """
+    destination
+        a binary file object, a file descriptor, or a callable taking a
+        memoryview
+
+    return a function that writes all of a memoryview to destination
+    """
+    if isinstance(destination, int):
+        return _fd_writer(destination)
+    if hasattr(destination, "write"):
+        return _file_writer(destination)
+    return destination
+
+class DownloadSink(object):
+    """
+    destination
+        a binary file object, a file descriptor, or a callable taking a
+        memoryview
+
+    callback
+        optional function taking a single integer: bytes_read
+
+    report_bytes, report_seconds, total_bytes
+        as for ReadReporter
+
+    min_buffer_size, max_buffer_size
+        bounds for the size of each read; equal bounds fix it
+
+    Write response bodies to a destination with readinto and one buffer.
+    A sink may drain any number of responses, one at a time.
+    """
+    def __init__(self,
+                 destination,
+                 callback=None,
+                 report_bytes=0,
+                 report_seconds=0.0,
+                 total_bytes=None,
+                 min_buffer_size=_min_buffer_size,
+                 max_buffer_size=_max_buffer_size):
+        self._log = logging.getLogger("DownloadSink")
+        self._write = destination_writer(destination)
+        self._callback = callback
+        self._report_bytes = report_bytes
+        self._report_seconds = report_seconds
+        self._total_bytes = total_bytes
+        self._min_buffer_size = min(min_buffer_size, max_buffer_size)
+        self._max_buffer_size = max_buffer_size
+        self._buffer_size = self._min_buffer_size
+        self._view = memoryview(bytearray(max_buffer_size))
+        self._reporter = None
+        self._reads = 0
+        self._bytes_written = 0
+        self._window_changes = 0
+
+    @property
+    def buffer_size(self):
+        """
+        the size of the next read
+        """
+        return self._buffer_size
+
+    def _adapt(self, bytes_read, read_seconds):
+        if bytes_read == self._buffer_size and \
+            read_seconds < _target_read_seconds / 2 and \
+            self._buffer_size < self._max_buffer_size:
+            self._buffer_size = min(self._buffer_size * 2,
+                                    self._max_buffer_size)
+            self._window_changes += 1
+        elif read_seconds > _target_read_seconds * 2 and \
+            self._buffer_size > self._min_buffer_size:
+            self._buffer_size = max(self._buffer_size // 2,
+                                    self._min_buffer_size)
+            self._window_changes += 1
+
+    def drain(self, response):
+        """
+        response
+            an HTTPResponse, or any file object with readinto
+
+        copy the rest of the response to the destination
+        return the number of bytes written
+        """
+        self._reporter = ReadReporter(response,
+                                      self._callback,
+                                      report_bytes=self._report_bytes,
+                                      report_seconds=self._report_seconds,
+                                      total_bytes=self._total_bytes)
+        view = self._view
+        bytes_written = 0
+        try:
+            while True:
+                start_time = time.time()
+                bytes_read = self._reporter.readinto(
+                    view[:self._buffer_size])
+                if bytes_read == 0:
+                    break
+                self._adapt(bytes_read, time.time() - start_time)
+                self._reads += 1
+                self._write(view[:bytes_read])
+                bytes_written += bytes_read
+        finally:
+            self._reporter.flush_callback()
+            self._bytes_written += bytes_written
+        self._log.debug("drained {0} bytes in {1} reads".format(
+            bytes_written, self._reads))
+        return bytes_written
+
+    def stats(self):
+        """
+        return a dict of the ReadReporter stats of the last response, with
+        the sink's totals and its current buffer size
+        """
+        result = (dict() if self._reporter is None \
+                  else self._reporter.stats())
+        result.update({
+            "reads"             : self._reads,
+            "bytes_written"     : self._bytes_written,
+            "buffer_size"       : self._buffer_size,
+            "max_buffer_size"   : self._max_buffer_size,
+            "window_changes"    : self._window_changes,
+        })
+        return result
@@ -18,6 +18,8 @@ except ImportError:
     from http.client import OK
     from http.client import SERVICE_UNAVAILABLE
     from http.client import INTERNAL_SERVER_ERROR
+from email.utils import parsedate_tz, mktime_tz
+import functools
 import logging
 import os
 try:
@@ -26,9 +28,28 @@ except ImportError:
     from urllib.parse import unquote_plus
 import socket
 import sys
+import time
 
 from lumberyard.http_util import current_timestamp, \
-    compute_authentication_string
+    compute_authentication_string, \
+    compute_body_length
+from lumberyard.retry_policy import default_retry_policy
+from lumberyard.chunked_body import chunked_request
+from lumberyard.dns_cache import default_dns_cache
+from lumberyard.request_timing import RequestTiming, \
+    request_observers, \
+    observe_response, \
+    finish_timing
+from lumberyard.rate_limiter import default_rate_limiter, \
+    throttled_body, \
+    ThrottledHTTPResponse, \
+    limit_upload, \
+    limit_download
+from lumberyard.sendfile_body import file_source, \
+    header_content_length, \
+    send_request
+from lumberyard.tls_session_cache import default_ssl_context, \
+    default_tls_session_cache
 
 class LumberyardHTTPError(Exception):
     """
@@ -52,16 +73,150 @@ class LumberyardRetryableHTTPError(LumberyardHTTPError):
                                      "Service unavailable")
         self.retry_after = retry_after
 
+class CircuitOpenError(LumberyardHTTPError):
+    """
+    requests to the host are refused without being sent, because recent
+    requests to it have failed; see RetryPolicy
+    """
+    def __init__(self, hostname):
+        LumberyardHTTPError.__init__(self, 
+                                     SERVICE_UNAVAILABLE, 
+                                     "Circuit open for {0}".format(hostname))
+        self.hostname = hostname
+
+def parse_retry_after(retry_after):
+    """
+    retry_after
+        the value of a Retry-After header: seconds, or an HTTP date
+
+    return the whole number of seconds to wait, or None if the value is
+    missing, unparseable or not in the future
+    """
+    if retry_after is None:
+        return None
+    try:
+        seconds = int(retry_after)
+    except ValueError:
+        date_tuple = parsedate_tz(retry_after)
+        if date_tuple is None:
+            return None
+        seconds = int(round(mktime_tz(date_tuple) - time.time()))
+    if seconds <= 0:
+        return None
+    return seconds
+
+def _is_expected_status(status, expected_status):
+    """
+    expected_status is a status, or a tuple of them
+    """
+    if isinstance(expected_status, tuple):
+        return status in expected_status
+    return status == expected_status
+
 _timeout_str = os.environ.get("NIMBUSIO_CONNECTION_TIMEOUT")
 _timeout = (None if _timeout_str is None else float(_timeout_str))
-_connection_retries = int(os.environ.get("NIMUSIO_CONNECTION_RETRIES", "5"))
-_connection_retry_seconds = 15
+# file bodies are sent in blocks of this size
+_body_block_size = int(
+    os.environ.get("NIMBUSIO_BODY_BLOCK_SIZE", str(1024 * 1024)))
 
 # For testing on a local machines, we will not use SSL
 if os.environ.get("NIMBUS_IO_SERVICE_SSL", "1") == "0":
     _base_class = HTTPConnection
 else:
     _base_class = HTTPSConnection
+_use_ssl = _base_class is HTTPSConnection
+
+def _base_class_kwargs(ssl_context):
+    """
+    keyword arguments for _base_class.__init__
+    """
+    kwargs = {"timeout" : _timeout}
+    if _use_ssl:
+        if ssl_context is None:
+            ssl_context = default_ssl_context()
+        kwargs["context"] = ssl_context
+    return kwargs
+
+def _connect(connection, ssl_context):
+    """
+    connect, resuming the host's TLS session if there is one
+    """
+    timing = connection._timing
+    ahead_of_request = False
+    if timing is None and \
+        len(request_observers(connection._observers)) > 0:
+        # the phases are reported with the connection's next request
+        timing = connection._timing = RequestTiming("CONNECT", 
+                                                    connection.host, 
+                                                    "/")
+        ahead_of_request = True
+    try:
+        if timing is not None:
+            timing.start_phase()
+        if _use_ssl:
+            default_tls_session_cache().connect(connection, ssl_context)
+            if timing is not None:
+                timing.end_phase("tls")
+        else:
+            _base_class.connect(connection)
+    finally:
+        if ahead_of_request:
+            connection._timing = None
+            connection._connect_phases = timing.phases
+
+def _create_connection(connection, address, timeout, source_address):
+    """
+    open the socket through the connection's DNSCache, timing the lookup
+    and the connect when the request is being timed
+    """
+    dns_cache = connection._dns_cache
+    timing = connection._timing
+    if timing is None:
+        return dns_cache.create_connection(address, timeout, source_address)
+    dns_cache.resolve(*address)
+    timing.end_phase("dns")
+    sock = dns_cache.create_connection(address, timeout, source_address)
+    timing.end_phase("connect")
+    return sock
+
+def _save_tls_session(connection):
+    """
+    a TLS 1.3 session ticket arrives with the first response
+    """
+    if _use_ssl:
+        default_tls_session_cache().save(connection)
+
+def _response_class(connection):
+    """
+    the response class for the connection's next response: one whose reads
+    wait for download tokens when downloads from the host are limited
+    """
+    rate_limiter = connection._rate_limiter
+    if not rate_limiter.limits(limit_download, connection.host):
+        return _base_class.response_class
+    return functools.partial(
+        ThrottledHTTPResponse,
+        throttle=rate_limiter.throttle(limit_download, connection.host),
+        max_read_size=rate_limiter.read_size(limit_download,
+                                             connection.host))
+
+def _send_request(connection, method, uri, body, headers):
+    """
+    send the request, with a file body going out through os.sendfile
+    when the connection is not using SSL and uploads are not rate limited
+    """
+    source = None
+    if not _use_ssl and not "Transfer-Encoding" in headers and \
+        not connection._rate_limiter.limits(limit_upload, connection.host):
+        source = file_source(body, header_content_length(headers))
+    if source is None:
+        _base_class.request(connection, 
+                            method, 
+                            uri, 
+                            body=body, 
+                            headers=headers)
+    else:
+        send_request(connection, method, uri, body, headers, source)
 
 class HTTPConnection(_base_class):
     """
@@ -83,6 +238,25 @@ class HTTPConnection(_base_class):
     debug level
         debug level of HTTPConnection base class 
 
+    retry_policy
+        the RetryPolicy deciding when a failed request is sent again;
+        default_retry_policy() if None
+
+    dns_cache
+        the DNSCache used to resolve base_address; default_dns_cache()
+        if None
+
+    ssl_context
+        the SSLContext for the TLS connection; default_ssl_context() if None
+
+    rate_limiter
+        the RateLimiter pacing requests and body bytes;
+        default_rate_limiter() if None
+
+    observers
+        callables passed a RequestTiming for each request, as well as
+        those added with add_request_observer
+
     nimbus.io wrapper for HTTPSConnection. This constructor performs
     the initial connection but does not send a request.
     """
@@ -92,15 +266,51 @@ class HTTPConnection(_base_class):
         user_name, 
         auth_key, 
         auth_id, 
-        debug_level=0
+        debug_level=0,
+        retry_policy=None,
+        dns_cache=None,
+        ssl_context=None,
+        rate_limiter=None,
+        observers=None
     ):
-        _base_class.__init__(self, base_address, timeout=_timeout)
+        kwargs = _base_class_kwargs(ssl_context)
+        _base_class.__init__(self, base_address, **kwargs)
+        # not a constructor argument before Python 3.7, where send() reads
+        # file bodies in fixed 8 KiB blocks and ignores this
+        self.blocksize = _body_block_size
+        self._ssl_context = kwargs.get("context")
         self._log = logging.getLogger("HTTPConnection")
+        self._base_address = base_address
+        if retry_policy is None:
+            retry_policy = default_retry_policy()
+        self._retry_policy = retry_policy
+        if rate_limiter is None:
+            rate_limiter = default_rate_limiter()
+        self._rate_limiter = rate_limiter
+        if dns_cache is None:
+            dns_cache = default_dns_cache()
+        self._dns_cache = dns_cache
+        # the base class connects through this
+        self._create_connection = self._open_socket
+        self._observers = list(observers or [])
+        self._timing = None
+        self._connect_phases = None
         self._user_name = user_name
         self._auth_key = auth_key
         self._auth_id = auth_id
         self.set_debuglevel(debug_level)
         self._connected = False
+        self._response = None
+
+    def _open_socket(self, 
+                     address, 
+                     timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                     source_address=None):
+        return _create_connection(self, address, timeout, source_address)
+
+    def connect(self):
+        _connect(self, self._ssl_context)
+        self._connected = True
 
     def close(self):
         self._log.debug("close()")
@@ -113,7 +323,8 @@ class HTTPConnection(_base_class):
                 uri, 
                 body=None, 
                 headers=None, 
-                expected_status=OK):
+                expected_status=OK,
+                content_length=None):
         """
         method
             one of GET, PUT, POST, DELETE, HEAD
@@ -122,38 +333,108 @@ class HTTPConnection(_base_class):
             the REST command for this request
 
         body
-            if present, must be a string or an open file object
+            if present, must be a string, an open file object or an
+            iterable of blocks. A file is streamed from its current
+            position. A body whose length can't be known, such as a pipe,
+            is sent with chunked transfer encoding; pass a ChunkedBody to
+            choose the chunk size.
 
         headers
             a dictionary of key/value pairs to be added to the HTTP headers
 
         expected_status
-            status indicating a successful result, for example 201 CREATED
+            status indicating a successful result, for example 201 CREATED,
+            or a tuple of them
 
-        send an HTTP request over the connection
+        content_length
+            the size of the body, for a body whose size can't be found
+            with len(), fstat or seek; sent as Content-Length
+
+        send an HTTP request over the connection, retrying transient
+        failures as the retry policy allows
         return a HTTPResponse object, or raise an exception
         """
-        retry_count = 0
-        while not self._connected:
+        observers = request_observers(self._observers)
+        if len(observers) > 0:
+            self._timing = RequestTiming(method, 
+                                         self.host, 
+                                         uri, 
+                                         self._connect_phases)
+            self._connect_phases = None
+        try:
+            response = self._request_with_retries(method, 
+                                                  uri, 
+                                                  body, 
+                                                  headers, 
+                                                  expected_status,
+                                                  content_length)
+        except Exception:
+            if self._timing is not None:
+                finish_timing(self._timing, observers, sys.exc_info()[1])
+            raise
+        else:
+            if self._timing is not None:
+                observe_response(response, self._timing, observers)
+        finally:
+            self._timing = None
+        return response
+
+    def _request_with_retries(self, 
+                              method, 
+                              uri, 
+                              body, 
+                              headers, 
+                              expected_status,
+                              content_length):
+        body, headers, content_length = chunked_request(body,
+                                                        headers,
+                                                        content_length)
+        body = throttled_body(self._rate_limiter, self.host, body)
+        retry = self._retry_policy.begin(self._base_address, method, body)
+        while True:
+            if not retry.before_attempt():
+                raise CircuitOpenError(self._base_address)
+            self._rate_limiter.acquire_request(self.host)
+            if self._timing is not None:
+                self._timing.begin_attempt()
+            try:
+                return_value = self._request_once(retry, 
+                                                  method, 
+                                                  uri, 
+                                                  body, 
+                                                  headers, 
+                                                  expected_status,
+                                                  content_length)
+            except Exception:
+                delay = retry.next_delay(sys.exc_info()[1])
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            retry.succeeded()
+            return return_value
+
+    def _request_once(self, 
+                      retry,
+                      method, 
+                      uri, 
+                      body, 
+                      headers, 
+                      expected_status,
+                      content_length):
+        """
+        send the request once
+        """
+        if not self._connected:
+            # a connect or DNS failure is one failed attempt; the retry
+            # policy decides whether, and when, to try again
             try:
                 self.connect()
             except Exception:
                 instance = sys.exc_info()[1]
-                # this could be an error from a real socket or a gevent 
-                # monkeypatched socket. So we check the string
-                if "DNSError".lower() in str(instance).lower():
-                    retry_count += 1
-                    if retry_count > _connection_retries:
-                        self._log("DNSError: too many retries".format(
-                            retry_count))
-                        raise
-                    self._log("DNSError retry {0} in {1} seconds".format(
-                        retry_count, _connection_retry_seconds))
-                    continue                       
-                self._log.exception("Unhandled connection error {0}".format(
+                self._log.warning("connection error {0}".format(
                     str(instance)))
                 raise
-            self._connected = True
 
         if headers is None:
             headers = dict()
@@ -177,23 +458,27 @@ class HTTPConnection(_base_class):
         # nginx will (rightly) reject with HTTP status 411 Length Required if
         # we send a PUT without a Content-Length header, even if the body size
         # is 0.  and our httplib base class won't add this header if body is
-        # None.
-        if method == "PUT":
-            try:
-                headers.setdefault("Content-Length", str(len(body)))
-            except TypeError:
-                if body is None:
-                    headers.setdefault("Content-Length", str(0))
+        # None, or work it out for a file body (it would send it chunked).
+        if content_length is not None:
+            headers["Content-Length"] = str(content_length)
+        elif (method == "PUT" or body is not None) and \
+            not "Content-Length" in headers and \
+            not "Transfer-Encoding" in headers:
+            content_length = compute_body_length(body)
+            if content_length is not None:
+                headers["Content-Length"] = str(content_length)
 
         # the body maybe beyond 7 bit ascii, so a unicode URL can't be combined
         # with it into a single string to form the request.
 
+        timing = self._timing
+        if timing is not None:
+            timing.bytes_sent = header_content_length(headers)
+            timing.start_phase()
+
+        retry.request_sent = True
         try:
-            _base_class.request(self, 
-                                method, 
-                                uri, 
-                                body=body, 
-                                headers=headers)
+            _send_request(self, method, uri, body, headers)
         except Exception:
             instance = sys.exc_info()[1]
             # 2012-02-14 dougfort -- we are getting timeouts here
@@ -205,7 +490,11 @@ class HTTPConnection(_base_class):
             # with it
             raise
 
+        if timing is not None:
+            timing.end_phase("send")
+
         try:
+            self.response_class = _response_class(self)
             response = self.getresponse()
         except BadStatusLine:
             instance = sys.exc_info()[1]
@@ -214,7 +503,11 @@ class HTTPConnection(_base_class):
             raise LumberyardHTTPError(INTERNAL_SERVER_ERROR, 
                                       "BadStatusLine")
 
-        if response.status != expected_status:
+        _save_tls_session(self)
+        if timing is not None:
+            timing.end_phase("first_byte")
+
+        if not _is_expected_status(response.status, expected_status):
             self._log.error("request failed {0} {1}".format(response.status, 
                                                             response.reason)) 
 
@@ -228,21 +521,18 @@ class HTTPConnection(_base_class):
             self.close()
 
             # if we got 503 service unavailable
-            # and there is a retry_after header with an integer value 
+            # and there is a retry_after header with a usable value 
             # give the caller a chance to retry
             if response.status == SERVICE_UNAVAILABLE:
-                retry_after = response.getheader("RETRY-AFTER", None)
-                if retry_after is not None:
-                    seconds = None
-                    try:
-                        seconds = int(retry_after)
-                    except Exception:
-                        pass
-                    if seconds is not None and seconds > 0:
-                        raise LumberyardRetryableHTTPError(seconds)
+                seconds = parse_retry_after(
+                    response.getheader("RETRY-AFTER", None))
+                if seconds is not None:
+                    raise LumberyardRetryableHTTPError(seconds)
 
             raise LumberyardHTTPError(response.status, response.reason)
 
+        # remember the response so a connection pool can drain it
+        self._response = response
         return response
 
 class UnAuthHTTPConnection(_base_class):
@@ -256,25 +546,80 @@ class UnAuthHTTPConnection(_base_class):
     debug level
         debug level of HTTPConnection base class 
 
+    retry_policy
+        the RetryPolicy deciding when a failed request is sent again;
+        default_retry_policy() if None
+
+    dns_cache
+        the DNSCache used to resolve base_address; default_dns_cache()
+        if None
+
+    ssl_context
+        the SSLContext for the TLS connection; default_ssl_context() if None
+
+    rate_limiter
+        the RateLimiter pacing requests and body bytes;
+        default_rate_limiter() if None
+
+    observers
+        callables passed a RequestTiming for each request, as well as
+        those added with add_request_observer
+
     nimbus.io wrapper for HTTPSConnection. This constructor performs
     the initial connection but does not send a request.
     """
     def __init__(
         self, 
         base_address, 
-        debug_level=0
+        debug_level=0,
+        retry_policy=None,
+        dns_cache=None,
+        ssl_context=None,
+        rate_limiter=None,
+        observers=None
     ):
-        _base_class.__init__(self, base_address, timeout=_timeout)
+        kwargs = _base_class_kwargs(ssl_context)
+        _base_class.__init__(self, base_address, **kwargs)
+        # not a constructor argument before Python 3.7, where send() reads
+        # file bodies in fixed 8 KiB blocks and ignores this
+        self.blocksize = _body_block_size
+        self._ssl_context = kwargs.get("context")
         self._log = logging.getLogger("UnAuthHTTPConnection")
+        self._base_address = base_address
+        if retry_policy is None:
+            retry_policy = default_retry_policy()
+        self._retry_policy = retry_policy
+        if rate_limiter is None:
+            rate_limiter = default_rate_limiter()
+        self._rate_limiter = rate_limiter
+        if dns_cache is None:
+            dns_cache = default_dns_cache()
+        self._dns_cache = dns_cache
+        # the base class connects through this
+        self._create_connection = self._open_socket
+        self._observers = list(observers or [])
+        self._timing = None
+        self._connect_phases = None
         self.set_debuglevel(debug_level)
+        self._response = None
         self.connect()
 
+    def _open_socket(self, 
+                     address, 
+                     timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                     source_address=None):
+        return _create_connection(self, address, timeout, source_address)
+
+    def connect(self):
+        _connect(self, self._ssl_context)
+
     def request(self, 
                 method, 
                 uri, 
                 body=None, 
                 headers=None, 
-                expected_status=OK):
+                expected_status=OK,
+                content_length=None):
         """
         method
             one of GET, POST, DELETE, HEAD
@@ -283,17 +628,98 @@ class UnAuthHTTPConnection(_base_class):
             the REST command for this request
 
         body
-            if present, must be a string or an open file object
+            if present, must be a string, an open file object or an
+            iterable of blocks. A file is streamed from its current
+            position. A body whose length can't be known, such as a pipe,
+            is sent with chunked transfer encoding; pass a ChunkedBody to
+            choose the chunk size.
 
         headers
             a dictionary of key/value pairs to be added to the HTTP headers
 
         expected_status
-            status indicating a successful result, for example 201 CREATED
+            status indicating a successful result, for example 201 CREATED,
+            or a tuple of them
+
+        content_length
+            the size of the body, for a body whose size can't be found
+            with len(), fstat or seek; sent as Content-Length
 
-        send an HTTP request over the connection
+        send an HTTP request over the connection, retrying transient
+        failures as the retry policy allows
         return a HTTPResponse object, or raise an exception
         """
+        observers = request_observers(self._observers)
+        if len(observers) > 0:
+            self._timing = RequestTiming(method, 
+                                         self.host, 
+                                         uri, 
+                                         self._connect_phases)
+            self._connect_phases = None
+        try:
+            response = self._request_with_retries(method, 
+                                                  uri, 
+                                                  body, 
+                                                  headers, 
+                                                  expected_status,
+                                                  content_length)
+        except Exception:
+            if self._timing is not None:
+                finish_timing(self._timing, observers, sys.exc_info()[1])
+            raise
+        else:
+            if self._timing is not None:
+                observe_response(response, self._timing, observers)
+        finally:
+            self._timing = None
+        return response
+
+    def _request_with_retries(self, 
+                              method, 
+                              uri, 
+                              body, 
+                              headers, 
+                              expected_status,
+                              content_length):
+        body, headers, content_length = chunked_request(body,
+                                                        headers,
+                                                        content_length)
+        body = throttled_body(self._rate_limiter, self.host, body)
+        retry = self._retry_policy.begin(self._base_address, method, body)
+        while True:
+            if not retry.before_attempt():
+                raise CircuitOpenError(self._base_address)
+            self._rate_limiter.acquire_request(self.host)
+            if self._timing is not None:
+                self._timing.begin_attempt()
+            try:
+                return_value = self._request_once(retry, 
+                                                  method, 
+                                                  uri, 
+                                                  body, 
+                                                  headers, 
+                                                  expected_status,
+                                                  content_length)
+            except Exception:
+                delay = retry.next_delay(sys.exc_info()[1])
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            retry.succeeded()
+            return return_value
+
+    def _request_once(self, 
+                      retry,
+                      method, 
+                      uri, 
+                      body, 
+                      headers, 
+                      expected_status,
+                      content_length):
+        """
+        send the request once
+        """
         if headers is None:
             headers = dict()
 
@@ -301,26 +727,41 @@ class UnAuthHTTPConnection(_base_class):
             "agent"                 : 'lumberyard/1.0'
         })
 
+        # reconnect after an error closed the connection, before anything
+        # of this request is sent
+        if self.sock is None:
+            try:
+                self.connect()
+            except Exception:
+                instance = sys.exc_info()[1]
+                self._log.exception(str(instance))
+                raise LumberyardHTTPError(INTERNAL_SERVER_ERROR, 
+                                          str(instance))
+
         # nginx will (rightly) reject with HTTP status 411 Length Required if
         # we send a PUT without a Content-Length header, even if the body size
         # is 0.  and our httplib base class won't add this header if body is
-        # None.
-        if method == "PUT":
-            try:
-                headers.setdefault("Content-Length", str(len(body)))
-            except TypeError:
-                if body is None:
-                    headers.setdefault("Content-Length", str(0))
+        # None, or work it out for a file body (it would send it chunked).
+        if content_length is not None:
+            headers["Content-Length"] = str(content_length)
+        elif (method == "PUT" or body is not None) and \
+            not "Content-Length" in headers and \
+            not "Transfer-Encoding" in headers:
+            content_length = compute_body_length(body)
+            if content_length is not None:
+                headers["Content-Length"] = str(content_length)
 
         # the body maybe beyond 7 bit ascii, so a unicode URL can't be combined
         # with it into a single string to form the request.
 
+        timing = self._timing
+        if timing is not None:
+            timing.bytes_sent = header_content_length(headers)
+            timing.start_phase()
+
+        retry.request_sent = True
         try:
-            _base_class.request(self, 
-                                method, 
-                                uri, 
-                                body=body, 
-                                headers=headers)
+            _send_request(self, method, uri, body, headers)
         except Exception:
             instance = sys.exc_info()[1]
             # 2012-02-14 dougfort -- we are getting timeouts here
@@ -330,7 +771,11 @@ class UnAuthHTTPConnection(_base_class):
             raise LumberyardHTTPError(INTERNAL_SERVER_ERROR, 
                                       str(instance))
 
+        if timing is not None:
+            timing.end_phase("send")
+
         try:
+            self.response_class = _response_class(self)
             response = self.getresponse()
         except BadStatusLine:
             instance = sys.exc_info()[1]
@@ -339,7 +784,11 @@ class UnAuthHTTPConnection(_base_class):
             raise LumberyardHTTPError(INTERNAL_SERVER_ERROR, 
                                       "BadStatusLine")
 
-        if response.status != expected_status:
+        _save_tls_session(self)
+        if timing is not None:
+            timing.end_phase("first_byte")
+
+        if not _is_expected_status(response.status, expected_status):
             self._log.error("request failed {0} {1}".format(response.status, 
                                                             response.reason)) 
 
@@ -353,20 +802,17 @@ class UnAuthHTTPConnection(_base_class):
             self.close()
 
             # if we got 503 service unavailable
-            # and there is a retry_after header with an integer value 
+            # and there is a retry_after header with a usable value 
             # give the caller a chance to retry
             if response.status == SERVICE_UNAVAILABLE:
-                retry_after = response.getheader("RETRY-AFTER", None)
-                if retry_after is not None:
-                    seconds = None
-                    try:
-                        seconds = int(retry_after)
-                    except Exception:
-                        pass
-                    if seconds is not None and seconds > 0:
-                        raise LumberyardRetryableHTTPError(seconds)
+                seconds = parse_retry_after(
+                    response.getheader("RETRY-AFTER", None))
+                if seconds is not None:
+                    raise LumberyardRetryableHTTPError(seconds)
 
             raise LumberyardHTTPError(response.status, response.reason)
 
+        # remember the response so a connection pool can drain it
+        self._response = response
         return response
 
@@ -6,7 +6,9 @@ utility functions for connecting with nimbus.io via HTTP
 """
 import hashlib
 import hmac
+import io
 import os
+import stat
 import time
 try:
     from urllib import urlencode
@@ -14,6 +16,8 @@ except ImportError:
     from urllib.parse import urlencode
 
 meta_prefix = "__nimbus_io__"
+# a GET or HEAD of a key returns its metadata as headers with this prefix
+meta_header_prefix = "x-nimbus-io-meta-"
 # TODO ssl
 _service_domain = os.environ.get("NIMBUS_IO_SERVICE_DOMAIN", 'nimbus.io')
 _host_port = int(os.environ.get("NIMBUS_IO_SERVICE_PORT", "443"))
@@ -118,4 +122,62 @@ def current_timestamp():
     """
     return int(time.time())
 
+def response_meta(response):
+    """
+    return the dict of key metadata in the headers of a GET or HEAD of
+    the key, without meta_header_prefix
+    """
+    return dict((name.lower()[len(meta_header_prefix):], value, ) \
+                for (name, value) in response.getheaders() \
+                if name.lower().startswith(meta_header_prefix))
+
 
+
+def compute_body_length(body):
+    """
+    body
+        a request body: None, bytes, a str, a file-like object or an
+        iterable of blocks
+
+    return the number of bytes the body will send, or None if that can't
+    be known without reading it. For a file this is what remains from its
+    current position: from len() if it has one, from fstat for a real
+    file, otherwise by seeking to the end and back.
+    """
+    if body is None:
+        return 0
+
+    if isinstance(body, (bytes, bytearray, str, )):
+        return len(body)
+    if isinstance(body, memoryview):
+        return body.nbytes
+    if not hasattr(body, "read"):
+        # an iterable of blocks
+        return None
+
+    try:
+        return len(body)
+    except TypeError:
+        pass
+
+    try:
+        file_stat = os.fstat(body.fileno())
+    except (AttributeError, EnvironmentError, ValueError, 
+            io.UnsupportedOperation):
+        file_stat = None
+    if file_stat is not None and stat.S_ISREG(file_stat.st_mode):
+        try:
+            position = body.tell()
+        except (AttributeError, EnvironmentError, io.UnsupportedOperation):
+            position = 0
+        return max(0, file_stat.st_size - position)
+
+    try:
+        position = body.tell()
+        body.seek(0, os.SEEK_END)
+        end = body.tell()
+        body.seek(position)
+    except (AttributeError, EnvironmentError, ValueError, 
+            io.UnsupportedOperation):
+        return None
+    return max(0, end - position)
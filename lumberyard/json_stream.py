@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+json_stream.py
+
+class JSONStream
+
+Incremental decoding of the JSON bodies returned by nimbus.io listings.
+
+A listing such as ``{"key_data": [{...}, {...}, ...], "truncated": false}``
+is decoded while the body is still arriving: each element of the named
+arrays is yielded as soon as it is complete, and only the element being
+decoded plus one read buffer are held in memory. Other top-level members
+are decoded whole into the ``fields`` dict.
+
+A body that is itself an array (for example the collection list) is
+streamed when array_names is None::
+
+    stream = JSONStream(response, ["key_data", "prefixes"])
+    for array_name, entry in stream:
+        ...
+    truncated = stream.fields.get("truncated")
+"""
+import codecs
+import json
+
+_read_size = 64 * 1024
+_whitespace = " \t\n\r"
+_delimiters = _whitespace + ",]}"
+
+class JSONStream(object):
+    """
+    input_file
+        an object with read(size) returning bytes, such as an HTTPResponse
+
+    array_names
+        names of top-level object members whose array elements are
+        yielded one at a time; None if the body is a top-level array
+
+    read_size
+        the number of bytes requested from input_file at a time
+
+    Iterating yields (array_name, element) tuples; array_name is None for
+    elements of a top-level array. Malformed JSON raises ValueError.
+    """
+    def __init__(self, input_file, array_names=None, read_size=_read_size):
+        self._input_file = input_file
+        self._array_names = (None if array_names is None \
+                             else frozenset(array_names))
+        self._read_size = read_size
+        self._utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json_decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._position = 0
+        self._eof = False
+        self.fields = dict()
+        # the named arrays found, including empty ones
+        self.arrays_seen = set()
+
+    def _fill(self, minimum_size=0):
+        """
+        append at least one read to the buffer
+        return False at the end of the input
+        """
+        if self._eof:
+            return False
+
+        # drop what has been consumed
+        if self._position > 0:
+            self._buffer = self._buffer[self._position:]
+            self._position = 0
+
+        size = max(self._read_size, minimum_size)
+        data = self._input_file.read(size)
+        if len(data) == 0:
+            self._eof = True
+            self._buffer += self._utf8_decoder.decode(b"", final=True)
+            return False
+        self._buffer += self._utf8_decoder.decode(data)
+        return True
+
+    def _peek(self):
+        """
+        return the next non-whitespace character without consuming it,
+        or None at the end of the input
+        """
+        while True:
+            while self._position < len(self._buffer):
+                character = self._buffer[self._position]
+                if character not in _whitespace:
+                    return character
+                self._position += 1
+            if not self._fill():
+                return None
+
+    def _expect(self, expected):
+        character = self._peek()
+        if character != expected:
+            raise ValueError("expected {0!r} found {1!r}".format(
+                expected, character))
+        self._position += 1
+
+    def _decode_value(self):
+        """
+        decode one complete JSON value at the current position
+        """
+        self._peek()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self._buffer,
+                                                           self._position)
+            except ValueError:
+                # incomplete; read at least as much again as we hold so
+                # a large value is not rescanned too many times
+                unconsumed = len(self._buffer) - self._position
+                if not self._fill(unconsumed):
+                    raise
+                continue
+            # a number that is not followed by a delimiter may continue in
+            # the next read
+            if not self._eof and \
+                isinstance(value, (int, float, )) and \
+                not isinstance(value, bool) and \
+                (end == len(self._buffer) or \
+                 self._buffer[end] not in _delimiters):
+                self._fill(len(self._buffer) - self._position)
+                continue
+            self._position = end
+            return value
+
+    def _iter_array(self, array_name):
+        self._expect("[")
+        if self._peek() == "]":
+            self._position += 1
+            return
+        while True:
+            yield array_name, self._decode_value()
+            character = self._peek()
+            self._position += 1
+            if character == "]":
+                return
+            if character != ",":
+                raise ValueError("expected ',' or ']' found {0!r}".format(
+                    character))
+
+    def _iter_object(self):
+        self._expect("{")
+        if self._peek() == "}":
+            self._position += 1
+            return
+        while True:
+            name = self._decode_value()
+            self._expect(":")
+            if name in self._array_names and self._peek() == "[":
+                self.arrays_seen.add(name)
+                for item in self._iter_array(name):
+                    yield item
+            else:
+                self.fields[name] = self._decode_value()
+            character = self._peek()
+            self._position += 1
+            if character == "}":
+                return
+            if character != ",":
+                raise ValueError("expected ',' or '}}' found {0!r}".format(
+                    character))
+
+    def __iter__(self):
+        if self._array_names is None:
+            iterator = self._iter_array(None)
+        else:
+            iterator = self._iter_object()
+        for item in iterator:
+            yield item
+        if self._peek() is not None:
+            raise ValueError("extra data after JSON value")
+
+def iter_json_array(input_file, array_name=None):
+    """
+    generate the elements of one streamed array, ignoring other members
+    """
+    array_names = (None if array_name is None else [array_name])
+    for _, entry in JSONStream(input_file, array_names):
+        yield entry
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+key_index.py
+
+class KeyIndex
+
+A local SQLite index of the keys of one collection, so listings by prefix,
+delimiter and glob pattern are answered without going to the service.
+
+The index is filled by paged listing through the same data/ endpoint as
+iter_keys. refresh continues from the last key indexed, so it only pulls
+keys added after it in key order: a refresh of an unchanged collection is
+a single request for an empty page. Each page is committed with the marker
+that follows it, so an interrupted refresh resumes where it stopped.
+
+A refresh from the marker can not see keys deleted since, nor keys added
+before the marker. reconcile lists the whole collection again into a new
+table and swaps it in, reporting what was added and removed. It is
+resumable in the same way.
+
+Queries walk the key index in order. A prefix is a range scan. With a
+delimiter, each common prefix is emitted once and the scan skips past
+every key under it, so a directory listing of millions of keys reads only
+the entries it returns. A glob pattern is matched with fnmatchcase, and
+the literal part before its first wildcard narrows the range scanned.
+
+The database is opened in WAL mode with a busy timeout, so several
+processes may share an index file. Opt in through ncl --index-dir or
+NIMBUSIO_KEY_INDEX_DIR.
+"""
+import fnmatch
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from lumberyard.key_listing import fetch_key_page
+
+_max_keys = 1000
+_busy_timeout_seconds = 30.0
+_glob_special_re = re.compile(r"[*?\[]")
+
+_schema = [
+    """create table if not exists keys (
+        key text primary key,
+        entry text not null
+    ) without rowid""",
+    """create table if not exists state (
+        name text primary key,
+        value text
+    )""",
+]
+
+def _prefix_upper_bound(prefix):
+    """
+    return the smallest string greater than every string starting with
+    prefix, or None if there is none
+    """
+    while len(prefix) > 0:
+        last = ord(prefix[-1])
+        if last < 0x10ffff:
+            return prefix[:-1] + chr(last + 1)
+        prefix = prefix[:-1]
+    return None
+
+def pattern_prefix(pattern):
+    """
+    return the literal part of a glob pattern before its first wildcard
+    """
+    match = _glob_special_re.search(pattern)
+    return (pattern if match is None else pattern[:match.start()])
+
+def index_filename(hostname):
+    """
+    return the file name of the index for a collection hostname
+    """
+    return "{0}.sqlite".format(re.sub(r"[^A-Za-z0-9.-]", "_", hostname))
+
+class KeyIndex(object):
+    """
+    path
+        the SQLite database file, created if it does not exist
+
+    A thread-safe local index of one collection's keys.
+    """
+    def __init__(self, path):
+        self._log = logging.getLogger("KeyIndex")
+        self.path = path
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path,
+                                   timeout=_busy_timeout_seconds,
+                                   check_same_thread=False)
+        self._db.execute("pragma journal_mode=wal")
+        self._db.execute("pragma synchronous=normal")
+        with self._db:
+            for statement in _schema:
+                self._db.execute(statement)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _get_state(self, name, default=None):
+        row = self._db.execute("select value from state where name = ?",
+                               (name, )).fetchone()
+        return (default if row is None else json.loads(row[0]))
+
+    def _set_state(self, name, value):
+        self._db.execute("insert or replace into state (name, value) "
+                         "values (?, ?)",
+                         (name, json.dumps(value), ))
+
+    @property
+    def refreshed_time(self):
+        """
+        when the index last caught up with the service, or None
+        """
+        with self._lock:
+            return self._get_state("refreshed_time")
+
+    def age_seconds(self):
+        """
+        return the seconds since the last refresh, or None if the index
+        has never been filled
+        """
+        refreshed_time = self.refreshed_time
+        if refreshed_time is None:
+            return None
+        return time.time() - refreshed_time
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("select count(*) from keys").fetchone()[0]
+
+    def _fill(self, table, marker_name, connection_pool, hostname, identity,
+              max_keys):
+        """
+        list the collection from the saved marker into table, committing
+        page by page; return the number of entries listed
+        """
+        count = 0
+        with self._lock:
+            marker = self._get_state(marker_name)
+        while True:
+            entries, truncated = fetch_key_page(connection_pool,
+                                                hostname,
+                                                identity,
+                                                marker=marker,
+                                                max_keys=max_keys)
+            with self._lock:
+                with self._db:
+                    self._db.executemany(
+                        "insert or replace into {0} (key, entry) "
+                        "values (?, ?)".format(table),
+                        ((entry["key"], json.dumps(entry), ) \
+                         for entry in entries))
+                    if len(entries) > 0:
+                        marker = entries[-1]["key"]
+                        self._set_state(marker_name, marker)
+            count += len(entries)
+            if not truncated or len(entries) == 0:
+                return count
+
+    def refresh(self, connection_pool, hostname, identity,
+                max_keys=_max_keys):
+        """
+        add the keys listed after the last one indexed; return how many
+        """
+        count = self._fill("keys",
+                           "marker",
+                           connection_pool,
+                           hostname,
+                           identity,
+                           max_keys)
+        with self._lock:
+            with self._db:
+                self._set_state("refreshed_time", time.time())
+        self._log.debug("{0} refreshed, {1} new keys".format(self.path,
+                                                             count))
+        return count
+
+    def reconcile(self, connection_pool, hostname, identity,
+                  max_keys=_max_keys):
+        """
+        replace the index with a full listing of the collection; return
+        (added, removed): the keys the service has that the index did not,
+        and the reverse
+        """
+        with self._lock:
+            with self._db:
+                self._db.execute("begin immediate")
+                if self._get_state("reconcile_marker") is None:
+                    # not resuming an interrupted reconcile
+                    self._db.execute("drop table if exists reconcile_keys")
+                self._db.execute("create table if not exists reconcile_keys "
+                                 "(key text primary key, entry text not null)"
+                                 " without rowid")
+        self._fill("reconcile_keys",
+                   "reconcile_marker",
+                   connection_pool,
+                   hostname,
+                   identity,
+                   max_keys)
+
+        with self._lock:
+            with self._db:
+                # the swap is one transaction; sqlite3 would run the DDL
+                # outside of one
+                self._db.execute("begin immediate")
+                added = self._db.execute(
+                    "select count(*) from (select key from reconcile_keys "
+                    "except select key from keys)").fetchone()[0]
+                removed = self._db.execute(
+                    "select count(*) from (select key from keys "
+                    "except select key from reconcile_keys)").fetchone()[0]
+                self._db.execute("drop table keys")
+                self._db.execute("alter table reconcile_keys rename to keys")
+                last_row = self._db.execute(
+                    "select max(key) from keys").fetchone()
+                self._set_state("marker", last_row[0])
+                self._db.execute("delete from state "
+                                 "where name = 'reconcile_marker'")
+                self._set_state("refreshed_time", time.time())
+        self._log.info("{0} reconciled, {1} added {2} removed".format(
+            self.path, added, removed))
+        return added, removed
+
+    def _select(self, low, high, after, limit):
+        """
+        return up to limit (key, entry) rows with low <= key < high (None
+        for no bound) and key > after, in key order
+        """
+        clauses, values = ["key >= ?"], [low]
+        if high is not None:
+            clauses.append("key < ?")
+            values.append(high)
+        if after is not None:
+            clauses.append("key > ?")
+            values.append(after)
+        statement = "select key, entry from keys where {0} " \
+                    "order by key limit ?".format(" and ".join(clauses))
+        values.append(limit)
+        with self._lock:
+            return self._db.execute(statement, values).fetchall()
+
+    def _rows(self, low, high, after):
+        """
+        generate the rows of _select a batch at a time, without holding
+        the lock between batches
+        """
+        while True:
+            rows = self._select(low, high, after, _max_keys)
+            for row in rows:
+                yield row
+            if len(rows) < _max_keys:
+                return
+            after = rows[-1][0]
+
+    def query(self, prefix=None, delimiter=None, pattern=None, marker=None):
+        """
+        generate the key entry dicts of the indexed keys that start with
+        prefix, come after marker and match the glob pattern, in key order.
+        With a delimiter, generate strings as the listing does: each key
+        with no delimiter after the prefix, and once each the common
+        prefixes up to and including the first delimiter after it, that
+        come after marker.
+        """
+        prefix = (prefix or "")
+        low = prefix
+        if pattern is not None:
+            literal = pattern_prefix(pattern)
+            if literal.startswith(prefix):
+                low = literal
+            elif not prefix.startswith(literal):
+                # the pattern and the prefix can not both match
+                return
+        high = _prefix_upper_bound(low)
+
+        if delimiter is None:
+            for key, entry in self._rows(low, high, marker):
+                if pattern is None or fnmatch.fnmatchcase(key, pattern):
+                    yield json.loads(entry)
+            return
+
+        if pattern is not None:
+            previous = None
+            for key, _ in self._rows(low, high, marker):
+                if not fnmatch.fnmatchcase(key, pattern):
+                    continue
+                item = _common_prefix(key, prefix, delimiter)
+                if item != previous and (marker is None or item > marker):
+                    yield item
+                previous = item
+            return
+
+        # skip past each common prefix instead of reading its keys
+        after = marker
+        while True:
+            rows = self._select(low, high, after, 1)
+            if len(rows) == 0:
+                return
+            key = rows[0][0]
+            item = _common_prefix(key, prefix, delimiter)
+            if item == key:
+                yield item
+                after = key
+                continue
+            if marker is None or item > marker:
+                yield item
+            low = _prefix_upper_bound(item)
+            if low is None or (high is not None and low >= high):
+                return
+
+def _common_prefix(key, prefix, delimiter):
+    """
+    return key up to and including the first delimiter after prefix, or
+    key itself if there is none
+    """
+    position = key.find(delimiter, len(prefix))
+    if position < 0:
+        return key
+    return key[:position + len(delimiter)]
+
+_open_indexes = dict()
+_open_indexes_lock = threading.Lock()
+
+def open_key_index(directory, hostname):
+    """
+    return the KeyIndex for a collection hostname in directory, shared by
+    every caller in the process
+    """
+    path = os.path.join(directory, index_filename(hostname))
+    with _open_indexes_lock:
+        key_index = _open_indexes.get(path)
+        if key_index is None:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            key_index = KeyIndex(path)
+            _open_indexes[path] = key_index
+        return key_index
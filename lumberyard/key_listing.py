@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+key_listing.py
+
+iterate over the keys of a collection, one page at a time.
+
+iter_keys is a generator that follows the listing marker: each page's last
+key (or prefix) is sent back as the marker for the next page. While the
+caller is consuming one page, a background thread is already fetching the
+next, so a full listing costs about the network time alone. At most one
+page is held besides the one being consumed, and the caller can stop at
+any point::
+
+    for key_entry in iter_keys(pool, hostname, identity, prefix="logs/"):
+        print(key_entry["key"])
+"""
+import logging
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import sys
+import threading
+
+from lumberyard.http_util import compute_uri
+from lumberyard.json_stream import JSONStream
+
+_max_keys = 1000
+_listing_arrays = ["key_data", "prefixes", ]
+
+class _Page(object):
+    """
+    one page of a listing, or the exception that ended it
+    """
+    def __init__(self, entries=None, truncated=False, error=None):
+        self.entries = entries
+        self.truncated = truncated
+        self.error = error
+        self.last_entry = None
+
+def _entry_marker(entry):
+    """
+    return the value to send as marker to continue after this entry
+    """
+    if isinstance(entry, dict):
+        return entry["key"]
+    return entry
+
+def _listing_uri(prefix, delimiter, marker, max_keys):
+    kwargs = {
+        "max_keys" : max_keys,
+        "prefix" : (prefix or None),
+        "delimiter" : (delimiter or None),
+        "marker" : (marker or None),
+    }
+    return compute_uri("data/", **kwargs)
+
+def _iter_page(connection_pool, hostname, identity, uri, max_keys, page):
+    """
+    generate the entries of one page as they are decoded from the response
+    body; when the page is exhausted, page.truncated and page.last_entry
+    are set
+    """
+    entry_count = 0
+    last_entry = None
+    with connection_pool.connection(hostname, identity) as http_connection:
+        response = http_connection.request("GET", uri)
+        stream = JSONStream(response, _listing_arrays)
+        for _, entry in stream:
+            entry_count += 1
+            last_entry = entry
+            yield entry
+        if entry_count == 0 and len(stream.arrays_seen) == 0 and \
+            not any(name in stream.fields for name in _listing_arrays):
+            raise ValueError("Unexpected return value {0}".format(
+                stream.fields))
+
+    # older servers do not report truncation: a full page means there
+    # may be more
+    truncated = stream.fields.get("truncated", entry_count >= max_keys)
+    page.truncated = truncated and entry_count > 0
+    page.last_entry = last_entry
+
+def fetch_key_page(connection_pool,
+                   hostname,
+                   identity,
+                   prefix=None,
+                   delimiter=None,
+                   marker=None,
+                   max_keys=_max_keys):
+    """
+    return a (entries, truncated) tuple for one page of a listing.
+
+    entries is a list of key entry dicts, or of prefix strings if a
+    delimiter was given; truncated is True if there may be more pages.
+    """
+    uri = _listing_uri(prefix, delimiter, marker, max_keys)
+    page = _Page()
+    entries = list(_iter_page(connection_pool,
+                              hostname,
+                              identity,
+                              uri,
+                              max_keys,
+                              page))
+    return entries, page.truncated
+
+class _PageFetcher(threading.Thread):
+    """
+    fetch pages one ahead of the consumer
+    """
+    def __init__(self, fetch_page, marker):
+        threading.Thread.__init__(self, name="PageFetcher")
+        self.daemon = True
+        self._log = logging.getLogger("PageFetcher")
+        self._fetch_page = fetch_page
+        self._marker = marker
+        # one page waiting while the consumer works on the current one
+        self.pages = queue.Queue(maxsize=1)
+        # set by the consumer when it takes a page from the queue
+        self.taken = threading.Event()
+        self.stopped = threading.Event()
+
+    def _put(self, page):
+        self.taken.clear()
+        while not self.stopped.is_set():
+            try:
+                self.pages.put(page, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(self):
+        marker = self._marker
+        while not self.stopped.is_set():
+            try:
+                entries, truncated = self._fetch_page(marker)
+            except Exception:
+                instance = sys.exc_info()[1]
+                self._put(_Page(error=instance))
+                return
+            if not self._put(_Page(entries, truncated)):
+                return
+            if not truncated:
+                return
+            marker = _entry_marker(entries[-1])
+            # fetch the next page only once the consumer has moved on to
+            # this one, so no more than one page waits
+            while not self.taken.wait(0.1):
+                if self.stopped.is_set():
+                    return
+
+def iter_keys(connection_pool,
+              hostname,
+              identity,
+              prefix=None,
+              delimiter=None,
+              marker=None,
+              max_keys=_max_keys,
+              prefetch=True):
+    """
+    connection_pool
+        a ConnectionPool
+
+    hostname
+        the collection hostname, from compute_collection_hostname
+
+    identity
+        the identity used to sign requests, or None for a public listing
+
+    prefix, delimiter, marker
+        the listing parameters sent to the server
+
+    max_keys
+        the page size
+
+    prefetch
+        if True, fetch the next page in a background thread while the
+        current page is consumed; if False, decode entries directly from
+        each response body as the caller consumes them
+
+    generate key entry dicts (or prefix strings if delimiter is given)
+    across every page of the listing
+    """
+    def _fetch_page(page_marker):
+        return fetch_key_page(connection_pool,
+                              hostname,
+                              identity,
+                              prefix=prefix,
+                              delimiter=delimiter,
+                              marker=page_marker,
+                              max_keys=max_keys)
+
+    if not prefetch:
+        # entries are yielded straight from the response body
+        while True:
+            page = _Page()
+            uri = _listing_uri(prefix, delimiter, marker, max_keys)
+            for entry in _iter_page(connection_pool,
+                                    hostname,
+                                    identity,
+                                    uri,
+                                    max_keys,
+                                    page):
+                yield entry
+            if not page.truncated:
+                return
+            marker = _entry_marker(page.last_entry)
+
+    fetcher = _PageFetcher(_fetch_page, marker)
+    fetcher.start()
+    try:
+        while True:
+            page = fetcher.pages.get()
+            fetcher.taken.set()
+            if page.error is not None:
+                raise page.error
+            for entry in page.entries:
+                yield entry
+            if not page.truncated:
+                return
+    finally:
+        # the consumer may stop early; let the fetcher finish its request
+        # and exit without waiting for us
+        fetcher.stopped.set()
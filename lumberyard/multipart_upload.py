@@ -0,0 +1,486 @@
+# -*- coding: utf-8 -*-
+"""
+multipart_upload.py
+
+archive one or more files to a single key as a multi-part (conversation)
+upload.
+
+A conversation is started on the collection, the source files are divided
+into parts, and a bounded pool of threads uploads the parts concurrently over
+pooled connections. Each part is read from its file by offset, so nothing
+larger than an HTTP block is held in memory. A part that fails is retried
+on its own; the others are not affected. When every part is archived, the
+conversation is finished; if any part gives up, it is aborted.
+
+Small single files are archived with one ordinary request. A stream of
+unknown length, such as a pipe, is archived with one request as it is read,
+with chunked transfer encoding; see ChunkedBody.
+
+Given digest algorithms, the hex digests of the upload are left in
+UploadProgress.digests. A single request is hashed as it is sent (see
+HashingReader). A digest is of the bytes in order, which the parts of a
+conversation are not sent in, so for a multi-part upload one more thread
+reads the files through from the start and hashes them while the parts
+go out; the files are read twice, but the parts stay concurrent.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from lumberyard.chunked_body import ChunkedBody
+from lumberyard.http_connection import LumberyardHTTPError
+from lumberyard.http_util import compute_uri
+from lumberyard.read_reporter import ReadReporter
+from lumberyard.stream_digest import HashingReader
+
+_part_size = int(os.environ.get("NIMBUSIO_PART_SIZE", str(64 * 1024 * 1024)))
+_max_workers = 4
+_part_retries = 3
+_part_retry_seconds = 1.0
+_hash_block_size = 1024 * 1024
+
+class MultipartUploadError(Exception):
+    """
+    a part could not be archived, and the conversation was aborted
+    """
+    pass
+
+class FileRangeReader(object):
+    """
+    fd
+        an open file descriptor
+
+    offset
+        the position of the first byte in the file
+
+    length
+        the number of bytes in the range
+
+    A read-only file-like view of a byte range of an open file.
+    Reads are positional (os.pread), so many readers can share one
+    file descriptor from different threads.
+    """
+    def __init__(self, fd, offset, length):
+        self._fd = fd
+        self._offset = offset
+        self._length = length
+        self._position = 0
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=None):
+        remaining = self._length - self._position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size == 0:
+            return b""
+        data = os.pread(self._fd, size, self._offset + self._position)
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._length
+        self._position = max(0, min(offset, self._length))
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def file_range(self):
+        """
+        return (fd, offset, length) of the bytes not yet read
+        """
+        return (self._fd,
+                self._offset + self._position,
+                self._length - self._position, )
+
+    def close(self):
+        pass
+
+class _FileSequenceReader(object):
+    """
+    a read-only file-like view of FileRangeReaders one after another
+    """
+    def __init__(self, readers):
+        self._readers = readers
+        self._length = sum(len(reader) for reader in readers)
+        self._position = 0
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=None):
+        remaining = self._length - self._position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        blocks = list()
+        start = 0
+        for reader in self._readers:
+            end = start + len(reader)
+            if size > 0 and start <= self._position < end:
+                reader.seek(self._position - start)
+                data = reader.read(min(size, end - self._position))
+                blocks.append(data)
+                self._position += len(data)
+                size -= len(data)
+            start = end
+        return b"".join(blocks)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._length
+        self._position = max(0, min(offset, self._length))
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        pass
+
+class UploadProgress(object):
+    """
+    callback
+        optional function taking a single integer: bytes_read
+
+    Thread-safe aggregate of the bytes sent by all parts of an upload.
+    An instance is itself a ReadReporter callback; each call is forwarded
+    to the wrapped callback.
+
+    digests is a dict of algorithm : hex digest of the bytes archived, if
+    the upload was hashed, otherwise None.
+    """
+    def __init__(self, callback=None):
+        self._lock = threading.Lock()
+        self._callback = callback
+        self._start_time = time.time()
+        self.bytes_sent = 0
+        self.digests = None
+
+    def __call__(self, bytes_read):
+        with self._lock:
+            self.bytes_sent += bytes_read
+            if self._callback is not None:
+                self._callback(bytes_read)
+
+    @property
+    def elapsed_seconds(self):
+        return time.time() - self._start_time
+
+    def bytes_per_second(self):
+        elapsed = self.elapsed_seconds
+        if elapsed <= 0:
+            return 0.0
+        return self.bytes_sent / elapsed
+
+class _PartCallback(object):
+    """
+    report a part's bytes to the aggregate without counting the bytes
+    resent by a retry a second time
+    """
+    def __init__(self, progress):
+        self._progress = progress
+        self._position = 0
+        self._reported = 0
+
+    def rewind(self):
+        self._position = 0
+
+    def __call__(self, bytes_read):
+        self._position += bytes_read
+        if self._position > self._reported:
+            self._progress(self._position - self._reported)
+            self._reported = self._position
+
+def _compute_parts(file_sizes, part_size):
+    """
+    return a list of (source_index, offset, length) covering every file
+    """
+    parts = list()
+    for source_index, file_size in enumerate(file_sizes):
+        offset = 0
+        while offset < file_size:
+            length = min(part_size, file_size - offset)
+            parts.append((source_index, offset, length, ))
+            offset += length
+    return parts
+
+def _hash_files(fds, file_sizes, algorithms, stopped):
+    """
+    return the hex digests of the files one after another, or None if
+    stopped is set first
+    """
+    reader = HashingReader(
+        _FileSequenceReader([FileRangeReader(fd, 0, file_size) \
+                             for fd, file_size in zip(fds, file_sizes)]),
+        algorithms)
+    while len(reader.read(_hash_block_size)) > 0:
+        if stopped.is_set():
+            return None
+    return reader.hexdigests()
+
+def _read_json(response):
+    return json.loads(response.read().decode("utf-8"))
+
+class MultipartUploader(object):
+    """
+    connection_pool
+        a ConnectionPool
+
+    hostname
+        the collection hostname, from compute_collection_hostname
+
+    identity
+        the identity used to sign requests
+
+    part_size
+        the size in bytes of each part
+
+    max_workers
+        the number of parts uploaded at once
+
+    part_retries
+        how many times a failed part is retried before the upload gives up
+
+    Archive files to a key with a concurrent multi-part upload.
+    """
+    def __init__(self,
+                 connection_pool,
+                 hostname,
+                 identity,
+                 part_size=_part_size,
+                 max_workers=_max_workers,
+                 part_retries=_part_retries):
+        self._log = logging.getLogger("MultipartUploader")
+        self._connection_pool = connection_pool
+        self._hostname = hostname
+        self._identity = identity
+        self._part_size = part_size
+        self._max_workers = max_workers
+        self._part_retries = part_retries
+
+    def _request_json(self, method, uri, body=None, headers=None):
+        with self._connection_pool.connection(self._hostname,
+                                              self._identity) \
+            as http_connection:
+            response = http_connection.request(method,
+                                               uri,
+                                               body=body,
+                                               headers=headers)
+            return _read_json(response)
+
+    def _archive_whole(self, key, fd, length, progress, meta, algorithms):
+        uri = compute_uri("data", key, **meta)
+        reader = FileRangeReader(fd, 0, length)
+        if algorithms is not None:
+            reader = HashingReader(reader, algorithms)
+        body = ReadReporter(reader, progress)
+        headers = {"Content-Length" : str(length)}
+        result = self._request_json("POST", uri, body=body, headers=headers)
+        if algorithms is not None:
+            progress.digests = reader.hexdigests()
+        return result
+
+    def _start_conversation(self):
+        uri = compute_uri("conversations", action="start")
+        result = self._request_json("POST", uri)
+        return result["conversation_identifier"]
+
+    def _finish_conversation(self, conversation_identifier, key, meta):
+        uri = compute_uri("conversations",
+                          conversation_identifier,
+                          action="finish",
+                          key_name=key,
+                          **meta)
+        return self._request_json("POST", uri)
+
+    def _abort_conversation(self, conversation_identifier):
+        uri = compute_uri("conversations", conversation_identifier)
+        try:
+            self._request_json("DELETE", uri)
+        except Exception:
+            instance = sys.exc_info()[1]
+            self._log.error("unable to abort conversation {0}: {1}".format(
+                conversation_identifier, instance))
+
+    def _archive_part(self,
+                      key,
+                      conversation_identifier,
+                      part_number,
+                      fd,
+                      offset,
+                      length,
+                      progress):
+        uri = compute_uri("data",
+                          key,
+                          conversation_identifier=conversation_identifier,
+                          conversation_part=part_number)
+        headers = {"Content-Length" : str(length)}
+        part_callback = _PartCallback(progress)
+        attempt = 0
+        while True:
+            attempt += 1
+            part_callback.rewind()
+            # a fresh reader each attempt starts the part from its first byte
+            body = ReadReporter(FileRangeReader(fd, offset, length),
+                                part_callback)
+            try:
+                return self._request_json("POST",
+                                          uri,
+                                          body=body,
+                                          headers=dict(headers))
+            except Exception:
+                instance = sys.exc_info()[1]
+                if attempt > self._part_retries:
+                    self._log.error("part {0} failed: {1}".format(
+                        part_number, instance))
+                    raise
+                self._log.warning("part {0} attempt {1} failed: {2}".format(
+                    part_number, attempt, instance))
+                time.sleep(_part_retry_seconds * attempt)
+
+    def archive_stream(self, key, source, callback=None, meta=None,
+                       chunk_size=None, algorithms=None):
+        """
+        key
+            the key to archive to
+
+        source
+            a binary file object, such as sys.stdin.buffer, or an
+            iterable of blocks; it need not have a length or be seekable
+
+        callback
+            optional ReadReporter callback taking a single integer:
+            bytes_read
+
+        meta
+            optional dict of metadata, sent as meta_prefix uri arguments
+
+        chunk_size
+            the most bytes sent in each chunk; None for the ChunkedBody
+            default
+
+        algorithms
+            optional hashlib names of digests to compute of what is sent;
+            source must then be a file object
+
+        archive the source as it is read, holding one chunk at a time
+        return an UploadProgress with the totals for the upload
+        """
+        if meta is None:
+            meta = dict()
+        progress = UploadProgress(callback)
+        kwargs = dict()
+        if chunk_size is not None:
+            kwargs["chunk_size"] = chunk_size
+        if algorithms is not None:
+            source = HashingReader(source, algorithms)
+        body = ChunkedBody(source, callback=progress, **kwargs)
+        self._request_json("POST",
+                           compute_uri("data", key, **meta),
+                           body=body)
+        if algorithms is not None:
+            progress.digests = source.hexdigests()
+        return progress
+
+    def archive(self, key, paths, callback=None, meta=None, algorithms=None):
+        """
+        key
+            the key to archive to
+
+        paths
+            a list of source file paths; their contents are archived
+            one after another as a single key
+
+        callback
+            optional ReadReporter callback taking a single integer:
+            bytes_read
+
+        meta
+            optional dict of metadata, sent as meta_prefix uri arguments
+
+        algorithms
+            optional hashlib names of digests to compute of the files
+
+        return an UploadProgress with the totals for the upload
+        """
+        if meta is None:
+            meta = dict()
+        progress = UploadProgress(callback)
+
+        fds = [os.open(path, os.O_RDONLY) for path in paths]
+        try:
+            file_sizes = [os.fstat(fd).st_size for fd in fds]
+            if len(fds) == 1 and file_sizes[0] <= self._part_size:
+                self._archive_whole(key,
+                                    fds[0],
+                                    file_sizes[0],
+                                    progress,
+                                    meta,
+                                    algorithms)
+                return progress
+
+            parts = _compute_parts(file_sizes, self._part_size)
+            conversation_identifier = self._start_conversation()
+            self._log.debug("conversation {0}: {1} parts".format(
+                conversation_identifier, len(parts)))
+
+            hash_executor = None
+            if algorithms is not None:
+                hash_executor = ThreadPoolExecutor(max_workers=1)
+                hash_stopped = threading.Event()
+                hash_future = hash_executor.submit(_hash_files,
+                                                   fds,
+                                                   file_sizes,
+                                                   algorithms,
+                                                   hash_stopped)
+            try:
+                with ThreadPoolExecutor(max_workers=self._max_workers) \
+                    as executor:
+                    futures = [
+                        executor.submit(self._archive_part,
+                                        key,
+                                        conversation_identifier,
+                                        part_number,
+                                        fds[source_index],
+                                        offset,
+                                        length,
+                                        progress)
+                        for part_number, (source_index, offset, length) \
+                            in enumerate(parts, start=1)]
+                    for future in futures:
+                        error = future.exception()
+                        if error is not None:
+                            for pending_future in futures:
+                                pending_future.cancel()
+                            raise error
+                if hash_executor is not None:
+                    progress.digests = hash_future.result()
+            except Exception:
+                instance = sys.exc_info()[1]
+                self._abort_conversation(conversation_identifier)
+                if isinstance(instance, LumberyardHTTPError):
+                    raise
+                raise MultipartUploadError(str(instance))
+            finally:
+                if hash_executor is not None:
+                    # it reads the files, which are closed below
+                    hash_stopped.set()
+                    hash_executor.shutdown(wait=True)
+
+            self._finish_conversation(conversation_identifier, key, meta)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+        return progress
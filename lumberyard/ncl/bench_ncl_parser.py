@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+bench_ncl_parser.py
+
+compare the single pass command matcher with the former one template at a
+time scan, on a script of generated NCL lines
+
+The legacy parser below is the matching loop parse_ncl_string used to run:
+each template compiled separately and tried in order, and the collection
+name checked again by regular expression. It shares the build functions,
+so only the matching differs.
+
+    cd lumberyard/ncl && python bench_ncl_parser.py --lines 100000
+"""
+from __future__ import print_function
+import argparse
+import re
+import sys
+import time
+
+import ncl_parser
+from ncl_parser import \
+    parse_ncl_string, \
+    clear_parse_cache, \
+    InvalidNCLString, \
+    _parse_uncached, \
+    _command_templates, \
+    _collection_name_pattern, \
+    _dispatch_table, \
+    _valid_collection_name
+
+_legacy_templates = [
+    (command, re.compile(template.format(_collection_name_pattern),
+                         re.UNICODE), ) \
+    for command, template in _command_templates]
+
+def _parse_legacy(ncl_string):
+    ncl_dict = {"command" : None}
+    match_object = None
+    for command, command_template in _legacy_templates:
+        match_object = command_template.match(ncl_string)
+        if match_object is not None:
+            ncl_dict["command"] = command
+            break
+    if match_object is None:
+        raise InvalidNCLString("Unable to recognize a command")
+    groups = match_object.groupdict()
+    if "collection_name" in groups and \
+        not _valid_collection_name(groups["collection_name"]):
+        raise InvalidNCLString("Invalid collection name {0}".format(
+            groups["collection_name"]))
+    _dispatch_table[ncl_dict["command"]](groups, ncl_dict)
+    return ncl_dict
+
+_line_templates = [
+    u"list collections",
+    u"list collection collection-{0}",
+    u"collection-{0} list keys dir{0}/ delimiter=/",
+    u"collection-{0} list key versions key-{0}",
+    u"collection-{0} list key key-{0} version=1",
+    u"collection-{0} archive key key-{0} /tmp/file-{0}",
+    u"collection-{0} retrieve key key-{0} dest=/tmp/file-{0}",
+    u"collection-{0} delete key key-{0}",
+    u"space usage collection-{0} days=7",
+]
+
+def _generate_lines(line_count, distinct_count):
+    """
+    a script that cycles through distinct_count different lines, as a
+    script driving many keys through the same few commands would
+    """
+    lines = list()
+    for index in range(line_count):
+        variant = index % distinct_count
+        template = _line_templates[variant % len(_line_templates)]
+        lines.append(template.format(variant))
+    return lines
+
+def _run_cached(ncl_string):
+    return parse_ncl_string(ncl_string)
+
+_methods = [
+    ("legacy",      _parse_legacy, ),
+    ("single-pass", _parse_uncached, ),
+    ("cached",      _run_cached, ),
+]
+
+def _time_method(parse_function, lines):
+    clear_parse_cache()
+    start_time = time.time()
+    for line in lines:
+        parse_function(line)
+    return time.time() - start_time
+
+def _parse_commandline():
+    parser = argparse.ArgumentParser(description="benchmark the NCL parser")
+    parser.add_argument("--lines", type=int, default=100000)
+    parser.add_argument("--distinct", type=int, default=500,
+                        help="number of different lines in the script")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="report the best of this many runs")
+    return parser.parse_args()
+
+def main():
+    args = _parse_commandline()
+    lines = _generate_lines(args.lines, args.distinct)
+
+    # the methods must agree before their speed is worth comparing
+    for line in lines[:args.distinct]:
+        expected = _parse_legacy(line)
+        for method_name, parse_function in _methods:
+            if parse_function(line) != expected:
+                raise AssertionError("{0} differs on {1!r}".format(
+                    method_name, line))
+
+    print("{0:12} {1:>10} {2:>12} {3:>14}".format(
+        "method", "lines", "seconds", "lines/sec"))
+    for method_name, parse_function in _methods:
+        elapsed_seconds = min(_time_method(parse_function, lines) \
+                              for _ in range(args.repeat))
+        print("{0:12} {1:10} {2:12.3f} {3:14.0f}".format(
+            method_name,
+            len(lines),
+            elapsed_seconds,
+            len(lines) / elapsed_seconds))
+    print("cache size {0} of {1}".format(len(ncl_parser._parse_cache),
+                                         ncl_parser._parse_cache_size))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -16,3 +16,5 @@ ncl_archive_key = "archivekey"
 ncl_retrieve_key = "retrieve-key"
 ncl_delete_key = "delete-key"
 ncl_space_usage = "space-usage"
+ncl_reconcile_keys = "reconcile-keys"
+ncl_sync = "sync"
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+ncl_batch.py
+
+run an NCL script concurrently
+
+The whole script is parsed up front. Commands run on a pool of worker
+threads; each command's output is captured and written in script order.
+A command that fails is recorded and the run continues. Commands that
+change collections run alone, after everything before them has finished.
+Commands that change keys (archive key, delete key, sync, reconcile keys)
+run in script order with respect to the other commands on the same
+collection and key: each waits for the earlier lines it conflicts with,
+and later conflicting lines wait for it. A command without a key, such as
+list keys or sync, covers every key in its collection.
+
+At the end a summary of failures and per-command latency and throughput
+is written to the error stream.
+"""
+from __future__ import print_function
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import io
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from ncl_parser import parse_ncl_string, InvalidNCLString
+from commands import \
+    ncl_create_collection, \
+    ncl_set_collection, \
+    ncl_delete_collection, \
+    ncl_archive_key, \
+    ncl_delete_key, \
+    ncl_sync, \
+    ncl_reconcile_keys
+
+# these change the collections the other commands act on
+_serial_commands = set([
+    ncl_create_collection,
+    ncl_set_collection,
+    ncl_delete_collection,
+])
+
+# these change the keys of a collection
+_mutating_commands = set([
+    ncl_archive_key,
+    ncl_delete_key,
+    ncl_sync,
+    ncl_reconcile_keys,
+])
+
+# output larger than this is spooled to a temporary file
+_max_memory_output = 1024 * 1024
+
+# commands in flight or waiting to be written, per worker
+_window_per_job = 4
+
+class _ScriptLine(object):
+    """
+    one line of the script and what became of it
+    """
+    def __init__(self, line_number, line, ncl_dict=None, error=None):
+        self.line_number = line_number
+        self.line = line
+        self.ncl_dict = ncl_dict
+        self.error = error
+        self.output = None
+        self.elapsed_seconds = 0.0
+
+def parse_script(input_file):
+    """
+    return a list of _ScriptLine for the non-blank lines of a script.
+    lines that do not parse carry the InvalidNCLString as their error
+    """
+    script_lines = list()
+    for line_number, line in enumerate(input_file, start=1):
+        line = line.strip()
+        if len(line) == 0 or line.startswith("#"):
+            continue
+        try:
+            ncl_dict = parse_ncl_string(line)
+        except InvalidNCLString:
+            instance = sys.exc_info()[1]
+            script_lines.append(_ScriptLine(line_number, line,
+                                            error=instance))
+            continue
+        script_lines.append(_ScriptLine(line_number, line, ncl_dict))
+    return script_lines
+
+def _percentile(sorted_values, fraction):
+    if len(sorted_values) == 0:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+class BatchStatistics(object):
+    """
+    latency and failure counts per command type
+    """
+    def __init__(self):
+        self._latencies = dict()
+        self._failures = dict()
+        self.failed_lines = list()
+        self._start_time = time.time()
+        self.elapsed_seconds = 0.0
+
+    def record(self, script_line):
+        command = (script_line.ncl_dict["command"] \
+                   if script_line.ncl_dict is not None else "unparsed")
+        self._latencies.setdefault(command, []).append(
+            script_line.elapsed_seconds)
+        if script_line.error is not None:
+            self._failures[command] = self._failures.get(command, 0) + 1
+            self.failed_lines.append(script_line)
+
+    def finish(self):
+        self.elapsed_seconds = time.time() - self._start_time
+
+    def report(self, output):
+        print("", file=output)
+        if len(self.failed_lines) > 0:
+            print("{0} failed commands".format(len(self.failed_lines)),
+                  file=output)
+            for script_line in sorted(self.failed_lines,
+                                      key=lambda l: l.line_number):
+                print("  line {0}: {1}: {2}".format(script_line.line_number,
+                                                    script_line.line,
+                                                    script_line.error),
+                      file=output)
+            print("", file=output)
+
+        print("{0:20} {1:>8} {2:>8} {3:>10} {4:>10} {5:>10} {6:>10}".format(
+            "command", "count", "failed", "p50 ms", "p95 ms", "max ms",
+            "per sec"), file=output)
+        for command in sorted(self._latencies):
+            latencies = sorted(self._latencies[command])
+            rate = (len(latencies) / self.elapsed_seconds \
+                    if self.elapsed_seconds > 0 else 0.0)
+            print("{0:20} {1:8} {2:8} {3:10.1f} {4:10.1f} {5:10.1f} "
+                  "{6:10.1f}".format(
+                      command,
+                      len(latencies),
+                      self._failures.get(command, 0),
+                      _percentile(latencies, 0.50) * 1000.0,
+                      _percentile(latencies, 0.95) * 1000.0,
+                      latencies[-1] * 1000.0,
+                      rate),
+                  file=output)
+        print("{0} commands in {1:.3f} seconds".format(
+            sum(len(l) for l in self._latencies.values()),
+            self.elapsed_seconds), file=output)
+
+def _conflicts(earlier, later):
+    """
+    return True if the two lines must run in script order: one of them
+    changes keys the other acts on
+    """
+    if not (earlier.ncl_dict["command"] in _mutating_commands or \
+            later.ncl_dict["command"] in _mutating_commands):
+        return False
+    collection_name = earlier.ncl_dict.get("collection_name")
+    if collection_name is None or \
+        collection_name != later.ncl_dict.get("collection_name"):
+        return False
+    earlier_key = earlier.ncl_dict.get("key")
+    later_key = later.ncl_dict.get("key")
+    return earlier_key is None or later_key is None or earlier_key == later_key
+
+def _submit_after(executor, dependencies, function, *args):
+    """
+    return a Future for function(*args), submitted to the executor once
+    every one of the dependencies is done, so no worker sits waiting
+    """
+    result = Future()
+    lock = threading.Lock()
+    remaining = [len(dependencies)]
+
+    def _copy_result(future):
+        error = future.exception()
+        if error is not None:
+            result.set_exception(error)
+        else:
+            result.set_result(future.result())
+
+    def _submit():
+        executor.submit(function, *args).add_done_callback(_copy_result)
+
+    def _dependency_done(_):
+        with lock:
+            remaining[0] -= 1
+            ready = (remaining[0] == 0)
+        if ready:
+            _submit()
+
+    if len(dependencies) == 0:
+        _submit()
+    for dependency in dependencies:
+        dependency.add_done_callback(_dependency_done)
+    return result
+
+def _run_line(script_line, execute, encoding):
+    """
+    run one command, capturing its output
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=_max_memory_output)
+    output = io.TextIOWrapper(spool, encoding=encoding, write_through=True)
+    start_time = time.time()
+    try:
+        execute(script_line.ncl_dict, output)
+    except Exception:
+        script_line.error = sys.exc_info()[1]
+    script_line.elapsed_seconds = time.time() - start_time
+    output.flush()
+    output.detach()
+    script_line.output = spool
+    return script_line
+
+def _write_output(script_line, output_file):
+    if script_line.output is None:
+        return
+    script_line.output.seek(0)
+    shutil.copyfileobj(script_line.output, output_file)
+    script_line.output.close()
+    script_line.output = None
+
+def run_batch(script_lines,
+              execute,
+              jobs,
+              output_file,
+              encoding="utf-8"):
+    """
+    script_lines
+        from parse_script
+
+    execute
+        a function taking (ncl_dict, output) that runs one command,
+        writing its results to the text stream output (and binary data to
+        output.buffer)
+
+    jobs
+        the number of commands run at once
+
+    output_file
+        a binary file the captured output is written to, in script order
+
+    return a BatchStatistics
+    """
+    statistics = BatchStatistics()
+    window = max(1, jobs * _window_per_job)
+    pending = deque()
+
+    def _complete_oldest():
+        _, future = pending.popleft()
+        script_line = future.result()
+        _write_output(script_line, output_file)
+        statistics.record(script_line)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for script_line in script_lines:
+            if script_line.error is not None:
+                # unparsed
+                statistics.record(script_line)
+                continue
+
+            if script_line.ncl_dict["command"] in _serial_commands:
+                while len(pending) > 0:
+                    _complete_oldest()
+                _run_line(script_line, execute, encoding)
+                _write_output(script_line, output_file)
+                statistics.record(script_line)
+                continue
+
+            while len(pending) >= window:
+                _complete_oldest()
+            dependencies = [future for (earlier, future) in pending \
+                            if _conflicts(earlier, script_line)]
+            pending.append((script_line,
+                            _submit_after(executor,
+                                          dependencies,
+                                          _run_line,
+                                          script_line,
+                                          execute,
+                                          encoding), ))
+
+        while len(pending) > 0:
+            _complete_oldest()
+
+    output_file.flush()
+    statistics.finish()
+    return statistics
@@ -0,0 +1,597 @@
+# -*- coding: utf-8 -*-
+"""
+ncl_bench.py
+
+drive a mix of NCL commands against the service, and report throughput,
+errors and latency percentiles as the run goes
+
+A workload file gives each command's share of the operations, the sizes of
+the objects archived, and the number of keys the commands pick from::
+
+    # percent  NCL command
+    70% mycoll retrieve key bench/{n}
+    20% mycoll list keys prefix=bench/
+    10% mycoll archive key bench/{n}
+
+    # archived object sizes, by percent
+    size 1KiB 50%
+    size 64KiB 40%
+    size 4MiB 10%
+
+    keys 1000
+
+{n} in a key or an option is replaced, for each operation, by a key number
+picked uniformly from the key space. archive key uploads a body of a size
+drawn from the distribution; its source paths are ignored. list keys
+fetches one page. The shares need not add up to 100.
+
+With a fixed concurrency (closed loop), each of jobs workers runs one
+operation after another. With an arrival rate (open loop), operations
+arrive at random at that average rate whether or not earlier ones have
+finished, and at most jobs run at once; latency is measured from when an
+operation arrived, so time spent queued behind a slow service counts.
+Operations still queued when the run ends are counted as unstarted.
+
+prepare archives every key of the key space first, so retrieves find them.
+"""
+from __future__ import print_function
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from lumberyard.http_util import compute_default_hostname, \
+    compute_collection_hostname, \
+    compute_uri
+from lumberyard.key_listing import fetch_key_page
+from lumberyard.request_timing import LatencyHistogram
+
+from ncl_parser import parse_ncl_string, InvalidNCLString
+from commands import \
+    ncl_list_collections, \
+    ncl_list_collection, \
+    ncl_list_keys, \
+    ncl_archive_key, \
+    ncl_retrieve_key, \
+    ncl_delete_key, \
+    ncl_space_usage
+
+class InvalidWorkload(Exception):
+    pass
+
+_key_placeholder = "{n}"
+_read_block_size = 1024 * 1024
+_default_key_count = 1000
+_default_size = 4 * 1024
+
+_size_units = {
+    ""      : 1,
+    "b"     : 1,
+    "k"     : 1024,
+    "kb"    : 1000,
+    "kib"   : 1024,
+    "m"     : 1024 ** 2,
+    "mb"    : 1000 ** 2,
+    "mib"   : 1024 ** 2,
+    "g"     : 1024 ** 3,
+    "gb"    : 1000 ** 3,
+    "gib"   : 1024 ** 3,
+}
+_size_re = re.compile(r"^(?P<number>[0-9.]+)\s*(?P<unit>[a-z]*)$")
+_operation_re = re.compile(r"^(?P<percent>[0-9.]+)%?\s+(?P<line>\S.*)$")
+
+def parse_size(text):
+    """
+    return the number of bytes in a size such as 512, 64KiB or 1.5MB
+    """
+    match = _size_re.match(text.strip().lower())
+    if match is None or not match.group("unit") in _size_units:
+        raise InvalidWorkload("invalid size {0}".format(text))
+    return int(float(match.group("number")) * _size_units[match.group("unit")])
+
+def _parse_percent(text):
+    try:
+        value = float(text.rstrip("%"))
+    except ValueError:
+        raise InvalidWorkload("invalid percentage {0}".format(text))
+    if value < 0:
+        raise InvalidWorkload("negative percentage {0}".format(text))
+    return value
+
+class _WeightedChoice(object):
+    """
+    pick items in proportion to their weights
+    """
+    def __init__(self, weighted_items):
+        self.items = [item for (item, _) in weighted_items]
+        self._cumulative = list()
+        total = 0.0
+        for _, weight in weighted_items:
+            total += weight
+            self._cumulative.append(total)
+        self.total = total
+
+    def choose(self, rng):
+        point = rng.random() * self.total
+        for item, cumulative in zip(self.items, self._cumulative):
+            if point < cumulative:
+                return item
+        return self.items[-1]
+
+_supported_commands = set([
+    ncl_list_collections,
+    ncl_list_collection,
+    ncl_list_keys,
+    ncl_archive_key,
+    ncl_retrieve_key,
+    ncl_delete_key,
+    ncl_space_usage,
+])
+
+class Workload(object):
+    """
+    operations
+        a list of (ncl_dict, percent)
+
+    sizes
+        a list of (bytes, percent) for archived objects
+
+    key_count
+        the number of keys {n} ranges over
+
+    The operation mix of a benchmark run.
+    """
+    def __init__(self, operations, sizes=None, key_count=_default_key_count):
+        if len(operations) == 0:
+            raise InvalidWorkload("the workload has no operations")
+        for ncl_dict, _ in operations:
+            if not ncl_dict["command"] in _supported_commands:
+                raise InvalidWorkload("{0} can not be benchmarked".format(
+                    ncl_dict["command"]))
+        if sizes is None or len(sizes) == 0:
+            sizes = [(_default_size, 100.0, )]
+        self.operations = _WeightedChoice(operations)
+        self.sizes = _WeightedChoice(sizes)
+        self.key_count = key_count
+        if self.operations.total <= 0 or self.sizes.total <= 0:
+            raise InvalidWorkload("the percentages add up to zero")
+
+    @property
+    def max_size(self):
+        return max(self.sizes.items)
+
+    def choose_operation(self, rng):
+        """
+        return the ncl_dict of an operation, with {n} filled in
+        """
+        ncl_dict = self.operations.choose(rng)
+        key_number = "{0:08}".format(rng.randrange(self.key_count))
+        return dict((name, (value.replace(_key_placeholder, key_number) \
+                            if isinstance(value, str) else value), ) \
+                    for (name, value) in ncl_dict.items())
+
+    def choose_size(self, rng):
+        return self.sizes.choose(rng)
+
+    def key_names(self, ncl_dict):
+        """
+        return every key name an archive or retrieve command can produce
+        """
+        key = ncl_dict["key"]
+        if not _key_placeholder in key:
+            return [key]
+        return [key.replace(_key_placeholder, "{0:08}".format(n)) \
+                for n in range(self.key_count)]
+
+def parse_workload(input_file):
+    """
+    return the Workload described by the lines of input_file
+    """
+    operations = list()
+    sizes = list()
+    key_count = _default_key_count
+    for line_number, line in enumerate(input_file, start=1):
+        line = line.strip()
+        if len(line) == 0 or line.startswith("#"):
+            continue
+        fields = line.split()
+        try:
+            if fields[0] == "size":
+                if len(fields) != 3:
+                    raise InvalidWorkload("expected size <bytes> <percent>")
+                sizes.append((parse_size(fields[1]),
+                              _parse_percent(fields[2]), ))
+                continue
+            if fields[0] == "keys":
+                if len(fields) != 2 or not fields[1].isdigit() or \
+                    int(fields[1]) == 0:
+                    raise InvalidWorkload("expected keys <count>")
+                key_count = int(fields[1])
+                continue
+            match = _operation_re.match(line)
+            if match is None:
+                raise InvalidWorkload("expected <percent> <ncl command>")
+            try:
+                ncl_dict = parse_ncl_string(match.group("line"))
+            except InvalidNCLString:
+                raise InvalidWorkload(str(sys.exc_info()[1]))
+            operations.append((ncl_dict,
+                               _parse_percent(match.group("percent")), ))
+        except InvalidWorkload:
+            instance = sys.exc_info()[1]
+            raise InvalidWorkload("line {0}: {1}".format(line_number,
+                                                         instance))
+    return Workload(operations, sizes, key_count)
+
+class BenchRunner(object):
+    """
+    connection_pool
+        the ConnectionPool requests are made through
+
+    identity
+        the identity requests are signed with
+
+    workload
+        a Workload
+
+    hostname
+        send every request to this host instead of the collection's
+        hostname, for a stand in server
+
+    Runs the operations of a workload.
+    """
+    def __init__(self, connection_pool, identity, workload, hostname=None):
+        self._connection_pool = connection_pool
+        self._identity = identity
+        self.workload = workload
+        self._hostname = hostname
+        # archive bodies are slices of this
+        self._data = memoryview(os.urandom(workload.max_size))
+
+    def _collection_hostname(self, ncl_dict):
+        if self._hostname is not None:
+            return self._hostname
+        return compute_collection_hostname(ncl_dict["collection_name"])
+
+    def _default_hostname(self):
+        if self._hostname is not None:
+            return self._hostname
+        return compute_default_hostname()
+
+    def _request(self, hostname, method, uri, body=None):
+        """
+        make the request and read its body; return the bytes moved
+        """
+        with self._connection_pool.connection(hostname, self._identity) \
+            as connection:
+            response = connection.request(method, uri, body=body)
+            byte_count = 0
+            while True:
+                data = response.read(_read_block_size)
+                if len(data) == 0:
+                    break
+                byte_count += len(data)
+        return byte_count + (0 if body is None else len(body))
+
+    def archive(self, ncl_dict, size):
+        return self._request(self._collection_hostname(ncl_dict),
+                             "PUT",
+                             compute_uri("data", ncl_dict["key"]),
+                             body=self._data[:size])
+
+    def execute(self, ncl_dict, rng):
+        """
+        run one operation; return the number of body bytes moved
+        """
+        command = ncl_dict["command"]
+        if command == ncl_retrieve_key:
+            return self._request(self._collection_hostname(ncl_dict),
+                                 "GET",
+                                 compute_uri("data", ncl_dict["key"]))
+        if command == ncl_archive_key:
+            return self.archive(ncl_dict, self.workload.choose_size(rng))
+        if command == ncl_delete_key:
+            return self._request(self._collection_hostname(ncl_dict),
+                                 "DELETE",
+                                 compute_uri("data", ncl_dict["key"]))
+        if command == ncl_list_keys:
+            entries, _ = fetch_key_page(self._connection_pool,
+                                        self._collection_hostname(ncl_dict),
+                                        self._identity,
+                                        prefix=ncl_dict.get("prefix"),
+                                        delimiter=ncl_dict.get("delimiter"),
+                                        marker=ncl_dict.get("marker"))
+            return len(entries)
+
+        path = "/".join(["customers", self._identity.user_name,
+                         "collections"])
+        kwargs = dict()
+        if command != ncl_list_collections:
+            path = "/".join([path, ncl_dict["collection_name"]])
+        if command == ncl_space_usage:
+            kwargs["action"] = "space_usage"
+        return self._request(self._default_hostname(),
+                             "GET",
+                             compute_uri(path, **kwargs))
+
+    def prepare(self, jobs):
+        """
+        archive every key the retrieve commands of the workload can ask
+        for; return the number archived
+        """
+        rng = random.Random(0)
+        archives = list()
+        for ncl_dict in self.workload.operations.items:
+            if ncl_dict["command"] != ncl_retrieve_key:
+                continue
+            for key in self.workload.key_names(ncl_dict):
+                archive_dict = dict(ncl_dict)
+                archive_dict["key"] = key
+                archives.append((archive_dict,
+                                 self.workload.choose_size(rng), ))
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for _ in executor.map(lambda a: self.archive(*a), archives):
+                pass
+        return len(archives)
+
+class _Counts(object):
+    """
+    what the operations of one command, or of one interval, came to
+    """
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.operations = 0
+        self.errors = 0
+        self.bytes = 0
+
+    def record(self, seconds, byte_count, error):
+        self.histogram.record(seconds)
+        self.operations += 1
+        if error is not None:
+            self.errors += 1
+        self.bytes += byte_count
+
+class BenchStatistics(object):
+    """
+    thread-safe counts and latency histograms, per command for the whole
+    run and for all commands per interval
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._commands = dict()
+        self._interval = _Counts()
+        self._last_errors = dict()
+        self.unstarted = 0
+        self.start_time = time.time()
+        self.elapsed_seconds = 0.0
+
+    def record(self, command, seconds, byte_count=0, error=None):
+        with self._lock:
+            counts = self._commands.get(command)
+            if counts is None:
+                counts = _Counts()
+                self._commands[command] = counts
+            counts.record(seconds, byte_count, error)
+            self._interval.record(seconds, byte_count, error)
+            if error is not None:
+                self._last_errors[command] = str(error)
+
+    def take_interval(self):
+        """
+        return the counts since the last call
+        """
+        with self._lock:
+            counts = self._interval
+            self._interval = _Counts()
+        return counts
+
+    def finish(self):
+        self.elapsed_seconds = time.time() - self.start_time
+
+    def summary(self):
+        """
+        return a list of dicts, one per command: command, operations,
+        errors, operations_per_second, bytes_per_second, p50, p95 and p99
+        in seconds, and the last error
+        """
+        with self._lock:
+            items = sorted(self._commands.items())
+        elapsed_seconds = max(self.elapsed_seconds, 1e-9)
+        result = list()
+        for command, counts in items:
+            entry = {
+                "command"               : command,
+                "operations"            : counts.operations,
+                "errors"                : counts.errors,
+                "operations_per_second" : counts.operations / elapsed_seconds,
+                "bytes_per_second"      : counts.bytes / elapsed_seconds,
+                "last_error"            : self._last_errors.get(command),
+            }
+            for percent in (50, 95, 99, ):
+                entry["p{0}".format(percent)] = \
+                    counts.histogram.percentile(percent)
+            result.append(entry)
+        return result
+
+    def report(self, output):
+        print("", file=output)
+        print("{0:20} {1:>10} {2:>8} {3:>10} {4:>10} {5:>10} {6:>10} "
+              "{7:>10}".format(
+                  "command", "count", "errors", "per sec", "MiB/s",
+                  "p50 ms", "p95 ms", "p99 ms"), file=output)
+        for entry in self.summary():
+            print("{0:20} {1:10} {2:8} {3:10.1f} {4:10.2f} {5:10.1f} "
+                  "{6:10.1f} {7:10.1f}".format(
+                      entry["command"],
+                      entry["operations"],
+                      entry["errors"],
+                      entry["operations_per_second"],
+                      entry["bytes_per_second"] / (1024.0 * 1024.0),
+                      entry["p50"] * 1000.0,
+                      entry["p95"] * 1000.0,
+                      entry["p99"] * 1000.0),
+                  file=output)
+        for entry in self.summary():
+            if entry["last_error"] is not None:
+                print("{0}: last error: {1}".format(entry["command"],
+                                                    entry["last_error"]),
+                      file=output)
+        if self.unstarted > 0:
+            print("{0} operations had not started when the run ended".format(
+                self.unstarted), file=output)
+
+def _print_interval_header(output):
+    print("{0:>8} {1:>10} {2:>10} {3:>10} {4:>10} {5:>10}".format(
+        "seconds", "per sec", "errors", "p50 ms", "p95 ms", "p99 ms"),
+        file=output)
+
+def _print_interval(elapsed_seconds, interval_seconds, counts, output):
+    histogram = counts.histogram
+    if counts.operations == 0:
+        print("{0:8.1f} {1:10.1f} {2:10}".format(elapsed_seconds, 0.0, 0),
+              file=output)
+        return
+    print("{0:8.1f} {1:10.1f} {2:10} {3:10.1f} {4:10.1f} {5:10.1f}".format(
+        elapsed_seconds,
+        counts.operations / interval_seconds,
+        counts.errors,
+        histogram.percentile(50) * 1000.0,
+        histogram.percentile(95) * 1000.0,
+        histogram.percentile(99) * 1000.0), file=output)
+
+def _run_operation(runner, statistics, ncl_dict, rng, start_time):
+    byte_count = 0
+    error = None
+    try:
+        byte_count = runner.execute(ncl_dict, rng)
+    except Exception:
+        error = sys.exc_info()[1]
+    statistics.record(ncl_dict["command"],
+                      time.time() - start_time,
+                      byte_count,
+                      error)
+
+def _closed_loop(runner, statistics, jobs, end_time, seed):
+    def _worker(index):
+        rng = random.Random(seed + index)
+        while time.time() < end_time:
+            _run_operation(runner,
+                           statistics,
+                           runner.workload.choose_operation(rng),
+                           rng,
+                           time.time())
+
+    threads = [threading.Thread(target=_worker, args=(index, )) \
+               for index in range(jobs)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    return threads
+
+def _open_loop(runner, statistics, jobs, end_time, arrival_rate, seed):
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    futures = list()
+
+    def _arrivals():
+        rng = random.Random(seed)
+        arrival_time = time.time()
+        while True:
+            arrival_time += rng.expovariate(arrival_rate)
+            if arrival_time >= end_time:
+                break
+            delay = arrival_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(executor.submit(_run_operation,
+                                           runner,
+                                           statistics,
+                                           runner.workload.choose_operation(
+                                               rng),
+                                           random.Random(rng.random()),
+                                           arrival_time))
+        for future in futures:
+            if future.cancel():
+                statistics.unstarted += 1
+        executor.shutdown(wait=True)
+
+    thread = threading.Thread(target=_arrivals)
+    thread.daemon = True
+    thread.start()
+    return [thread]
+
+def run_bench(runner,
+              jobs,
+              duration_seconds,
+              arrival_rate=None,
+              report_seconds=1.0,
+              output=None,
+              seed=None):
+    """
+    runner
+        a BenchRunner
+
+    jobs
+        the number of operations run at once
+
+    duration_seconds
+        how long new operations are started for
+
+    arrival_rate
+        operations per second arriving at random (open loop); None runs
+        jobs operations back to back (closed loop)
+
+    report_seconds
+        how often to print a line of throughput, errors and latency
+
+    output
+        the text stream the report is written to, by default stdout
+
+    seed
+        seeds the random choices, for a repeatable mix
+
+    return a BenchStatistics
+    """
+    if output is None:
+        output = sys.stdout
+    if seed is None:
+        seed = random.randrange(1 << 32)
+    jobs = max(1, jobs)
+
+    statistics = BenchStatistics()
+    end_time = statistics.start_time + duration_seconds
+    if arrival_rate is None:
+        threads = _closed_loop(runner, statistics, jobs, end_time, seed)
+    else:
+        threads = _open_loop(runner,
+                             statistics,
+                             jobs,
+                             end_time,
+                             arrival_rate,
+                             seed)
+
+    _print_interval_header(output)
+    last_report_time = statistics.start_time
+    while True:
+        next_report_time = last_report_time + report_seconds
+        for thread in threads:
+            thread.join(max(0.0, next_report_time - time.time()))
+        finished = not any(thread.is_alive() for thread in threads)
+        current_time = time.time()
+        if current_time >= next_report_time or finished:
+            counts = statistics.take_interval()
+            if not finished or counts.operations > 0:
+                _print_interval(current_time - statistics.start_time,
+                                current_time - last_report_time,
+                                counts,
+                                output)
+            last_report_time = current_time
+        if finished:
+            break
+
+    statistics.finish()
+    statistics.report(output)
+    return statistics
@@ -6,32 +6,65 @@ main program for nimbusio command lnaguage
 """
 from __future__ import print_function
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 try:
     from httplib import CREATED
 except ImportError:
     from http.client import CREATED
+import fnmatch
+import hashlib
 import json
 import logging
+import os
 try:
     from StringIO import StringIO
 except ImportError:
     from io import StringIO
 
 import sys
-
-
-from lumberyard.http_connection import HTTPConnection, \
-        UnAuthHTTPConnection, \
-        LumberyardHTTPError
+import threading
+import time
+
+from lumberyard.http_connection import LumberyardHTTPError
+from lumberyard.connection_pool import ConnectionPool
+from lumberyard.dns_cache import default_dns_cache
+from lumberyard.download_sink import DownloadSink
+from lumberyard.rate_limiter import RateLimiter, set_default_rate_limiter
+from lumberyard.request_timing import TimingAggregator, \
+    add_request_observer, \
+    request_label
+from lumberyard.multipart_upload import MultipartUploader
+from lumberyard.parallel_download import ParallelDownloader
+from lumberyard.key_listing import iter_keys
+from lumberyard.key_index import open_key_index, pattern_prefix
+from lumberyard.directory_sync import DirectorySync, default_manifest_path
+from lumberyard.object_cache import open_object_cache
+from lumberyard.compression import CompressingReader, \
+    DecompressingWriter, \
+    codec_names, \
+    compression_meta, \
+    compression_meta_name
+from lumberyard.stream_digest import DigestMismatch, \
+    HashingReader, \
+    HashingWriter, \
+    default_algorithms, \
+    etag_md5, \
+    fetch_server_md5, \
+    load_digest_manifest, \
+    verify_digests
+from lumberyard.json_stream import JSONStream, iter_json_array
 
 from lumberyard.http_util import compute_default_hostname, \
         compute_collection_hostname, \
         compute_default_collection_name, \
-        compute_uri
+        compute_uri, \
+        response_meta
 
 from identity import load_identity_from_environment, \
     load_identity_from_file
 from ncl_parser import parse_ncl_string, InvalidNCLString
+from ncl_batch import parse_script, run_batch
+from ncl_bench import BenchRunner, InvalidWorkload, parse_workload, run_bench
 from commands import \
     ncl_list_collections, \
     ncl_list_collection, \
@@ -44,7 +77,9 @@ from commands import \
     ncl_archive_key, \
     ncl_retrieve_key, \
     ncl_delete_key, \
-    ncl_space_usage
+    ncl_space_usage, \
+    ncl_reconcile_keys, \
+    ncl_sync
 
 class NCLError(Exception):
     pass
@@ -56,7 +91,26 @@ class NCLErrorResult(NCLError):
     pass
 
 _max_keys = 1000
-_read_buffer_size = 64 * 1024
+_index_directory = os.environ.get("NIMBUSIO_KEY_INDEX_DIR")
+_index_max_age = float(os.environ.get("NIMBUSIO_KEY_INDEX_MAX_AGE", "60"))
+_compression = os.environ.get("NIMBUSIO_COMPRESSION")
+_digest = os.environ.get("NIMBUSIO_DIGEST")
+_cache_directory = os.environ.get("NIMBUSIO_OBJECT_CACHE_DIR")
+_cache_max_bytes = int(os.environ.get("NIMBUSIO_OBJECT_CACHE_MAX_BYTES",
+                                      str(1024 * 1024 * 1024)))
+
+# connections are reused across every command in a run
+_connection_pool = ConnectionPool()
+
+# in batch mode each worker thread writes its command's output to its own
+# stream, so output can be written in script order
+_output_local = threading.local()
+
+def _output():
+    """
+    return the text stream command output is written to
+    """
+    return getattr(_output_local, "stream", sys.stdout)
 
 _log_format = '%(asctime)s %(name)-12s: %(levelname)-8s %(message)s'
 def _initialize_logging():
@@ -73,11 +127,89 @@ def _initialize_logging():
     logging.root.addHandler(console)
     logging.root.setLevel(log_level)
 
+def _digest_list(value):
+    """
+    argparse type for --digest: a comma separated list of hashlib names
+    """
+    algorithms = [name.strip().lower() for name in value.split(",") \
+                  if len(name.strip()) > 0]
+    for algorithm in algorithms:
+        try:
+            hashlib.new(algorithm)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                "unknown digest {0!r}".format(algorithm))
+    return algorithms
+
 def _parse_commandline():
     parser = argparse.ArgumentParser(description="Nimbus.io Command Language")
     parser.add_argument("-i", "--identity-file", type=str, default=None,
                         help="path to a nimbusio identity file")
-    parser.add_argument("residue", type=str, nargs="+", 
+    parser.add_argument("--parallel", type=int, default=None,
+                        help="number of concurrent transfers for a key; "
+                        "retrieve key uses it when destination= is given, "
+                        "sync for files")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="bytes in each chunk when archive key reads "
+                        "from stdin")
+    parser.add_argument("--compression", type=str, choices=codec_names,
+                        default=_compression,
+                        help="compress keys archived with this codec; "
+                        "keys archived compressed are always decompressed "
+                        "when retrieved")
+    parser.add_argument("--compress-workers", type=int, default=0,
+                        help="threads to compress on; 0 compresses as one "
+                        "stream on the uploading thread")
+    parser.add_argument("--digest", type=_digest_list,
+                        default=_digest,
+                        help="comma separated digests, such as md5,sha256, "
+                        "to compute as keys are archived and retrieved; "
+                        "reported on stderr, and md5 checked against the "
+                        "service")
+    parser.add_argument("--digest-manifest", type=str, default=None,
+                        help="check the digests against this sha256sum or "
+                        "md5sum style file, by key name or source path")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="run commands read from stdin as a batch, "
+                        "this many at a time")
+    parser.add_argument("--upload-rate", type=float, default=None,
+                        help="most bytes per second to upload")
+    parser.add_argument("--download-rate", type=float, default=None,
+                        help="most bytes per second to download")
+    parser.add_argument("--request-rate", type=float, default=None,
+                        help="most requests per second to send")
+    parser.add_argument("--stats", action="store_true", default=False,
+                        help="report request latency percentiles for each "
+                        "command, and --cache-dir counts, on stderr")
+    parser.add_argument("--index-dir", type=str, default=_index_directory,
+                        help="keep a local index of each collection's keys "
+                        "in this directory, and answer list keys from it")
+    parser.add_argument("--index-max-age", type=float,
+                        default=_index_max_age,
+                        help="seconds before list keys refreshes the local "
+                        "index from the service")
+    parser.add_argument("--cache-dir", type=str, default=_cache_directory,
+                        help="keep retrieved keys in this directory, and "
+                        "fetch them again only if they have changed")
+    parser.add_argument("--cache-max-bytes", type=int,
+                        default=_cache_max_bytes,
+                        help="most bytes the --cache-dir holds")
+    parser.add_argument("--bench", type=str, default=None,
+                        help="run the workload mix in this file as a load "
+                        "test, -j operations at a time")
+    parser.add_argument("--duration", type=float, default=60.0,
+                        help="seconds a --bench run lasts")
+    parser.add_argument("--arrival-rate", type=float, default=None,
+                        help="operations per second arriving at random "
+                        "for --bench, instead of running back to back")
+    parser.add_argument("--report-interval", type=float, default=5.0,
+                        help="seconds between --bench progress lines")
+    parser.add_argument("--prepare", action="store_true", default=False,
+                        help="archive the keys the --bench workload "
+                        "retrieves before starting")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed the --bench random choices")
+    parser.add_argument("residue", type=str, nargs="*", 
                         help="a ncl comman on the commandline")
 
     return parser.parse_args()
@@ -106,62 +238,49 @@ def _list_collections(args, identity, ncl_dict):
     if identity is None:
         raise InvalidIdentity("Must have identity to list collections")
 
-    http_connection = HTTPConnection(compute_default_hostname(),
-                                     identity.user_name,
-                                     identity.auth_key,
-                                     identity.auth_key_id)
     path = "/".join(["customers", identity.user_name, "collections"])
     uri = compute_uri(path)
 
-    response = http_connection.request(method, uri, body=None)
-        
-    data = response.read()
-    http_connection.close()
-    result = json.loads(data.decode("utf-8"))
-    # TODO: add an option for verbose list
-    for entry in result:
-        print(entry["name"])
+    with _connection_pool.connection(compute_default_hostname(), identity) \
+        as http_connection:
+        response = http_connection.request(method, uri, body=None)
+        # TODO: add an option for verbose list
+        for entry in iter_json_array(response):
+            print(entry["name"], file=_output())
 
 def _list_collection(args, identity, ncl_dict):
     method = "GET"
 
-    http_connection = HTTPConnection(compute_default_hostname(),
-                                     identity.user_name,
-                                     identity.auth_key,
-                                     identity.auth_key_id)
     path = "/".join(["customers", 
                      identity.user_name, 
                      "collections",
                      ncl_dict["collection_name"]])
     uri = compute_uri(path)
 
-    response = http_connection.request(method, uri, body=None)
-        
-    data = response.read()
-    http_connection.close()
+    with _connection_pool.connection(compute_default_hostname(), identity) \
+        as http_connection:
+        response = http_connection.request(method, uri, body=None)
+        data = response.read()
+
     result = json.loads(data.decode("utf-8"))
-    print(str(result))
+    print(str(result), file=_output())
 
 def _create_collection(args, identity, ncl_dict):
     method = "POST"
-    
-    http_connection = HTTPConnection(compute_default_hostname(),
-                                     identity.user_name,
-                                     identity.auth_key,
-                                     identity.auth_key_id)
 
     path = "/".join(["customers", identity.user_name, "collections"]) 
     uri = compute_uri(path, action="create", name=ncl_dict["collection_name"])
 
-    response = http_connection.request(method, 
-                                       uri, 
-                                       body=None, 
-                                       expected_status=CREATED)
-        
-    data = response.read()
-    http_connection.close()
+    with _connection_pool.connection(compute_default_hostname(), identity) \
+        as http_connection:
+        response = http_connection.request(method, 
+                                           uri, 
+                                           body=None, 
+                                           expected_status=CREATED)
+        data = response.read()
+
     result = json.loads(data.decode("utf-8"))
-    print(str(result))
+    print(str(result), file=_output())
  
 def _set_collection(args, identity, ncl_dict):
     raise NCLNotImplemented("_set_collection")
@@ -170,46 +289,60 @@ def _delete_collectio0n(args, identity, ncl_dict):
     raise NCLNotImplemented("_delete_collection")
 
 def _list_keys(args, identity, ncl_dict):
-    method = "GET"
-
     hostname = compute_collection_hostname(ncl_dict["collection_name"])
-    if identity is None:
-        http_connection = UnAuthHTTPConnection(hostname)
-    else:
-        http_connection = HTTPConnection(hostname,
-                                         identity.user_name,
-                                         identity.auth_key,
-                                         identity.auth_key_id)
 
-    kwargs = {
-        "max_keys" : _max_keys,
-    }
-    if "prefix" in ncl_dict and ncl_dict["prefix"] != "" and \
-        ncl_dict["prefix"] is not None: 
-        kwargs["prefix"] = ncl_dict["prefix"]
-    if "marker" in ncl_dict and ncl_dict["marker"] != "" and \
-        ncl_dict["marker"] is not None: 
-        kwargs["marker"] = ncl_dict["marker"]
-    if "delimiter" in ncl_dict and ncl_dict["delimiter"] != "" and \
-        ncl_dict["delimiter"] is not None: 
-        kwargs["delimiter"] = ncl_dict["delimiter"]
-
-    uri = compute_uri("data/", **kwargs)
-
-    response = http_connection.request(method, uri)
-    
-    data = response.read()
-    http_connection.close()
-    data_dict = json.loads(data.decode("utf-8"))
-
-    if "key_data" in data_dict:
-        for key_entry in data_dict["key_data"]:
-            print(key_entry["key"])
-    elif "prefixes" in data_dict:
-        for prefix in data_dict["prefixes"]:
-            print(prefix)
+    kwargs = dict()
+    for name in ["prefix", "marker", "delimiter", "pattern", ]:
+        if name in ncl_dict and ncl_dict[name] != "" and \
+            ncl_dict[name] is not None: 
+            kwargs[name] = ncl_dict[name]
+
+    if args.index_dir is not None:
+        key_index = open_key_index(args.index_dir, hostname)
+        age_seconds = key_index.age_seconds()
+        if age_seconds is None or age_seconds > args.index_max_age:
+            key_index.refresh(_connection_pool, hostname, identity)
+        entries = key_index.query(**kwargs)
     else:
-        raise ValueError("Unexpected return value {0}".format(data_dict))
+        entries = _iter_matching_keys(hostname, identity, kwargs)
+
+    for entry in entries:
+        if "delimiter" in kwargs:
+            print(entry, file=_output())
+        else:
+            print(entry["key"], file=_output())
+
+def _iter_matching_keys(hostname, identity, kwargs):
+    """
+    list keys from the service, filtering them by pattern= locally
+    """
+    pattern = kwargs.pop("pattern", None)
+    if pattern is not None and not "delimiter" in kwargs:
+        # the service can narrow the listing to the pattern's literal start
+        literal = pattern_prefix(pattern)
+        if literal.startswith(kwargs.get("prefix", "")):
+            kwargs["prefix"] = literal
+    entries = iter_keys(_connection_pool, 
+                        hostname, 
+                        identity, 
+                        max_keys=_max_keys, 
+                        **kwargs)
+    if pattern is None:
+        return entries
+    return (entry for entry in entries \
+            if fnmatch.fnmatchcase((entry if "delimiter" in kwargs \
+                                    else entry["key"]), pattern))
+
+def _reconcile_keys(args, identity, ncl_dict):
+    if args.index_dir is None:
+        raise NCLErrorResult("reconcile keys needs --index-dir")
+    hostname = compute_collection_hostname(ncl_dict["collection_name"])
+    key_index = open_key_index(args.index_dir, hostname)
+    added, removed = key_index.reconcile(_connection_pool, hostname, identity)
+    print("{0} keys: {1} added, {2} removed".format(len(key_index),
+                                                   added,
+                                                   removed),
+          file=_output())
 
 def _list_key_versions(args, identity, ncl_dict):
     raise NCLNotImplemented("_list_key_versions")
@@ -218,36 +351,252 @@ def _list_key(args, identity, ncl_dict):
     raise NCLNotImplemented("_list_key")
 
 def _archive_key(args, identity, ncl_dict):
-    raise NCLNotImplemented("_archive_key")
+    log = logging.getLogger("_archive_key")
+
+    if identity is None:
+        raise InvalidIdentity("Must have identity to archive a key")
+    paths = ncl_dict.get("paths", ["-"])
+    if paths == ["-"] and getattr(args, "commands_from_stdin", False):
+        raise NCLErrorResult("archive key requires a source path when "
+                             "commands are read from stdin")
+
+    hostname = compute_collection_hostname(ncl_dict["collection_name"])
+    kwargs = dict()
+    if args.parallel is not None:
+        kwargs["max_workers"] = args.parallel
+    uploader = MultipartUploader(_connection_pool, 
+                                 hostname, 
+                                 identity, 
+                                 **kwargs)
+    algorithms = _digest_algorithms(args)
+    if args.compression is not None:
+        progress = _archive_compressed(args,
+                                       uploader,
+                                       ncl_dict["key"],
+                                       paths,
+                                       algorithms)
+    elif paths == ["-"]:
+        # stream from stdin as it is written
+        progress = uploader.archive_stream(ncl_dict["key"],
+                                           sys.stdin.buffer,
+                                           chunk_size=args.chunk_size,
+                                           algorithms=algorithms)
+    else:
+        progress = uploader.archive(ncl_dict["key"],
+                                    paths,
+                                    algorithms=algorithms)
+
+    if progress.digests is not None:
+        server_md5 = None
+        # the service's MD5 is of the bytes it stored, which are
+        # compressed if the upload was
+        if "md5" in progress.digests and args.compression is None:
+            server_md5 = fetch_server_md5(_connection_pool,
+                                          hostname,
+                                          identity,
+                                          ncl_dict["key"])
+        _check_digests(args,
+                       ncl_dict["key"],
+                       progress.digests,
+                       server_md5,
+                       [ncl_dict["key"]] + (paths if len(paths) == 1 \
+                                            else []))
+
+    log.info("archived {0} bytes in {1:.3f} seconds {2:.3f} MB/s".format(
+        progress.bytes_sent, 
+        progress.elapsed_seconds, 
+        progress.bytes_per_second() / (1024 * 1024)))
+
+def _archive_compressed(args, uploader, key, paths, algorithms):
+    """
+    archive one source compressed with args.compression, recording the
+    codec in the key's metadata; digests are of the source, before
+    compression
+    """
+    if len(paths) != 1:
+        raise NCLErrorResult("--compression archives a single source")
+    source = (sys.stdin.buffer if paths == ["-"] else open(paths[0], "rb"))
+    executor = None
+    if args.compress_workers > 0:
+        executor = ThreadPoolExecutor(max_workers=args.compress_workers)
+    try:
+        hashing_reader = None
+        if algorithms is not None:
+            hashing_reader = HashingReader(source, algorithms)
+        reader = CompressingReader((source if hashing_reader is None \
+                                    else hashing_reader),
+                                   args.compression,
+                                   executor=executor)
+        progress = uploader.archive_stream(key,
+                                           reader,
+                                           meta=compression_meta(
+                                               args.compression),
+                                           chunk_size=args.chunk_size)
+        logging.getLogger("_archive_key").info(
+            "compressed {bytes_in} bytes to {bytes_out}, "
+            "{ratio:.2f}x".format(**reader.stats()))
+        if hashing_reader is not None:
+            progress.digests = hashing_reader.hexdigests()
+        return progress
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if source is not sys.stdin.buffer:
+            source.close()
 
 def _retrieve_key(args, identity, ncl_dict):
     method = "GET"
 
     hostname = compute_collection_hostname(ncl_dict["collection_name"])
-    if identity is None:
-        http_connection = UnAuthHTTPConnection(hostname)
-    else:
-        http_connection = HTTPConnection(hostname,
-                                         identity.user_name,
-                                         identity.auth_key,
-                                         identity.auth_key_id)
 
     kwargs = {
     }
 
+    algorithms = _digest_algorithms(args)
+
+    # a key archived compressed is decompressed whether or not this run
+    # has --compression; that only picks the codec for archives. The codec
+    # comes back in the metadata headers of the GET or HEAD of the key
+    if args.parallel is not None and "dest" in ncl_dict and \
+        algorithms is None:
+        downloader = ParallelDownloader(_connection_pool,
+                                        hostname,
+                                        identity,
+                                        segment_count=args.parallel)
+        head = downloader.head(ncl_dict["key"])
+        # a compressed body is read in order, not by ranges
+        if not compression_meta_name in head.meta:
+            downloader.retrieve(ncl_dict["key"], ncl_dict["dest"], head=head)
+            return
+
     uri = compute_uri("data", ncl_dict["key"], **kwargs)
 
-    response = http_connection.request(method, 
-                                       uri, 
-                                       body=None)
+    if "dest" in ncl_dict:
+        output_file = open(ncl_dict["dest"], "wb")
+    else:
+        output_file = _output().buffer
+
+    # digests are of the contents, so they are taken after decompression
+    destination = output_file
+    hashing_writer = None
+    if algorithms is not None:
+        destination = hashing_writer = HashingWriter(destination, algorithms)
+    decompressing_writers = list()
+
+    def _key_destination(destination, meta):
+        codec = meta.get(compression_meta_name)
+        if codec is None:
+            return destination
+        decompressing_writer = DecompressingWriter(destination, codec)
+        decompressing_writers.append(decompressing_writer)
+        return decompressing_writer
+
+    try:
+        if args.cache_dir is not None:
+            object_cache = open_object_cache(args.cache_dir,
+                                             args.cache_max_bytes)
+            _, etag = object_cache.retrieve(
+                _connection_pool,
+                hostname,
+                identity,
+                ncl_dict["key"],
+                destination,
+                wrap_destination=_key_destination)
+        else:
+            with _connection_pool.connection(hostname, identity) \
+                as http_connection:
+                response = http_connection.request(method, 
+                                                   uri, 
+                                                   body=None)
+                etag = response.getheader("ETag")
+                destination = _key_destination(destination,
+                                               response_meta(response))
+                DownloadSink(destination).drain(response)
+        for decompressing_writer in decompressing_writers:
+            decompressing_writer.close()
+        if hashing_writer is not None:
+            # the ETag is the MD5 of the body as stored, before it is
+            # decompressed
+            server_md5 = (None if len(decompressing_writers) > 0 \
+                          else etag_md5(etag))
+            _check_digests(args,
+                           ncl_dict["key"],
+                           hashing_writer.hexdigests(),
+                           server_md5,
+                           [ncl_dict["key"], ncl_dict.get("dest")])
+    finally:
+        if "dest" in ncl_dict:
+            output_file.close()
+
+def _digest_algorithms(args):
+    """
+    return the digests to compute, or None
+    """
+    if args.digest is not None:
+        return args.digest
+    if getattr(args, "manifest_digests", None) is not None:
+        return list(default_algorithms)
+    return None
+
+def _check_digests(args, name, digests, server_md5, manifest_names):
+    """
+    report the digests on stderr, and check them against the service's
+    MD5, if any, and the --digest-manifest entry for the first of
+    manifest_names it has
+    """
+    for algorithm in sorted(digests):
+        print("{0} ({1}) = {2}".format(algorithm.upper(),
+                                       name,
+                                       digests[algorithm]), file=sys.stderr)
+    try:
+        if server_md5 is not None:
+            verify_digests(name, digests, {"md5" : server_md5})
+        manifest = getattr(args, "manifest_digests", None)
+        if manifest is None:
+            return
+        for manifest_name in manifest_names:
+            if manifest_name in manifest:
+                checked = verify_digests(name,
+                                         digests,
+                                         manifest[manifest_name])
+                if len(checked) == 0:
+                    raise NCLErrorResult("{0}: no digest in common with the "
+                                         "manifest".format(name))
+                return
+        raise NCLErrorResult("{0} is not in the digest manifest".format(name))
+    except DigestMismatch:
+        instance = sys.exc_info()[1]
+        raise NCLErrorResult(str(instance))
 
-    while True:
-        data = response.read(_read_buffer_size)
-        if len(data) == 0:
-            break
-        sys.stdout.buffer.write(data)
+def _sync(args, identity, ncl_dict):
+    if identity is None:
+        raise InvalidIdentity("Must have identity to sync")
+    if not os.path.isdir(ncl_dict["directory"]):
+        raise NCLErrorResult("{0} is not a directory".format(
+            ncl_dict["directory"]))
 
-    http_connection.close()
+    hostname = compute_collection_hostname(ncl_dict["collection_name"])
+    key_prefix = ncl_dict.get("prefix", "")
+    manifest_path = ncl_dict.get("manifest")
+    if manifest_path is None:
+        manifest_path = default_manifest_path(hostname,
+                                              ncl_dict["directory"],
+                                              key_prefix)
+    kwargs = dict()
+    if args.parallel is not None:
+        kwargs["max_workers"] = args.parallel
+    directory_sync = DirectorySync(_connection_pool,
+                                   hostname,
+                                   identity,
+                                   manifest_path,
+                                   key_prefix=key_prefix,
+                                   delete=ncl_dict.get("delete", False),
+                                   **kwargs)
+    result = directory_sync.sync(ncl_dict["directory"])
+    result.report(_output())
+    if len(result.errors) > 0:
+        raise NCLErrorResult("{0} files failed to sync".format(
+            len(result.errors)))
 
 def _delete_key(args, identity, ncl_dict):
     raise NCLNotImplemented("_delete_key")
@@ -258,11 +607,6 @@ def _space_usage(args, identity, ncl_dict):
     if identity is None:
         raise InvalidIdentity("Must have identity to retrieve space usage")
 
-    http_connection = HTTPConnection(compute_default_hostname(),
-                                     identity.user_name,
-                                     identity.auth_key,
-                                     identity.auth_key_id)
-
     kwargs = {"action" : "space_usage"}
     if "days" in ncl_dict:
         kwargs["days_of_history"] = ncl_dict["days"]
@@ -273,28 +617,44 @@ def _space_usage(args, identity, ncl_dict):
                      ncl_dict["collection_name"]])
     uri = compute_uri(path, **kwargs)
 
-    response = http_connection.request(method, uri, body=None)
-        
-    data = response.read()
-    http_connection.close()
-    result = json.loads(data.decode("utf-8"))
-
-    if not result["success"]:
-        raise NCLErrorResult(result["error_message"])
-
-    print()
-    for day_entry in result["operational_stats"]:
-        print(day_entry["day"])
-        if day_entry["archive_success"] != 0:
-            print("{0:8} archive success".format(day_entry["archive_success"]))
-            print("{0:8} archive bytes".format(day_entry["success_bytes_in"]))
-        if day_entry["retrieve_success"] != 0:
-            print("{0:8} retrieve success".format(day_entry["retrieve_success"]))
-            print("{0:8} retrieve bytes".format(day_entry["success_bytes_out"]))
-        if day_entry["delete_success"] != 0:
-            print("{0:8} delete success".format(day_entry["delete_success"]))
-        if day_entry["listmatch_success"] != 0:
-            print("{0:8} listmatch success".format(day_entry["listmatch_success"]))
+    with _connection_pool.connection(compute_default_hostname(), identity) \
+        as http_connection:
+        response = http_connection.request(method, uri, body=None)
+        stream = JSONStream(response, ["operational_stats"])
+
+        header_printed = False
+        for _, day_entry in stream:
+            if stream.fields.get("success") is False:
+                break
+            if not header_printed:
+                print(file=_output())
+                header_printed = True
+            _print_day_entry(day_entry)
+
+    if not stream.fields.get("success"):
+        raise NCLErrorResult(stream.fields.get("error_message"))
+    if not header_printed:
+        print(file=_output())
+
+def _print_day_entry(day_entry):
+    output = _output()
+    print(day_entry["day"], file=output)
+    if day_entry["archive_success"] != 0:
+        print("{0:8} archive success".format(day_entry["archive_success"]),
+              file=output)
+        print("{0:8} archive bytes".format(day_entry["success_bytes_in"]),
+              file=output)
+    if day_entry["retrieve_success"] != 0:
+        print("{0:8} retrieve success".format(day_entry["retrieve_success"]),
+              file=output)
+        print("{0:8} retrieve bytes".format(day_entry["success_bytes_out"]),
+              file=output)
+    if day_entry["delete_success"] != 0:
+        print("{0:8} delete success".format(day_entry["delete_success"]),
+              file=output)
+    if day_entry["listmatch_success"] != 0:
+        print("{0:8} listmatch success".format(
+              day_entry["listmatch_success"]), file=output)
 
 _dispatch_table = {
     ncl_list_collections    : _list_collections,
@@ -308,7 +668,117 @@ _dispatch_table = {
     ncl_archive_key         : _archive_key,
     ncl_retrieve_key        : _retrieve_key,
     ncl_delete_key          : _delete_key,
-    ncl_space_usage         : _space_usage}
+    ncl_space_usage         : _space_usage,
+    ncl_reconcile_keys      : _reconcile_keys,
+    ncl_sync                : _sync}
+
+def _run_command(args, identity, ncl_dict):
+    """
+    run one command, labelling its requests with the command for --stats
+    """
+    with request_label(ncl_dict["command"]):
+        _dispatch_table[ncl_dict["command"]](args, identity, ncl_dict)
+
+def _report_request_stats(aggregator, output):
+    """
+    print request latency percentiles for each command
+    """
+    print("", file=output)
+    print("{0:20} {1:>8} {2:>8} {3:>8} {4:>10} {5:>10} {6:>10} "
+          "{7:>14}".format(
+              "command", "requests", "errors", "retries", "p50 ms",
+              "p95 ms", "p99 ms", "1st byte p95"), file=output)
+    for entry in aggregator.summary():
+        first_byte = entry.get("first_byte", {95 : 0.0})
+        print("{0:20} {1:8} {2:8} {3:8} {4:10.1f} {5:10.1f} {6:10.1f} "
+              "{7:14.1f}".format(
+                  entry["key"],
+                  entry["count"],
+                  entry["errors"],
+                  entry["retries"],
+                  entry["total"][50] * 1000.0,
+                  entry["total"][95] * 1000.0,
+                  entry["total"][99] * 1000.0,
+                  first_byte[95] * 1000.0),
+              file=output)
+
+def _report_cache_stats(object_cache, output):
+    """
+    print the object cache hit ratio and bytes saved
+    """
+    stats = object_cache.stats()
+    print("", file=output)
+    print("cache: {0} requests, {1} hits ({2:.1%}), {3} bytes saved, "
+          "{4} bytes fetched, {5} evictions".format(
+              stats["requests"],
+              stats["hits"],
+              stats["hit_ratio"],
+              stats["bytes_saved"],
+              stats["bytes_fetched"],
+              stats["evictions"]), file=output)
+
+def _run_batch(args, identity, input_file):
+    """
+    run a whole script concurrently
+    returns 0 if every command succeeded
+    """
+    def _execute(ncl_dict, output):
+        _output_local.stream = output
+        try:
+            _run_command(args, identity, ncl_dict)
+        finally:
+            del _output_local.stream
+
+    script_lines = parse_script(input_file)
+
+    # look up every hostname the script uses at once, rather than one
+    # lookup per command; failures are left for the commands to report
+    hostnames = [compute_default_hostname()]
+    for script_line in script_lines:
+        if script_line.ncl_dict is not None and \
+            "collection_name" in script_line.ncl_dict:
+            hostnames.append(compute_collection_hostname(
+                script_line.ncl_dict["collection_name"]))
+    dns_cache = default_dns_cache()
+    dns_cache.prefetch(hostnames)
+
+    statistics = run_batch(script_lines, 
+                           _execute, 
+                           max(1, args.jobs), 
+                           sys.stdout.buffer,
+                           encoding=sys.stdout.encoding)
+    statistics.report(sys.stderr)
+    logging.getLogger("batch").debug("dns cache {0}".format(
+        dns_cache.stats()))
+
+    return (1 if len(statistics.failed_lines) > 0 else 0)
+
+def _run_bench(args, identity):
+    """
+    run the --bench workload
+    returns 0 if no operation failed
+    """
+    if identity is None:
+        raise InvalidIdentity("Must have identity to run a benchmark")
+    with open(args.bench) as input_file:
+        workload = parse_workload(input_file)
+
+    jobs = (1 if args.jobs is None else max(1, args.jobs))
+    runner = BenchRunner(_connection_pool, identity, workload)
+    if args.prepare:
+        start_time = time.time()
+        count = runner.prepare(jobs)
+        print("archived {0} keys in {1:.1f} seconds".format(
+            count, time.time() - start_time), file=sys.stderr)
+
+    statistics = run_bench(runner,
+                           jobs,
+                           args.duration,
+                           arrival_rate=args.arrival_rate,
+                           report_seconds=args.report_interval,
+                           seed=args.seed)
+    errors = sum(entry["errors"] for entry in statistics.summary())
+    return (1 if errors > 0 else 0)
 
 def main():
     """
@@ -319,6 +789,35 @@ def main():
     log = logging.getLogger("main")
     args = _parse_commandline()
 
+    aggregator = None
+    if args.stats:
+        aggregator = TimingAggregator()
+        add_request_observer(aggregator)
+    try:
+        return _run(args, log)
+    finally:
+        # every exit, including the early error returns
+        _connection_pool.close_all()
+        if aggregator is not None:
+            _report_request_stats(aggregator, sys.stderr)
+            if args.cache_dir is not None:
+                _report_cache_stats(open_object_cache(args.cache_dir,
+                                                      args.cache_max_bytes),
+                                    sys.stderr)
+
+def _run(args, log):
+    """
+    run the commands from the commandline or stdin
+    returns 0 if they all succeeded
+    """
+    if args.upload_rate is not None or \
+        args.download_rate is not None or \
+        args.request_rate is not None:
+        set_default_rate_limiter(RateLimiter(
+            upload_bytes_per_second=args.upload_rate,
+            download_bytes_per_second=args.download_rate,
+            requests_per_second=args.request_rate))
+
     try:
         identity = _load_identity(args)
     except InvalidIdentity:
@@ -326,15 +825,36 @@ def main():
         log.error("invalid identity: {0}".format(instance))
         return 1
 
+    if args.digest_manifest is not None:
+        try:
+            with open(args.digest_manifest) as manifest_file:
+                args.manifest_digests = load_digest_manifest(manifest_file)
+        except (IOError, ValueError, ):
+            instance = sys.exc_info()[1]
+            log.error("invalid digest manifest: {0}".format(instance))
+            return 1
+
     if len(args.residue) > 0:
         input_file = StringIO(" ".join(args.residue))
     else:
         input_file = sys.stdin
+    args.commands_from_stdin = input_file is sys.stdin
+
+    if args.bench is not None:
+        try:
+            return _run_bench(args, identity)
+        except (InvalidWorkload, InvalidIdentity, IOError, ):
+            instance = sys.exc_info()[1]
+            log.error(str(instance))
+            return 1
+
+    if args.jobs is not None:
+        return _run_batch(args, identity, input_file)
 
     for line in input_file:
         try:
             ncl_dict = parse_ncl_string(line)
-            _dispatch_table[ncl_dict["command"]](args, identity, ncl_dict)
+            _run_command(args, identity, ncl_dict)
         except InvalidNCLString:
             instance = sys.exc_info()[1]
             log.error(str(instance))
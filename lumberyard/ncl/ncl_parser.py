@@ -19,40 +19,85 @@ from commands import \
     ncl_archive_key, \
     ncl_retrieve_key, \
     ncl_delete_key, \
-    ncl_space_usage
+    ncl_space_usage, \
+    ncl_reconcile_keys, \
+    ncl_sync
 
 class InvalidNCLString(Exception):
     pass
 
 # detect the basic command skeleton
 # TODO: we could allow abbreviations
+_collection_name_pattern = "(?P<collection_name>[a-z0-9][a-z0-9-]*[a-z0-9])"
 _command_templates = [
-    (ncl_list_collections, re.compile("^list collections$", re.UNICODE), ),
+    (ncl_list_collections, "^list collections$", ),
     (ncl_list_collection, 
-     re.compile("^list collection\s(?P<collection_name>[a-z0-9][a-z0-9-]*[a-z0-9])$", re.UNICODE), ),
+     "^list collection\\s{0}$", ),
     (ncl_create_collection,
-     re.compile("^create collection\s(?P<collection_name>[a-z0-9][a-z0-9-]*[a-z0-9])\s*(?P<options>.*)$", re.UNICODE), ),
+     "^create collection\\s{0}\\s*(?P<options>.*)$", ),
     (ncl_set_collection,
-     re.compile("set collection\s(?P<collection_name>[a-z0-9][a-z0-9-]*[a-z0-9])\s*(?P<options>.*)$", re.UNICODE), ),
+     "set collection\\s{0}\\s*(?P<options>.*)$", ),
     (ncl_delete_collection,
-     re.compile("delete collection\s(?P<collection_name>[a-z0-9][a-z0-9-]*[a-z0-9])", re.UNICODE), ),
+     "delete collection\\s{0}", ),
     (ncl_list_keys, 
-     re.compile("^(?P<collection_name>[a-z0-9][a-z0-9-]*[a-z0-9])\slist keys\s*(?P<options>.*)$", re.UNICODE), ),
+     "^{0}\\slist keys\\s*(?P<options>.*)$", ),
     (ncl_list_key_versions, 
-     re.compile("^(?P<collection_name>[a-z0-9][a-z0-9-]*[a-z0-9])\slist key versions\s(?P<key>\S+)\s*(?P<options>.*)$", re.UNICODE), ),
+     "^{0}\\slist key versions\\s(?P<key>\\S+)\\s*(?P<options>.*)$", ),
     (ncl_list_key, 
-     re.compile("^(?P<collection_name>[a-z0-9][a-z0-9-]*[a-z0-9])\slist key\s(?P<key>\S+)\s*(?P<options>.*)$", re.UNICODE), ),
+     "^{0}\\slist key\\s(?P<key>\\S+)\\s*(?P<options>.*)$", ),
     (ncl_archive_key, 
-     re.compile("^(?P<collection_name>[a-z0-9][a-z0-9-]*[a-z0-9])\sarchive key\s(?P<key>\S+)\s*(?P<paths>.*)$", re.UNICODE), ),
+     "^{0}\\sarchive key\\s(?P<key>\\S+)\\s*(?P<paths>.*)$", ),
     (ncl_retrieve_key, 
-     re.compile("^(?P<collection_name>[a-z0-9][a-z0-9-]*[a-z0-9])\sretrieve key\s(?P<key>\S+)\s*(?P<options>.*)$", re.UNICODE), ),
+     "^{0}\\sretrieve key\\s(?P<key>\\S+)\\s*(?P<options>.*)$", ),
     (ncl_delete_key, 
-     re.compile("^(?P<collection_name>[a-z0-9][a-z0-9-]*[a-z0-9])\sdelete key\s(?P<key>\S+)\s*(?P<options>.*)$", re.UNICODE), ),
+     "^{0}\\sdelete key\\s(?P<key>\\S+)\\s*(?P<options>.*)$", ),
     (ncl_space_usage, 
-     re.compile("^space usage\s(?P<collection_name>[a-z0-9][a-z0-9-]*[a-z0-9])\s*(?P<options>.*)$", re.UNICODE), ), ]
+     "^space usage\\s{0}\\s*(?P<options>.*)$", ),
+    (ncl_reconcile_keys, 
+     "^{0}\\sreconcile keys$", ),
+    (ncl_sync, 
+     "^{0}\\ssync\\s(?P<directory>\\S+)\\s*(?P<options>.*)$", ), ]
+
+_group_name_re = re.compile(r"\(\?P<(?P<name>[a-z_]+)>")
+
+def _compile_command_matcher(command_templates):
+    """
+    combine the command templates into a single regular expression, tried
+    in one pass instead of one template after another.
+
+    Each template becomes an alternative, in the original order, so the
+    first template that matches still wins. Its named groups get a per
+    template prefix, and it ends with an empty marker group; the marker is
+    the last group matched, so match.lastgroup identifies the command.
+
+    return (compiled_expression, {marker : (command, names, first, last)}),
+    where match.groups()[first:last] are the values of the named groups
+    """
+    alternatives = list()
+    group_names = dict()
+    for index, (command, template) in enumerate(command_templates):
+        marker = "c{0}".format(index)
+        pattern = template.format(_collection_name_pattern)
+        group_names[marker] = (command, _group_name_re.findall(pattern), )
+        pattern = _group_name_re.sub(
+            lambda m: "(?P<{0}_{1}>".format(marker, m.group("name")), pattern)
+        alternatives.append("(?:{0}(?P<{1}>))".format(pattern, marker))
+    command_matcher = re.compile("|".join(alternatives), re.UNICODE)
+
+    # each alternative's groups are numbered consecutively, ending with
+    # its marker
+    commands = dict()
+    for marker, (command, names) in group_names.items():
+        last = command_matcher.groupindex[marker] - 1
+        commands[marker] = (command, names, last - len(names), last, )
+    return command_matcher, commands
+
+_command_matcher, _command_groups = \
+    _compile_command_matcher(_command_templates)
 
 _collection_name_re = re.compile(r'[a-z0-9][a-z0-9-]*[a-z0-9]$')
 _max_collection_name_size = 63
+_parse_cache_size = 4096
 
 def _valid_collection_name(collection_name):
     """
@@ -63,6 +108,14 @@ def _valid_collection_name(collection_name):
         and not '--' in collection_name \
         and _collection_name_re.match(collection_name) is not None
 
+def _valid_matched_collection_name(collection_name):
+    """
+    _valid_collection_name for a name captured by _command_matcher, which
+    has already checked the characters
+    """
+    return len(collection_name) <= _max_collection_name_size \
+        and not '--' in collection_name
+
 def _parse_options(option_string):
     option_dict = dict()
     for item in option_string.split():
@@ -72,12 +125,12 @@ def _parse_options(option_string):
         option_dict[option_pair[0].lower()] = option_pair[1]
     return option_dict
 
-def _build_list_collections(_match_object, _ncl_dict):
+def _build_list_collections(_groups, _ncl_dict):
     pass
 
-def _build_list_collection(match_object, ncl_dict):
-    ncl_dict["collection_name"] = match_object.group("collection_name")
-    if not _valid_collection_name(ncl_dict["collection_name"]):
+def _build_list_collection(groups, ncl_dict):
+    ncl_dict["collection_name"] = groups["collection_name"]
+    if not _valid_matched_collection_name(ncl_dict["collection_name"]):
         raise InvalidNCLString("Invalid collection name {0}".format(
             ncl_dict["collection_name"]))
 
@@ -93,94 +146,138 @@ def _collection_options(option_string, ncl_dict):
     if "access_control" in option_dict:
         ncl_dict["access_control"] = option_dict["access_control"]
 
-def _build_create_collection(match_object, ncl_dict):
-    ncl_dict["collection_name"] = match_object.group("collection_name")
-    if not _valid_collection_name(ncl_dict["collection_name"]):
+def _build_create_collection(groups, ncl_dict):
+    ncl_dict["collection_name"] = groups["collection_name"]
+    if not _valid_matched_collection_name(ncl_dict["collection_name"]):
         raise InvalidNCLString("Invalid collection name {0}".format(
             ncl_dict["collection_name"]))
 
-    _collection_options(match_object.group("options"), ncl_dict)
+    _collection_options(groups["options"], ncl_dict)
 
-def _build_set_collection(match_object, ncl_dict):
-    ncl_dict["collection_name"] = match_object.group("collection_name")
-    if not _valid_collection_name(ncl_dict["collection_name"]):
+def _build_set_collection(groups, ncl_dict):
+    ncl_dict["collection_name"] = groups["collection_name"]
+    if not _valid_matched_collection_name(ncl_dict["collection_name"]):
         raise InvalidNCLString("Invalid collection name {0}".format(
             ncl_dict["collection_name"]))
 
-    _collection_options(match_object.group("options"), ncl_dict)
+    _collection_options(groups["options"], ncl_dict)
     
-def _build_delete_collection(match_object, ncl_dict):
-    ncl_dict["collection_name"] = match_object.group("collection_name")
-    if not _valid_collection_name(ncl_dict["collection_name"]):
+def _build_delete_collection(groups, ncl_dict):
+    ncl_dict["collection_name"] = groups["collection_name"]
+    if not _valid_matched_collection_name(ncl_dict["collection_name"]):
         raise InvalidNCLString("Invalid collection name {0}".format(
             ncl_dict["collection_name"]))
 
-def _build_list_keys(match_object, ncl_dict):
-    ncl_dict["collection_name"] = match_object.group("collection_name")
-    if not _valid_collection_name(ncl_dict["collection_name"]):
+def _build_list_keys(groups, ncl_dict):
+    ncl_dict["collection_name"] = groups["collection_name"]
+    if not _valid_matched_collection_name(ncl_dict["collection_name"]):
         raise InvalidNCLString("Invalid collection name {0}".format(
             ncl_dict["collection_name"]))
 
-def _build_list_versions(match_object, ncl_dict):
-    ncl_dict["collection_name"] = match_object.group("collection_name")
-    if not _valid_collection_name(ncl_dict["collection_name"]):
+    # a bare <directory-path> is the listing prefix
+    option_items = groups["options"].split()
+    if len(option_items) > 0 and not "=" in option_items[0]:
+        ncl_dict["prefix"] = option_items.pop(0)
+    option_dict = _parse_options(" ".join(option_items))
+    for name in ["prefix", "marker", "delimiter", "pattern", ]:
+        if name in option_dict:
+            ncl_dict[name] = option_dict[name]
+
+def _build_list_versions(groups, ncl_dict):
+    ncl_dict["collection_name"] = groups["collection_name"]
+    if not _valid_matched_collection_name(ncl_dict["collection_name"]):
         raise InvalidNCLString("Invalid collection name {0}".format(
             ncl_dict["collection_name"]))
 
-    ncl_dict["key"] = match_object.group("key")
+    ncl_dict["key"] = groups["key"]
 
-def _build_list_key(match_object, ncl_dict):
-    ncl_dict["collection_name"] = match_object.group("collection_name")
-    if not _valid_collection_name(ncl_dict["collection_name"]):
+def _build_list_key(groups, ncl_dict):
+    ncl_dict["collection_name"] = groups["collection_name"]
+    if not _valid_matched_collection_name(ncl_dict["collection_name"]):
         raise InvalidNCLString("Invalid collection name {0}".format(
             ncl_dict["collection_name"]))
 
-    ncl_dict["key"] = match_object.group("key")
+    ncl_dict["key"] = groups["key"]
     
-    option_dict = _parse_options(match_object.group("options"))
+    option_dict = _parse_options(groups["options"])
     if "version" in option_dict:
         ncl_dict["version"] = option_dict["version"]
 
-def _build_archive_key(match_object, ncl_dict):
-    ncl_dict["collection_name"] = match_object.group("collection_name")
-    if not _valid_collection_name(ncl_dict["collection_name"]):
+def _build_archive_key(groups, ncl_dict):
+    ncl_dict["collection_name"] = groups["collection_name"]
+    if not _valid_matched_collection_name(ncl_dict["collection_name"]):
         raise InvalidNCLString("Invalid collection name {0}".format(
             ncl_dict["collection_name"]))
 
-    ncl_dict["key"] = match_object.group("key")
-    paths = match_object.group("paths").split()
+    ncl_dict["key"] = groups["key"]
+    paths = list()
+    for item in groups["paths"].split():
+        # source=<source-path1>[,<source-path2>[,...]]
+        if item.lower().startswith("source="):
+            paths.extend(p for p in item[len("source="):].split(",") if p)
+        else:
+            paths.append(item)
     if len(paths) > 0:
         ncl_dict["paths"] = paths
 
-def _build_retrieve_key(match_object, ncl_dict):
-    ncl_dict["collection_name"] = match_object.group("collection_name")
-    if not _valid_collection_name(ncl_dict["collection_name"]):
+def _build_retrieve_key(groups, ncl_dict):
+    ncl_dict["collection_name"] = groups["collection_name"]
+    if not _valid_matched_collection_name(ncl_dict["collection_name"]):
         raise InvalidNCLString("Invalid collection name {0}".format(
             ncl_dict["collection_name"]))
 
-    ncl_dict["key"] = match_object.group("key")
-    option_dict = _parse_options(match_object.group("options"))
+    ncl_dict["key"] = groups["key"]
+    option_dict = _parse_options(groups["options"])
     if "dest" in option_dict:
         ncl_dict["dest"] = option_dict["dest"]
+    if "destination" in option_dict:
+        ncl_dict["dest"] = option_dict["destination"]
 
-def _build_delete_key(match_object, ncl_dict):
-    ncl_dict["collection_name"] = match_object.group("collection_name")
-    if not _valid_collection_name(ncl_dict["collection_name"]):
+def _build_delete_key(groups, ncl_dict):
+    ncl_dict["collection_name"] = groups["collection_name"]
+    if not _valid_matched_collection_name(ncl_dict["collection_name"]):
         raise InvalidNCLString("Invalid collection name {0}".format(
             ncl_dict["collection_name"]))
 
-    ncl_dict["key"] = match_object.group("key")
+    ncl_dict["key"] = groups["key"]
 
-def _build_space_usage(match_object, ncl_dict):
-    ncl_dict["collection_name"] = match_object.group("collection_name")
-    if not _valid_collection_name(ncl_dict["collection_name"]):
+def _build_space_usage(groups, ncl_dict):
+    ncl_dict["collection_name"] = groups["collection_name"]
+    if not _valid_matched_collection_name(ncl_dict["collection_name"]):
         raise InvalidNCLString("Invalid collection name {0}".format(
             ncl_dict["collection_name"]))
 
-    option_dict = _parse_options(match_object.group("options"))
+    option_dict = _parse_options(groups["options"])
     if "days" in option_dict:
         ncl_dict["days"] = int(option_dict["days"])
 
+def _build_reconcile_keys(groups, ncl_dict):
+    ncl_dict["collection_name"] = groups["collection_name"]
+    if not _valid_matched_collection_name(ncl_dict["collection_name"]):
+        raise InvalidNCLString("Invalid collection name {0}".format(
+            ncl_dict["collection_name"]))
+
+def _build_sync(groups, ncl_dict):
+    ncl_dict["collection_name"] = groups["collection_name"]
+    if not _valid_matched_collection_name(ncl_dict["collection_name"]):
+        raise InvalidNCLString("Invalid collection name {0}".format(
+            ncl_dict["collection_name"]))
+
+    ncl_dict["directory"] = groups["directory"]
+    option_dict = _parse_options(groups["options"])
+    if "prefix" in option_dict:
+        ncl_dict["prefix"] = option_dict["prefix"]
+    if "manifest" in option_dict:
+        ncl_dict["manifest"] = option_dict["manifest"]
+    if "delete" in option_dict:
+        if option_dict["delete"].lower() == "true":
+            ncl_dict["delete"] = True
+        elif option_dict["delete"].lower() == "false":
+            ncl_dict["delete"] = False
+        else:
+            raise InvalidNCLString("Unknown delete {0}".format(
+                option_dict["delete"]))
+
 _dispatch_table = {
     ncl_list_collections   : _build_list_collections,
     ncl_list_collection    : _build_list_collection,
@@ -194,34 +291,33 @@ _dispatch_table = {
     ncl_retrieve_key       : _build_retrieve_key,
     ncl_delete_key         : _build_delete_key,
     ncl_space_usage        : _build_space_usage,
+    ncl_reconcile_keys     : _build_reconcile_keys,
+    ncl_sync               : _build_sync,
 }
 
-def parse_ncl_string(ncl_string):
+def _parse_uncached(ncl_string):
     """
     return a well-formed NCL object
     or raise InvalidNCLString
     """
     ncl_dict = {}
 
-    # first identify the command
-    ncl_dict["command"] = None
-    match_object = None
-    for command, command_template in _command_templates:
-        match_object = command_template.match(ncl_string)
-        if match_object is not None:
-            ncl_dict["command"] = command
-            break
-
+    # first identify the command, trying every template in one pass
+    match_object = _command_matcher.match(ncl_string)
     if match_object is None:
         raise InvalidNCLString("Unable to recognize a command")
 
+    command, names, first, last = _command_groups[match_object.lastgroup]
+    ncl_dict["command"] = command
+    groups = dict(zip(names, match_object.groups()[first:last]))
+
     try:
         build_function = _dispatch_table[command]
     except KeyError:
         raise InvalidNCLString("Unknown command {0}".format(command))
 
     try:
-        build_function(match_object, ncl_dict)
+        build_function(groups, ncl_dict)
     except InvalidNCLString:
         raise
     except Exception:
@@ -230,3 +326,43 @@ def parse_ncl_string(ncl_string):
 
     return ncl_dict
 
+# ncl_string -> (ncl_dict, None) or (None, error message)
+# scripts repeat the same lines, so each distinct string is parsed once
+_parse_cache = dict()
+
+def _copy_ncl_dict(ncl_dict):
+    """
+    the cached dict is never handed out; callers may change their copy
+    """
+    ncl_dict = dict(ncl_dict)
+    if "paths" in ncl_dict:
+        ncl_dict["paths"] = list(ncl_dict["paths"])
+    return ncl_dict
+
+def parse_ncl_string(ncl_string):
+    """
+    return a well-formed NCL object
+    or raise InvalidNCLString
+    """
+    try:
+        ncl_dict, error_message = _parse_cache[ncl_string]
+    except KeyError:
+        try:
+            ncl_dict, error_message = _parse_uncached(ncl_string), None
+        except InvalidNCLString:
+            ncl_dict, error_message = None, str(sys.exc_info()[1])
+        if len(_parse_cache) >= _parse_cache_size:
+            _parse_cache.clear()
+        _parse_cache[ncl_string] = (ncl_dict, error_message, )
+
+    if error_message is not None:
+        raise InvalidNCLString(error_message)
+
+    return _copy_ncl_dict(ncl_dict)
+
+def clear_parse_cache():
+    """
+    forget every parsed string
+    """
+    _parse_cache.clear()
+
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+test_ncl_batch.py
+
+unit tests for script parsing and ordering, and batch runs against a
+StandInServer
+"""
+import argparse
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.stand_in_server import StandInServer
+
+from identity import identity_template
+from ncl_batch import parse_script, run_batch
+import ncl_main
+
+_identity = identity_template(user_name="test-user",
+                              auth_key_id="42",
+                              auth_key="test-auth-key")
+_collection_name = "default"
+
+def _args():
+    return argparse.Namespace(parallel=None,
+                              chunk_size=None,
+                              commands_from_stdin=False,
+                              compression=None,
+                              compress_workers=0,
+                              digest=None,
+                              cache_dir=None,
+                              cache_max_bytes=0,
+                              index_dir=None)
+
+class TestParseScript(unittest.TestCase):
+    """
+    scripts are parsed up front
+    """
+    def test_bad_lines(self):
+        script_lines = parse_script(io.StringIO(
+            u"# a comment\n"
+            u"aaa retrieve key one\n"
+            u"\n"
+            u"aaa fetch key two\n"
+            u"aaa list keys\n"
+            u"retrieve key\n"))
+        self.assertEqual([l.line_number for l in script_lines], [2, 4, 5, 6])
+        self.assertEqual([l.line_number for l in script_lines \
+                          if l.error is not None], [4, 6])
+        self.assertEqual(script_lines[0].ncl_dict["key"], "one")
+
+class TestBarriers(unittest.TestCase):
+    """
+    the order commands start and finish in, without a server
+    """
+    def _run(self, script, delays, jobs=4):
+        events = list()
+        lock = threading.Lock()
+
+        def _execute(ncl_dict, output):
+            line = ncl_dict["line"]
+            with lock:
+                events.append(("start", line, ))
+            time.sleep(delays.get(line, 0.0))
+            with lock:
+                events.append(("end", line, ))
+
+        script_lines = parse_script(io.StringIO(script))
+        for script_line in script_lines:
+            script_line.ncl_dict["line"] = script_line.line_number
+        run_batch(script_lines, _execute, jobs, io.BytesIO())
+        return events
+
+    def _assert_after(self, events, first, second):
+        self.assertTrue(events.index(("end", first, )) < \
+                        events.index(("start", second, )),
+                        (first, second, events, ))
+
+    def test_collection_commands(self):
+        events = self._run(u"aaa list keys\n"
+                           u"bbb list keys\n"
+                           u"create collection ccc\n"
+                           u"aaa list keys\n",
+                           {1 : 0.2, 2 : 0.1})
+        self._assert_after(events, 1, 3)
+        self._assert_after(events, 2, 3)
+        self._assert_after(events, 3, 4)
+
+    def test_key_commands(self):
+        events = self._run(u"aaa archive key k1 /dev/null\n"
+                           u"aaa retrieve key k1\n"
+                           u"aaa retrieve key k2\n"
+                           u"bbb retrieve key k1\n"
+                           u"aaa list keys\n"
+                           u"aaa delete key k2\n"
+                           u"aaa retrieve key k3\n",
+                           {1 : 0.3, 3 : 0.2})
+        # the same collection and key, or the whole collection, wait
+        self._assert_after(events, 1, 2)
+        self._assert_after(events, 1, 5)
+        self._assert_after(events, 3, 6)
+        self._assert_after(events, 5, 6)
+        # other keys and collections do not
+        self.assertTrue(events.index(("start", 3, )) < \
+                        events.index(("end", 1, )))
+        self.assertTrue(events.index(("start", 4, )) < \
+                        events.index(("end", 1, )))
+        self.assertTrue(events.index(("start", 7, )) < \
+                        events.index(("end", 3, )))
+
+class TestBatch(unittest.TestCase):
+    """
+    batch runs of ncl commands against a StandInServer
+    """
+    def setUp(self):
+        self._server = StandInServer(
+            {_identity.user_name : (_identity.auth_key_id,
+                                    _identity.auth_key)})
+        self._server.start()
+        self._directory = tempfile.mkdtemp()
+        self._compute_collection_hostname = \
+            ncl_main.compute_collection_hostname
+        ncl_main.compute_collection_hostname = \
+            lambda _: self._server.base_address
+        self._args = _args()
+        self._delays = dict()
+
+    def tearDown(self):
+        ncl_main.compute_collection_hostname = \
+            self._compute_collection_hostname
+        ncl_main._connection_pool.close_all()
+        shutil.rmtree(self._directory)
+        self._server.stop()
+
+    def _run(self, script, jobs=4):
+        def _execute(ncl_dict, output):
+            time.sleep(self._delays.get(ncl_dict.get("key"), 0.0))
+            ncl_main._output_local.stream = output
+            try:
+                ncl_main._run_command(self._args, _identity, ncl_dict)
+            finally:
+                del ncl_main._output_local.stream
+
+        output = io.BytesIO()
+        statistics = run_batch(parse_script(io.StringIO(script)),
+                               _execute,
+                               jobs,
+                               output)
+        return statistics, output.getvalue()
+
+    def test_output_order(self):
+        for key in ["one", "two", "three"]:
+            self._server.set_key(_collection_name, key,
+                                 key.encode("ascii") + b"\n")
+        # the first line finishes last
+        self._delays["one"] = 0.3
+        statistics, output = self._run(u"aaa retrieve key one\n"
+                                       u"aaa retrieve key two\n"
+                                       u"aaa retrieve key three\n")
+        self.assertEqual(statistics.failed_lines, [])
+        self.assertEqual(output, b"one\ntwo\nthree\n")
+
+    def test_failure_continues(self):
+        self._server.set_key(_collection_name, "found", b"found\n")
+        statistics, output = self._run(u"aaa retrieve key missing\n"
+                                       u"aaa retrieve key found\n")
+        self.assertEqual([l.line_number for l in statistics.failed_lines],
+                         [1])
+        self.assertEqual(output, b"found\n")
+        summary = io.StringIO()
+        statistics.report(summary)
+        self.assertTrue("line 1: aaa retrieve key missing" in \
+                        summary.getvalue())
+
+    def test_archive_then_retrieve(self):
+        path = os.path.join(self._directory, "source")
+        with open(path, "wb") as output_file:
+            output_file.write(b"archived\n")
+        # the archive is slow, but the retrieve still sees it
+        self._delays["key"] = 0.3
+        statistics, output = self._run(
+            u"aaa archive key key {0}\n"
+            u"aaa retrieve key key\n".format(path))
+        self.assertEqual(statistics.failed_lines, [])
+        self.assertEqual(output, b"archived\n")
+
+if __name__ == "__main__":
+    unittest.main()
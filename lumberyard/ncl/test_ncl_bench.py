@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+test_ncl_bench.py
+
+unit tests for the workload parser, and a short run against a
+StandInServer
+"""
+import io
+import os
+import random
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.connection_pool import ConnectionPool
+from lumberyard.stand_in_server import StandInServer
+
+from identity import identity_template
+from ncl_bench import BenchRunner, \
+    InvalidWorkload, \
+    parse_size, \
+    parse_workload, \
+    run_bench
+from commands import ncl_archive_key, ncl_retrieve_key
+
+_identity = identity_template(user_name="test-user",
+                              auth_key_id="42",
+                              auth_key="test-auth-key")
+
+_workload = u"""
+# a read heavy mix
+80% aaa retrieve key bench/{n}
+10 aaa list keys prefix=bench/
+10% aaa archive key bench/{n}
+size 1KiB 50%
+size 16KiB 50%
+keys 20
+"""
+
+class TestWorkload(unittest.TestCase):
+    """
+    workload files
+    """
+    def test_parse(self):
+        workload = parse_workload(io.StringIO(_workload))
+        self.assertEqual(workload.key_count, 20)
+        self.assertEqual(sorted(workload.sizes.items), [1024, 16384])
+        self.assertEqual(workload.operations.total, 100.0)
+
+        rng = random.Random(1)
+        commands = [workload.choose_operation(rng)["command"] \
+                    for _ in range(1000)]
+        self.assertTrue(700 < commands.count(ncl_retrieve_key) < 900)
+        ncl_dict = workload.choose_operation(rng)
+        self.assertFalse("{n}" in ncl_dict.get("key", ""))
+
+    def test_sizes(self):
+        self.assertEqual(parse_size("512"), 512)
+        self.assertEqual(parse_size("64KiB"), 65536)
+        self.assertEqual(parse_size("1.5MB"), 1500000)
+        with self.assertRaises(InvalidWorkload):
+            parse_size("12 furlongs")
+
+    def test_invalid(self):
+        for text in [u"", u"50% list keys", u"size 1KiB", u"keys x",
+                     u"50% create collection abc"]:
+            with self.assertRaises(InvalidWorkload):
+                parse_workload(io.StringIO(text))
+
+class TestBench(unittest.TestCase):
+    """
+    closed and open loop runs against a StandInServer
+    """
+    def setUp(self):
+        self._server = StandInServer(
+            {_identity.user_name : (_identity.auth_key_id,
+                                    _identity.auth_key)})
+        self._server.start()
+        self._pool = ConnectionPool()
+        workload = parse_workload(io.StringIO(_workload))
+        self._runner = BenchRunner(self._pool,
+                                   _identity,
+                                   workload,
+                                   hostname=self._server.base_address)
+
+    def tearDown(self):
+        self._pool.close_all()
+        self._server.stop()
+
+    def _run(self, **kwargs):
+        output = io.StringIO()
+        statistics = run_bench(self._runner,
+                               2,
+                               0.5,
+                               report_seconds=0.2,
+                               output=output,
+                               seed=7,
+                               **kwargs)
+        return dict((entry["command"], entry) \
+                    for entry in statistics.summary()), output.getvalue()
+
+    def test_closed_loop(self):
+        self.assertEqual(self._runner.prepare(4), 20)
+        summary, output = self._run()
+        self.assertEqual(summary[ncl_retrieve_key]["errors"], 0)
+        self.assertTrue(summary[ncl_retrieve_key]["operations"] > 0)
+        self.assertTrue(summary[ncl_archive_key]["bytes_per_second"] > 0)
+        self.assertTrue("p99 ms" in output)
+
+    def test_open_loop_errors(self):
+        # nothing was prepared, so retrieves of keys not archived during
+        # the run are 404s
+        summary, _ = self._run(arrival_rate=100)
+        entry = summary[ncl_retrieve_key]
+        self.assertTrue(entry["errors"] > 0)
+        self.assertTrue(entry["last_error"] is not None)
+        total = sum(entry["operations"] for entry in summary.values())
+        self.assertTrue(20 < total < 100, total)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+test_ncl_main.py
+
+ncl commands run against a StandInServer
+"""
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.stand_in_server import StandInServer
+
+from identity import identity_template
+import ncl_main
+
+_identity = identity_template(user_name="test-user",
+                              auth_key_id="42",
+                              auth_key="test-auth-key")
+_data = b"".join("line {0}\n".format(n).encode("ascii") \
+                 for n in range(10000))
+
+def _args(**kwargs):
+    values = dict(parallel=None,
+                  chunk_size=None,
+                  commands_from_stdin=False,
+                  compression=None,
+                  compress_workers=0,
+                  digest=None,
+                  cache_dir=None,
+                  cache_max_bytes=0,
+                  index_dir=None)
+    values.update(kwargs)
+    return argparse.Namespace(**values)
+
+class TestNCLMain(unittest.TestCase):
+    """
+    archive and retrieve through the ncl command functions
+    """
+    def setUp(self):
+        self._server = StandInServer(
+            {_identity.user_name : (_identity.auth_key_id,
+                                    _identity.auth_key)})
+        self._server.start()
+        self._directory = tempfile.mkdtemp()
+        self._compute_collection_hostname = \
+            ncl_main.compute_collection_hostname
+        ncl_main.compute_collection_hostname = \
+            lambda _: self._server.base_address
+
+    def tearDown(self):
+        ncl_main.compute_collection_hostname = \
+            self._compute_collection_hostname
+        ncl_main._connection_pool.close_all()
+        shutil.rmtree(self._directory)
+        self._server.stop()
+
+    def _path(self, name):
+        return os.path.join(self._directory, name)
+
+    def test_compressed_retrieve(self):
+        # decompressed without --compression on the retrieve
+        with open(self._path("source"), "wb") as output_file:
+            output_file.write(_data)
+        ncl_main._archive_key(_args(compression="gzip"),
+                              _identity,
+                              {"collection_name" : "aaa",
+                               "key" : "logs",
+                               "paths" : [self._path("source")]})
+        self.assertTrue(len(self._server.get_key("default", "logs")) < \
+                        len(_data) / 2)
+        # the codec comes with the GET: one request, or a HEAD and a GET
+        # when --parallel asks for ranges. Through the cache, the second
+        # retrieve is a 304 and the codec is kept in the entry
+        cache_args = _args(cache_dir=self._path("cache"),
+                           cache_max_bytes=1024 * 1024)
+        for args, requests in [(_args(), 1, ),
+                               (_args(parallel=3), 2, ),
+                               (cache_args, 1, ),
+                               (cache_args, 1, )]:
+            request_count = self._server.request_count
+            ncl_main._retrieve_key(args,
+                                   _identity,
+                                   {"collection_name" : "aaa",
+                                    "key" : "logs",
+                                    "dest" : self._path("retrieved")})
+            self.assertEqual(self._server.request_count - request_count,
+                             requests)
+            with open(self._path("retrieved"), "rb") as input_file:
+                self.assertEqual(input_file.read(), _data)
+        self.assertEqual(self._server.not_modified_count, 1)
+
+    def test_cached_retrieve_checks_etag(self):
+        # a cache entry damaged on disk fails the check against the ETag
+        self._server.set_key("default", "key", _data)
+        args = _args(cache_dir=self._path("cache"),
+                     cache_max_bytes=1024 * 1024,
+                     digest=["md5"])
+        ncl_dict = {"collection_name" : "aaa",
+                    "key" : "key",
+                    "dest" : self._path("retrieved")}
+        ncl_main._retrieve_key(args, _identity, ncl_dict)
+        object_cache = ncl_main.open_object_cache(args.cache_dir)
+        entry_path = object_cache._entry_path(self._server.base_address,
+                                              "key")
+        with open(entry_path, "r+b") as entry_file:
+            entry_file.seek(-1, os.SEEK_END)
+            entry_file.write(b"?")
+        with self.assertRaises(ncl_main.NCLErrorResult):
+            ncl_main._retrieve_key(args, _identity, ncl_dict)
+        self.assertEqual(self._server.not_modified_count, 1)
+
+    def test_main_closes_connections(self):
+        # idle pooled connections are closed when a command fails
+        pool = ncl_main._connection_pool
+        with pool.connection(self._server.base_address, _identity) \
+            as first_connection:
+            with pool.connection(self._server.base_address, _identity) \
+                as second_connection:
+                for http_connection in [first_connection, second_connection]:
+                    http_connection.request("GET", "/data/").read()
+        self.assertEqual(pool.stats()["idle"], 2)
+
+        saved_argv = sys.argv
+        saved_environ = dict(os.environ)
+        saved_handlers = list(logging.root.handlers)
+        saved_level = logging.root.level
+        sys.argv = ["ncl", "aaa", "retrieve", "key", "missing",
+                    "dest={0}".format(self._path("missing"))]
+        os.environ.update({"NIMBUSIO_USER_NAME" : _identity.user_name,
+                           "NIMBUSIO_AUTH_KEY_ID" : _identity.auth_key_id,
+                           "NIMBUSIO_AUTH_KEY" : _identity.auth_key})
+        try:
+            self.assertEqual(ncl_main.main(), 1)
+        finally:
+            sys.argv = saved_argv
+            os.environ.clear()
+            os.environ.update(saved_environ)
+            logging.root.handlers = saved_handlers
+            logging.root.setLevel(saved_level)
+        self.assertEqual(pool.stats()["idle"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -22,7 +22,9 @@ from commands import \
     ncl_list_key, \
     ncl_archive_key, \
     ncl_retrieve_key, \
-    ncl_delete_key
+    ncl_delete_key, \
+    ncl_reconcile_keys, \
+    ncl_sync
 
 _test_cases = [
     (u"*** invalid string ***", "exception"),
@@ -72,6 +74,16 @@ _test_cases = [
                                          "collection_name" : "xxx",
                                          "key" : "aaa",
                                          "paths" : [u"/ppp/file1"]}),
+    (u"xxx archive key aaa source=/ppp/file1,/ppp/file2",
+        {"command" : ncl_archive_key,
+         "collection_name" : "xxx",
+         "key" : "aaa",
+         "paths" : [u"/ppp/file1", u"/ppp/file2"]}),
+    (u"xxx archive key aaa /ppp/file1 SOURCE=/ppp/file2,",
+        {"command" : ncl_archive_key,
+         "collection_name" : "xxx",
+         "key" : "aaa",
+         "paths" : [u"/ppp/file1", u"/ppp/file2"]}),
     (u"xxx retrieve key aaa", {"command" : ncl_retrieve_key,
                               "collection_name" : "xxx",
                               "key" : "aaa"}),
@@ -82,6 +94,34 @@ _test_cases = [
     (u"xxx delete key aaa", {"command" : ncl_delete_key,
                              "collection_name" : "xxx",
                              "key" : "aaa"}),
+    (u"xxx list keys logs/ pattern=*.gz", {"command" : ncl_list_keys,
+                                           "collection_name" : "xxx",
+                                           "prefix" : "logs/",
+                                           "pattern" : "*.gz"}),
+    (u"xxx list keys prefix=logs/ marker=logs/aaa delimiter=/",
+        {"command" : ncl_list_keys,
+         "collection_name" : "xxx",
+         "prefix" : "logs/",
+         "marker" : "logs/aaa",
+         "delimiter" : "/"}),
+    (u"xxx list keys logs/ marker=logs/aaa", {"command" : ncl_list_keys,
+                                              "collection_name" : "xxx",
+                                              "prefix" : "logs/",
+                                              "marker" : "logs/aaa"}),
+    (u"xxx list keys delimiter=/", {"command" : ncl_list_keys,
+                                    "collection_name" : "xxx",
+                                    "delimiter" : "/"}),
+    (u"xxx list keys logs/ marker", "exception"),
+    (u"xxx reconcile keys", {"command" : ncl_reconcile_keys,
+                             "collection_name" : "xxx"}),
+    (u"xxx reconcile keys now", "exception"),
+    (u"xxx sync /home/aaa prefix=aaa/ delete=true", 
+        {"command" : ncl_sync,
+         "collection_name" : "xxx",
+         "directory" : "/home/aaa",
+         "prefix" : "aaa/",
+         "delete" : True}),
+    (u"xxx sync /home/aaa delete=maybe", "exception"),
 ]
 
 class TestBucket(unittest.TestCase):
@@ -90,7 +130,7 @@ class TestBucket(unittest.TestCase):
     """
     def test_all_test_cases(self):
         for test_string, expected_result in _test_cases:
-            print >>sys.stderr, test_string
+            sys.stderr.write("{0}\n".format(test_string))
             if expected_result == "exception":
                 self.assertRaises(InvalidNCLString, 
                                   parse_ncl_string, 
@@ -101,6 +141,28 @@ class TestBucket(unittest.TestCase):
                                  expected_result, 
                                  (test_string, result)) 
 
+    def test_cached_results_are_copies(self):
+        """
+        a repeated string is served from the cache, and changing one
+        result does not change the next
+        """
+        test_string = u"xxx archive key aaa /ppp/file1 /ppp/file2"
+        first_result = parse_ncl_string(test_string)
+        first_result["paths"].append("/ppp/file3")
+        first_result["key"] = "bbb"
+        second_result = parse_ncl_string(test_string)
+        self.assertEqual(second_result["key"], "aaa")
+        self.assertEqual(second_result["paths"], ["/ppp/file1", "/ppp/file2"])
+
+    def test_cached_failures_raise(self):
+        """
+        an invalid string raises every time it is parsed
+        """
+        for _ in range(2):
+            self.assertRaises(InvalidNCLString, 
+                              parse_ncl_string, 
+                              u"list collection 111111111111111-")
+
 if __name__ == "__main__":
     unittest.main()
 
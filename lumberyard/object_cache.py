@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+"""
+object_cache.py
+
+class ObjectCache
+
+An on-disk cache of retrieved keys, revalidated with conditional GETs.
+
+Each cached key is one file: a line of JSON with the hostname, key, ETag,
+Last-Modified, size and key metadata, then the body. A retrieve of a
+cached key sends If-None-Match with the ETag, or If-Modified-Since when
+the service gave no ETag. A 304 Not Modified costs one small round trip,
+and the body and metadata are taken from the file; a 200 is streamed to
+the destination and into a new file at the same time, which replaces the
+old one. A key that is gone, 404, is dropped from the cache.
+
+Files are written under tmp/ and renamed into place, so a reader only ever
+opens a whole entry, and an entry opened before it is replaced or evicted
+stays readable through the open file. This makes one cache directory safe
+to share between processes without locking reads or stores.
+
+The cache is bounded by total bytes. A hit sets the file's mtime, so mtime
+orders the entries by last use. Once this process has stored enough to
+take the directory past max_bytes, it takes an exclusive lock on the lock
+file, scans the directory, and removes the least recently used entries
+until the total is under _low_water of max_bytes. Other processes' stores
+are counted at the next scan.
+
+stats() reports requests, hits (304s), misses, the hit ratio, and the
+bytes served from the cache instead of the service.
+
+Opt in through ncl --cache-dir or NIMBUSIO_OBJECT_CACHE_DIR.
+"""
+try:
+    from httplib import OK, NOT_MODIFIED, NOT_FOUND
+except ImportError:
+    from http.client import OK, NOT_MODIFIED, NOT_FOUND
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+import errno
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from lumberyard.download_sink import DownloadSink
+from lumberyard.http_connection import LumberyardHTTPError
+from lumberyard.http_util import compute_uri, response_meta
+
+_max_bytes = int(os.environ.get("NIMBUSIO_OBJECT_CACHE_MAX_BYTES",
+                                str(1024 * 1024 * 1024)))
+# eviction removes entries until the total is this fraction of max_bytes
+_low_water = 0.9
+# temporary files older than this were left by a process that died
+_stale_temp_seconds = 3600.0
+
+def _replace(source, destination):
+    if hasattr(os, "replace"):
+        os.replace(source, destination)
+    else:
+        os.rename(source, destination)
+
+def _remove(path):
+    """
+    remove a file another process may already have removed
+    """
+    try:
+        os.unlink(path)
+    except OSError:
+        instance = sys.exc_info()[1]
+        if instance.errno != errno.ENOENT:
+            raise
+
+class _TeeReader(object):
+    """
+    a file object that copies what is read from the response into
+    output_file
+    """
+    def __init__(self, response, output_file):
+        self._response = response
+        self._output_file = output_file
+
+    def readinto(self, buffer):
+        bytes_read = self._response.readinto(buffer)
+        if bytes_read > 0:
+            self._output_file.write(memoryview(buffer)[:bytes_read])
+        return bytes_read
+
+class ObjectCache(object):
+    """
+    directory
+        the cache directory, created if it does not exist
+
+    max_bytes
+        the most bytes of entries to keep
+
+    An LRU cache of key bodies, shared between threads and processes.
+    """
+    def __init__(self, directory, max_bytes=_max_bytes):
+        self._log = logging.getLogger("ObjectCache")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._objects_directory = os.path.join(directory, "objects")
+        self._temp_directory = os.path.join(directory, "tmp")
+        for path in [self._objects_directory, self._temp_directory]:
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except OSError:
+                    # another process made it first
+                    if not os.path.isdir(path):
+                        raise
+        self._lock_path = os.path.join(directory, "lock")
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._evictions = 0
+        self._bytes_saved = 0
+        self._bytes_fetched = 0
+        self._total_bytes = None
+        self._evict_lock = threading.Lock()
+
+    def _entry_path(self, hostname, key):
+        name = hashlib.sha1(u"{0}\n{1}".format(hostname, key).encode(
+            "utf-8")).hexdigest()
+        return os.path.join(self._objects_directory, name[:2], name)
+
+    def _open_entry(self, path, hostname, key):
+        """
+        return (open file positioned at the body, header dict), or
+        (None, None) if there is no whole entry for the key
+        """
+        try:
+            entry_file = open(path, "rb")
+        except IOError:
+            return None, None
+        try:
+            header = json.loads(entry_file.readline().decode("utf-8"))
+            body_size = os.fstat(entry_file.fileno()).st_size - \
+                entry_file.tell()
+        except ValueError:
+            entry_file.close()
+            return None, None
+        # entries written before the metadata was kept are fetched again
+        if header.get("hostname") != hostname or \
+            header.get("key") != key or \
+            header.get("size") != body_size or \
+            not "meta" in header:
+            entry_file.close()
+            return None, None
+        return entry_file, header
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def retrieve(self, connection_pool, hostname, identity, key, destination,
+                 callback=None, wrap_destination=None):
+        """
+        connection_pool
+            a ConnectionPool
+
+        hostname
+            the collection hostname
+
+        identity
+            the identity used to sign requests
+
+        key
+            the key to retrieve
+
+        destination
+            a binary file object, a file descriptor, or a callable taking
+            a memoryview, as for DownloadSink
+
+        callback
+            optional function taking a single integer: bytes_read
+
+        wrap_destination
+            optional function taking destination and the dict of the key's
+            metadata, from the response or the entry, and returning what to
+            write the body to instead, such as a DecompressingWriter
+
+        write the body of the key to destination, from the cache if the
+        service says it has not changed
+        return (the number of bytes written, the key's ETag or None)
+        """
+        path = self._entry_path(hostname, key)
+        entry_file, header = self._open_entry(path, hostname, key)
+        self._count("_requests")
+        try:
+            headers = dict()
+            if header is not None:
+                if header.get("etag") is not None:
+                    headers["If-None-Match"] = header["etag"]
+                elif header.get("last_modified") is not None:
+                    headers["If-Modified-Since"] = header["last_modified"]
+
+            with connection_pool.connection(hostname, identity) \
+                as http_connection:
+                try:
+                    response = http_connection.request(
+                        "GET",
+                        compute_uri("data", key),
+                        headers=headers,
+                        expected_status=(OK, NOT_MODIFIED, ))
+                except LumberyardHTTPError:
+                    instance = sys.exc_info()[1]
+                    if instance.status == NOT_FOUND and header is not None:
+                        _remove(path)
+                    raise
+
+                etag = response.getheader("ETag")
+                if response.status == NOT_MODIFIED and header is not None:
+                    meta = header["meta"]
+                else:
+                    meta = response_meta(response)
+                if wrap_destination is not None:
+                    destination = wrap_destination(destination, meta)
+                sink = DownloadSink(destination, callback=callback)
+                if response.status == NOT_MODIFIED and header is not None:
+                    response.read()
+                    bytes_written = sink.drain(entry_file)
+                    self._touch(path)
+                    self._count("_hits")
+                    self._count("_bytes_saved", bytes_written)
+                    return bytes_written, (etag or header.get("etag"))
+
+                bytes_written = self._store(response,
+                                            sink,
+                                            path,
+                                            hostname,
+                                            key,
+                                            meta)
+                self._count("_misses")
+                self._count("_bytes_fetched", bytes_written)
+                return bytes_written, etag
+        finally:
+            if entry_file is not None:
+                entry_file.close()
+
+    def _store(self, response, sink, path, hostname, key, meta):
+        """
+        drain the response into the sink, and into a new entry if the
+        response can be revalidated and may fit
+        """
+        etag = response.getheader("ETag")
+        last_modified = response.getheader("Last-Modified")
+        content_length = response.getheader("Content-Length")
+        if (etag is None and last_modified is None) or \
+            content_length is None or \
+            int(content_length) > self.max_bytes:
+            return sink.drain(response)
+
+        fd, temp_path = tempfile.mkstemp(dir=self._temp_directory)
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                header = {"hostname"        : hostname,
+                          "key"             : key,
+                          "etag"            : etag,
+                          "last_modified"   : last_modified,
+                          "size"            : int(content_length),
+                          "meta"            : meta, }
+                temp_file.write(json.dumps(header).encode("utf-8"))
+                temp_file.write(b"\n")
+                bytes_written = sink.drain(_TeeReader(response, temp_file))
+            if bytes_written != header["size"]:
+                _remove(temp_path)
+                return bytes_written
+            if not os.path.isdir(os.path.dirname(path)):
+                try:
+                    os.makedirs(os.path.dirname(path))
+                except OSError:
+                    if not os.path.isdir(os.path.dirname(path)):
+                        raise
+            _replace(temp_path, path)
+        except Exception:
+            _remove(temp_path)
+            raise
+
+        self._count("_stores")
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += bytes_written
+            over = self._total_bytes is None or \
+                self._total_bytes > self.max_bytes
+        if over:
+            self.evict()
+        return bytes_written
+
+    def _touch(self, path):
+        try:
+            os.utime(path, None)
+        except OSError:
+            # evicted by another process since it was opened
+            pass
+
+    def _scan(self):
+        """
+        return [(mtime, size, path)] for the entries, and remove temporary
+        files left by processes that died
+        """
+        entries = list()
+        for shard in os.listdir(self._objects_directory):
+            shard_path = os.path.join(self._objects_directory, shard)
+            try:
+                names = os.listdir(shard_path)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(shard_path, name)
+                try:
+                    stat_result = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat_result.st_mtime,
+                                stat_result.st_size,
+                                path, ))
+        current_time = time.time()
+        for name in os.listdir(self._temp_directory):
+            path = os.path.join(self._temp_directory, name)
+            try:
+                if current_time - os.stat(path).st_mtime > \
+                    _stale_temp_seconds:
+                    _remove(path)
+            except OSError:
+                continue
+        return entries
+
+    def evict(self):
+        """
+        remove the least recently used entries until the cache is under
+        its low water mark; return the number removed
+        """
+        with self._evict_lock:
+            with open(self._lock_path, "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    entries = self._scan()
+                    total_bytes = sum(entry[1] for entry in entries)
+                    removed = 0
+                    if total_bytes > self.max_bytes:
+                        entries.sort()
+                        target = int(self.max_bytes * _low_water)
+                        for _, size, path in entries:
+                            if total_bytes <= target:
+                                break
+                            _remove(path)
+                            total_bytes -= size
+                            removed += 1
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        with self._lock:
+            self._total_bytes = total_bytes
+            self._evictions += removed
+        if removed > 0:
+            self._log.debug("evicted {0} entries, {1} bytes left".format(
+                removed, total_bytes))
+        return removed
+
+    def stats(self):
+        """
+        return a dict of the cache's counts for this process
+        """
+        with self._lock:
+            revalidated = self._hits + self._misses
+            return {
+                "requests"      : self._requests,
+                "hits"          : self._hits,
+                "misses"        : self._misses,
+                "hit_ratio"     : (0.0 if revalidated == 0 \
+                                   else float(self._hits) / revalidated),
+                "stores"        : self._stores,
+                "evictions"     : self._evictions,
+                "bytes_saved"   : self._bytes_saved,
+                "bytes_fetched" : self._bytes_fetched,
+            }
+
+_open_caches = dict()
+_open_caches_lock = threading.Lock()
+
+def open_object_cache(directory, max_bytes=_max_bytes):
+    """
+    return the ObjectCache for directory, shared by every caller in the
+    process
+    """
+    with _open_caches_lock:
+        object_cache = _open_caches.get(directory)
+        if object_cache is None:
+            object_cache = ObjectCache(directory, max_bytes)
+            _open_caches[directory] = object_cache
+        return object_cache
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+parallel_download.py
+
+retrieve a key as several byte ranges fetched at the same time.
+
+The size of the object comes from a HEAD request. The destination file is
+preallocated to that size, and each range is written straight to its place
+in the file with positional writes (os.pwrite) as it arrives. No range is
+reassembled in memory: each segment reads into one reused buffer through a
+DownloadSink, so memory use is segment_count * block_size regardless of the
+object size.
+
+A segment that fails is retried from the last byte it wrote.
+
+A server or proxy may ignore Range and answer with the whole object. The
+other segments wait for the answer to the first range request: if it is
+200 OK rather than 206 Partial Content, the first segment writes the whole
+body from offset 0 as one sequential stream and the others are not
+fetched. A HEAD whose Accept-Ranges is not bytes gets one segment from the
+start.
+
+head() returns what the HEAD says of the key, its metadata included, so a
+caller can decide whether to fetch it in ranges at all, and hand the
+answer to retrieve() rather than send the HEAD twice.
+"""
+try:
+    from httplib import OK, PARTIAL_CONTENT
+except ImportError:
+    from http.client import OK, PARTIAL_CONTENT
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import sys
+import threading
+import time
+
+from lumberyard.download_sink import DownloadSink
+from lumberyard.http_util import compute_uri, response_meta
+
+_segment_count = 4
+_block_size = 256 * 1024
+_segment_retries = 3
+_segment_retry_seconds = 1.0
+
+# ranges_served is False if the server says it does not serve ranges
+KeyHead = namedtuple("KeyHead", ["size", "ranges_served", "meta", ])
+
+class ParallelDownloadError(Exception):
+    """
+    the server did not return the expected ranges
+    """
+    pass
+
+def _compute_segments(size, segment_count):
+    """
+    return a list of (offset, length) dividing size bytes into at most
+    segment_count ranges
+    """
+    segment_count = max(1, min(segment_count, size))
+    segment_size = size // segment_count
+    segments = list()
+    offset = 0
+    for index in range(segment_count):
+        length = (size - offset if index == segment_count - 1 \
+                  else segment_size)
+        segments.append((offset, length, ))
+        offset += length
+    return segments
+
+class _RangeCheck(object):
+    """
+    whether the server honored the first range request; the other
+    segments wait for the answer
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self.honored = None
+
+    def set(self, honored):
+        if self.honored is None:
+            self.honored = honored
+        self._event.set()
+
+    def wait(self):
+        self._event.wait()
+        return self.honored
+
+def _preallocate(fd, size):
+    """
+    reserve size bytes for the file, so the ranges can be written in any
+    order without growing it
+    """
+    if size == 0:
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        os.ftruncate(fd, size)
+
+class ParallelDownloader(object):
+    """
+    connection_pool
+        a ConnectionPool
+
+    hostname
+        the collection hostname, from compute_collection_hostname
+
+    identity
+        the identity used to sign requests, or None
+
+    segment_count
+        the number of ranges fetched at once
+
+    block_size
+        the size of the read buffer for each range
+
+    Retrieve a key into a file as concurrent byte ranges.
+    """
+    def __init__(self,
+                 connection_pool,
+                 hostname,
+                 identity,
+                 segment_count=_segment_count,
+                 block_size=_block_size,
+                 segment_retries=_segment_retries):
+        self._log = logging.getLogger("ParallelDownloader")
+        self._connection_pool = connection_pool
+        self._hostname = hostname
+        self._identity = identity
+        self._segment_count = segment_count
+        self._block_size = block_size
+        self._segment_retries = segment_retries
+        self._lock = threading.Lock()
+
+    def head(self, key):
+        """
+        return a KeyHead for the key, from a HEAD request
+        """
+        uri = compute_uri("data", key)
+        with self._connection_pool.connection(self._hostname,
+                                              self._identity) \
+            as http_connection:
+            response = http_connection.request("HEAD", uri)
+            response.read()
+            content_length = response.getheader("Content-Length")
+            accept_ranges = response.getheader("Accept-Ranges")
+            meta = response_meta(response)
+        if content_length is None:
+            raise ParallelDownloadError("no Content-Length for {0}".format(
+                uri))
+        return KeyHead(int(content_length),
+                       (accept_ranges is None or \
+                        "bytes" in accept_ranges.lower()),
+                       meta)
+
+    def _fetch_range(self, uri, fd, segment, callback, range_check=None):
+        """
+        fetch the bytes remaining in the segment into the file,
+        advancing segment["offset"] past each block as it is written.
+        with a range_check that is not yet answered, a 200 OK is taken
+        as the whole object, written from offset 0
+        """
+        if range_check is not None and range_check.honored is False:
+            # the server ignores ranges: start the whole body again
+            segment["offset"] = 0
+            segment["length"] = segment["size"]
+        offset, length = segment["offset"], segment["length"]
+        headers = {
+            "Range" : "bytes={0}-{1}".format(offset, offset + length - 1)}
+        expected_status = PARTIAL_CONTENT
+        if range_check is not None and not range_check.honored:
+            expected_status = (PARTIAL_CONTENT, OK, )
+        with self._connection_pool.connection(self._hostname,
+                                              self._identity) \
+            as http_connection:
+            response = http_connection.request("GET",
+                                               uri,
+                                               headers=headers,
+                                               expected_status=expected_status)
+            if range_check is not None:
+                if response.status == OK:
+                    self._log.info("range ignored, retrieving {0} "
+                                   "sequentially".format(uri))
+                    segment["offset"] = 0
+                    segment["length"] = segment["size"]
+                range_check.set(response.status == PARTIAL_CONTENT)
+            def _write(view):
+                if len(view) > segment["length"]:
+                    raise ParallelDownloadError(
+                        "range at {0} is too long".format(segment["offset"]))
+                while len(view) > 0:
+                    written = os.pwrite(fd, view, segment["offset"])
+                    segment["offset"] += written
+                    segment["length"] -= written
+                    view = view[written:]
+
+            def _report(bytes_read):
+                with self._lock:
+                    callback(bytes_read)
+
+            sink = DownloadSink(_write,
+                                (None if callback is None else _report),
+                                min_buffer_size=self._block_size,
+                                max_buffer_size=self._block_size)
+            sink.drain(response)
+            if segment["length"] > 0:
+                raise ParallelDownloadError(
+                    "range at {0} ended early".format(segment["offset"]))
+
+    def _fetch_segment(self, uri, fd, offset, length, callback, size,
+                       range_check=None):
+        segment = {"offset" : offset, "length" : length, "size" : size}
+        attempt = 0
+        while True:
+            try:
+                self._fetch_range(uri, fd, segment, callback, range_check)
+                return
+            except Exception:
+                instance = sys.exc_info()[1]
+                attempt += 1
+                if attempt > self._segment_retries:
+                    if range_check is not None:
+                        # release the waiting segments; this error is
+                        # the one retrieve raises
+                        range_check.set(False)
+                    raise
+                # resume from the last byte written
+                self._log.warning(
+                    "range at {0} attempt {1} failed: {2}".format(
+                        segment["offset"], attempt, instance))
+                time.sleep(_segment_retry_seconds * attempt)
+
+    def _fetch_later_segment(self, uri, fd, offset, length, callback, size,
+                             range_check):
+        """
+        fetch a segment after the first, once the first range request
+        shows the server honors ranges
+        """
+        if not range_check.wait():
+            return
+        self._fetch_segment(uri, fd, offset, length, callback, size)
+
+    def retrieve(self, key, path, callback=None, head=None):
+        """
+        key
+            the key to retrieve
+
+        path
+            the destination file; it is created or truncated
+
+        callback
+            optional function taking a single integer: bytes_written
+
+        head
+            the KeyHead from head(), if the caller has it; otherwise a HEAD
+            request is sent
+
+        return the size of the object
+        """
+        uri = compute_uri("data", key)
+        if head is None:
+            head = self.head(key)
+        size, ranges_served, _ = head
+        segments = _compute_segments(size,
+                                     (self._segment_count if ranges_served \
+                                      else 1))
+        segments = [(offset, length) for (offset, length) in segments \
+                    if length > 0]
+        range_check = _RangeCheck()
+
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            _preallocate(fd, size)
+            with ThreadPoolExecutor(max_workers=max(1, len(segments))) \
+                as executor:
+                futures = [executor.submit(self._fetch_segment,
+                                           uri,
+                                           fd,
+                                           offset,
+                                           length,
+                                           callback,
+                                           size,
+                                           range_check)
+                           for (offset, length) in segments[:1]]
+                futures.extend(executor.submit(self._fetch_later_segment,
+                                               uri,
+                                               fd,
+                                               offset,
+                                               length,
+                                               callback,
+                                               size,
+                                               range_check)
+                               for (offset, length) in segments[1:])
+                for future in futures:
+                    future.result()
+        finally:
+            os.close(fd)
+
+        return size
@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+rate_limiter.py
+
+class TokenBucket
+class RateLimiter
+class ThrottledHTTPResponse
+
+Hold upload bytes, download bytes and requests per second under a ceiling,
+for the whole process and for each host.
+
+Each limit is a token bucket refilled at the limit's rate. A caller
+reserves what it is about to use and sleeps until the bucket would have
+held it. The bucket may go into debt, so callers are served in the order
+they reserved: many threads sharing one limit are spaced out evenly rather
+than released together. The bucket holds at most burst_seconds worth of
+tokens, so an idle period does not buy a burst later.
+
+The limits are applied where the bytes move, not once per call. A
+connection wraps a rate limited upload body in a ReadReporter, and reads
+the response through a ThrottledHTTPResponse. Each read is at most
+burst_seconds worth of bytes, and waits for its tokens before returning, so
+a large body is paced block by block. Every attempt at a request, retries
+included, takes a request token.
+
+A global limit and a host limit both apply; the wait is the longer of the
+two. Host limits come from the host_* arguments, for every host, or from
+set_host_limits, for one host.
+
+default_rate_limiter() is configured from the environment; by default it
+limits nothing:
+
+    NIMBUSIO_RATE_UPLOAD_BPS, NIMBUSIO_RATE_DOWNLOAD_BPS
+        bytes per second, for the process
+    NIMBUSIO_RATE_REQUESTS
+        requests per second, for the process
+    NIMBUSIO_HOST_RATE_UPLOAD_BPS, NIMBUSIO_HOST_RATE_DOWNLOAD_BPS,
+    NIMBUSIO_HOST_RATE_REQUESTS
+        the same, for each host
+"""
+try:
+    from httplib import HTTPResponse
+except ImportError:
+    from http.client import HTTPResponse
+import io
+import logging
+import os
+import threading
+import time
+
+from lumberyard.read_reporter import ReadReporter
+
+_burst_seconds = 0.1
+_min_read_size = 4096
+
+limit_upload = "upload"
+limit_download = "download"
+limit_requests = "requests"
+
+class TokenBucket(object):
+    """
+    rate
+        tokens added per second
+
+    burst_seconds
+        the bucket holds this many seconds of tokens, and at least one
+
+    A thread-safe token bucket whose reservations may run into debt.
+    """
+    def __init__(self, rate, burst_seconds=_burst_seconds):
+        self._lock = threading.Lock()
+        self.rate = float(rate)
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self._tokens = self.capacity
+        self._last_time = time.time()
+
+    def reserve(self, amount):
+        """
+        take amount tokens; return the seconds to wait before using them
+        """
+        with self._lock:
+            current_time = time.time()
+            self._tokens = min(
+                self.capacity,
+                self._tokens + (current_time - self._last_time) * self.rate)
+            self._last_time = current_time
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+def _rate_from_environment(name):
+    value = os.environ.get(name, "")
+    if value == "" or float(value) <= 0:
+        return None
+    return float(value)
+
+class RateLimiter(object):
+    """
+    upload_bytes_per_second, download_bytes_per_second,
+    requests_per_second
+        limits for the process, or None for no limit
+
+    host_upload_bytes_per_second, host_download_bytes_per_second,
+    host_requests_per_second
+        limits for each host, or None for no limit
+
+    burst_seconds
+        how far ahead of its rate a limit may run
+
+    Token bucket limits shared by every connection given this limiter.
+    """
+    def __init__(self,
+                 upload_bytes_per_second=None,
+                 download_bytes_per_second=None,
+                 requests_per_second=None,
+                 host_upload_bytes_per_second=None,
+                 host_download_bytes_per_second=None,
+                 host_requests_per_second=None,
+                 burst_seconds=_burst_seconds):
+        self._log = logging.getLogger("RateLimiter")
+        self._lock = threading.Lock()
+        self._burst_seconds = burst_seconds
+        self._global_buckets = self._make_buckets({
+            limit_upload      : upload_bytes_per_second,
+            limit_download    : download_bytes_per_second,
+            limit_requests    : requests_per_second,
+        })
+        self._host_rates = {
+            limit_upload      : host_upload_bytes_per_second,
+            limit_download    : host_download_bytes_per_second,
+            limit_requests    : host_requests_per_second,
+        }
+        # hostname -> {kind : TokenBucket}
+        self._host_buckets = dict()
+        self._counters = {
+            "waits"         : 0,
+            "wait_seconds"  : 0.0,
+        }
+
+    def _make_buckets(self, rates):
+        return dict((kind, TokenBucket(rate, self._burst_seconds), ) \
+                    for (kind, rate) in rates.items() if rate is not None)
+
+    def set_host_limits(self,
+                        hostname,
+                        upload_bytes_per_second=None,
+                        download_bytes_per_second=None,
+                        requests_per_second=None):
+        """
+        replace the limits for one host; None is no limit
+        """
+        buckets = self._make_buckets({
+            limit_upload      : upload_bytes_per_second,
+            limit_download    : download_bytes_per_second,
+            limit_requests    : requests_per_second,
+        })
+        with self._lock:
+            self._host_buckets[hostname] = buckets
+
+    def _buckets(self, kind, hostname):
+        with self._lock:
+            host_buckets = self._host_buckets.get(hostname)
+            if host_buckets is None:
+                host_buckets = self._make_buckets(self._host_rates)
+                self._host_buckets[hostname] = host_buckets
+        return [bucket for bucket in (self._global_buckets.get(kind),
+                                      host_buckets.get(kind), )
+                if bucket is not None]
+
+    def limits(self, kind, hostname):
+        """
+        return True if kind (limit_upload, limit_download or
+        limit_requests) is limited for the host
+        """
+        return len(self._buckets(kind, hostname)) > 0
+
+    def read_size(self, kind, hostname):
+        """
+        return the most bytes one read should move: burst_seconds worth at
+        the lowest rate that applies
+        """
+        rate = min(bucket.rate for bucket in self._buckets(kind, hostname))
+        return max(_min_read_size, int(rate * self._burst_seconds))
+
+    def acquire(self, kind, hostname, amount=1):
+        """
+        wait until amount of kind may be used for the host
+        """
+        if amount <= 0:
+            return
+        wait_seconds = 0.0
+        for bucket in self._buckets(kind, hostname):
+            wait_seconds = max(wait_seconds, bucket.reserve(amount))
+        if wait_seconds > 0:
+            with self._lock:
+                self._counters["waits"] += 1
+                self._counters["wait_seconds"] += wait_seconds
+            time.sleep(wait_seconds)
+
+    def acquire_request(self, hostname):
+        self.acquire(limit_requests, hostname)
+
+    def throttle(self, kind, hostname):
+        """
+        return a function taking a byte count, that waits for that many
+        bytes of kind for the host
+        """
+        def _throttle(byte_count):
+            self.acquire(kind, hostname, byte_count)
+        return _throttle
+
+    def stats(self):
+        """
+        return a dict of the number of waits and the seconds waited
+        """
+        with self._lock:
+            result = dict(self._counters)
+            result["hosts"] = len(self._host_buckets)
+        return result
+
+def throttled_body(rate_limiter, hostname, body):
+    """
+    return body wrapped so reading it waits for upload tokens, or body
+    itself if uploads to the host are not limited
+    """
+    if body is None or not rate_limiter.limits(limit_upload, hostname):
+        return body
+    if isinstance(body, str):
+        # as http.client would encode it
+        body = body.encode("iso-8859-1")
+    if isinstance(body, (bytes, bytearray, memoryview, )):
+        body = io.BytesIO(body)
+    elif not hasattr(body, "read"):
+        return _throttled_blocks(rate_limiter, hostname, body)
+    return ReadReporter(body,
+                        throttle=rate_limiter.throttle(limit_upload, hostname),
+                        max_read_size=rate_limiter.read_size(limit_upload,
+                                                             hostname))
+
+def _throttled_blocks(rate_limiter, hostname, blocks):
+    read_size = rate_limiter.read_size(limit_upload, hostname)
+    for block in blocks:
+        if isinstance(block, str):
+            block = block.encode("iso-8859-1")
+        view = memoryview(block).cast("B")
+        for offset in range(0, len(view), read_size):
+            part = view[offset:offset + read_size]
+            rate_limiter.acquire(limit_upload, hostname, len(part))
+            yield part
+
+class _ThrottledFile(object):
+    """
+    wraps a response's socket file: the bytes read from it wait for
+    tokens. Lines, the status, headers and chunk sizes, are not counted.
+    """
+    def __init__(self, file_object, throttle):
+        self._file_object = file_object
+        self._throttle = throttle
+
+    def read(self, *args):
+        data = self._file_object.read(*args)
+        self._throttle(len(data))
+        return data
+
+    def read1(self, *args):
+        data = self._file_object.read1(*args)
+        self._throttle(len(data))
+        return data
+
+    def readinto(self, b):
+        bytes_read = self._file_object.readinto(b)
+        self._throttle(bytes_read or 0)
+        return bytes_read
+
+    def __getattr__(self, name):
+        return getattr(self._file_object, name)
+
+class ThrottledHTTPResponse(HTTPResponse):
+    """
+    An HTTPResponse whose body reads wait for download tokens.
+    Use it as a connection's response_class, through functools.partial
+    to supply throttle and max_read_size.
+
+    The tokens are taken where the bytes leave the socket file, so a read
+    that HTTPResponse implements with another (read through readinto,
+    before Python 3.11) is charged once. The methods here only keep each
+    read to max_read_size.
+    """
+    def __init__(self, sock, *args, **kwargs):
+        throttle = kwargs.pop("throttle")
+        self._max_read_size = kwargs.pop("max_read_size")
+        HTTPResponse.__init__(self, sock, *args, **kwargs)
+        self.fp = _ThrottledFile(self.fp, throttle)
+
+    def read(self, amt=None):
+        if amt is None or amt < 0:
+            blocks = list()
+            while True:
+                data = self.read(self._max_read_size)
+                if len(data) == 0:
+                    return b"".join(blocks)
+                blocks.append(data)
+        return HTTPResponse.read(self, min(amt, self._max_read_size))
+
+    def read1(self, n=-1):
+        if n is None or n < 0 or n > self._max_read_size:
+            n = self._max_read_size
+        return HTTPResponse.read1(self, n)
+
+    def readinto(self, b):
+        view = memoryview(b).cast("B")[:self._max_read_size]
+        return HTTPResponse.readinto(self, view)
+
+_default_rate_limiter = None
+_default_rate_limiter_lock = threading.Lock()
+
+def default_rate_limiter():
+    """
+    return the limiter shared by connections that are not given one
+    """
+    global _default_rate_limiter
+    with _default_rate_limiter_lock:
+        if _default_rate_limiter is None:
+            _default_rate_limiter = RateLimiter(
+                upload_bytes_per_second=_rate_from_environment(
+                    "NIMBUSIO_RATE_UPLOAD_BPS"),
+                download_bytes_per_second=_rate_from_environment(
+                    "NIMBUSIO_RATE_DOWNLOAD_BPS"),
+                requests_per_second=_rate_from_environment(
+                    "NIMBUSIO_RATE_REQUESTS"),
+                host_upload_bytes_per_second=_rate_from_environment(
+                    "NIMBUSIO_HOST_RATE_UPLOAD_BPS"),
+                host_download_bytes_per_second=_rate_from_environment(
+                    "NIMBUSIO_HOST_RATE_DOWNLOAD_BPS"),
+                host_requests_per_second=_rate_from_environment(
+                    "NIMBUSIO_HOST_RATE_REQUESTS"))
+        return _default_rate_limiter
+
+def set_default_rate_limiter(rate_limiter):
+    """
+    use this limiter for connections created from now on
+    """
+    global _default_rate_limiter
+    with _default_rate_limiter_lock:
+        _default_rate_limiter = rate_limiter
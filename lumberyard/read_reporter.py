@@ -11,11 +11,29 @@ Intended to be passed as the 'body' parameter to HTTPConnection.request
 
 Takes an open python file object and a callback functions as arguments
 The callback should take a single integer as an argument: bytes_read.
+
+By default the callback is called after every read. With report_bytes or
+report_seconds, reads are added up and the callback is called once that
+many bytes have been read, or that many seconds have passed since it was
+last called. Whatever is left over is reported at end of file, on close,
+and by flush_callback. The sum of the reported counts is always the number
+of bytes read.
+
+readinto reads into a buffer provided by the caller, such as a bytearray
+or a memoryview of one, so a caller reusing its buffer makes no new bytes
+objects.
+
+stats() gives the bytes read so far, the throughput, and the estimated
+seconds remaining when total_bytes is known.
 """
-import collections
+try:
+    from collections.abc import Iterable
+except ImportError:
+    from collections import Iterable
 import logging
+import time
 
-class ReadReporter(collections.Iterable):
+class ReadReporter(Iterable):
     """
     A class that wraps a python file object (or something like him)
     and reports bytes read to a calback
@@ -24,11 +42,44 @@ class ReadReporter(collections.Iterable):
 
     Takes an open pythong file object and a callback functions as arguments
     The callback should take a single integer as an argument: bytes_read.
+
+    report_bytes
+        call the callback once at least this many bytes are pending
+
+    report_seconds
+        call the callback once this many seconds have passed since the last
+        call, if any bytes are pending
+
+    total_bytes
+        the number of bytes expected, for the ETA in stats()
+
+    throttle
+        optional function taking the number of bytes just read, called
+        before they are returned; it may sleep to pace the reads
+
+    max_read_size
+        read at most this many bytes at a time
     """
-    def __init__(self, file_object, callback=None):
+    def __init__(self,
+                 file_object,
+                 callback=None,
+                 report_bytes=0,
+                 report_seconds=0.0,
+                 total_bytes=None,
+                 throttle=None,
+                 max_read_size=None):
         self._log = logging.getLogger("ReadReporter")
         self._file_object = file_object
         self._callback = callback
+        self._report_bytes = report_bytes
+        self._report_seconds = report_seconds
+        self._total_bytes = total_bytes
+        self._throttle = throttle
+        self._max_read_size = max_read_size
+        self._pending = 0
+        self._bytes_read = 0
+        self._start_time = None
+        self._last_report_time = None
 
     def __iter__(self):
         while True:
@@ -37,36 +88,134 @@ class ReadReporter(collections.Iterable):
                 break
             yield data
 
+    @property
+    def file_object(self):
+        """
+        the wrapped file object
+        """
+        return self._file_object
+
     def set_callback(self, callback):
         self._callback = callback
 
+    def report(self, bytes_read):
+        """
+        report bytes that were read from the file object directly,
+        rather than through read()
+        """
+        if self._start_time is None:
+            self._start_time = self._last_report_time = time.time()
+        self._bytes_read += bytes_read
+        self._pending += bytes_read
+
+        if bytes_read == 0:
+            # end of file
+            self.flush_callback()
+        elif self._report_seconds > 0:
+            current_time = time.time()
+            if self._pending >= self._report_bytes > 0 or \
+                current_time - self._last_report_time >= self._report_seconds:
+                self._last_report_time = current_time
+                self.flush_callback()
+        elif self._pending >= self._report_bytes:
+            self.flush_callback()
+
+    def flush_callback(self):
+        """
+        pass any bytes not yet reported to the callback
+        """
+        pending = self._pending
+        if pending == 0 or self._callback is None:
+            return
+        self._pending = 0
+        self._callback(pending)
+
+    def stats(self):
+        """
+        return a dict of bytes_read, elapsed_seconds, bytes_per_second and
+        eta_seconds (None without total_bytes)
+        """
+        elapsed_seconds = (0.0 if self._start_time is None \
+                           else time.time() - self._start_time)
+        bytes_per_second = (self._bytes_read / elapsed_seconds \
+                            if elapsed_seconds > 0 else 0.0)
+        eta_seconds = None
+        if self._total_bytes is not None and bytes_per_second > 0:
+            remaining = max(0, self._total_bytes - self._bytes_read)
+            eta_seconds = remaining / bytes_per_second
+        return {
+            "bytes_read"        : self._bytes_read,
+            "total_bytes"       : self._total_bytes,
+            "elapsed_seconds"   : elapsed_seconds,
+            "bytes_per_second"  : bytes_per_second,
+            "eta_seconds"       : eta_seconds,
+        }
+
     def close(self):
         self._log.debug("close")
+        self.flush_callback()
         self._file_object.close()
 
     def fileno(self):
-        self._log.debug("fileno = {0}".format(self._file_object.fileno()))
-        return self._file_object.fileno()
+        result = self._file_object.fileno()
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug("fileno = {0}".format(result))
+        return result
 
     def read(self, size=None):
-        self._log.debug("read({0})".format(size))
-        data = None
+        if self._max_read_size is not None:
+            if size is None or size < 0:
+                return b"".join(iter(lambda: self.read(self._max_read_size),
+                                     b""))
+            size = min(size, self._max_read_size)
+
         if size is None:
             data = self._file_object.read()
         else:
             data = self._file_object.read(size)
 
-        self._log.debug("actual bytes read {0}".format(len(data)))
-        self._callback(len(data))
+        if self._throttle is not None:
+            self._throttle(len(data))
+
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug("read({0}) actual bytes read {1}".format(
+                size, len(data)))
+        self.report(len(data))
 
         return data
 
-    def seek(self, offset, whence=None):
-        self._log.debug("seek({0}, {1})".format(offset, whence))
-        self._file_object.seek(offset, whence)
+    def readinto(self, buffer):
+        """
+        read into a writable buffer, returning the number of bytes read
+        """
+        if self._max_read_size is not None and \
+            len(buffer) > self._max_read_size:
+            buffer = memoryview(buffer).cast("B")[:self._max_read_size]
+        readinto = getattr(self._file_object, "readinto", None)
+        if readinto is not None:
+            bytes_read = readinto(buffer)
+        else:
+            view = memoryview(buffer).cast("B")
+            data = self._file_object.read(len(view))
+            bytes_read = len(data)
+            view[:bytes_read] = data
+
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug("readinto({0}) actual bytes read {1}".format(
+                len(buffer), bytes_read))
+        if self._throttle is not None:
+            self._throttle(bytes_read or 0)
+        self.report(bytes_read or 0)
+
+        return bytes_read
+
+    def seek(self, offset, whence=0):
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug("seek({0}, {1})".format(offset, whence))
+        return self._file_object.seek(offset, whence)
 
     def tell(self):
         result = self._file_object.tell()
-        self._log.debug("tell() = {0}".format(result))
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug("tell() = {0}".format(result))
         return result
-
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""
+request_timing.py
+
+class RequestTiming
+class LatencyHistogram
+class TimingAggregator
+
+Where the time of each request went.
+
+An observer is a callable taking one RequestTiming. Observers registered
+with add_request_observer see the requests of every connection; those
+given to a connection as observers see only its own. With no observers a
+connection records nothing.
+
+A RequestTiming holds the method, host, a template of the URI (the key and
+other names replaced by placeholders), the status, the body bytes sent and
+received, the number of retries, and the seconds spent in each phase of
+the last attempt:
+
+    dns         looking up the host, when the connection was (re)made,
+                during the request or ahead of it, as a ConnectionPool does
+    connect     the TCP connect
+    tls         the TLS handshake
+    send        sending the request line, headers and body
+    first_byte  from the end of the send to the response headers
+    body        from the response headers to the end of the body
+
+total_seconds runs from the call to request until the body has been read
+or the response closed, including any retries. A response that is never
+read to the end nor closed is never reported. A request that fails is
+reported when it fails, with error set.
+
+request_label labels the requests a thread makes, so the aggregator can
+group them by something more meaningful than their URI, like a command.
+
+LatencyHistogram keeps counts in log-linear buckets like an HDR histogram:
+every value is kept to within 1 part in 2 ** significant_bits, over any
+range, in a small fixed amount of memory per power of two.
+"""
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+try:
+    from urllib.parse import urlsplit, parse_qsl
+except ImportError:
+    from urlparse import urlsplit, parse_qsl
+
+phase_names = ["dns", "connect", "tls", "send", "first_byte", "body", ]
+
+_observers = list()
+_observers_lock = threading.Lock()
+_label_local = threading.local()
+
+def add_request_observer(observer):
+    """
+    call observer with the RequestTiming of every request
+    """
+    global _observers
+    with _observers_lock:
+        _observers = _observers + [observer]
+
+def remove_request_observer(observer):
+    global _observers
+    with _observers_lock:
+        _observers = [o for o in _observers if o is not observer]
+
+def request_observers(connection_observers):
+    """
+    return the observers for a connection: the process wide ones, then
+    its own
+    """
+    if len(connection_observers) == 0:
+        return _observers
+    return _observers + connection_observers
+
+@contextmanager
+def request_label(label):
+    """
+    label the requests this thread makes inside the with block
+    """
+    previous = getattr(_label_local, "label", None)
+    _label_local.label = label
+    try:
+        yield
+    finally:
+        _label_local.label = previous
+
+# the query arguments whose values name an operation, not an object
+_query_verbs = set(["action", ])
+
+def uri_template(uri):
+    """
+    return the uri with the names in it replaced by placeholders:
+    /data/a/b?action=meta&version_identifier=1 becomes
+    /data/{key}?action=meta&version_identifier
+    """
+    split_uri = urlsplit(uri)
+    path_parts = [p for p in split_uri.path.split("/") if len(p) > 0]
+    if len(path_parts) > 1:
+        placeholder = ("{key}" if path_parts[0] == "data" else "{id}")
+        path_parts = [path_parts[0], placeholder]
+    template = "/" + "/".join(path_parts)
+    query = parse_qsl(split_uri.query, keep_blank_values=True)
+    if len(query) > 0:
+        template += "?" + "&".join(
+            (name + "=" + value if name in _query_verbs else name) \
+            for (name, value) in sorted(query))
+    return template
+
+class RequestTiming(object):
+    """
+    the timing record of one request
+    """
+    def __init__(self, method, host, uri, connect_phases=None):
+        self.method = method
+        self.host = host
+        self.uri_template = uri_template(uri)
+        self.label = getattr(_label_local, "label", None)
+        self.status = None
+        self.bytes_sent = None
+        self.bytes_received = 0
+        self.retries = -1
+        self.phases = dict()
+        self.error = None
+        self.start_time = time.time()
+        self.total_seconds = None
+        self._phase_start = None
+        # the phases of a connection made ahead of the request
+        self._carried_phases = dict(connect_phases or {})
+
+    def begin_attempt(self):
+        self.retries += 1
+        self.phases = self._carried_phases
+        self._carried_phases = dict()
+        self.bytes_received = 0
+
+    def start_phase(self):
+        self._phase_start = time.time()
+
+    def end_phase(self, name):
+        """
+        charge the time since start_phase (or the last end_phase) to name
+        """
+        current_time = time.time()
+        self.phases[name] = self.phases.get(name, 0.0) + \
+            (current_time - self._phase_start)
+        self._phase_start = current_time
+
+    def as_dict(self):
+        return {
+            "method"            : self.method,
+            "host"              : self.host,
+            "uri_template"      : self.uri_template,
+            "label"             : self.label,
+            "status"            : self.status,
+            "bytes_sent"        : self.bytes_sent,
+            "bytes_received"    : self.bytes_received,
+            "retries"           : self.retries,
+            "phases"            : dict(self.phases),
+            "error"             : self.error,
+            "total_seconds"     : self.total_seconds,
+        }
+
+def finish_timing(timing, observers, error=None):
+    """
+    complete the record and pass it to each observer
+    """
+    timing.total_seconds = time.time() - timing.start_time
+    if error is not None:
+        timing.error = str(error)
+        if timing.status is None:
+            timing.status = getattr(error, "status", None)
+    for observer in observers:
+        try:
+            observer(timing)
+        except Exception:
+            logging.getLogger("RequestTiming").exception(
+                "observer {0!r}".format(observer))
+
+class _TimedReader(object):
+    """
+    stands in for an HTTPResponse's fp, counting the body bytes read from
+    it; the response closes it at the end of the body
+    """
+    def __init__(self, fp, timing, observers):
+        self._fp = fp
+        self._timing = timing
+        self._observers = observers
+        self._finished = False
+
+    def _count(self, byte_count):
+        self._timing.bytes_received += byte_count
+
+    def read(self, *args):
+        data = self._fp.read(*args)
+        self._count(len(data))
+        return data
+
+    def read1(self, *args):
+        data = self._fp.read1(*args)
+        self._count(len(data))
+        return data
+
+    def readinto(self, b):
+        bytes_read = self._fp.readinto(b)
+        self._count(bytes_read or 0)
+        return bytes_read
+
+    def readline(self, *args):
+        # chunked bodies: size lines and trailers, as well as data
+        data = self._fp.readline(*args)
+        self._count(len(data))
+        return data
+
+    def peek(self, *args):
+        return self._fp.peek(*args)
+
+    def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        self._timing.end_phase("body")
+        finish_timing(self._timing, self._observers)
+
+    def close(self):
+        self._fp.close()
+        self.finish()
+
+    def __getattr__(self, name):
+        return getattr(self._fp, name)
+
+def observe_response(response, timing, observers):
+    """
+    report the timing once the response body has been read or the
+    response closed
+    """
+    timing.status = response.status
+    timing.start_phase()
+    if response.fp is None or response.length == 0:
+        timing.end_phase("body")
+        finish_timing(timing, observers)
+        return
+    response.fp = _TimedReader(response.fp, timing, observers)
+
+class LatencyHistogram(object):
+    """
+    significant_bits
+        values are kept to within 1 part in 2 ** significant_bits
+
+    unit_seconds
+        the smallest duration told apart
+
+    A thread-safe log-linear histogram of durations.
+    """
+    def __init__(self, significant_bits=7, unit_seconds=1e-6):
+        self._lock = threading.Lock()
+        self._significant_bits = significant_bits
+        self._unit_seconds = unit_seconds
+        # (shift, value >> shift) -> count
+        self._counts = dict()
+        self.count = 0
+        self.total_seconds = 0.0
+        self.min_seconds = None
+        self.max_seconds = None
+
+    def _bucket(self, units):
+        shift = max(0, units.bit_length() - self._significant_bits)
+        return (shift, units >> shift, )
+
+    def record(self, seconds):
+        units = max(0, int(seconds / self._unit_seconds))
+        bucket = self._bucket(units)
+        with self._lock:
+            self._counts[bucket] = self._counts.get(bucket, 0) + 1
+            self.count += 1
+            self.total_seconds += seconds
+            if self.min_seconds is None or seconds < self.min_seconds:
+                self.min_seconds = seconds
+            if self.max_seconds is None or seconds > self.max_seconds:
+                self.max_seconds = seconds
+
+    def merge(self, other):
+        with other._lock:
+            counts = dict(other._counts)
+            count, total_seconds = other.count, other.total_seconds
+            min_seconds, max_seconds = other.min_seconds, other.max_seconds
+        with self._lock:
+            for bucket, bucket_count in counts.items():
+                self._counts[bucket] = self._counts.get(bucket, 0) + \
+                    bucket_count
+            self.count += count
+            self.total_seconds += total_seconds
+            if min_seconds is not None and \
+                (self.min_seconds is None or min_seconds < self.min_seconds):
+                self.min_seconds = min_seconds
+            if max_seconds is not None and \
+                (self.max_seconds is None or max_seconds > self.max_seconds):
+                self.max_seconds = max_seconds
+
+    def percentile(self, percent):
+        """
+        return the duration in seconds that percent of the values are at
+        or below, to the histogram's precision; None if it is empty
+        """
+        with self._lock:
+            if self.count == 0:
+                return None
+            threshold = max(1, int(round(self.count * percent / 100.0)))
+            seen = 0
+            for (shift, value) in sorted(self._counts,
+                                         key=lambda b: b[1] << b[0]):
+                seen += self._counts[(shift, value, )]
+                if seen >= threshold:
+                    # the middle of the bucket
+                    units = (value << shift) + ((1 << shift) >> 1)
+                    seconds = units * self._unit_seconds
+                    return min(max(seconds, self.min_seconds),
+                               self.max_seconds)
+        return self.max_seconds
+
+    @property
+    def mean_seconds(self):
+        return (self.total_seconds / self.count if self.count > 0 else None)
+
+class TimingAggregator(object):
+    """
+    key_function
+        optional function of a RequestTiming returning the group it counts
+        in; by default its label, or its method and URI template
+
+    An observer keeping a LatencyHistogram of total time, and of each
+    phase, for each group of requests.
+    """
+    def __init__(self, key_function=None):
+        self._lock = threading.Lock()
+        self._key_function = (key_function or _default_key)
+        # key -> {"total" : LatencyHistogram, phase : LatencyHistogram}
+        self._histograms = dict()
+        self._counters = dict()
+
+    def __call__(self, timing):
+        key = self._key_function(timing)
+        with self._lock:
+            histograms = self._histograms.get(key)
+            if histograms is None:
+                histograms = dict((name, LatencyHistogram(), ) \
+                                  for name in ["total"] + phase_names)
+                self._histograms[key] = histograms
+                self._counters[key] = {"errors"           : 0,
+                                       "retries"          : 0,
+                                       "bytes_sent"       : 0,
+                                       "bytes_received"   : 0, }
+            counters = self._counters[key]
+            counters["errors"] += (0 if timing.error is None else 1)
+            counters["retries"] += timing.retries
+            counters["bytes_sent"] += (timing.bytes_sent or 0)
+            counters["bytes_received"] += timing.bytes_received
+        histograms["total"].record(timing.total_seconds)
+        for name, seconds in timing.phases.items():
+            histograms[name].record(seconds)
+
+    def histogram(self, key, phase="total"):
+        with self._lock:
+            return self._histograms[key][phase]
+
+    def summary(self, percents=(50, 95, 99, )):
+        """
+        return a list of dicts, one per group, sorted by key: key, count,
+        the counters, and for total and each phase seen a dict of
+        percent -> seconds
+        """
+        with self._lock:
+            items = sorted(self._histograms.items(), key=lambda i: str(i[0]))
+            counters = dict((k, dict(v), ) for (k, v) in \
+                            self._counters.items())
+        result = list()
+        for key, histograms in items:
+            entry = {"key" : key, "count" : histograms["total"].count}
+            entry.update(counters[key])
+            for name, histogram in histograms.items():
+                if histogram.count > 0:
+                    entry[name] = dict((percent, histogram.percentile(percent))
+                                       for percent in percents)
+            result.append(entry)
+        return result
+
+def _default_key(timing):
+    if timing.label is not None:
+        return timing.label
+    return "{0} {1}".format(timing.method, timing.uri_template)
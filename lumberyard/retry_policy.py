@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+"""
+retry_policy.py
+
+class RetryPolicy
+
+Decide whether a failed request may be sent again, and when.
+
+A request is retried when it failed with a transient error: a connection
+error, or a 500, 502, 503 or 504 status. It must also be safe to send
+twice. A request that never reached the wire is always safe. Otherwise the
+method must be idempotent and the body must be replayable: bytes, or a file
+that can be rewound to where it started.
+
+The delay is the server's Retry-After value when it sent one. Otherwise it
+is decorrelated jitter: a random value between the base delay and three
+times the previous delay, capped at max_delay. No retry is started that
+would end after the request's deadline.
+
+Each host has a circuit breaker. After breaker_threshold transient failures
+in a row, requests to the host are refused for breaker_reset_seconds; the
+connection raises CircuitOpenError without sending them. After that one
+trial request is let through. Its success closes the breaker and its
+failure opens it again.
+
+The policy only decides. The connection does the sleeping, so the same
+policy serves the synchronous and the asyncio connections::
+
+    retry = policy.begin(hostname, method, body)
+    while True:
+        if not retry.before_attempt():
+            raise CircuitOpenError(hostname)
+        try:
+            # sets retry.request_sent = True before writing the request
+            response = send_request(retry)
+        except Exception:
+            delay = retry.next_delay(sys.exc_info()[1])
+            if delay is None:
+                raise
+            time.sleep(delay)
+            continue
+        retry.succeeded()
+        return response
+"""
+try:
+    from httplib import HTTPException
+    from httplib import INTERNAL_SERVER_ERROR
+    from httplib import BAD_GATEWAY
+    from httplib import SERVICE_UNAVAILABLE
+    from httplib import GATEWAY_TIMEOUT
+except ImportError:
+    from http.client import HTTPException
+    from http.client import INTERNAL_SERVER_ERROR
+    from http.client import BAD_GATEWAY
+    from http.client import SERVICE_UNAVAILABLE
+    from http.client import GATEWAY_TIMEOUT
+import logging
+import os
+import random
+import socket
+import threading
+import time
+
+_max_attempts = int(os.environ.get("NIMBUSIO_RETRY_MAX_ATTEMPTS", "5"))
+_base_delay = float(os.environ.get("NIMBUSIO_RETRY_BASE_SECONDS", "0.5"))
+_max_delay = float(os.environ.get("NIMBUSIO_RETRY_MAX_SECONDS", "30.0"))
+_deadline_seconds = float(
+    os.environ.get("NIMBUSIO_RETRY_DEADLINE_SECONDS", "300.0"))
+_breaker_threshold = int(os.environ.get("NIMBUSIO_BREAKER_THRESHOLD", "5"))
+_breaker_reset_seconds = float(
+    os.environ.get("NIMBUSIO_BREAKER_RESET_SECONDS", "30.0"))
+
+_retry_statuses = frozenset([
+    INTERNAL_SERVER_ERROR,
+    BAD_GATEWAY,
+    SERVICE_UNAVAILABLE,
+    GATEWAY_TIMEOUT,
+])
+_idempotent_methods = frozenset(["GET", "HEAD", "PUT", "DELETE", "OPTIONS", ])
+
+breaker_closed = "closed"
+breaker_open = "open"
+breaker_half_open = "half-open"
+
+def _is_transient(error):
+    """
+    return True if the error says nothing about the request itself, so the
+    same request may succeed later
+    """
+    # LumberyardHTTPError and its subclasses carry the response status
+    status = getattr(error, "status", None)
+    if status is not None:
+        return status in _retry_statuses
+    return isinstance(error, (socket.error, HTTPException, ))
+
+class _CircuitBreaker(object):
+    """
+    the health of one host. the caller must hold the policy lock
+    """
+    def __init__(self):
+        self.state = breaker_closed
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+
+class _BodyRewinder(object):
+    """
+    remember where a file body started, so it can be sent again
+    """
+    def __init__(self, body):
+        self._body = body
+        self._position = None
+        if body is None or isinstance(body, (bytes, str, )):
+            self.replayable = True
+            return
+        self.replayable = False
+        if hasattr(body, "seek") and hasattr(body, "tell"):
+            try:
+                self._position = body.tell()
+            except Exception:
+                return
+            self.replayable = True
+
+    def rewind(self):
+        if self._position is not None:
+            self._body.seek(self._position)
+
+class _Retry(object):
+    """
+    the retry state of one request, from RetryPolicy.begin
+    """
+    def __init__(self, policy, hostname, method, body):
+        self._policy = policy
+        self._hostname = hostname
+        self._idempotent = method.upper() in _idempotent_methods
+        self._rewinder = _BodyRewinder(body)
+        self._deadline = time.time() + policy.deadline_seconds
+        self._previous_delay = policy.base_delay
+        self.attempts = 0
+        # the connection sets this once it starts writing the request
+        self.request_sent = False
+
+    def before_attempt(self):
+        """
+        return False if the host's breaker refuses the request;
+        otherwise rewind the body if this is a retry, and return True
+        """
+        if not self._policy._admit(self._hostname):
+            return False
+        if self.attempts > 0:
+            self._rewinder.rewind()
+        self.attempts += 1
+        self.request_sent = False
+        return True
+
+    def succeeded(self):
+        self._policy._record_success(self._hostname)
+
+    def next_delay(self, error):
+        """
+        error
+            the exception the attempt raised
+
+        return the seconds to wait before the next attempt, or None if
+        the error should be raised
+        """
+        policy = self._policy
+        if not _is_transient(error):
+            # a response from the host, such as a 4xx, says the host is
+            # up and the request was at fault. a local error, such as one
+            # reading the body, says nothing about the host
+            if getattr(error, "status", None) is not None:
+                policy._record_success(self._hostname)
+            else:
+                policy._release_trial(self._hostname)
+            return None
+
+        if not policy._record_failure(self._hostname):
+            # the breaker would refuse the retry
+            policy._count("give_ups")
+            return None
+
+        if self.request_sent and \
+            not (self._idempotent and self._rewinder.replayable):
+            policy._count("not_retryable")
+            return None
+
+        if self.attempts >= policy.max_attempts:
+            policy._count("give_ups")
+            return None
+
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            delay = float(retry_after)
+        else:
+            delay = min(policy.max_delay,
+                        random.uniform(policy.base_delay,
+                                       self._previous_delay * 3))
+            self._previous_delay = delay
+
+        if time.time() + delay > self._deadline:
+            policy._count("deadline_exceeded")
+            return None
+
+        policy._log.warning("retry {0} {1} in {2:.3f}s after {3}".format(
+            self.attempts, self._hostname, delay, error))
+        policy._count("retries")
+        if retry_after is not None:
+            policy._count("retry_after_honored")
+        policy._count("retry_sleep_seconds", delay)
+        return delay
+
+class RetryPolicy(object):
+    """
+    max_attempts
+        the most times one request is sent, including the first; 1 disables
+        retries
+
+    base_delay, max_delay
+        the bounds of the jittered delay between attempts, in seconds
+
+    deadline_seconds
+        no retry is started that would wait past this long after the
+        request began
+
+    breaker_threshold
+        consecutive transient failures that open a host's circuit breaker;
+        None disables the breakers
+
+    breaker_reset_seconds
+        how long an open breaker fails requests before letting a trial
+        request through
+
+    A policy holds the breakers and the metrics, so one policy is shared by
+    every connection: see default_retry_policy.
+    """
+    def __init__(self,
+                 max_attempts=_max_attempts,
+                 base_delay=_base_delay,
+                 max_delay=_max_delay,
+                 deadline_seconds=_deadline_seconds,
+                 breaker_threshold=_breaker_threshold,
+                 breaker_reset_seconds=_breaker_reset_seconds):
+        self._log = logging.getLogger("RetryPolicy")
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline_seconds = deadline_seconds
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset_seconds = breaker_reset_seconds
+
+        self._lock = threading.Lock()
+        # hostname -> _CircuitBreaker
+        self._breakers = dict()
+        self._counters = {
+            "requests"              : 0,
+            "retries"               : 0,
+            "retry_after_honored"   : 0,
+            "retry_sleep_seconds"   : 0.0,
+            "give_ups"              : 0,
+            "deadline_exceeded"     : 0,
+            "not_retryable"         : 0,
+            "breaker_opened"        : 0,
+            "breaker_rejected"      : 0,
+        }
+
+    def begin(self, hostname, method, body=None):
+        """
+        hostname
+            the host the request goes to; each has its own breaker
+
+        method
+            the HTTP method; only idempotent methods are retried once sent
+
+        body
+            the request body; a file body is rewound before a retry
+
+        return the retry state for one request
+        """
+        self._count("requests")
+        return _Retry(self, hostname, method, body)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _admit(self, hostname):
+        if self.breaker_threshold is None:
+            return True
+        with self._lock:
+            breaker = self._breakers.get(hostname)
+            if breaker is None or breaker.state == breaker_closed:
+                return True
+            if breaker.state == breaker_open and \
+                time.time() - breaker.opened_at >= self.breaker_reset_seconds:
+                self._log.info("circuit half-open for {0}".format(hostname))
+                breaker.state = breaker_half_open
+            if breaker.state == breaker_half_open and \
+                not breaker.trial_in_flight:
+                breaker.trial_in_flight = True
+                return True
+            self._counters["breaker_rejected"] += 1
+        return False
+
+    def _record_success(self, hostname):
+        if self.breaker_threshold is None:
+            return
+        with self._lock:
+            breaker = self._breakers.get(hostname)
+            if breaker is None:
+                return
+            if breaker.state != breaker_closed:
+                self._log.info("circuit closed for {0}".format(hostname))
+            breaker.state = breaker_closed
+            breaker.consecutive_failures = 0
+            breaker.trial_in_flight = False
+
+    def _release_trial(self, hostname):
+        """
+        let another trial request through a half-open breaker, leaving
+        its state as it is
+        """
+        if self.breaker_threshold is None:
+            return
+        with self._lock:
+            breaker = self._breakers.get(hostname)
+            if breaker is not None:
+                breaker.trial_in_flight = False
+
+    def _record_failure(self, hostname):
+        """
+        return False if the failure left the host's breaker open
+        """
+        if self.breaker_threshold is None:
+            return True
+        with self._lock:
+            breaker = self._breakers.setdefault(hostname, _CircuitBreaker())
+            breaker.consecutive_failures += 1
+            breaker.trial_in_flight = False
+            if breaker.state == breaker_half_open or \
+                (breaker.state == breaker_closed and \
+                 breaker.consecutive_failures >= self.breaker_threshold):
+                self._log.warning("circuit open for {0} after {1} "
+                                  "failures".format(
+                                      hostname,
+                                      breaker.consecutive_failures))
+                breaker.state = breaker_open
+                breaker.opened_at = time.time()
+                self._counters["breaker_opened"] += 1
+            return breaker.state != breaker_open
+
+    def breaker_state(self, hostname):
+        """
+        return breaker_closed, breaker_open or breaker_half_open
+        """
+        with self._lock:
+            breaker = self._breakers.get(hostname)
+            return (breaker_closed if breaker is None else breaker.state)
+
+    def stats(self):
+        """
+        return a dict of retry counters, with the state of every breaker
+        that is not closed under "breakers"
+        """
+        with self._lock:
+            result = dict(self._counters)
+            result["breakers"] = dict(
+                (hostname, breaker.state, ) \
+                for (hostname, breaker) in self._breakers.items() \
+                if breaker.state != breaker_closed)
+        return result
+
+_default_retry_policy = None
+_default_retry_policy_lock = threading.Lock()
+
+def default_retry_policy():
+    """
+    return the policy shared by connections that are not given one
+    """
+    global _default_retry_policy
+    with _default_retry_policy_lock:
+        if _default_retry_policy is None:
+            _default_retry_policy = RetryPolicy()
+        return _default_retry_policy
+
+# for callers that do their own retrying
+no_retry_policy = RetryPolicy(max_attempts=1, breaker_threshold=None)
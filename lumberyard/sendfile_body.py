@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+sendfile_body.py
+
+send a request body straight from a file to the socket with os.sendfile
+
+Without SSL, a body backed by a regular file does not need to pass through
+Python at all. The request line and headers are sent through http.client
+as usual. The body then goes out with os.sendfile from the file descriptor,
+so no bytes object is made for it.
+
+These bodies qualify:
+
+- an open file
+- a FileRangeReader
+- either of those wrapped in a ReadReporter, whose callback is then
+  called every _report_bytes or so rather than on every read
+
+Anything else, or any connection using SSL, goes through the ordinary
+http.client path. So does a platform without os.sendfile, or a file too
+short for the Content-Length. If os.sendfile fails before sending
+anything, the body is read and sent normally after the headers.
+
+Set NIMBUSIO_SENDFILE=0 to turn this path off.
+"""
+import errno
+import logging
+import os
+import select
+import socket
+import stat
+
+from lumberyard.read_reporter import ReadReporter
+
+_sendfile_enabled = os.environ.get("NIMBUSIO_SENDFILE", "1") != "0" and \
+    hasattr(os, "sendfile")
+_sendfile_block_size = 16 * 1024 * 1024
+_report_bytes = 4 * 1024 * 1024
+
+# os.sendfile can't be used with this socket or file
+_unsupported_errors = set([errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, ])
+if hasattr(errno, "EOPNOTSUPP"):
+    _unsupported_errors.add(errno.EOPNOTSUPP)
+
+class _FileSource(object):
+    """
+    a body backed by a regular file
+    """
+    def __init__(self, source, reporter, fd, offset, count):
+        self.source = source
+        self.reporter = reporter
+        self.fd = fd
+        self.offset = offset
+        self.count = count
+
+    def report(self, byte_count):
+        if self.reporter is not None and byte_count > 0:
+            self.reporter.report(byte_count)
+
+    def advance(self, byte_count):
+        """
+        leave the body positioned as if it had been read
+        """
+        self.source.seek(self.source.tell() + byte_count)
+
+def file_source(body, content_length):
+    """
+    body
+        a request body
+
+    content_length
+        the Content-Length being sent
+
+    return a _FileSource if the body can be sent with os.sendfile,
+    otherwise None
+    """
+    if not _sendfile_enabled or content_length is None or body is None:
+        return None
+
+    reporter = None
+    source = body
+    if isinstance(body, ReadReporter):
+        reporter = body
+        source = body.file_object
+
+    if hasattr(source, "file_range"):
+        fd, offset, length = source.file_range()
+        if length < content_length:
+            return None
+        return _FileSource(source, reporter, fd, offset, content_length)
+
+    try:
+        fd = source.fileno()
+        offset = source.tell()
+        file_stat = os.fstat(fd)
+    except Exception:
+        return None
+    if not stat.S_ISREG(file_stat.st_mode) or \
+        file_stat.st_size - offset < content_length:
+        return None
+    # anything buffered by the file object is ahead of the descriptor
+    if hasattr(source, "flush"):
+        try:
+            source.flush()
+        except Exception:
+            return None
+    return _FileSource(source, reporter, fd, offset, content_length)
+
+def _wait_writable(sock, timeout):
+    _, writable, _ = select.select([], [sock], [], timeout)
+    if len(writable) == 0:
+        raise socket.timeout("timed out")
+
+def send_file_body(sock, file_source):
+    """
+    send the body with os.sendfile
+    return the number of bytes sent before os.sendfile turned out to be
+    unusable, which can only be 0, or None when the whole body was sent
+    """
+    log = logging.getLogger("sendfile")
+    timeout = sock.gettimeout()
+    sock_fd = sock.fileno()
+    sent_total = 0
+    unreported = 0
+    try:
+        while sent_total < file_source.count:
+            size = min(_sendfile_block_size, file_source.count - sent_total)
+            try:
+                sent = os.sendfile(sock_fd,
+                                   file_source.fd,
+                                   file_source.offset + sent_total,
+                                   size)
+            except (BlockingIOError, InterruptedError, ):
+                # a socket with a timeout is non-blocking underneath
+                _wait_writable(sock, timeout)
+                continue
+            except OSError as instance:
+                if sent_total == 0 and instance.errno in _unsupported_errors:
+                    log.debug("os.sendfile unusable: {0}".format(instance))
+                    return 0
+                raise
+            if sent == 0:
+                raise IOError("file ended after {0} of {1} bytes".format(
+                    sent_total, file_source.count))
+            sent_total += sent
+            unreported += sent
+            if unreported >= _report_bytes:
+                file_source.report(unreported)
+                unreported = 0
+    finally:
+        file_source.report(unreported)
+        file_source.advance(sent_total)
+    return None
+
+def header_content_length(headers):
+    """
+    return the Content-Length in headers as an int, or None
+    """
+    for name, value in headers.items():
+        if name.lower() == "content-length":
+            return int(value)
+    return None
+
+def send_request(connection, method, uri, body, headers, source):
+    """
+    connection
+        a connected or unconnected http.client HTTPConnection
+
+    source
+        the _FileSource made from body by file_source
+
+    send the request line and headers through the connection, then the
+    body with os.sendfile; if os.sendfile can't be used here, send the
+    body the usual way
+    """
+    header_names = set(name.lower() for name in headers)
+    connection.putrequest(method,
+                          uri,
+                          skip_host="host" in header_names,
+                          skip_accept_encoding="accept-encoding" in \
+                            header_names)
+    for name, value in headers.items():
+        connection.putheader(name, value)
+    connection.endheaders()
+
+    if send_file_body(connection.sock, source) == 0:
+        connection.send(body)
@@ -0,0 +1,682 @@
+# -*- coding: utf-8 -*-
+"""
+stand_in_server.py
+
+class StandInServer
+
+An in-process stand-in for the nimbus.io REST endpoints used by lumberyard.
+It runs an HTTP/1.1 keep-alive server on a background thread, holds
+archived keys in memory and verifies the signatures produced by
+compute_authentication_string.
+
+It serves key GET, HEAD, PUT, POST and DELETE (with single byte ranges,
+which it can be told to ignore as some proxies do, and ETag and
+Last-Modified validators for conditional GETs), key metadata (meta_prefix
+arguments, read back with action=meta and as meta_header_prefix headers on
+a GET or HEAD of the key),
+the data/ listing with prefix, delimiter, marker and max_keys, multi-part
+conversations, and the customers/<user>/collections endpoints: listing,
+reading, creating and deleting collections, and space usage. Collections
+are tracked per user, and every user has the default collection. Keys are
+held per collection, named by the first label of the Host header.
+
+Intended for tests and benchmarks; run with NIMBUS_IO_SERVICE_SSL=0 so
+the connection classes speak plain HTTP::
+
+    server = StandInServer({"test-user" : ("1", "test-key")})
+    server.start()
+    connection = HTTPConnection(server.base_address,
+                                "test-user",
+                                "test-key",
+                                "1")
+    ...
+    server.stop()
+"""
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+try:
+    from urllib import unquote_plus
+    from urlparse import urlsplit, parse_qs
+except ImportError:
+    from urllib.parse import unquote_plus, urlsplit, parse_qs
+from email.utils import formatdate, parsedate_tz, mktime_tz
+import hashlib
+import itertools
+import json
+import logging
+import sys
+import threading
+import time
+
+from lumberyard.http_util import compute_authentication_string, \
+    meta_header_prefix, \
+    meta_prefix
+
+_default_collection = "default"
+_discard_block_size = 1024 * 1024
+
+def _collection_entry(collection_name):
+    return {"name"              : collection_name,
+            "versioning"        : False,
+            "creation-time"     : time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                                time.gmtime()), }
+
+def _query_meta(query):
+    """
+    return the key metadata in the meta_prefix arguments of a query
+    """
+    return dict((name[len(meta_prefix):], value, ) \
+                for (name, value) in query.items() \
+                if name.startswith(meta_prefix))
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _StandInRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # the headers and body of a response go out in separate writes; with
+    # Nagle's algorithm on, the body waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format_string, *args):
+        self.server.stand_in.log.debug(format_string % args)
+
+    def _send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        if headers is not None:
+            for name, value in headers.items():
+                self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD" and len(body) > 0:
+            self.wfile.write(body)
+
+    def _receive(self, size):
+        """
+        read size bytes of the request body; when the stand in is
+        discarding bodies, read them in blocks and return b""
+        """
+        stand_in = self.server.stand_in
+        stand_in.add_count("bytes_received", size)
+        if not stand_in.discard_bodies:
+            return self.rfile.read(size)
+        remaining = size
+        while remaining > 0:
+            data = self.rfile.read(min(remaining, _discard_block_size))
+            if len(data) == 0:
+                break
+            remaining -= len(data)
+        return b""
+
+    def _read_body(self):
+        length = self.headers.get("Content-Length")
+        if length is not None:
+            return self._receive(int(length))
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = list()
+            while True:
+                size_line = self.rfile.readline()
+                size = int(size_line.split(b";")[0].strip(), 16)
+                if size == 0:
+                    # trailers, up to the terminating blank line
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(self._receive(size))
+                self.rfile.readline()
+            return b"".join(chunks)
+        return b""
+
+    def _authenticate(self):
+        """
+        return the user name of a correctly signed request,
+        None for an unsigned request; raise ValueError for a bad signature
+        """
+        authorization = self.headers.get("Authorization")
+        if authorization is None:
+            return None
+        try:
+            scheme, credentials = authorization.split(" ", 1)
+            auth_key_id, _ = credentials.split(":", 1)
+            timestamp = int(self.headers["x-nimbus-io-timestamp"])
+        except Exception:
+            raise ValueError("malformed authorization")
+        if scheme != "NIMBUS.IO":
+            raise ValueError("unknown scheme {0}".format(scheme))
+
+        for user_name, (user_key_id, auth_key) in \
+            self.server.stand_in.users.items():
+            if str(user_key_id) != auth_key_id:
+                continue
+            expected = compute_authentication_string(auth_key_id,
+                                                     auth_key,
+                                                     user_name,
+                                                     self.command,
+                                                     timestamp,
+                                                     unquote_plus(self.path))
+            if expected == authorization:
+                return user_name
+        raise ValueError("invalid signature")
+
+    def _parse_range(self, size):
+        """
+        return (first, last) from a single 'bytes=first-last' Range header,
+        or None
+        """
+        range_header = self.headers.get("Range")
+        if range_header is None or not range_header.startswith("bytes="):
+            return None
+        first, _, last = range_header[len("bytes="):].partition("-")
+        if first == "":
+            first = max(0, size - int(last))
+            last = size - 1
+        else:
+            first = int(first)
+            last = (size - 1 if last == "" else min(int(last), size - 1))
+        return first, last
+
+    def _not_modified(self, etag, modified_time):
+        """
+        True if If-None-Match lists etag or, without it, the key has not
+        changed since If-Modified-Since
+        """
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return etag in tags or "*" in tags
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since is not None:
+            date_tuple = parsedate_tz(if_modified_since)
+            if date_tuple is not None:
+                return int(modified_time) <= mktime_tz(date_tuple)
+        return False
+
+    def _collection_name(self):
+        host = self.headers.get("Host", "").split(":")[0]
+        labels = host.split(".")
+        if len(labels) > 1 and not labels[0].isdigit():
+            return labels[0]
+        return _default_collection
+
+    def _handle(self):
+        stand_in = self.server.stand_in
+        stand_in.record_request(dict(self.headers.items()))
+        body = (b"" if self.command in ("GET", "HEAD", ) \
+                else self._read_body())
+
+        try:
+            user_name = self._authenticate()
+        except ValueError:
+            instance = sys.exc_info()[1]
+            self._send(401, str(instance).encode("utf-8"))
+            return
+
+        if stand_in.delay_seconds > 0:
+            time.sleep(stand_in.delay_seconds)
+
+        failure = stand_in.pop_failure(" ".join([self.command, self.path]))
+        if failure is not None:
+            status, headers = failure
+            self._send(status, b"injected failure", headers)
+            return
+
+        split_path = urlsplit(self.path)
+        path_parts = [p for p in split_path.path.split("/") if len(p) > 0]
+        query = dict((k, v[0], ) for (k, v) in \
+                     parse_qs(split_path.query).items())
+        if path_parts == ["data"] and self.command == "GET":
+            self._handle_list_keys(query)
+            return
+        if len(path_parts) > 1 and path_parts[0] == "data":
+            key = unquote_plus("/".join(path_parts[1:]))
+            self._handle_key(user_name, key, body, query)
+            return
+        if len(path_parts) > 0 and path_parts[0] == "conversations":
+            self._handle_conversation(user_name, path_parts[1:], query)
+            return
+        if len(path_parts) > 2 and path_parts[0] == "customers" and \
+            path_parts[2] == "collections":
+            self._handle_collections(user_name,
+                                     unquote_plus(path_parts[1]),
+                                     path_parts[3:],
+                                     query)
+            return
+
+        self._send(404, b"unknown path")
+
+    def _send_json(self, status, result):
+        self._send(status,
+                   json.dumps(result).encode("utf-8"),
+                   {"Content-Type" : "application/json"})
+
+    def _handle_list_keys(self, query):
+        stand_in = self.server.stand_in
+        max_keys = int(query.get("max_keys", "1000"))
+        prefix = query.get("prefix", "")
+        delimiter = query.get("delimiter")
+        marker = query.get("marker")
+
+        entries = stand_in.list_keys(self._collection_name(),
+                                     prefix,
+                                     delimiter,
+                                     marker)
+        truncated = len(entries) > max_keys
+        entries = entries[:max_keys]
+        if delimiter is None:
+            self._send_json(200, {"key_data" : entries,
+                                  "truncated" : truncated})
+        else:
+            self._send_json(200, {"prefixes" : entries,
+                                  "truncated" : truncated})
+
+    def _handle_conversation(self, user_name, path_parts, query):
+        stand_in = self.server.stand_in
+        collection = self._collection_name()
+        if user_name is None:
+            self._send(401, b"authentication required")
+            return
+
+        if self.command == "POST" and len(path_parts) == 0 and \
+            query.get("action") == "start":
+            conversation_identifier = stand_in.start_conversation()
+            self._send_json(200, {
+                "success"                   : True,
+                "conversation_identifier"   : conversation_identifier})
+            return
+
+        if len(path_parts) != 1:
+            self._send(404, b"unknown conversation path")
+            return
+        conversation_identifier = path_parts[0]
+
+        if self.command == "POST" and query.get("action") == "finish":
+            if not stand_in.finish_conversation(collection,
+                                                conversation_identifier,
+                                                query["key_name"],
+                                                _query_meta(query)):
+                self._send(404, b"no such conversation")
+                return
+            self._send_json(200, {"success" : True})
+            return
+
+        if self.command == "DELETE":
+            stand_in.abort_conversation(conversation_identifier)
+            self._send_json(200, {"success" : True})
+            return
+
+        self._send(405, b"method not allowed")
+
+    def _handle_collections(self, user_name, customer, path_parts, query):
+        stand_in = self.server.stand_in
+        if user_name is None:
+            self._send(401, b"authentication required")
+            return
+        if user_name != customer:
+            self._send(403, b"not your collections")
+            return
+
+        if len(path_parts) == 0:
+            if self.command == "GET":
+                self._send_json(200, stand_in.list_collections(user_name))
+                return
+            if self.command == "POST" and query.get("action") == "create":
+                entry = stand_in.create_collection(user_name, query["name"])
+                if entry is None:
+                    self._send(409, b"collection exists")
+                    return
+                result = dict(entry)
+                result["success"] = True
+                self._send_json(201, result)
+                return
+            self._send(405, b"method not allowed")
+            return
+
+        if len(path_parts) != 1:
+            self._send(404, b"unknown collection path")
+            return
+        collection_name = unquote_plus(path_parts[0])
+
+        if self.command == "DELETE":
+            if not stand_in.delete_collection(user_name, collection_name):
+                self._send(404, b"no such collection")
+                return
+            self._send_json(200, {"success" : True})
+            return
+
+        if self.command != "GET":
+            self._send(405, b"method not allowed")
+            return
+
+        entry = stand_in.get_collection(user_name, collection_name)
+        if entry is None:
+            self._send(404, b"no such collection")
+            return
+        if query.get("action") == "space_usage":
+            self._send_json(200, {"success"             : True,
+                                  "operational_stats"   : []})
+            return
+        self._send_json(200, entry)
+
+    def _handle_key(self, user_name, key, body, query):
+        stand_in = self.server.stand_in
+        collection = self._collection_name()
+
+        if self.command in ("GET", "HEAD", ):
+            data = stand_in.get_key(collection, key)
+            if data is None:
+                self._send(404, b"no such key")
+                return
+            if query.get("action") == "meta":
+                self._send_json(200, stand_in.get_meta(collection, key))
+                return
+            modified_time = stand_in.modified_time(collection, key)
+            validators = {
+                "ETag"          : '"{0}"'.format(
+                    hashlib.md5(data).hexdigest()),
+                "Last-Modified" : formatdate(modified_time, usegmt=True),
+            }
+            if self._not_modified(validators["ETag"], modified_time):
+                stand_in.add_count("not_modified_count")
+                self._send(304, b"", validators)
+                return
+            for name, value in stand_in.get_meta(collection, key).items():
+                validators[meta_header_prefix + name] = value
+            byte_range = None
+            if stand_in.honor_ranges:
+                validators["Accept-Ranges"] = "bytes"
+                byte_range = self._parse_range(len(data))
+            if byte_range is None:
+                self._send(200, data, validators)
+                return
+            first, last = byte_range
+            validators["Content-Range"] = "bytes {0}-{1}/{2}".format(
+                first, last, len(data))
+            self._send(206, data[first:last + 1], validators)
+            return
+
+        if user_name is None:
+            self._send(401, b"authentication required")
+            return
+
+        if self.command == "POST" and "conversation_identifier" in query:
+            if not stand_in.add_conversation_part(
+                query["conversation_identifier"],
+                int(query["conversation_part"]),
+                body):
+                self._send(404, b"no such conversation")
+                return
+            self._send_json(200, {"success" : True})
+            return
+
+        if self.command in ("PUT", "POST", ):
+            stand_in.set_key(collection, key, body, _query_meta(query))
+            self._send(200, b'{"success": true}',
+                       {"Content-Type" : "application/json"})
+            return
+
+        if self.command == "DELETE":
+            if stand_in.delete_key(collection, key):
+                self._send(200, b'{"success": true}',
+                           {"Content-Type" : "application/json"})
+            else:
+                self._send(404, b"no such key")
+            return
+
+        self._send(405, b"method not allowed")
+
+    do_GET = _handle
+    do_HEAD = _handle
+    do_PUT = _handle
+    do_POST = _handle
+    do_DELETE = _handle
+
+class StandInServer(object):
+    """
+    users
+        a dict of user_name : (auth_key_id, auth_key)
+
+    address
+        (host, port) to listen on; port 0 picks a free port
+
+    ssl_context
+        a server-side SSLContext to serve HTTPS; None serves plain HTTP
+
+    An in-process stand-in for the nimbus.io REST service.
+    """
+    def __init__(self, users=None, address=("127.0.0.1", 0),
+                 ssl_context=None):
+        self.log = logging.getLogger("StandInServer")
+        if users is None:
+            users = dict()
+        self.users = users
+        self.delay_seconds = 0
+        self.request_count = 0
+        # the headers of the most recent request
+        self.last_headers = None
+        # request body bytes read, and whether they are kept
+        self.bytes_received = 0
+        self.discard_bodies = False
+        # conditional GETs answered 304 Not Modified
+        self.not_modified_count = 0
+        # False to ignore Range headers and answer with the whole key
+        self.honor_ranges = True
+        self._lock = threading.Lock()
+        # (collection_name, key) -> bytes
+        self._keys = dict()
+        # (collection_name, key) -> time archived
+        self._modified_times = dict()
+        # (collection_name, key) -> {name : value}
+        self._meta = dict()
+        # user_name -> {collection_name : collection entry}
+        self._collections = dict()
+        self._failures = list()
+        # conversation_identifier -> {part_number : bytes}
+        self._conversations = dict()
+        self._conversation_ids = itertools.count(1)
+        self._server = _ThreadingHTTPServer(address, _StandInRequestHandler)
+        if ssl_context is not None:
+            self._server.socket = ssl_context.wrap_socket(self._server.socket,
+                                                          server_side=True)
+        self._server.stand_in = self
+        self._thread = None
+
+    @property
+    def base_address(self):
+        """
+        the address to pass to the connection classes, for example
+        ``127.0.0.1:8088``
+        """
+        host, port = self._server.server_address[:2]
+        return "{0}:{1}".format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="StandInServer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def record_request(self, headers):
+        """
+        count a request and keep its headers; the handler threads call
+        this concurrently
+        """
+        with self._lock:
+            self.request_count += 1
+            self.last_headers = headers
+
+    def add_count(self, name, amount=1):
+        """
+        add to one of the counters, such as bytes_received
+        """
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def set_key(self, collection_name, key, data, meta=None):
+        with self._lock:
+            self._keys[(collection_name, key, )] = data
+            self._modified_times[(collection_name, key, )] = time.time()
+            self._meta[(collection_name, key, )] = dict(meta or {})
+
+    def get_meta(self, collection_name, key):
+        """
+        the metadata archived with the key, without meta_prefix
+        """
+        with self._lock:
+            return dict(self._meta.get((collection_name, key, ), {}))
+
+    def modified_time(self, collection_name, key):
+        """
+        when the key was last archived
+        """
+        with self._lock:
+            return self._modified_times.get((collection_name, key, ), 0.0)
+
+    def get_key(self, collection_name, key):
+        with self._lock:
+            return self._keys.get((collection_name, key, ))
+
+    def list_keys(self, collection_name, prefix, delimiter, marker):
+        """
+        return the sorted listing after marker: key entry dicts, or
+        prefix strings if delimiter is not None
+        """
+        with self._lock:
+            keys = sorted((key, len(data), ) \
+                          for ((collection, key), data) in self._keys.items() \
+                          if collection == collection_name and \
+                          key.startswith(prefix))
+        if delimiter is None:
+            return [{"key" : key, "size" : size} \
+                    for (key, size) in keys \
+                    if marker is None or key > marker]
+
+        prefixes = list()
+        for key, _ in keys:
+            position = key.find(delimiter, len(prefix))
+            if position >= 0:
+                key = key[:position + len(delimiter)]
+            if marker is not None and key <= marker:
+                continue
+            if len(prefixes) == 0 or prefixes[-1] != key:
+                prefixes.append(key)
+        return prefixes
+
+    def _user_collections(self, user_name):
+        """
+        the user's collections, starting with the default one; call with
+        the lock held
+        """
+        collections = self._collections.get(user_name)
+        if collections is None:
+            collections = {_default_collection : _collection_entry(
+                _default_collection)}
+            self._collections[user_name] = collections
+        return collections
+
+    def create_collection(self, user_name, collection_name):
+        """
+        return the new collection entry, or None if it already exists
+        """
+        with self._lock:
+            collections = self._user_collections(user_name)
+            if collection_name in collections:
+                return None
+            entry = _collection_entry(collection_name)
+            collections[collection_name] = entry
+            return dict(entry)
+
+    def get_collection(self, user_name, collection_name):
+        with self._lock:
+            entry = self._user_collections(user_name).get(collection_name)
+            return (None if entry is None else dict(entry))
+
+    def list_collections(self, user_name):
+        """
+        return the user's collection entries, sorted by name
+        """
+        with self._lock:
+            collections = self._user_collections(user_name)
+            return [dict(collections[name]) for name in sorted(collections)]
+
+    def delete_collection(self, user_name, collection_name):
+        """
+        remove the collection and its keys; return False if there was no
+        such collection
+        """
+        with self._lock:
+            collections = self._user_collections(user_name)
+            if collections.pop(collection_name, None) is None:
+                return False
+            for collection_key in [k for k in self._keys \
+                                   if k[0] == collection_name]:
+                del self._keys[collection_key]
+            return True
+
+    def delete_key(self, collection_name, key):
+        with self._lock:
+            self._meta.pop((collection_name, key, ), None)
+            return self._keys.pop((collection_name, key, ), None) is not None
+
+    def start_conversation(self):
+        with self._lock:
+            conversation_identifier = "conversation-{0}".format(
+                next(self._conversation_ids))
+            self._conversations[conversation_identifier] = dict()
+        return conversation_identifier
+
+    def add_conversation_part(self, conversation_identifier, part, data):
+        with self._lock:
+            if not conversation_identifier in self._conversations:
+                return False
+            self._conversations[conversation_identifier][part] = data
+        return True
+
+    def finish_conversation(self, collection_name, conversation_identifier,
+                            key, meta=None):
+        with self._lock:
+            parts = self._conversations.pop(conversation_identifier, None)
+            if parts is None:
+                return False
+            self._keys[(collection_name, key, )] = \
+                b"".join(parts[n] for n in sorted(parts))
+            self._modified_times[(collection_name, key, )] = time.time()
+            self._meta[(collection_name, key, )] = dict(meta or {})
+        return True
+
+    def abort_conversation(self, conversation_identifier):
+        with self._lock:
+            self._conversations.pop(conversation_identifier, None)
+
+    @property
+    def open_conversations(self):
+        with self._lock:
+            return len(self._conversations)
+
+    def queue_failure(self, status, retry_after=None, match=None):
+        """
+        the next request will fail with this status; if match is given,
+        the next request whose "METHOD path" line contains it
+        """
+        headers = dict()
+        if retry_after is not None:
+            headers["Retry-After"] = str(retry_after)
+        with self._lock:
+            self._failures.append((status, headers, match, ))
+
+    def pop_failure(self, request_line):
+        with self._lock:
+            for index, (status, headers, match) in enumerate(self._failures):
+                if match is None or match in request_line:
+                    del self._failures[index]
+                    return status, headers
+            return None
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+stream_digest.py
+
+class HashingReader
+class HashingWriter
+
+Compute digests of a key's contents while they stream, so a transfer can
+be verified without reading the data a second time.
+
+A HashingReader wraps an upload body, as a ReadReporter does, and updates
+its hashes with every block read from it. A HashingWriter is a
+DownloadSink destination that updates its hashes with every block of the
+response before writing it on. Any algorithm hashlib knows may be asked
+for; by default MD5 and SHA-256.
+
+A retry rewinds an upload body to where it started; the HashingReader's
+hashes start again with it, so the digests are of the bytes sent by the
+attempt that succeeded.
+
+The digests can be checked against:
+
+- the service: a quoted 32 digit hex ETag, as on a GET or HEAD of the key,
+  is the MD5 of its contents (etag_md5, fetch_server_md5)
+- a local manifest in the format of sha256sum or md5sum, or the BSD
+  "SHA256 (name) = digest" format (load_digest_manifest)
+
+verify_digests raises DigestMismatch if any digest differs.
+"""
+import hashlib
+import re
+
+from lumberyard.download_sink import destination_writer
+from lumberyard.http_util import compute_uri
+
+default_algorithms = ("md5", "sha256", )
+_etag_md5_re = re.compile(r'^(W/)?"?([0-9a-fA-F]{32})"?$')
+_gnu_line_re = re.compile(r"^([0-9a-fA-F]+) [ *](.+)$")
+_bsd_line_re = re.compile(r"^([A-Za-z0-9-]+) \((.+)\) = ([0-9a-fA-F]+)$")
+# the algorithm of a sha256sum style line, by the length of its digest
+_algorithm_by_length = {32 : "md5", 40 : "sha1", 64 : "sha256",
+                        128 : "sha512"}
+
+class DigestMismatch(Exception):
+    pass
+
+def _new_hashers(algorithms):
+    """
+    return a list of (name, hash object); raise ValueError for an unknown
+    algorithm
+    """
+    return [(name.lower(), hashlib.new(name.lower()), ) \
+            for name in algorithms]
+
+class HashingReader(object):
+    """
+    file_object
+        a binary file object, such as an open file or a ReadReporter
+
+    algorithms
+        the hashlib names of the digests to compute
+
+    A file-like object that hashes what is read through it.
+    """
+    def __init__(self, file_object, algorithms=default_algorithms):
+        self._file_object = file_object
+        self._algorithms = algorithms
+        self._hashers = _new_hashers(algorithms)
+        self._start = None
+        self.bytes_hashed = 0
+
+    @property
+    def file_object(self):
+        """
+        the wrapped file object
+        """
+        return self._file_object
+
+    def _mark_start(self):
+        if self._start is None:
+            self._start = self._tell()
+
+    def _update(self, data):
+        for _, hasher in self._hashers:
+            hasher.update(data)
+        self.bytes_hashed += len(data)
+
+    def _tell(self):
+        try:
+            return self._file_object.tell()
+        except Exception:
+            # a pipe can not be rewound, so where it started doesn't matter
+            return 0
+
+    def read(self, size=None):
+        self._mark_start()
+        if size is None:
+            data = self._file_object.read()
+        else:
+            data = self._file_object.read(size)
+        self._update(data)
+        return data
+
+    def readinto(self, buffer):
+        """
+        read into a writable buffer, returning the number of bytes read
+        """
+        self._mark_start()
+        readinto = getattr(self._file_object, "readinto", None)
+        if readinto is not None:
+            bytes_read = readinto(buffer)
+        else:
+            view = memoryview(buffer).cast("B")
+            data = self._file_object.read(len(view))
+            bytes_read = len(data)
+            view[:bytes_read] = data
+        if bytes_read:
+            self._update(memoryview(buffer).cast("B")[:bytes_read])
+        return bytes_read
+
+    def seek(self, offset, whence=0):
+        result = self._file_object.seek(offset, whence)
+        if self._start is not None and self._tell() == self._start:
+            # rewound for a retry: hash the bytes again from the start
+            self._hashers = _new_hashers(self._algorithms)
+            self.bytes_hashed = 0
+        return result
+
+    def tell(self):
+        return self._file_object.tell()
+
+    def close(self):
+        self._file_object.close()
+
+    def hexdigests(self):
+        """
+        return a dict of algorithm name : hex digest of the bytes read
+        """
+        return dict((name, hasher.hexdigest(), ) \
+                    for (name, hasher) in self._hashers)
+
+class HashingWriter(object):
+    """
+    destination
+        a binary file object, a file descriptor, or a callable taking a
+        memoryview, as for DownloadSink
+
+    algorithms
+        the hashlib names of the digests to compute
+
+    A DownloadSink destination that hashes what is written to it.
+    """
+    def __init__(self, destination, algorithms=default_algorithms):
+        self._write = destination_writer(destination)
+        self._hashers = _new_hashers(algorithms)
+        self.bytes_hashed = 0
+
+    def __call__(self, view):
+        for _, hasher in self._hashers:
+            hasher.update(view)
+        self.bytes_hashed += len(view)
+        self._write(view)
+
+    def hexdigests(self):
+        """
+        return a dict of algorithm name : hex digest of the bytes written
+        """
+        return dict((name, hasher.hexdigest(), ) \
+                    for (name, hasher) in self._hashers)
+
+def etag_md5(etag):
+    """
+    return the MD5 hex digest an ETag holds, or None if it is not one
+    """
+    if etag is None:
+        return None
+    match = _etag_md5_re.match(etag.strip())
+    if match is None:
+        return None
+    return match.group(2).lower()
+
+def fetch_server_md5(connection_pool, hostname, identity, key):
+    """
+    return the MD5 the service has for the key, from the ETag of a HEAD,
+    or None if it gives none
+    """
+    with connection_pool.connection(hostname, identity) as http_connection:
+        response = http_connection.request("HEAD", compute_uri("data", key))
+        response.read()
+        return etag_md5(response.getheader("ETag"))
+
+def load_digest_manifest(input_file):
+    """
+    input_file
+        a text file of sha256sum, md5sum or BSD style lines
+
+    return a dict of name : {algorithm : hex digest}
+    """
+    manifest = dict()
+    for line in input_file:
+        line = line.rstrip("\r\n")
+        if len(line.strip()) == 0 or line.startswith("#"):
+            continue
+        match = _bsd_line_re.match(line)
+        if match is not None:
+            algorithm = match.group(1).lower().replace("-", "")
+            name, digest = match.group(2), match.group(3)
+        else:
+            match = _gnu_line_re.match(line)
+            if match is None:
+                raise ValueError("not a digest line: {0!r}".format(line))
+            digest, name = match.group(1), match.group(2)
+            algorithm = _algorithm_by_length.get(len(digest))
+            if algorithm is None:
+                raise ValueError("unknown digest length: {0!r}".format(line))
+        manifest.setdefault(name, dict())[algorithm] = digest.lower()
+    return manifest
+
+def verify_digests(name, digests, expected):
+    """
+    name
+        what was hashed, for the error message
+
+    digests
+        a dict of algorithm : hex digest, as from hexdigests()
+
+    expected
+        a dict of algorithm : hex digest to check them against
+
+    raise DigestMismatch if any algorithm in both differs
+    return the sorted list of the algorithms checked
+    """
+    checked = sorted(set(digests) & set(expected))
+    mismatched = [algorithm for algorithm in checked \
+                  if digests[algorithm] != expected[algorithm].lower()]
+    if len(mismatched) > 0:
+        raise DigestMismatch("{0}: {1} digest {2} expected {3}".format(
+            name,
+            mismatched[0],
+            digests[mismatched[0]],
+            expected[mismatched[0]]))
+    return checked
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+test_async_http_connection.py
+
+parity tests: AsyncHTTPConnection against HTTPConnection,
+both talking to a StandInServer
+"""
+import asyncio
+import os
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.http_connection import HTTPConnection, \
+    UnAuthHTTPConnection, \
+    LumberyardHTTPError, \
+    LumberyardRetryableHTTPError
+from lumberyard.async_http_connection import AsyncHTTPConnection, \
+    AsyncUnAuthHTTPConnection
+from lumberyard.http_util import compute_uri
+from lumberyard.retry_policy import no_retry_policy
+from lumberyard.stand_in_server import StandInServer
+
+_user_name = "test-user"
+_auth_key_id = "42"
+_auth_key = "test-auth-key"
+_collection_name = "default"
+
+def _run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+class TestAsyncParity(unittest.TestCase):
+    """
+    the asyncio client must behave like the synchronous client
+    """
+    def setUp(self):
+        self._server = StandInServer({_user_name : (_auth_key_id, _auth_key)})
+        self._server.start()
+
+    def tearDown(self):
+        self._server.stop()
+
+    def _sync_connection(self, auth_key=_auth_key, **kwargs):
+        return HTTPConnection(self._server.base_address,
+                              _user_name,
+                              auth_key,
+                              _auth_key_id,
+                              **kwargs)
+
+    def _async_connection(self, auth_key=_auth_key, **kwargs):
+        return AsyncHTTPConnection(self._server.base_address,
+                                   _user_name,
+                                   auth_key,
+                                   _auth_key_id,
+                                   **kwargs)
+
+    def _sync_result(self, method, uri, body=None, auth_key=_auth_key,
+                     retry_policy=None):
+        connection = self._sync_connection(auth_key,
+                                           retry_policy=retry_policy)
+        try:
+            response = connection.request(method, uri, body=body)
+            return response.status, response.read()
+        except LumberyardRetryableHTTPError as instance:
+            return "retry", instance.retry_after
+        except LumberyardHTTPError as instance:
+            return "error", instance.status
+        finally:
+            connection.close()
+
+    def _async_result(self, method, uri, body=None, auth_key=_auth_key,
+                      retry_policy=None):
+        async def _request():
+            connection = self._async_connection(auth_key,
+                                                retry_policy=retry_policy)
+            try:
+                response = await connection.request(method, uri, body=body)
+                return response.status, await response.read()
+            except LumberyardRetryableHTTPError as instance:
+                return "retry", instance.retry_after
+            except LumberyardHTTPError as instance:
+                return "error", instance.status
+            finally:
+                await connection.close()
+        return _run(_request())
+
+    def test_retrieve(self):
+        self._server.set_key(_collection_name, "aaa", b"x" * 100000)
+        uri = compute_uri("data", "aaa")
+        self.assertEqual(self._sync_result("GET", uri),
+                         self._async_result("GET", uri))
+        self.assertEqual(self._async_result("GET", uri),
+                         (200, b"x" * 100000, ))
+
+    def test_archive(self):
+        for label, result_function in [("sync", self._sync_result),
+                                       ("async", self._async_result)]:
+            uri = compute_uri("data", label)
+            status, _ = result_function("PUT", uri, body=label.encode("utf-8"))
+            self.assertEqual(status, 200)
+            self.assertEqual(self._server.get_key(_collection_name, label),
+                             label.encode("utf-8"))
+
+    def test_empty_put(self):
+        uri = compute_uri("data", "empty")
+        self.assertEqual(self._sync_result("PUT", uri),
+                         self._async_result("PUT", uri))
+        self.assertEqual(self._server.get_key(_collection_name, "empty"), b"")
+
+    def test_not_found(self):
+        uri = compute_uri("data", "no-such-key")
+        self.assertEqual(self._sync_result("GET", uri), ("error", 404, ))
+        self.assertEqual(self._async_result("GET", uri), ("error", 404, ))
+
+    def test_bad_signature(self):
+        uri = compute_uri("data", "aaa")
+        self.assertEqual(self._sync_result("PUT", uri, b"a", "wrong-key"),
+                         ("error", 401, ))
+        self.assertEqual(self._async_result("PUT", uri, b"a", "wrong-key"),
+                         ("error", 401, ))
+
+    def test_retry_after(self):
+        uri = compute_uri("data", "aaa")
+        self._server.queue_failure(503, retry_after=7)
+        sync_result = self._sync_result("GET", uri,
+                                        retry_policy=no_retry_policy)
+        self._server.queue_failure(503, retry_after=7)
+        async_result = self._async_result("GET", uri,
+                                          retry_policy=no_retry_policy)
+        self.assertEqual(sync_result, ("retry", 7, ))
+        self.assertEqual(async_result, sync_result)
+
+    def test_unauthenticated(self):
+        self._server.set_key(_collection_name, "public", b"public data")
+        uri = compute_uri("data", "public")
+
+        connection = UnAuthHTTPConnection(self._server.base_address)
+        sync_data = connection.request("GET", uri).read()
+        connection.close()
+
+        async def _request():
+            connection = AsyncUnAuthHTTPConnection(self._server.base_address)
+            response = await connection.request("GET", uri)
+            data = await response.read()
+            await connection.close()
+            return data
+
+        self.assertEqual(_run(_request()), sync_data)
+
+    def test_concurrent_requests(self):
+        for index in range(20):
+            self._server.set_key(_collection_name,
+                                 "key-{0}".format(index),
+                                 str(index).encode("utf-8") * 1000)
+
+        async def _retrieve(connection, index):
+            uri = compute_uri("data", "key-{0}".format(index))
+            response = await connection.request("GET", uri)
+            return await response.read()
+
+        async def _retrieve_all():
+            connection = self._async_connection(max_streams=4)
+            results = await asyncio.gather(
+                *[_retrieve(connection, index) for index in range(20)])
+            await connection.close()
+            return results
+
+        results = _run(_retrieve_all())
+        for index, data in enumerate(results):
+            self.assertEqual(data, str(index).encode("utf-8") * 1000)
+
+    def test_streamed_bodies(self):
+        async def _produce():
+            for _ in range(10):
+                yield b"y" * 10000
+
+        async def _archive_and_retrieve():
+            connection = self._async_connection()
+            uri = compute_uri("data", "streamed")
+            response = await connection.request("PUT", uri, body=_produce())
+            await response.release()
+            response = await connection.request("GET", uri)
+            chunks = [data async for data in response.iter_chunks(4096)]
+            await connection.close()
+            return chunks
+
+        chunks = _run(_archive_and_retrieve())
+        self.assertTrue(max(len(data) for data in chunks) <= 4096)
+        self.assertEqual(b"".join(chunks), b"y" * 100000)
+
+    def test_timeout(self):
+        self._server.set_key(_collection_name, "slow", b"slow")
+        self._server.delay_seconds = 1.0
+
+        async def _request():
+            connection = self._async_connection(retry_policy=no_retry_policy)
+            try:
+                await connection.request("GET",
+                                         compute_uri("data", "slow"),
+                                         timeout=0.1)
+            finally:
+                await connection.close()
+
+        self.assertRaises(asyncio.TimeoutError, _run, _request())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+test_chunked_body.py
+
+test ChunkedBody framing, and chunked uploads from pipes and generators
+against a StandInServer
+"""
+import io
+import os
+import threading
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.chunked_body import ChunkedBody
+from lumberyard.connection_pool import ConnectionPool
+from lumberyard.http_connection import HTTPConnection
+from lumberyard.http_util import compute_uri
+from lumberyard.multipart_upload import MultipartUploader
+from lumberyard.ncl.identity import identity_template
+from lumberyard.stand_in_server import StandInServer
+
+_identity = identity_template(user_name="test-user",
+                              auth_key_id="42",
+                              auth_key="test-auth-key")
+_collection_name = "default"
+
+def _decode(framed):
+    """
+    return the data chunks of a chunked body
+    """
+    chunks = list()
+    stream = io.BytesIO(framed)
+    while True:
+        size = int(stream.readline().strip(), 16)
+        if size == 0:
+            return chunks
+        chunks.append(stream.read(size))
+        assert stream.read(2) == b"\r\n"
+
+class TestChunkedBody(unittest.TestCase):
+    """
+    framing of file and iterable sources
+    """
+    def test_file(self):
+        reported = list()
+        body = ChunkedBody(io.BytesIO(b"0123456789"),
+                           chunk_size=4,
+                           callback=reported.append)
+        framed = b"".join(bytes(chunk) for chunk in body)
+        self.assertTrue(framed.endswith(b"\r\n0\r\n\r\n"))
+        self.assertEqual(_decode(framed), [b"0123", b"4567", b"89"])
+        self.assertEqual(sum(reported), 10)
+        self.assertEqual(body.stats()["bytes_read"], 10)
+
+    def test_iterable(self):
+        reported = list()
+        blocks = [b"ab", u"c", memoryview(b"defghij"), b"", b"k"]
+        body = ChunkedBody(iter(blocks), chunk_size=4,
+                           callback=reported.append)
+        framed = b"".join(bytes(chunk) for chunk in body)
+        self.assertEqual(_decode(framed), [b"abcd", b"efgh", b"ijk"])
+        self.assertEqual(sum(reported), 11)
+
+    def test_empty(self):
+        framed = b"".join(bytes(chunk) for chunk in ChunkedBody([]))
+        self.assertEqual(framed, b"0\r\n\r\n")
+        with self.assertRaises(ValueError):
+            ChunkedBody([], chunk_size=0)
+
+class TestChunkedUpload(unittest.TestCase):
+    """
+    bodies of unknown length go out chunked and arrive intact
+    """
+    def setUp(self):
+        self._server = StandInServer(
+            {_identity.user_name : (_identity.auth_key_id,
+                                    _identity.auth_key)})
+        self._server.start()
+        self._connection = HTTPConnection(self._server.base_address,
+                                          _identity.user_name,
+                                          _identity.auth_key,
+                                          _identity.auth_key_id)
+
+    def tearDown(self):
+        self._connection.close()
+        self._server.stop()
+
+    def _pipe(self, data, block_size=10000):
+        """
+        return the read end of a pipe a thread writes data into
+        """
+        read_fd, write_fd = os.pipe()
+
+        def _write():
+            with os.fdopen(write_fd, "wb") as output_file:
+                for offset in range(0, len(data), block_size):
+                    output_file.write(data[offset:offset + block_size])
+
+        thread = threading.Thread(target=_write)
+        thread.daemon = True
+        thread.start()
+        return os.fdopen(read_fd, "rb")
+
+    def test_pipe(self):
+        data = os.urandom(1024 * 1024 + 5)
+        with self._pipe(data) as body:
+            response = self._connection.request("PUT",
+                                                compute_uri("data", "pipe"),
+                                                body=body)
+            response.read()
+        headers = self._server.last_headers
+        self.assertEqual(headers["Transfer-Encoding"], "chunked")
+        self.assertFalse("Content-Length" in headers)
+        self.assertEqual(self._server.get_key(_collection_name, "pipe"), data)
+
+    def test_generator(self):
+        blocks = (b"g" * 1000 for _ in range(50))
+        body = ChunkedBody(blocks, chunk_size=4096)
+        response = self._connection.request("PUT",
+                                            compute_uri("data", "blocks"),
+                                            body=body)
+        response.read()
+        self.assertEqual(self._server.last_headers["Transfer-Encoding"],
+                         "chunked")
+        self.assertEqual(self._server.get_key(_collection_name, "blocks"),
+                         b"g" * 50000)
+
+    def test_archive_stream(self):
+        data = os.urandom(300000)
+        pool = ConnectionPool()
+        try:
+            uploader = MultipartUploader(pool,
+                                         self._server.base_address,
+                                         _identity)
+            with self._pipe(data) as source:
+                progress = uploader.archive_stream("stream",
+                                                   source,
+                                                   chunk_size=65536)
+        finally:
+            pool.close_all()
+        self.assertEqual(progress.bytes_sent, len(data))
+        self.assertEqual(self._server.get_key(_collection_name, "stream"),
+                         data)
+
+if __name__ == "__main__":
+    unittest.main()
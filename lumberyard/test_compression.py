@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+test_compression.py
+
+test CompressingReader and DecompressingWriter, and a compressed archive
+and retrieve against a StandInServer
+"""
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import io
+import os
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.compression import CompressingReader, \
+    CompressionError, \
+    DecompressingWriter, \
+    codec_names, \
+    compression_meta, \
+    compression_meta_name, \
+    fetch_key_meta
+from lumberyard.connection_pool import ConnectionPool
+from lumberyard.download_sink import DownloadSink
+from lumberyard.http_util import compute_uri
+from lumberyard.multipart_upload import MultipartUploader
+from lumberyard.ncl.identity import identity_template
+from lumberyard.stand_in_server import StandInServer
+
+_identity = identity_template(user_name="test-user",
+                              auth_key_id="42",
+                              auth_key="test-auth-key")
+_collection_name = "default"
+_data = b"".join("line {0} of a log\n".format(n).encode("ascii") \
+                 for n in range(20000))
+
+def _decompress(compressed, codec, block_size=1000):
+    output = io.BytesIO()
+    writer = DecompressingWriter(output, codec)
+    view = memoryview(compressed)
+    for offset in range(0, len(view), block_size):
+        writer(view[offset:offset + block_size])
+    writer.close()
+    return output.getvalue()
+
+class TestCompression(unittest.TestCase):
+    """
+    round trips through each codec, as one stream and in blocks
+    """
+    def setUp(self):
+        self._executor = ThreadPoolExecutor(max_workers=3)
+
+    def tearDown(self):
+        self._executor.shutdown()
+
+    def test_round_trip(self):
+        for codec in codec_names:
+            for executor in [None, self._executor]:
+                for data in [_data, b""]:
+                    reported = list()
+                    reader = CompressingReader(io.BytesIO(data),
+                                               codec,
+                                               callback=reported.append,
+                                               executor=executor,
+                                               block_size=50000)
+                    compressed = reader.read()
+                    self.assertEqual(sum(reported), len(data))
+                    self.assertEqual(_decompress(compressed, codec), data,
+                                     (codec, executor, ))
+                    if len(data) > 0:
+                        self.assertTrue(reader.stats()["ratio"] > 2.0)
+
+    def test_blocks_are_valid_gzip(self):
+        reader = CompressingReader(io.BytesIO(_data),
+                                   executor=self._executor,
+                                   block_size=10000)
+        self.assertEqual(gzip.decompress(reader.read()), _data)
+
+    def test_truncated(self):
+        compressed = gzip.compress(_data)
+        with self.assertRaises(CompressionError):
+            _decompress(compressed[:len(compressed) // 2], "gzip")
+        with self.assertRaises(CompressionError):
+            CompressingReader(io.BytesIO(_data), "zip")
+
+    def test_bounded_output(self):
+        # a large expansion comes out in blocks, not all at once
+        sizes = list()
+        writer = DecompressingWriter(lambda view: sizes.append(len(view)),
+                                     "gzip")
+        writer(memoryview(gzip.compress(b"\0" * (8 * 1024 * 1024))))
+        writer.close()
+        self.assertEqual(sum(sizes), 8 * 1024 * 1024)
+        self.assertTrue(max(sizes) <= 1024 * 1024)
+
+class TestCompressedTransfer(unittest.TestCase):
+    """
+    archive compressed with the codec in the metadata, and retrieve
+    """
+    def setUp(self):
+        self._server = StandInServer(
+            {_identity.user_name : (_identity.auth_key_id,
+                                    _identity.auth_key)})
+        self._server.start()
+        self._pool = ConnectionPool()
+
+    def tearDown(self):
+        self._pool.close_all()
+        self._server.stop()
+
+    def test_archive_and_retrieve(self):
+        uploader = MultipartUploader(self._pool,
+                                     self._server.base_address,
+                                     _identity)
+        reader = CompressingReader(io.BytesIO(_data), "bz2")
+        uploader.archive_stream("logs", reader, meta=compression_meta("bz2"))
+        stored = self._server.get_key(_collection_name, "logs")
+        self.assertTrue(len(stored) < len(_data) / 2)
+
+        key_meta = fetch_key_meta(self._pool,
+                                  self._server.base_address,
+                                  _identity,
+                                  "logs")
+        codec = key_meta[compression_meta_name]
+        self.assertEqual(codec, "bz2")
+
+        output = io.BytesIO()
+        writer = DecompressingWriter(output, codec)
+        with self._pool.connection(self._server.base_address, _identity) \
+            as http_connection:
+            response = http_connection.request("GET",
+                                               compute_uri("data", "logs"))
+            DownloadSink(writer).drain(response)
+        writer.close()
+        self.assertEqual(output.getvalue(), _data)
+
+if __name__ == "__main__":
+    unittest.main()
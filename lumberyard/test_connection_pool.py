@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+test_connection_pool.py
+
+test ConnectionPool against a StandInServer
+"""
+import os
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.connection_pool import ConnectionPool
+from lumberyard.ncl.identity import identity_template
+from lumberyard.stand_in_server import StandInServer
+
+_identity = identity_template(user_name="test-user",
+                              auth_key_id="42",
+                              auth_key="test-auth-key")
+
+class TestConnectionPool(unittest.TestCase):
+    """
+    checkout, checkin and close_all
+    """
+    def setUp(self):
+        self._server = StandInServer(
+            {_identity.user_name : (_identity.auth_key_id,
+                                    _identity.auth_key)})
+        self._server.start()
+        self._pool = ConnectionPool()
+
+    def tearDown(self):
+        self._pool.close_all()
+        self._server.stop()
+
+    def _request(self, http_connection):
+        http_connection.request("GET", "/data/").read()
+
+    def test_reuse(self):
+        for _ in range(3):
+            with self._pool.connection(self._server.base_address,
+                                       _identity) as http_connection:
+                self._request(http_connection)
+        stats = self._pool.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["idle"], ),
+                         (2, 1, 1, ))
+
+    def test_close_all(self):
+        # a connection out during close_all is closed when it comes back
+        busy_connection = self._pool.checkout(self._server.base_address,
+                                              _identity)
+        self._request(busy_connection)
+        with self._pool.connection(self._server.base_address, _identity) \
+            as idle_connection:
+            self._request(idle_connection)
+        self._pool.close_all()
+        self.assertEqual(self._pool.stats()["idle"], 0)
+        self.assertEqual(idle_connection.sock, None)
+
+        self._pool.checkin(busy_connection)
+        self.assertEqual(busy_connection.sock, None)
+        self.assertEqual(self._pool.stats()["idle"], 0)
+
+        # and the pool still works
+        with self._pool.connection(self._server.base_address, _identity) \
+            as http_connection:
+            self._request(http_connection)
+        self.assertEqual(self._pool.stats()["idle"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+test_digests.py
+
+test HashingReader, HashingWriter and the digest checks, and hashed
+archives and retrieves against a StandInServer
+"""
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.connection_pool import ConnectionPool
+from lumberyard.download_sink import DownloadSink
+from lumberyard.http_connection import HTTPConnection
+from lumberyard.http_util import compute_uri
+from lumberyard.multipart_upload import MultipartUploader
+from lumberyard.ncl.identity import identity_template
+from lumberyard.retry_policy import RetryPolicy
+from lumberyard.stand_in_server import StandInServer
+from lumberyard.stream_digest import DigestMismatch, \
+    HashingReader, \
+    HashingWriter, \
+    etag_md5, \
+    fetch_server_md5, \
+    load_digest_manifest, \
+    verify_digests
+
+_identity = identity_template(user_name="test-user",
+                              auth_key_id="42",
+                              auth_key="test-auth-key")
+_collection_name = "default"
+
+def _expected(data):
+    return {"md5"       : hashlib.md5(data).hexdigest(),
+            "sha256"    : hashlib.sha256(data).hexdigest()}
+
+class TestStreamDigest(unittest.TestCase):
+    """
+    hashing readers and writers, and the checks
+    """
+    def test_reader(self):
+        data = os.urandom(100000)
+        reader = HashingReader(io.BytesIO(data))
+        buffer = bytearray(7000)
+        self.assertEqual(reader.read(5), data[:5])
+        while reader.readinto(buffer) > 0:
+            pass
+        self.assertEqual(reader.bytes_hashed, len(data))
+        self.assertEqual(reader.hexdigests(), _expected(data))
+
+    def test_rewind(self):
+        # a retry rewinds the body; the bytes are hashed once, not twice
+        data = os.urandom(10000)
+        source = io.BytesIO(b"header" + data)
+        source.seek(6)
+        reader = HashingReader(source, ["sha256"])
+        reader.read(4000)
+        reader.seek(6)
+        self.assertEqual(reader.read(), data)
+        self.assertEqual(reader.hexdigests(),
+                         {"sha256" : hashlib.sha256(data).hexdigest()})
+
+    def test_writer(self):
+        data = os.urandom(50000)
+        output = io.BytesIO()
+        writer = HashingWriter(output, ["md5", "SHA256"])
+        for offset in range(0, len(data), 3000):
+            writer(memoryview(data)[offset:offset + 3000])
+        self.assertEqual(output.getvalue(), data)
+        self.assertEqual(writer.hexdigests(), _expected(data))
+        with self.assertRaises(ValueError):
+            HashingWriter(output, ["no-such-digest"])
+
+    def test_checks(self):
+        digest = hashlib.md5(b"x").hexdigest()
+        self.assertEqual(etag_md5('"{0}"'.format(digest.upper())), digest)
+        self.assertEqual(etag_md5("W/\"{0}\"".format(digest)), digest)
+        self.assertEqual(etag_md5('"not-an-md5"'), None)
+        self.assertEqual(verify_digests("x",
+                                        {"md5" : digest, "sha1" : "00"},
+                                        {"md5" : digest.upper()}),
+                         ["md5"])
+        with self.assertRaises(DigestMismatch):
+            verify_digests("x", {"md5" : digest}, {"md5" : "0" * 32})
+
+    def test_manifest(self):
+        sha256 = hashlib.sha256(b"a").hexdigest()
+        md5 = hashlib.md5(b"b").hexdigest()
+        manifest = load_digest_manifest(io.StringIO(
+            u"# comment\n"
+            u"{0}  dir/a file\n"
+            u"{1} *b\n"
+            u"\n"
+            u"SHA256 (b) = {2}\n".format(sha256, md5, sha256)))
+        self.assertEqual(manifest, {"dir/a file" : {"sha256" : sha256},
+                                    "b" : {"md5" : md5,
+                                           "sha256" : sha256}})
+        with self.assertRaises(ValueError):
+            load_digest_manifest(io.StringIO(u"abc  short\n"))
+
+class TestHashedTransfer(unittest.TestCase):
+    """
+    digests of archives and retrieves agree with the service's ETag
+    """
+    def setUp(self):
+        self._server = StandInServer(
+            {_identity.user_name : (_identity.auth_key_id,
+                                    _identity.auth_key)})
+        self._server.start()
+        self._pool = ConnectionPool()
+        self._uploader = MultipartUploader(self._pool,
+                                           self._server.base_address,
+                                           _identity,
+                                           part_size=1000)
+        self._directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+        self._pool.close_all()
+        self._server.stop()
+
+    def _write(self, name, data):
+        path = os.path.join(self._directory, name)
+        with open(path, "wb") as output_file:
+            output_file.write(data)
+        return path
+
+    def test_archive(self):
+        # larger than a part, and in two files: still sent in parts, six
+        # of them with the start and the finish of the conversation
+        first, second = os.urandom(3000), os.urandom(2500)
+        paths = [self._write("first", first), self._write("second", second)]
+        progress = self._uploader.archive("key", paths,
+                                          algorithms=["md5", "sha256"])
+        self.assertEqual(self._server.request_count, 8)
+        self.assertEqual(progress.bytes_sent, 5500)
+        self.assertEqual(progress.digests, _expected(first + second))
+        self.assertEqual(self._server.get_key(_collection_name, "key"),
+                         first + second)
+        self.assertEqual(fetch_server_md5(self._pool,
+                                          self._server.base_address,
+                                          _identity,
+                                          "key"),
+                         progress.digests["md5"])
+
+    def test_archive_whole(self):
+        # one file no larger than a part is hashed as it is sent
+        data = os.urandom(1000)
+        progress = self._uploader.archive("key",
+                                          [self._write("data", data)],
+                                          algorithms=["sha256"])
+        self.assertEqual(self._server.request_count, 1)
+        self.assertEqual(progress.digests,
+                         {"sha256" : hashlib.sha256(data).hexdigest()})
+
+    def test_retried_put(self):
+        # the retry rewinds the body, and the digest is of one copy of it
+        data = os.urandom(20000)
+        self._server.queue_failure(503)
+        connection = HTTPConnection(self._server.base_address,
+                                    _identity.user_name,
+                                    _identity.auth_key,
+                                    _identity.auth_key_id,
+                                    retry_policy=RetryPolicy(
+                                        base_delay=0.01,
+                                        max_delay=0.01,
+                                        breaker_threshold=None))
+        try:
+            with open(self._write("data", data), "rb") as input_file:
+                reader = HashingReader(input_file, ["sha256"])
+                connection.request("PUT",
+                                   compute_uri("data", "key"),
+                                   body=reader).read()
+        finally:
+            connection.close()
+        self.assertEqual(self._server.get_key(_collection_name, "key"), data)
+        self.assertEqual(reader.hexdigests(),
+                         {"sha256" : hashlib.sha256(data).hexdigest()})
+
+    def test_archive_stream(self):
+        data = os.urandom(70000)
+        progress = self._uploader.archive_stream("stream",
+                                                 io.BytesIO(data),
+                                                 chunk_size=4096,
+                                                 algorithms=["md5"])
+        self.assertEqual(progress.digests,
+                         {"md5" : hashlib.md5(data).hexdigest()})
+        self.assertEqual(self._uploader.archive_stream(
+            "plain", io.BytesIO(data)).digests, None)
+
+    def test_retrieve(self):
+        data = os.urandom(200000)
+        self._server.set_key(_collection_name, "key", data)
+        output = io.BytesIO()
+        writer = HashingWriter(output)
+        with self._pool.connection(self._server.base_address, _identity) \
+            as http_connection:
+            response = http_connection.request("GET",
+                                               compute_uri("data", "key"))
+            server_md5 = etag_md5(response.getheader("ETag"))
+            DownloadSink(writer).drain(response)
+        self.assertEqual(output.getvalue(), data)
+        self.assertEqual(verify_digests("key",
+                                        writer.hexdigests(),
+                                        {"md5" : server_md5}),
+                         ["md5"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+test_directory_sync.py
+
+test DirectorySync against a StandInServer
+"""
+import os
+import shutil
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.connection_pool import ConnectionPool
+from lumberyard.directory_sync import DirectorySync, \
+    SyncError, \
+    SyncManifest, \
+    iter_tree, \
+    merge_sorted
+from lumberyard.ncl.identity import identity_template
+from lumberyard.stand_in_server import StandInServer
+
+_identity = identity_template(user_name="test-user",
+                              auth_key_id="42",
+                              auth_key="test-auth-key")
+_collection_name = "default"
+
+class TestDirectorySync(unittest.TestCase):
+    """
+    sync a small tree, then change it
+    """
+    def setUp(self):
+        self._server = StandInServer(
+            {_identity.user_name : (_identity.auth_key_id,
+                                    _identity.auth_key)})
+        self._server.start()
+        self._pool = ConnectionPool()
+        self._directory = tempfile.mkdtemp()
+        self._tree = os.path.join(self._directory, "tree")
+        self._files = dict()
+        for name in ["a", "b/c", "b/d", "b.e", "f/g/h"]:
+            self._write(name, name.encode("utf-8") * 100)
+
+    def tearDown(self):
+        self._pool.close_all()
+        self._server.stop()
+        shutil.rmtree(self._directory)
+
+    def _write(self, name, data):
+        path = os.path.join(self._tree, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as output_file:
+            output_file.write(data)
+        self._files[name] = data
+
+    def _sync(self, delete=False):
+        directory_sync = DirectorySync(
+            self._pool,
+            self._server.base_address,
+            _identity,
+            os.path.join(self._directory, "manifest.sqlite"),
+            key_prefix="sync/",
+            delete=delete,
+            max_workers=2)
+        return directory_sync.sync(self._tree)
+
+    def _assert_mirrored(self):
+        keys = [entry["key"] for entry in \
+                self._server.list_keys(_collection_name, "sync/", None, None)]
+        self.assertEqual(keys, sorted("sync/" + name for name in self._files))
+        for name, data in self._files.items():
+            self.assertEqual(self._server.get_key(_collection_name,
+                                                  "sync/" + name), data)
+
+    def test_tree_order(self):
+        keys = [key for (key, _, _) in iter_tree(self._tree)]
+        self.assertEqual(keys, sorted(self._files))
+        merged = list(merge_sorted([("a", 1), ("c", 3)], [("b", 2), ("c", 4)]))
+        self.assertEqual(merged, [("a", [1, None]),
+                                  ("b", [None, 2]),
+                                  ("c", [3, 4])])
+
+    def test_sync(self):
+        result = self._sync()
+        self.assertEqual((result.files, result.uploaded, len(result.errors)),
+                         (5, 5, 0))
+        self._assert_mirrored()
+
+        result = self._sync()
+        self.assertEqual((result.unchanged, result.hashed, result.uploaded),
+                         (5, 0, 0))
+
+        # a new mtime with the same contents is hashed, not uploaded
+        path = os.path.join(self._tree, "a")
+        os.utime(path, (1000000000, 1000000000))
+        self._write("b/d", b"changed")
+        self._write("b/x", b"new")
+        result = self._sync()
+        self.assertEqual((result.touched, result.uploaded, result.unchanged),
+                         (1, 2, 3))
+        self._assert_mirrored()
+
+        os.remove(os.path.join(self._tree, "b/c"))
+        del self._files["b/c"]
+        self._server.set_key(_collection_name, "sync/stray", b"x")
+        self.assertEqual(self._sync().deleted, 0)
+        result = self._sync(delete=True)
+        self.assertEqual((result.deleted, result.uploaded), (2, 0))
+        self._assert_mirrored()
+
+    def test_interrupted_sync_resumes(self):
+        self._server.queue_failure(400, match="sync/b/d")
+        result = self._sync()
+        self.assertEqual([key for (key, _) in result.errors], ["sync/b/d"])
+        self.assertEqual(result.uploaded, 4)
+
+        result = self._sync()
+        self.assertEqual((result.unchanged, result.uploaded), (4, 1))
+        self._assert_mirrored()
+
+    def test_manifest_target(self):
+        path = os.path.join(self._directory, "manifest.sqlite")
+        SyncManifest(path, "one").close()
+        with self.assertRaises(SyncError):
+            SyncManifest(path, "two")
+
+if __name__ == "__main__":
+    unittest.main()
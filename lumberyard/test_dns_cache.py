@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+test_dns_cache.py
+
+test DNSCache with a counting resolver, and HTTPConnection connecting
+through it to a StandInServer
+"""
+import os
+import socket
+import threading
+import time
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.dns_cache import DNSCache
+from lumberyard.http_connection import HTTPConnection
+from lumberyard.http_util import compute_uri
+from lumberyard.stand_in_server import StandInServer
+
+class _Resolver(object):
+    """
+    resolve every name to 127.0.0.1, except names starting with "bad"
+    """
+    def __init__(self, delay_seconds=0.0):
+        self.calls = list()
+        self.delay_seconds = delay_seconds
+        self.fail = False
+
+    def __call__(self, host, port, family=0, socktype=0):
+        self.calls.append(host)
+        time.sleep(self.delay_seconds)
+        if self.fail or host.startswith("bad"):
+            raise socket.gaierror(socket.EAI_NONAME, "unknown " + host)
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "",
+                 ("127.0.0.1", port), )]
+
+class TestDNSCache(unittest.TestCase):
+    """
+    cache behaviour
+    """
+    def test_positive(self):
+        resolver = _Resolver()
+        cache = DNSCache(positive_ttl=0.2, stale_seconds=0, resolver=resolver)
+        first = cache.resolve("aaa.example", 443)
+        self.assertEqual(cache.resolve("aaa.example", 443), first)
+        self.assertEqual(len(resolver.calls), 1)
+        time.sleep(0.25)
+        cache.resolve("aaa.example", 443)
+        self.assertEqual(len(resolver.calls), 2)
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 2)
+
+    def test_negative(self):
+        resolver = _Resolver()
+        cache = DNSCache(negative_ttl=60, resolver=resolver)
+        for _ in range(3):
+            self.assertRaises(socket.gaierror,
+                              cache.resolve, "bad.example", 443)
+        self.assertEqual(len(resolver.calls), 1)
+        self.assertEqual(cache.stats()["negative_hits"], 2)
+
+    def test_stale_while_revalidate(self):
+        resolver = _Resolver()
+        cache = DNSCache(positive_ttl=0.05, stale_seconds=60,
+                         resolver=resolver)
+        addresses = cache.resolve("aaa.example", 443)
+        time.sleep(0.1)
+
+        # an expired entry is served at once while it is refreshed
+        resolver.delay_seconds = 0.5
+        start_time = time.time()
+        self.assertEqual(cache.resolve("aaa.example", 443), addresses)
+        self.assertTrue(time.time() - start_time < 0.25)
+        time.sleep(0.75)
+        self.assertEqual(len(resolver.calls), 2)
+        self.assertEqual(cache.stats()["stale_hits"], 1)
+
+        # a failed refresh keeps the stale addresses
+        resolver.delay_seconds = 0
+        resolver.fail = True
+        time.sleep(0.1)
+        self.assertEqual(cache.resolve("aaa.example", 443), addresses)
+        time.sleep(0.1)
+        self.assertEqual(cache.resolve("aaa.example", 443), addresses)
+
+    def test_concurrent_lookups_coalesce(self):
+        resolver = _Resolver(delay_seconds=0.2)
+        cache = DNSCache(resolver=resolver)
+        threads = [threading.Thread(target=cache.resolve,
+                                    args=("aaa.example", 443, )) \
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(resolver.calls), 1)
+
+    def test_prefetch(self):
+        resolver = _Resolver(delay_seconds=0.1)
+        cache = DNSCache(resolver=resolver)
+        names = ["c{0}.example:443".format(n) for n in range(20)]
+        start_time = time.time()
+        errors = cache.prefetch(names + ["bad.example:443"])
+        self.assertTrue(time.time() - start_time < 1.0)
+        self.assertEqual(list(errors.keys()), ["bad.example:443"])
+        for name in names:
+            cache.resolve(name.split(":")[0], 443)
+        self.assertEqual(len(resolver.calls), 21)
+
+class TestCachedConnection(unittest.TestCase):
+    """
+    HTTPConnection resolving through a DNSCache
+    """
+    def setUp(self):
+        self._server = StandInServer({"test-user" : ("42", "test-key")})
+        self._server.start()
+        self._server.set_key("photos", "aaa", b"aaa data")
+
+    def tearDown(self):
+        self._server.stop()
+
+    def test_connect_through_cache(self):
+        resolver = _Resolver()
+        cache = DNSCache(resolver=resolver)
+        _, port = self._server.base_address.split(":")
+        hostname = "photos.nimbus.test:{0}".format(port)
+        for _ in range(3):
+            connection = HTTPConnection(hostname,
+                                        "test-user",
+                                        "test-key",
+                                        "42",
+                                        dns_cache=cache)
+            try:
+                response = connection.request("GET",
+                                              compute_uri("data", "aaa"))
+                self.assertEqual(response.read(), b"aaa data")
+            finally:
+                connection.close()
+        self.assertEqual(resolver.calls, ["photos.nimbus.test"])
+
+if __name__ == "__main__":
+    unittest.main()
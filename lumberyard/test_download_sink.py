@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+test_download_sink.py
+
+test DownloadSink destinations, progress and buffer sizing, against a
+StandInServer
+"""
+import io
+import os
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.download_sink import DownloadSink
+import lumberyard.download_sink as download_sink
+from lumberyard.http_connection import HTTPConnection
+from lumberyard.http_util import compute_uri
+from lumberyard.stand_in_server import StandInServer
+
+_user_name = "test-user"
+_auth_key_id = "42"
+_auth_key = "test-auth-key"
+_collection_name = "default"
+
+class _SlowReader(object):
+    """
+    a body whose every read takes a second, by the fake clock
+    """
+    def __init__(self, data, clock):
+        self._stream = io.BytesIO(data)
+        self._clock = clock
+
+    def readinto(self, buffer):
+        self._clock.now += 1.0
+        return self._stream.readinto(buffer)
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+class TestDownloadSink(unittest.TestCase):
+    """
+    each destination gets the whole body, read through one buffer
+    """
+    def setUp(self):
+        self._server = StandInServer({_user_name : (_auth_key_id, _auth_key)})
+        self._server.start()
+        self._data = os.urandom(3 * 1024 * 1024 + 11)
+        self._server.set_key(_collection_name, "data", self._data)
+        self._connection = HTTPConnection(self._server.base_address,
+                                          _user_name,
+                                          _auth_key,
+                                          _auth_key_id)
+
+    def tearDown(self):
+        self._connection.close()
+        self._server.stop()
+
+    def _drain(self, sink):
+        response = self._connection.request("GET", compute_uri("data", "data"))
+        return sink.drain(response)
+
+    def test_file_object(self):
+        output_file = io.BytesIO()
+        reported = list()
+        sink = DownloadSink(output_file, reported.append)
+        self.assertEqual(self._drain(sink), len(self._data))
+        self.assertEqual(output_file.getvalue(), self._data)
+        self.assertEqual(sum(reported), len(self._data))
+
+    def test_file_descriptor(self):
+        with tempfile.TemporaryFile() as output_file:
+            sink = DownloadSink(output_file.fileno())
+            self._drain(sink)
+            output_file.seek(0)
+            self.assertEqual(output_file.read(), self._data)
+
+    def test_callable(self):
+        blocks = list()
+        sink = DownloadSink(lambda view: blocks.append(bytes(view)),
+                            min_buffer_size=4096,
+                            max_buffer_size=4096)
+        self._drain(sink)
+        self.assertEqual(b"".join(blocks), self._data)
+        self.assertTrue(all(len(block) <= 4096 for block in blocks))
+        self.assertEqual(sink.stats()["window_changes"], 0)
+
+    def test_coalesced_progress(self):
+        reported = list()
+        sink = DownloadSink(io.BytesIO(),
+                            reported.append,
+                            report_bytes=1024 * 1024,
+                            total_bytes=len(self._data),
+                            min_buffer_size=64 * 1024,
+                            max_buffer_size=64 * 1024)
+        self._drain(sink)
+        self.assertEqual(sum(reported), len(self._data))
+        self.assertEqual(len(reported), 4)
+        self.assertEqual(sink.stats()["bytes_read"], len(self._data))
+
+    def test_window_grows(self):
+        sink = DownloadSink(io.BytesIO(),
+                            min_buffer_size=4096,
+                            max_buffer_size=1024 * 1024)
+        sink.drain(io.BytesIO(self._data))
+        self.assertEqual(sink.buffer_size, 1024 * 1024)
+
+    def test_window_shrinks(self):
+        clock = _Clock()
+        previous_time = download_sink.time
+        download_sink.time = clock
+        try:
+            sink = DownloadSink(io.BytesIO(),
+                                min_buffer_size=4096,
+                                max_buffer_size=1024 * 1024)
+            sink.drain(io.BytesIO(b"x" * (64 * 1024)))
+            self.assertEqual(sink.buffer_size, 64 * 1024)
+            sink.drain(_SlowReader(b"x" * (256 * 1024), clock))
+            self.assertEqual(sink.buffer_size, 4096)
+        finally:
+            download_sink.time = previous_time
+
+if __name__ == "__main__":
+    unittest.main()
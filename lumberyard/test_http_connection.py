@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+test_http_connection.py
+
+test streaming file bodies with a Content-Length, against a StandInServer
+"""
+import io
+import os
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.http_connection import HTTPConnection
+from lumberyard.http_util import compute_uri, compute_body_length
+from lumberyard.read_reporter import ReadReporter
+from lumberyard.stand_in_server import StandInServer
+
+_user_name = "test-user"
+_auth_key_id = "42"
+_auth_key = "test-auth-key"
+_collection_name = "default"
+
+class TestBodyLength(unittest.TestCase):
+    """
+    compute_body_length for each kind of body
+    """
+    def test_lengths(self):
+        self.assertEqual(compute_body_length(None), 0)
+        self.assertEqual(compute_body_length(b"abc"), 3)
+        self.assertEqual(compute_body_length(memoryview(b"abcd")), 4)
+        self.assertEqual(compute_body_length(iter([b"a", b"b"])), None)
+        self.assertEqual(compute_body_length([b"a", b"bb"]), None)
+
+        stream = io.BytesIO(b"x" * 100)
+        stream.read(30)
+        self.assertEqual(compute_body_length(stream), 70)
+        self.assertEqual(stream.tell(), 30)
+        self.assertEqual(compute_body_length(ReadReporter(stream, len)), 70)
+
+    def test_real_file(self):
+        with tempfile.TemporaryFile() as body:
+            body.write(b"y" * 1000)
+            body.seek(250)
+            self.assertEqual(compute_body_length(body), 750)
+            self.assertEqual(compute_body_length(ReadReporter(body, len)),
+                             750)
+
+class TestStreamedBody(unittest.TestCase):
+    """
+    file bodies go out with a Content-Length and arrive intact
+    """
+    def setUp(self):
+        self._server = StandInServer({_user_name : (_auth_key_id, _auth_key)})
+        self._server.start()
+        self._connection = HTTPConnection(self._server.base_address,
+                                          _user_name,
+                                          _auth_key,
+                                          _auth_key_id)
+
+    def tearDown(self):
+        self._connection.close()
+        self._server.stop()
+
+    def _put(self, key, body, **kwargs):
+        response = self._connection.request("PUT",
+                                            compute_uri("data", key),
+                                            body=body,
+                                            **kwargs)
+        response.read()
+        return self._server.last_headers
+
+    def test_file(self):
+        data = os.urandom(3 * 1024 * 1024 + 17)
+        reported = list()
+        with tempfile.TemporaryFile() as body:
+            body.write(data)
+            body.seek(0)
+            headers = self._put("file", ReadReporter(body, reported.append))
+        self.assertEqual(headers["Content-Length"], str(len(data)))
+        self.assertFalse("Transfer-Encoding" in headers)
+        self.assertEqual(self._server.get_key(_collection_name, "file"), data)
+        self.assertEqual(sum(reported), len(data))
+
+    def test_seekable_stream(self):
+        body = io.BytesIO(b"skip" + b"z" * 5000)
+        body.seek(4)
+        headers = self._put("stream", body)
+        self.assertEqual(headers["Content-Length"], "5000")
+        self.assertEqual(self._server.get_key(_collection_name, "stream"),
+                         b"z" * 5000)
+
+    def test_explicit_length(self):
+        blocks = (b"q" * 1000 for _ in range(5))
+        headers = self._put("blocks", blocks, content_length=5000)
+        self.assertEqual(headers["Content-Length"], "5000")
+        self.assertEqual(self._server.get_key(_collection_name, "blocks"),
+                         b"q" * 5000)
+
+    def test_empty_put(self):
+        headers = self._put("empty", None)
+        self.assertEqual(headers["Content-Length"], "0")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+test_json_stream.py
+
+unit tests for JSONStream
+"""
+import io
+import json
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from lumberyard.json_stream import JSONStream, iter_json_array
+
+_listing = {
+    "success" : True,
+    "key_data" : [
+        {"key" : u"kéy-{0}".format(n),
+         "file_size" : n * 1000,
+         "timestamp" : 1349000000.25 + n,
+         "tombstone" : n % 2 == 0,
+         "version_identifier" : None} for n in range(50)],
+    "truncated" : False,
+    "nested" : {"a" : [1, 2, {"b" : "]}"}]},
+}
+
+class TestJSONStream(unittest.TestCase):
+    """
+    decode listings incrementally, at every possible read boundary
+    """
+    def test_object_members(self):
+        body = json.dumps(_listing, indent=1).encode("utf-8")
+        for read_size in [1, 2, 3, 7, 64, 100000]:
+            stream = JSONStream(io.BytesIO(body), ["key_data"], read_size)
+            entries = [entry for (name, entry) in stream]
+            self.assertEqual(entries, _listing["key_data"], read_size)
+            self.assertEqual(stream.fields["truncated"], False)
+            self.assertEqual(stream.fields["nested"], _listing["nested"])
+
+    def test_top_level_array(self):
+        collections = [{"name" : "c{0}".format(n), "versioning" : False} \
+                       for n in range(10)]
+        body = json.dumps(collections).encode("utf-8")
+        for read_size in [1, 5, 1000]:
+            self.assertEqual(
+                list(iter_json_array(io.BytesIO(body))), collections)
+
+    def test_numbers_across_reads(self):
+        body = b"[12345, 6.25e3, -7]"
+        self.assertEqual(
+            list(iter_json_array(io.BufferedReader(io.BytesIO(body), 1))),
+            [12345, 6250.0, -7])
+        for read_size in [1, 2, 3]:
+            stream = JSONStream(io.BytesIO(body), None, read_size)
+            self.assertEqual([entry for (_, entry) in stream],
+                             [12345, 6250.0, -7])
+
+    def test_empty_and_missing(self):
+        stream = JSONStream(io.BytesIO(b'{"prefixes": [], "x": 1}'),
+                            ["key_data", "prefixes"])
+        self.assertEqual(list(stream), [])
+        self.assertEqual(stream.fields, {"x" : 1})
+
+    def test_malformed(self):
+        for body in [b'{"key_data": [1, 2', b'{"key_data": [1 2]}',
+                     b'[1, 2] 3', b'']:
+            stream = JSONStream(io.BytesIO(body), ["key_data"], 1)
+            self.assertRaises(ValueError, list, stream)
+
+if __name__ == "__main__":
+    unittest.main()
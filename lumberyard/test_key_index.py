@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+test_key_index.py
+
+test KeyIndex refresh, reconcile and queries against a StandInServer
+"""
+import os
+import shutil
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.connection_pool import ConnectionPool
+from lumberyard.key_index import KeyIndex, open_key_index
+from lumberyard.ncl.identity import identity_template
+from lumberyard.stand_in_server import StandInServer
+
+_identity = identity_template(user_name="test-user",
+                              auth_key_id="42",
+                              auth_key="test-auth-key")
+_collection_name = "default"
+
+class TestKeyIndex(unittest.TestCase):
+    """
+    fill an index from the listing and answer listings locally
+    """
+    def setUp(self):
+        self._server = StandInServer(
+            {_identity.user_name : (_identity.auth_key_id,
+                                    _identity.auth_key)})
+        self._server.start()
+        self._pool = ConnectionPool()
+        self._directory = tempfile.mkdtemp()
+        self._keys = sorted("dir-{0}/key-{1:03}.{2}".format(d, k, extension) \
+                            for d in range(5) \
+                            for k in range(10) \
+                            for extension in ["gz", "txt"])
+        self._keys.append("top")
+        for key in self._keys:
+            self._server.set_key(_collection_name, key, b"x")
+        self._index = KeyIndex(os.path.join(self._directory,
+                                           "index.sqlite"))
+
+    def tearDown(self):
+        self._index.close()
+        self._pool.close_all()
+        self._server.stop()
+        shutil.rmtree(self._directory)
+
+    def _refresh(self):
+        return self._index.refresh(self._pool,
+                                   self._server.base_address,
+                                   _identity,
+                                   max_keys=7)
+
+    def _server_listing(self, prefix="", delimiter=None, marker=None):
+        entries = self._server.list_keys(_collection_name,
+                                         prefix,
+                                         delimiter,
+                                         marker)
+        if delimiter is None:
+            return [entry["key"] for entry in entries]
+        return entries
+
+    def test_queries_match_the_service(self):
+        self.assertEqual(self._refresh(), len(self._keys))
+        for kwargs in [dict(),
+                       dict(prefix="dir-2/"),
+                       dict(prefix="dir-2/", marker="dir-2/key-004.gz"),
+                       dict(delimiter="/"),
+                       dict(delimiter="/", marker="dir-1/"),
+                       dict(delimiter="/", marker="dir-1/key-000.gz"),
+                       dict(prefix="dir-", delimiter="-"),
+                       dict(prefix="dir-3/", delimiter="."), ]:
+            result = list(self._index.query(**kwargs))
+            if not "delimiter" in kwargs:
+                result = [entry["key"] for entry in result]
+            self.assertEqual(result, self._server_listing(**kwargs), kwargs)
+
+    def test_pattern(self):
+        self._refresh()
+        keys = [entry["key"] for entry in \
+                self._index.query(pattern="dir-[12]/key-00?.gz")]
+        self.assertEqual(keys, ["dir-{0}/key-00{1}.gz".format(d, k) \
+                                for d in [1, 2] for k in range(10)])
+        self.assertEqual(list(self._index.query(prefix="dir-4/",
+                                                pattern="dir-1/*")), [])
+        self.assertEqual(list(self._index.query(pattern="*.txt",
+                                                delimiter="/")),
+                         ["dir-{0}/".format(d) for d in range(5)])
+
+    def test_incremental_refresh_and_reconcile(self):
+        self._refresh()
+        self.assertTrue(self._index.age_seconds() < 60)
+        self.assertEqual(self._refresh(), 0)
+
+        # after the last key: found by refresh
+        self._server.set_key(_collection_name, "zzz", b"x")
+        self.assertEqual(self._refresh(), 1)
+
+        # before the marker, or deleted: only reconcile sees them
+        self._server.set_key(_collection_name, "aaa", b"x")
+        self._server.delete_key(_collection_name, "dir-0/key-000.gz")
+        self._server.delete_key(_collection_name, "top")
+        self.assertEqual(self._refresh(), 0)
+        added, removed = self._index.reconcile(self._pool,
+                                               self._server.base_address,
+                                               _identity,
+                                               max_keys=7)
+        self.assertEqual((added, removed, ), (1, 2, ))
+        self.assertEqual([entry["key"] for entry in self._index.query()],
+                         self._server_listing())
+        self.assertEqual(self._refresh(), 0)
+
+    def test_interrupted_refresh_resumes(self):
+        self._server.queue_failure(400, match="marker=dir-1")
+        with self.assertRaises(Exception):
+            self._refresh()
+        partial = len(self._index)
+        self.assertTrue(0 < partial < len(self._keys))
+
+        # a second process sharing the file carries on from the marker
+        other = open_key_index(self._directory, "index")
+        self.assertTrue(other is open_key_index(self._directory, "index"))
+        self.assertEqual(len(other), partial)
+        self.assertEqual(self._refresh(), len(self._keys) - partial)
+        self.assertEqual(len(self._index), len(self._keys))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+test_key_listing.py
+
+test iter_keys against a StandInServer
+"""
+import os
+import time
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.connection_pool import ConnectionPool
+from lumberyard.key_listing import iter_keys
+from lumberyard.ncl.identity import identity_template
+from lumberyard.stand_in_server import StandInServer
+
+_identity = identity_template(user_name="test-user",
+                              auth_key_id="42",
+                              auth_key="test-auth-key")
+_collection_name = "default"
+
+class TestKeyListing(unittest.TestCase):
+    """
+    list keys across pages
+    """
+    def setUp(self):
+        self._server = StandInServer(
+            {_identity.user_name : (_identity.auth_key_id,
+                                    _identity.auth_key)})
+        self._server.start()
+        self._pool = ConnectionPool()
+        self._keys = sorted("dir-{0}/key-{1:03}".format(d, k) \
+                            for d in range(5) for k in range(10))
+        for key in self._keys:
+            self._server.set_key(_collection_name, key, b"x")
+
+    def tearDown(self):
+        self._pool.close_all()
+        self._server.stop()
+
+    def _list(self, **kwargs):
+        return list(iter_keys(self._pool,
+                              self._server.base_address,
+                              _identity,
+                              **kwargs))
+
+    def test_all_pages(self):
+        for prefetch in [True, False]:
+            entries = self._list(max_keys=7, prefetch=prefetch)
+            self.assertEqual([e["key"] for e in entries], self._keys)
+
+    def test_prefix_and_marker(self):
+        entries = self._list(prefix="dir-2/", marker="dir-2/key-004",
+                             max_keys=2)
+        self.assertEqual([e["key"] for e in entries],
+                         ["dir-2/key-{0:03}".format(k) for k in range(5, 10)])
+
+    def test_delimiter(self):
+        prefixes = self._list(delimiter="/", max_keys=2)
+        self.assertEqual(prefixes, ["dir-{0}/".format(d) for d in range(5)])
+
+    def test_one_page_ahead(self):
+        # while the first page is consumed only the second is fetched
+        generator = iter_keys(self._pool,
+                              self._server.base_address,
+                              _identity,
+                              max_keys=5)
+        try:
+            next(generator)
+            time.sleep(0.5)
+            self.assertEqual(self._server.request_count, 2)
+        finally:
+            generator.close()
+
+    def test_early_stop(self):
+        generator = iter_keys(self._pool,
+                              self._server.base_address,
+                              _identity,
+                              max_keys=5)
+        first = next(generator)
+        generator.close()
+        self.assertEqual(first["key"], self._keys[0])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+test_multipart_upload.py
+
+test MultipartUploader against a StandInServer
+"""
+import os
+import shutil
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.connection_pool import ConnectionPool
+from lumberyard.retry_policy import no_retry_policy
+from lumberyard.http_connection import LumberyardHTTPError
+import lumberyard.multipart_upload
+from lumberyard.multipart_upload import MultipartUploader
+from lumberyard.ncl.identity import identity_template
+from lumberyard.stand_in_server import StandInServer
+
+_identity = identity_template(user_name="test-user",
+                              auth_key_id="42",
+                              auth_key="test-auth-key")
+_collection_name = "default"
+_part_size = 64 * 1024
+
+class TestMultipartUpload(unittest.TestCase):
+    """
+    archive files in parts
+    """
+    def setUp(self):
+        lumberyard.multipart_upload._part_retry_seconds = 0
+        self._server = StandInServer(
+            {_identity.user_name : (_identity.auth_key_id,
+                                    _identity.auth_key)})
+        self._server.start()
+        # exercise the uploader's and downloader's own retries
+        self._pool = ConnectionPool(
+            connection_kwargs={"retry_policy" : no_retry_policy})
+        self._uploader = MultipartUploader(self._pool,
+                                           self._server.base_address,
+                                           _identity,
+                                           part_size=_part_size,
+                                           max_workers=3,
+                                           part_retries=2)
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self._pool.close_all()
+        self._server.stop()
+        shutil.rmtree(self._temp_dir)
+
+    def _make_file(self, name, size):
+        path = os.path.join(self._temp_dir, name)
+        data = os.urandom(size)
+        with open(path, "wb") as output_file:
+            output_file.write(data)
+        return path, data
+
+    def test_small_file(self):
+        path, data = self._make_file("small", 1000)
+        self._uploader.archive("small-key", [path])
+        self.assertEqual(self._server.get_key(_collection_name, "small-key"),
+                         data)
+
+    def test_multiple_sources(self):
+        path1, data1 = self._make_file("source1", _part_size * 3 + 17)
+        path2, data2 = self._make_file("source2", _part_size + 1)
+        reported = list()
+        progress = self._uploader.archive("big-key",
+                                          [path1, path2],
+                                          callback=reported.append)
+        self.assertEqual(self._server.get_key(_collection_name, "big-key"),
+                         data1 + data2)
+        self.assertEqual(progress.bytes_sent, len(data1) + len(data2))
+        self.assertEqual(sum(reported), len(data1) + len(data2))
+        self.assertEqual(self._server.open_conversations, 0)
+
+    def test_part_retry(self):
+        path, data = self._make_file("retry", _part_size * 4)
+        self._server.queue_failure(500, match="conversation_part=2")
+        progress = self._uploader.archive("retry-key", [path])
+        self.assertEqual(self._server.get_key(_collection_name, "retry-key"),
+                         data)
+        # the resent part is not counted twice
+        self.assertEqual(progress.bytes_sent, len(data))
+
+    def test_part_failure_aborts(self):
+        path, _ = self._make_file("failure", _part_size * 4)
+        for _ in range(3):
+            self._server.queue_failure(500,
+                                       match="conversation_part=3")
+        self.assertRaises(LumberyardHTTPError,
+                          self._uploader.archive,
+                          "failure-key",
+                          [path])
+        self.assertEqual(self._server.get_key(_collection_name,
+                                              "failure-key"),
+                         None)
+        self.assertEqual(self._server.open_conversations, 0)
+
+if __name__ == "__main__":
+    unittest.main()
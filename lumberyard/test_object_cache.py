@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+test_object_cache.py
+
+test ObjectCache revalidation and eviction against a StandInServer
+"""
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.connection_pool import ConnectionPool
+from lumberyard.http_connection import LumberyardHTTPError
+from lumberyard.ncl.identity import identity_template
+from lumberyard.object_cache import ObjectCache
+from lumberyard.stand_in_server import StandInServer
+
+_identity = identity_template(user_name="test-user",
+                              auth_key_id="42",
+                              auth_key="test-auth-key")
+_collection_name = "default"
+
+class TestObjectCache(unittest.TestCase):
+    """
+    retrieve keys through a cache
+    """
+    def setUp(self):
+        self._server = StandInServer(
+            {_identity.user_name : (_identity.auth_key_id,
+                                    _identity.auth_key)})
+        self._server.start()
+        self._pool = ConnectionPool()
+        self._directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self._pool.close_all()
+        self._server.stop()
+        shutil.rmtree(self._directory)
+
+    def _retrieve(self, cache, key):
+        output = io.BytesIO()
+        bytes_written, etag = cache.retrieve(self._pool,
+                                             self._server.base_address,
+                                             _identity,
+                                             key,
+                                             output)
+        data = output.getvalue()
+        self.assertEqual(bytes_written, len(data))
+        # the ETag comes back from a hit as well as a miss
+        self.assertEqual(etag, '"{0}"'.format(hashlib.md5(data).hexdigest()))
+        return data
+
+    def test_revalidation(self):
+        cache = ObjectCache(self._directory, max_bytes=1024 * 1024)
+        self._server.set_key(_collection_name, "a", b"a" * 1000)
+        self.assertEqual(self._retrieve(cache, "a"), b"a" * 1000)
+        self.assertEqual(self._retrieve(cache, "a"), b"a" * 1000)
+        self.assertEqual(self._server.not_modified_count, 1)
+
+        # a changed key is fetched and cached again
+        self._server.set_key(_collection_name, "a", b"b" * 500)
+        self.assertEqual(self._retrieve(cache, "a"), b"b" * 500)
+        self.assertEqual(self._retrieve(cache, "a"), b"b" * 500)
+
+        # another process sharing the directory revalidates the same entry
+        other = ObjectCache(self._directory, max_bytes=1024 * 1024)
+        self.assertEqual(self._retrieve(other, "a"), b"b" * 500)
+        self.assertEqual(other.stats()["hits"], 1)
+
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 2))
+        self.assertEqual(stats["bytes_saved"], 1500)
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+        self._server.delete_key(_collection_name, "a")
+        with self.assertRaises(LumberyardHTTPError):
+            self._retrieve(cache, "a")
+        self.assertFalse(os.path.exists(
+            cache._entry_path(self._server.base_address, "a")))
+
+    def test_lru_eviction(self):
+        cache = ObjectCache(self._directory, max_bytes=3500)
+        for key in ["a", "b", "c"]:
+            self._server.set_key(_collection_name, key, key.encode() * 1000)
+            self._retrieve(cache, key)
+        # a, b and c were used long ago, in that order; using a again
+        # makes it the newest, so b and c are evicted first
+        entry = cache._entry_path(self._server.base_address, "b")
+        for key, mtime in [("a", 1), ("b", 2), ("c", 3)]:
+            os.utime(cache._entry_path(self._server.base_address, key),
+                     (mtime, mtime))
+        self._retrieve(cache, "a")
+
+        self._server.set_key(_collection_name, "d", b"d" * 1000)
+        self._retrieve(cache, "d")
+        self.assertTrue(cache.stats()["evictions"] >= 1)
+        self.assertFalse(os.path.exists(entry))
+        self._retrieve(cache, "a")
+        self.assertEqual(cache.stats()["hits"], 2)
+
+        # a body larger than the cache is passed through, not stored
+        self._server.set_key(_collection_name, "e", b"e" * 5000)
+        self.assertEqual(self._retrieve(cache, "e"), b"e" * 5000)
+        self.assertFalse(os.path.exists(
+            cache._entry_path(self._server.base_address, "e")))
+
+if __name__ == "__main__":
+    unittest.main()
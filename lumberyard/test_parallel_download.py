@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+test_parallel_download.py
+
+test ParallelDownloader against a StandInServer
+"""
+import os
+import shutil
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.connection_pool import ConnectionPool
+from lumberyard.retry_policy import no_retry_policy
+import lumberyard.parallel_download
+from lumberyard.parallel_download import ParallelDownloader
+from lumberyard.ncl.identity import identity_template
+from lumberyard.stand_in_server import StandInServer
+
+_identity = identity_template(user_name="test-user",
+                              auth_key_id="42",
+                              auth_key="test-auth-key")
+_collection_name = "default"
+
+class TestParallelDownload(unittest.TestCase):
+    """
+    retrieve keys as concurrent ranges
+    """
+    def setUp(self):
+        lumberyard.parallel_download._segment_retry_seconds = 0
+        self._server = StandInServer(
+            {_identity.user_name : (_identity.auth_key_id,
+                                    _identity.auth_key)})
+        self._server.start()
+        # exercise the uploader's and downloader's own retries
+        self._pool = ConnectionPool(
+            connection_kwargs={"retry_policy" : no_retry_policy})
+        self._downloader = ParallelDownloader(self._pool,
+                                              self._server.base_address,
+                                              _identity,
+                                              segment_count=5,
+                                              block_size=4096)
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self._pool.close_all()
+        self._server.stop()
+        shutil.rmtree(self._temp_dir)
+
+    def _retrieve(self, key, size):
+        data = os.urandom(size)
+        self._server.set_key(_collection_name, key, data)
+        path = os.path.join(self._temp_dir, key)
+        reported = list()
+        result = self._downloader.retrieve(key, path, reported.append)
+        self.assertEqual(result, size)
+        self.assertEqual(sum(reported), size)
+        with open(path, "rb") as input_file:
+            self.assertEqual(input_file.read(), data)
+
+    def test_segments(self):
+        self._retrieve("segments", 100003)
+
+    def test_tiny_and_empty(self):
+        self._retrieve("tiny", 3)
+        self._retrieve("empty", 0)
+
+    def test_head(self):
+        # the HEAD's answer, metadata included, is reused by retrieve
+        self._server.set_key(_collection_name, "head", b"x" * 1000,
+                             meta={"compression" : "gzip"})
+        head = self._downloader.head("head")
+        self.assertEqual(head, (1000, True, {"compression" : "gzip"}, ))
+        request_count = self._server.request_count
+        path = os.path.join(self._temp_dir, "head")
+        self.assertEqual(self._downloader.retrieve("head", path, head=head),
+                         1000)
+        self.assertEqual(self._server.request_count - request_count, 5)
+
+    def test_segment_retry(self):
+        # fail two range requests; the HEAD gets through
+        self._server.queue_failure(500, match="GET /data/retry")
+        self._server.queue_failure(500, match="GET /data/retry")
+        self._retrieve("retry", 50000)
+
+    def test_ranges_ignored(self):
+        # a whole body answers the first range; it is written sequentially
+        self._server.honor_ranges = False
+        self._retrieve("whole", 100003)
+        # the HEAD, and one GET
+        self.assertEqual(self._server.request_count, 2)
+
+    def test_ranges_ignored_retry(self):
+        self._server.honor_ranges = False
+        self._server.queue_failure(500, match="GET /data/whole")
+        self._retrieve("whole", 50000)
+
+if __name__ == "__main__":
+    unittest.main()
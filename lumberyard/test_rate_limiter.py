@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+test_rate_limiter.py
+
+test token buckets on a fake clock, and limited transfers against a
+StandInServer
+"""
+import io
+import os
+import threading
+import time
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.http_connection import HTTPConnection
+from lumberyard.http_util import compute_uri
+import lumberyard.rate_limiter as rate_limiter
+from lumberyard.rate_limiter import RateLimiter, \
+    TokenBucket, \
+    limit_upload, \
+    limit_download
+from lumberyard.read_reporter import ReadReporter
+from lumberyard.stand_in_server import StandInServer
+
+_user_name = "test-user"
+_auth_key_id = "42"
+_auth_key = "test-auth-key"
+_collection_name = "default"
+
+class _Clock(object):
+    """
+    stands in for the time module: sleep advances time
+    """
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = list()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+class TestTokenBucket(unittest.TestCase):
+    """
+    reservations are paced at the rate, without bursts after idling
+    """
+    def setUp(self):
+        self._clock = _Clock()
+        self._previous_time = rate_limiter.time
+        rate_limiter.time = self._clock
+
+    def tearDown(self):
+        rate_limiter.time = self._previous_time
+
+    def test_debt(self):
+        bucket = TokenBucket(1000, burst_seconds=0.1)
+        self.assertEqual(bucket.reserve(100), 0.0)
+        self.assertAlmostEqual(bucket.reserve(100), 0.1)
+        self.assertAlmostEqual(bucket.reserve(100), 0.2)
+        self._clock.now += 0.2
+        self.assertAlmostEqual(bucket.reserve(100), 0.1)
+
+    def test_idle_does_not_burst(self):
+        bucket = TokenBucket(1000, burst_seconds=0.1)
+        self._clock.now += 60
+        self.assertEqual(bucket.reserve(100), 0.0)
+        self.assertAlmostEqual(bucket.reserve(1000), 1.0)
+
+    def test_host_and_global(self):
+        limiter = RateLimiter(upload_bytes_per_second=1000,
+                              host_upload_bytes_per_second=500,
+                              burst_seconds=0.1)
+        limiter.set_host_limits("fast", upload_bytes_per_second=2000)
+        limiter.acquire(limit_upload, "slow", 50)
+        limiter.acquire(limit_upload, "slow", 100)
+        self.assertAlmostEqual(self._clock.slept[-1], 0.2)
+        self.assertTrue(limiter.limits(limit_upload, "fast"))
+        self.assertFalse(limiter.limits(limit_download, "fast"))
+        self.assertEqual(limiter.read_size(limit_upload, "slow"), 4096)
+        self.assertEqual(limiter.stats()["waits"], 1)
+
+    def test_throttled_reads(self):
+        limiter = RateLimiter(upload_bytes_per_second=100000,
+                              burst_seconds=0.1)
+        body = rate_limiter.throttled_body(limiter, "host", b"x" * 50000)
+        self.assertTrue(isinstance(body, ReadReporter))
+        blocks = list(iter(lambda: body.read(1024 * 1024), b""))
+        self.assertEqual([len(block) for block in blocks], [10000] * 5)
+        self.assertAlmostEqual(sum(self._clock.slept), 0.4)
+
+    def test_unlimited(self):
+        limiter = RateLimiter()
+        body = b"abc"
+        self.assertTrue(rate_limiter.throttled_body(limiter, "host", body) \
+                        is body)
+        limiter.acquire_request("host")
+        self.assertEqual(self._clock.slept, [])
+
+class _CountingRateLimiter(RateLimiter):
+    """
+    counts the tokens taken of each kind
+    """
+    def __init__(self, **kwargs):
+        RateLimiter.__init__(self, **kwargs)
+        self.taken = dict()
+
+    def acquire(self, kind, hostname, amount=1):
+        self.taken[kind] = self.taken.get(kind, 0) + amount
+        RateLimiter.acquire(self, kind, hostname, amount)
+
+class TestLimitedTransfers(unittest.TestCase):
+    """
+    the limits hold for body bytes and for requests across threads
+    """
+    def setUp(self):
+        self._server = StandInServer({_user_name : (_auth_key_id, _auth_key)})
+        self._server.start()
+
+    def tearDown(self):
+        self._server.stop()
+
+    def _connection(self, limiter):
+        return HTTPConnection(self._server.base_address,
+                              _user_name,
+                              _auth_key,
+                              _auth_key_id,
+                              rate_limiter=limiter)
+
+    def test_upload_and_download(self):
+        limiter = RateLimiter(upload_bytes_per_second=1000000,
+                              download_bytes_per_second=1000000)
+        data = os.urandom(300000)
+        connection = self._connection(limiter)
+        try:
+            start_time = time.time()
+            response = connection.request("PUT",
+                                          compute_uri("data", "key"),
+                                          body=io.BytesIO(data))
+            response.read()
+            upload_seconds = time.time() - start_time
+
+            start_time = time.time()
+            response = connection.request("GET", compute_uri("data", "key"))
+            self.assertEqual(response.read(), data)
+            download_seconds = time.time() - start_time
+        finally:
+            connection.close()
+        self.assertEqual(self._server.get_key(_collection_name, "key"), data)
+        self.assertTrue(upload_seconds >= 0.15, upload_seconds)
+        self.assertTrue(download_seconds >= 0.15, download_seconds)
+
+    def test_download_charged_once(self):
+        # each byte returned takes one token, however it is read
+        limiter = _CountingRateLimiter(download_bytes_per_second=50000000)
+        data = os.urandom(200000)
+        self._server.set_key(_collection_name, "key", data)
+        connection = self._connection(limiter)
+        try:
+            for read in [lambda response: response.read(5000),
+                         lambda response: response.read1(5000),
+                         lambda response: response.read(),
+                         self._readinto]:
+                limiter.taken.clear()
+                response = connection.request("GET",
+                                              compute_uri("data", "key"))
+                blocks = list(iter(lambda: read(response), b""))
+                self.assertEqual(b"".join(blocks), data)
+                self.assertEqual(limiter.taken[limit_download], len(data))
+        finally:
+            connection.close()
+
+    def _readinto(self, response):
+        buffer = bytearray(7000)
+        bytes_read = response.readinto(buffer)
+        return bytes(buffer[:bytes_read])
+
+    def test_requests_across_threads(self):
+        limiter = RateLimiter(requests_per_second=50)
+        self._server.set_key(_collection_name, "key", b"data")
+        results = list()
+
+        def _get():
+            connection = self._connection(limiter)
+            try:
+                for _ in range(5):
+                    results.append(connection.request(
+                        "GET", compute_uri("data", "key")).read())
+            finally:
+                connection.close()
+
+        start_time = time.time()
+        threads = [threading.Thread(target=_get) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed_seconds = time.time() - start_time
+        self.assertEqual(results, [b"data"] * 20)
+        # 20 requests, a 0.1 second burst of 5 free
+        self.assertTrue(elapsed_seconds >= 0.25, elapsed_seconds)
+
+if __name__ == "__main__":
+    unittest.main()
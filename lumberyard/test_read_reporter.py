@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+test_read_reporter.py
+
+test ReadReporter callbacks, readinto and stats
+"""
+import io
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import lumberyard.read_reporter as read_reporter
+from lumberyard.read_reporter import ReadReporter
+
+class _ReadOnly(object):
+    """
+    a file object without readinto
+    """
+    def __init__(self, data):
+        self._stream = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+class TestReadReporter(unittest.TestCase):
+    """
+    reported counts always add up to the bytes read
+    """
+    def test_every_read(self):
+        reported = list()
+        reporter = ReadReporter(io.BytesIO(b"a" * 10), reported.append)
+        while len(reporter.read(3)) > 0:
+            pass
+        self.assertEqual(reported, [3, 3, 3, 1])
+
+    def test_coalesced_by_bytes(self):
+        reported = list()
+        reporter = ReadReporter(io.BytesIO(b"a" * 100),
+                                reported.append,
+                                report_bytes=32)
+        while len(reporter.read(10)) > 0:
+            pass
+        self.assertEqual(reported, [40, 40, 20])
+
+    def test_coalesced_by_time(self):
+        clock = _Clock()
+        previous_time = read_reporter.time
+        read_reporter.time = clock
+        try:
+            reported = list()
+            reporter = ReadReporter(io.BytesIO(b"a" * 100),
+                                    reported.append,
+                                    report_seconds=1.0)
+            reporter.read(10)
+            reporter.read(10)
+            clock.now += 1.5
+            reporter.read(10)
+            self.assertEqual(reported, [30])
+            reporter.read(10)
+            reporter.close()
+            self.assertEqual(reported, [30, 10])
+        finally:
+            read_reporter.time = previous_time
+
+    def test_readinto(self):
+        for file_object in [io.BytesIO(b"0123456789"),
+                            _ReadOnly(b"0123456789")]:
+            reported = list()
+            reporter = ReadReporter(file_object, reported.append)
+            buffer = bytearray(4)
+            view = memoryview(buffer)
+            chunks = list()
+            while True:
+                bytes_read = reporter.readinto(view)
+                if bytes_read == 0:
+                    break
+                chunks.append(bytes(view[:bytes_read]))
+            self.assertEqual(b"".join(chunks), b"0123456789")
+            self.assertEqual(sum(reported), 10)
+
+    def test_stats(self):
+        clock = _Clock()
+        previous_time = read_reporter.time
+        read_reporter.time = clock
+        try:
+            reporter = ReadReporter(io.BytesIO(b"a" * 100),
+                                    total_bytes=100)
+            self.assertEqual(reporter.stats()["bytes_read"], 0)
+            reporter.read(25)
+            clock.now += 2.0
+            stats = reporter.stats()
+            self.assertEqual(stats["bytes_read"], 25)
+            self.assertEqual(stats["bytes_per_second"], 12.5)
+            self.assertEqual(stats["eta_seconds"], 6.0)
+        finally:
+            read_reporter.time = previous_time
+
+if __name__ == "__main__":
+    unittest.main()
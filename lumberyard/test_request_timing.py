@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+test_request_timing.py
+
+test request timing records, the histogram and the aggregator, against a
+StandInServer
+"""
+import os
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.http_connection import HTTPConnection, \
+    UnAuthHTTPConnection, \
+    LumberyardHTTPError
+from lumberyard.http_util import compute_uri
+from lumberyard.request_timing import LatencyHistogram, \
+    TimingAggregator, \
+    add_request_observer, \
+    remove_request_observer, \
+    request_label, \
+    uri_template
+from lumberyard.retry_policy import RetryPolicy
+from lumberyard.stand_in_server import StandInServer
+
+_user_name = "test-user"
+_auth_key_id = "42"
+_auth_key = "test-auth-key"
+_collection_name = "default"
+
+class TestHistogram(unittest.TestCase):
+    """
+    percentiles are within the histogram's precision
+    """
+    def test_percentiles(self):
+        histogram = LatencyHistogram()
+        self.assertEqual(histogram.percentile(50), None)
+        for milliseconds in range(1, 1001):
+            histogram.record(milliseconds / 1000.0)
+        for percent, expected in [(50, 0.5), (95, 0.95), (99, 0.99)]:
+            self.assertAlmostEqual(histogram.percentile(percent),
+                                   expected,
+                                   delta=expected / 64.0)
+        self.assertEqual(histogram.percentile(100), 1.0)
+        self.assertEqual(histogram.count, 1000)
+
+    def test_merge(self):
+        first, second = LatencyHistogram(), LatencyHistogram()
+        first.record(0.001)
+        second.record(2.0)
+        first.merge(second)
+        self.assertEqual(first.count, 2)
+        self.assertEqual(first.max_seconds, 2.0)
+        self.assertAlmostEqual(first.percentile(100), 2.0, delta=2.0 / 64)
+
+    def test_uri_template(self):
+        self.assertEqual(uri_template("/data/a/b%2Fc?action=meta&x=1"),
+                         "/data/{key}?action=meta&x")
+        self.assertEqual(uri_template("/data/?prefix=abc"), "/data?prefix")
+        self.assertEqual(uri_template("/conversations/17"),
+                         "/conversations/{id}")
+
+class TestRequestTiming(unittest.TestCase):
+    """
+    each request is reported once its body has been read
+    """
+    def setUp(self):
+        self._server = StandInServer({_user_name : (_auth_key_id, _auth_key)})
+        self._server.start()
+        self._server.set_key(_collection_name, "aaa", b"a" * 5000)
+        self._timings = list()
+
+    def tearDown(self):
+        self._server.stop()
+
+    def _connection(self, **kwargs):
+        return HTTPConnection(self._server.base_address,
+                              _user_name,
+                              _auth_key,
+                              _auth_key_id,
+                              observers=[self._timings.append],
+                              **kwargs)
+
+    def test_phases(self):
+        connection = self._connection()
+        try:
+            response = connection.request("PUT",
+                                          compute_uri("data", "bbb"),
+                                          body=b"b" * 300)
+            response.read()
+            response = connection.request("GET", compute_uri("data", "aaa"))
+            self.assertEqual(len(self._timings), 1)
+            response.read()
+        finally:
+            connection.close()
+
+        put, get = self._timings
+        self.assertEqual((put.method, put.uri_template, put.status),
+                         ("PUT", "/data/{key}", 200, ))
+        self.assertEqual(put.bytes_sent, 300)
+        self.assertEqual(sorted(put.phases),
+                         ["body", "connect", "dns", "first_byte", "send"])
+        # the second request reuses the connection
+        self.assertEqual(sorted(get.phases), ["body", "first_byte", "send"])
+        self.assertEqual((get.status, get.bytes_received, get.retries, ),
+                         (200, 5000, 0, ))
+        self.assertTrue(get.total_seconds >= sum(get.phases.values()) * 0.99)
+
+    def test_error_and_retries(self):
+        self._server.queue_failure(503)
+        connection = self._connection(retry_policy=RetryPolicy(
+            base_delay=0.01, max_delay=0.01, breaker_threshold=None))
+        try:
+            connection.request("GET", compute_uri("data", "aaa")).read()
+            with self.assertRaises(LumberyardHTTPError):
+                connection.request("GET", compute_uri("data", "zzz"))
+        finally:
+            connection.close()
+        found, missing = self._timings
+        self.assertEqual((found.status, found.retries, found.error, ),
+                         (200, 1, None, ))
+        self.assertEqual(missing.status, 404)
+        self.assertTrue(missing.error is not None)
+
+    def test_global_observer_and_aggregator(self):
+        aggregator = TimingAggregator()
+        add_request_observer(aggregator)
+        try:
+            connection = UnAuthHTTPConnection(self._server.base_address)
+            try:
+                with request_label("retrieve_key"):
+                    for _ in range(3):
+                        connection.request(
+                            "GET", compute_uri("data", "aaa")).read()
+                connection.request("HEAD", compute_uri("data", "aaa")).read()
+            finally:
+                connection.close()
+        finally:
+            remove_request_observer(aggregator)
+
+        summary = dict((entry["key"], entry) for entry in \
+                       aggregator.summary())
+        self.assertEqual(sorted(summary), ["HEAD /data/{key}",
+                                           "retrieve_key"])
+        entry = summary["retrieve_key"]
+        self.assertEqual(entry["count"], 3)
+        self.assertEqual(entry["bytes_received"], 15000)
+        self.assertTrue(entry["total"][50] <= entry["total"][99])
+
+if __name__ == "__main__":
+    unittest.main()
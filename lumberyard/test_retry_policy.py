@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+test_retry_policy.py
+
+test RetryPolicy, alone and driving HTTPConnection against a StandInServer
+"""
+import asyncio
+from email.utils import formatdate
+import io
+import os
+import socket
+import time
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.http_connection import HTTPConnection, \
+    LumberyardHTTPError, \
+    LumberyardRetryableHTTPError, \
+    CircuitOpenError, \
+    parse_retry_after
+from lumberyard.async_http_connection import AsyncHTTPConnection
+from lumberyard.http_util import compute_uri
+from lumberyard.retry_policy import RetryPolicy, \
+    breaker_closed, \
+    breaker_open
+from lumberyard.stand_in_server import StandInServer
+
+_user_name = "test-user"
+_auth_key_id = "42"
+_auth_key = "test-auth-key"
+_collection_name = "default"
+
+def _fast_policy(**kwargs):
+    kwargs.setdefault("base_delay", 0.01)
+    kwargs.setdefault("max_delay", 0.05)
+    return RetryPolicy(**kwargs)
+
+class TestRetryPolicy(unittest.TestCase):
+    """
+    retry decisions without a server
+    """
+    def test_jitter_bounds(self):
+        policy = _fast_policy(max_attempts=50, breaker_threshold=None)
+        retry = policy.begin("host", "GET")
+        for _ in range(40):
+            self.assertTrue(retry.before_attempt())
+            retry.request_sent = True
+            delay = retry.next_delay(LumberyardHTTPError(500, "error"))
+            self.assertTrue(0.01 <= delay <= 0.05, delay)
+
+    def test_not_transient(self):
+        policy = _fast_policy()
+        retry = policy.begin("host", "GET")
+        retry.before_attempt()
+        retry.request_sent = True
+        self.assertEqual(retry.next_delay(LumberyardHTTPError(404, "nf")),
+                         None)
+        self.assertEqual(retry.next_delay(ValueError("bad")), None)
+
+    def test_local_error_leaves_breaker(self):
+        policy = _fast_policy(max_attempts=1, breaker_threshold=1)
+        retry = policy.begin("host", "GET")
+        retry.before_attempt()
+        retry.next_delay(LumberyardHTTPError(500, "error"))
+        self.assertEqual(policy.breaker_state("host"), breaker_open)
+
+        # a client bug does not close the breaker; a response does
+        policy.breaker_reset_seconds = 0.0
+        for error in [TypeError("bug"), ValueError("bad body")]:
+            retry = policy.begin("host", "GET")
+            self.assertTrue(retry.before_attempt())
+            self.assertEqual(retry.next_delay(error), None)
+            self.assertNotEqual(policy.breaker_state("host"), breaker_closed)
+        retry = policy.begin("host", "GET")
+        self.assertTrue(retry.before_attempt())
+        retry.next_delay(LumberyardHTTPError(404, "not found"))
+        self.assertEqual(policy.breaker_state("host"), breaker_closed)
+
+    def test_unsent_post_is_retried(self):
+        policy = _fast_policy()
+        retry = policy.begin("host", "POST", b"data")
+        retry.before_attempt()
+        self.assertNotEqual(retry.next_delay(IOError("refused")), None)
+        retry.before_attempt()
+        retry.request_sent = True
+        self.assertEqual(retry.next_delay(IOError("reset")), None)
+
+    def test_unseekable_body(self):
+        policy = _fast_policy()
+        retry = policy.begin("host", "PUT", iter([b"a", b"b"]))
+        retry.before_attempt()
+        retry.request_sent = True
+        self.assertEqual(retry.next_delay(IOError("reset")), None)
+        self.assertEqual(policy.stats()["not_retryable"], 1)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("7"), 7)
+        self.assertEqual(parse_retry_after("0"), None)
+        self.assertEqual(parse_retry_after("soon"), None)
+        self.assertEqual(parse_retry_after(None), None)
+        later = formatdate(time.time() + 100, usegmt=True)
+        self.assertTrue(95 <= parse_retry_after(later) <= 101)
+
+class TestRetryingConnection(unittest.TestCase):
+    """
+    HTTPConnection retrying under a policy
+    """
+    def setUp(self):
+        self._server = StandInServer({_user_name : (_auth_key_id, _auth_key)})
+        self._server.start()
+        self._server.set_key(_collection_name, "aaa", b"aaa data")
+
+    def tearDown(self):
+        self._server.stop()
+
+    def _connection(self, policy):
+        return HTTPConnection(self._server.base_address,
+                              _user_name,
+                              _auth_key,
+                              _auth_key_id,
+                              retry_policy=policy)
+
+    def _get(self, policy, key="aaa"):
+        connection = self._connection(policy)
+        try:
+            return connection.request("GET", compute_uri("data", key)).read()
+        finally:
+            connection.close()
+
+    def test_transient_get(self):
+        policy = _fast_policy()
+        self._server.queue_failure(500)
+        self._server.queue_failure(502)
+        self.assertEqual(self._get(policy), b"aaa data")
+        stats = policy.stats()
+        self.assertEqual(stats["retries"], 2)
+        self.assertEqual(stats["requests"], 1)
+
+    def test_retry_after(self):
+        policy = _fast_policy()
+        self._server.queue_failure(503, retry_after=1)
+        start_time = time.time()
+        self.assertEqual(self._get(policy), b"aaa data")
+        self.assertTrue(time.time() - start_time >= 1.0)
+        self.assertEqual(policy.stats()["retry_after_honored"], 1)
+
+    def test_deadline(self):
+        policy = _fast_policy(deadline_seconds=0.5)
+        self._server.queue_failure(503, retry_after=5)
+        self.assertRaises(LumberyardRetryableHTTPError, self._get, policy)
+        self.assertEqual(policy.stats()["deadline_exceeded"], 1)
+
+    def test_give_up(self):
+        policy = _fast_policy(max_attempts=2)
+        for _ in range(3):
+            self._server.queue_failure(500)
+        self.assertRaises(LumberyardHTTPError, self._get, policy)
+        self.assertEqual(policy.stats()["give_ups"], 1)
+        self.assertEqual(self._server.request_count, 2)
+
+    def test_connect_error(self):
+        # each refused connect is one attempt, paced by the policy
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        address = "127.0.0.1:{0}".format(listener.getsockname()[1])
+        listener.close()
+        policy = _fast_policy(max_attempts=3)
+        connection = HTTPConnection(address,
+                                    _user_name,
+                                    _auth_key,
+                                    _auth_key_id,
+                                    retry_policy=policy)
+        start_time = time.time()
+        try:
+            self.assertRaises(socket.error,
+                              connection.request,
+                              "GET",
+                              compute_uri("data", "aaa"))
+        finally:
+            connection.close()
+        self.assertTrue(time.time() - start_time < 1.0)
+        stats = policy.stats()
+        self.assertEqual((stats["retries"], stats["give_ups"], ), (2, 1, ))
+
+    def test_post_not_retried(self):
+        policy = _fast_policy()
+        self._server.queue_failure(500)
+        connection = self._connection(policy)
+        try:
+            self.assertRaises(LumberyardHTTPError,
+                              connection.request,
+                              "POST",
+                              compute_uri("data", "bbb"),
+                              body=b"bbb data")
+        finally:
+            connection.close()
+        self.assertEqual(self._server.request_count, 1)
+        self.assertEqual(self._server.get_key(_collection_name, "bbb"), None)
+
+    def test_file_body_rewound(self):
+        policy = _fast_policy()
+        self._server.queue_failure(503, match="PUT")
+        body = io.BytesIO(b"skipped" + b"x" * 100000)
+        body.seek(len(b"skipped"))
+        connection = self._connection(policy)
+        try:
+            connection.request("PUT", compute_uri("data", "ccc"), body=body)
+        finally:
+            connection.close()
+        self.assertEqual(self._server.get_key(_collection_name, "ccc"),
+                         b"x" * 100000)
+
+    def test_circuit_breaker(self):
+        policy = _fast_policy(max_attempts=1,
+                              breaker_threshold=2,
+                              breaker_reset_seconds=0.2)
+        hostname = self._server.base_address
+        for _ in range(2):
+            self._server.queue_failure(500)
+            self.assertRaises(LumberyardHTTPError, self._get, policy)
+        self.assertEqual(policy.breaker_state(hostname), breaker_open)
+
+        request_count = self._server.request_count
+        self.assertRaises(CircuitOpenError, self._get, policy)
+        self.assertEqual(self._server.request_count, request_count)
+        self.assertEqual(policy.stats()["breakers"],
+                         {hostname : breaker_open})
+
+        # after the reset interval a trial request closes the breaker
+        time.sleep(0.2)
+        self.assertEqual(self._get(policy), b"aaa data")
+        self.assertEqual(policy.breaker_state(hostname), breaker_closed)
+        stats = policy.stats()
+        self.assertEqual(stats["breaker_opened"], 1)
+        self.assertEqual(stats["breaker_rejected"], 1)
+
+    def test_async_connection(self):
+        policy = _fast_policy()
+        self._server.queue_failure(500)
+
+        async def _request():
+            connection = AsyncHTTPConnection(self._server.base_address,
+                                             _user_name,
+                                             _auth_key,
+                                             _auth_key_id,
+                                             retry_policy=policy)
+            try:
+                response = await connection.request(
+                    "GET", compute_uri("data", "aaa"))
+                return await response.read()
+            finally:
+                await connection.close()
+
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEqual(loop.run_until_complete(_request()), b"aaa data")
+        finally:
+            loop.close()
+        self.assertEqual(policy.stats()["retries"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
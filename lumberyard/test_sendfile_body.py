@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+test_sendfile_body.py
+
+test sending file bodies with os.sendfile, against a StandInServer
+"""
+import errno
+import io
+import os
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.http_connection import HTTPConnection
+from lumberyard.http_util import compute_uri
+from lumberyard.multipart_upload import FileRangeReader
+from lumberyard.read_reporter import ReadReporter
+from lumberyard.stand_in_server import StandInServer
+import lumberyard.sendfile_body as sendfile_body
+
+_user_name = "test-user"
+_auth_key_id = "42"
+_auth_key = "test-auth-key"
+_collection_name = "default"
+
+@unittest.skipUnless(sendfile_body._sendfile_enabled, "needs os.sendfile")
+class TestSendfileBody(unittest.TestCase):
+    """
+    real file bodies go out through os.sendfile, anything else as before
+    """
+    def setUp(self):
+        self._server = StandInServer({_user_name : (_auth_key_id, _auth_key)})
+        self._server.start()
+        self._connection = HTTPConnection(self._server.base_address,
+                                          _user_name,
+                                          _auth_key,
+                                          _auth_key_id)
+        self._sendfile_calls = list()
+        self._real_sendfile = os.sendfile
+        def _counting_sendfile(out_fd, in_fd, offset, count):
+            self._sendfile_calls.append(count)
+            return self._real_sendfile(out_fd, in_fd, offset, count)
+        os.sendfile = _counting_sendfile
+
+    def tearDown(self):
+        os.sendfile = self._real_sendfile
+        self._connection.close()
+        self._server.stop()
+
+    def _put(self, key, body):
+        response = self._connection.request("PUT",
+                                            compute_uri("data", key),
+                                            body=body)
+        response.read()
+        return self._server.get_key(_collection_name, key)
+
+    def test_file(self):
+        data = os.urandom(9 * 1024 * 1024 + 5)
+        reported = list()
+        with tempfile.TemporaryFile() as body:
+            body.write(data)
+            body.seek(5)
+            self.assertEqual(self._put("file",
+                                       ReadReporter(body, reported.append)),
+                             data[5:])
+            self.assertEqual(body.tell(), len(data))
+        self.assertTrue(len(self._sendfile_calls) > 0)
+        self.assertEqual(sum(reported), len(data) - 5)
+        # progress comes in batches, not a call per socket write
+        self.assertTrue(len(reported) <= 4, reported)
+
+    def test_file_range(self):
+        data = os.urandom(100000)
+        with tempfile.TemporaryFile() as body:
+            body.write(data)
+            body.flush()
+            reader = FileRangeReader(body.fileno(), 1000, 50000)
+            self.assertEqual(self._put("range", reader), data[1000:51000])
+        self.assertTrue(len(self._sendfile_calls) > 0)
+
+    def test_stream_falls_back(self):
+        reported = list()
+        body = ReadReporter(io.BytesIO(b"s" * 5000), reported.append)
+        self.assertEqual(self._put("stream", body), b"s" * 5000)
+        self.assertEqual(self._sendfile_calls, [])
+        self.assertEqual(sum(reported), 5000)
+
+    def test_unsupported_falls_back(self):
+        def _unsupported_sendfile(out_fd, in_fd, offset, count):
+            raise OSError(errno.EINVAL, "not here")
+        os.sendfile = _unsupported_sendfile
+        data = os.urandom(70000)
+        reported = list()
+        with tempfile.TemporaryFile() as body:
+            body.write(data)
+            body.seek(0)
+            self.assertEqual(self._put("fallback",
+                                       ReadReporter(body, reported.append)),
+                             data)
+        self.assertEqual(sum(reported), len(data))
+
+if __name__ == "__main__":
+    unittest.main()
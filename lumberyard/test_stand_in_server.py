@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+test_stand_in_server.py
+
+test the StandInServer endpoints the benchmarks and the other tests rely on
+"""
+import json
+import os
+import threading
+import time
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# the stand in server speaks plain HTTP
+os.environ["NIMBUS_IO_SERVICE_SSL"] = "0"
+
+from lumberyard.http_connection import HTTPConnection, \
+    UnAuthHTTPConnection, \
+    LumberyardHTTPError
+from lumberyard.http_util import compute_uri
+from lumberyard.stand_in_server import StandInServer
+
+_user_name = "test-user"
+_auth_key_id = "42"
+_auth_key = "test-auth-key"
+
+class TestStandInServer(unittest.TestCase):
+    """
+    collections, signatures and keep-alive latency
+    """
+    def setUp(self):
+        self._server = StandInServer({_user_name : (_auth_key_id, _auth_key),
+                                      "other-user" : ("43", "other-key")})
+        self._server.start()
+        self._connection = HTTPConnection(self._server.base_address,
+                                          _user_name,
+                                          _auth_key,
+                                          _auth_key_id)
+
+    def tearDown(self):
+        self._connection.close()
+        self._server.stop()
+
+    def _request_json(self, method, uri, **kwargs):
+        response = self._connection.request(method, uri, **kwargs)
+        return json.loads(response.read().decode("utf-8"))
+
+    def test_collections(self):
+        path = "/".join(["customers", _user_name, "collections"])
+        result = self._request_json("POST",
+                                    compute_uri(path,
+                                                action="create",
+                                                name="logs"),
+                                    expected_status=201)
+        self.assertEqual((result["name"], result["success"], ),
+                         ("logs", True, ))
+
+        entries = self._request_json("GET", compute_uri(path))
+        self.assertEqual([entry["name"] for entry in entries],
+                         ["default", "logs"])
+
+        entry = self._request_json("GET", compute_uri(path + "/logs"))
+        self.assertEqual(entry["name"], "logs")
+        result = self._request_json("GET", compute_uri(path + "/logs",
+                                                       action="space_usage"))
+        self.assertEqual(result["operational_stats"], [])
+
+        self._request_json("DELETE", compute_uri(path + "/logs"))
+        with self.assertRaises(LumberyardHTTPError):
+            self._connection.request("GET", compute_uri(path + "/logs"))
+
+    def test_signatures(self):
+        other_path = "/".join(["customers", "other-user", "collections"])
+        with self.assertRaises(LumberyardHTTPError) as context:
+            self._connection.request("GET", compute_uri(other_path))
+        self.assertEqual(context.exception.status, 403)
+
+        forged = HTTPConnection(self._server.base_address,
+                                _user_name,
+                                "wrong-key",
+                                _auth_key_id)
+        try:
+            with self.assertRaises(LumberyardHTTPError) as context:
+                forged.request("PUT", compute_uri("data", "key"), body=b"x")
+            self.assertEqual(context.exception.status, 401)
+        finally:
+            forged.close()
+
+        unsigned = UnAuthHTTPConnection(self._server.base_address)
+        try:
+            with self.assertRaises(LumberyardHTTPError) as context:
+                unsigned.request("GET", compute_uri(other_path))
+            self.assertEqual(context.exception.status, 401)
+        finally:
+            unsigned.close()
+
+    def test_concurrent_counts(self):
+        self._server.set_key("default", "aaa", b"aaa data")
+
+        def _get():
+            connection = HTTPConnection(self._server.base_address,
+                                        _user_name,
+                                        _auth_key,
+                                        _auth_key_id)
+            try:
+                for _ in range(25):
+                    connection.request("GET",
+                                       compute_uri("data", "aaa")).read()
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=_get) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self._server.request_count, 200)
+
+    def test_keep_alive_latency(self):
+        # a response split across writes must not wait on a delayed ACK
+        self._server.set_key("default", "key", b"x" * 1000)
+        uri = compute_uri("data", "key")
+        self._connection.request("GET", uri).read()
+        start_time = time.time()
+        for _ in range(20):
+            self._connection.request("GET", uri).read()
+        self.assertTrue(time.time() - start_time < 0.4)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+test_tls_session_cache.py
+
+test TLS session resumption against a StandInServer serving HTTPS with a
+self-signed certificate made by the openssl command
+"""
+try:
+    from httplib import HTTPConnection as _PlainHTTPConnection
+except ImportError:
+    from http.client import HTTPConnection as _PlainHTTPConnection
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from lumberyard.stand_in_server import StandInServer
+from lumberyard.tls_session_cache import TLSSessionCache, \
+    default_ssl_context, \
+    set_default_ssl_context
+
+_openssl = shutil.which("openssl") if hasattr(shutil, "which") else None
+
+@unittest.skipIf(_openssl is None, "needs the openssl command")
+class TestTLSSessionCache(unittest.TestCase):
+    """
+    reconnects offer the cached session and the server resumes it
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls._temp_dir = tempfile.mkdtemp()
+        cls._cert_path = os.path.join(cls._temp_dir, "cert.pem")
+        cls._key_path = os.path.join(cls._temp_dir, "key.pem")
+        subprocess.check_call([_openssl, "req", "-x509",
+                               "-newkey", "rsa:2048",
+                               "-nodes",
+                               "-keyout", cls._key_path,
+                               "-out", cls._cert_path,
+                               "-days", "1",
+                               "-subj", "/CN=localhost",
+                               "-addext", "subjectAltName=IP:127.0.0.1"],
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls._temp_dir)
+
+    def setUp(self):
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(self._cert_path, self._key_path)
+        self._server = StandInServer(ssl_context=server_context)
+        self._server.start()
+        self._server.set_key("default", "aaa", b"aaa data")
+        self._client_context = ssl.create_default_context(
+            cafile=self._cert_path)
+
+    def tearDown(self):
+        self._server.stop()
+
+    def _get(self, session_cache):
+        host, port = self._server.base_address.split(":")
+        connection = _PlainHTTPConnection(host, int(port))
+        session_cache.connect(connection, self._client_context)
+        try:
+            connection.request("GET", "/data/aaa")
+            response = connection.getresponse()
+            data = response.read()
+            session_cache.save(connection)
+            return data, connection.sock.session_reused
+        finally:
+            connection.close()
+
+    def test_resumption(self):
+        session_cache = TLSSessionCache()
+        results = [self._get(session_cache) for _ in range(4)]
+        self.assertEqual(results,
+                         [(b"aaa data", False, )] + \
+                         [(b"aaa data", True, )] * 3)
+        stats = session_cache.stats()
+        self.assertEqual(stats["handshakes"], 1)
+        self.assertEqual(stats["resumed"], 3)
+        self.assertEqual(stats["resumption_rate"], 0.75)
+
+    def test_cleared(self):
+        session_cache = TLSSessionCache()
+        self._get(session_cache)
+        session_cache.clear()
+        self.assertEqual(self._get(session_cache), (b"aaa data", False, ))
+
+    def test_default_context(self):
+        self.assertTrue(default_ssl_context() is default_ssl_context())
+        previous = default_ssl_context()
+        try:
+            set_default_ssl_context(self._client_context)
+            self.assertTrue(default_ssl_context() is self._client_context)
+        finally:
+            set_default_ssl_context(previous)
+
+if __name__ == "__main__":
+    unittest.main()
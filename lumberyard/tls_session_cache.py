@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+tls_session_cache.py
+
+class TLSSessionCache
+
+TLS for the connection classes, when NIMBUS_IO_SERVICE_SSL is on.
+
+Every connection shares one SSLContext, from default_ssl_context. By
+default it is ssl.create_default_context(); NIMBUSIO_SSL_CA_FILE names
+extra certificate authorities. set_default_ssl_context installs a context
+configured some other way.
+
+The cache keeps the last TLS session of each host. A connection offers it
+when it reconnects, so the server can resume the session instead of doing
+a full handshake. That matters because a connection is closed after every
+error response, and a pooled connection is replaced when it goes stale.
+
+A session is saved after the handshake and again after each response. With
+TLS 1.3 the server sends the session ticket after the handshake, so it is
+only known once the first response has been read.
+
+stats() counts full handshakes and resumed sessions.
+"""
+try:
+    from httplib import HTTPConnection as _PlainHTTPConnection
+except ImportError:
+    from http.client import HTTPConnection as _PlainHTTPConnection
+import logging
+import os
+import ssl
+import threading
+
+_ca_file = os.environ.get("NIMBUSIO_SSL_CA_FILE")
+
+_default_ssl_context = None
+_default_ssl_context_lock = threading.Lock()
+
+def default_ssl_context():
+    """
+    return the SSLContext shared by every connection
+    """
+    global _default_ssl_context
+    with _default_ssl_context_lock:
+        if _default_ssl_context is None:
+            _default_ssl_context = ssl.create_default_context(cafile=_ca_file)
+        return _default_ssl_context
+
+def set_default_ssl_context(ssl_context):
+    """
+    use this SSLContext for connections created from now on
+    """
+    global _default_ssl_context
+    with _default_ssl_context_lock:
+        _default_ssl_context = ssl_context
+
+class TLSSessionCache(object):
+    """
+    the most recent TLS session for each (host, port)
+    """
+    def __init__(self):
+        self._log = logging.getLogger("TLSSessionCache")
+        self._lock = threading.Lock()
+        # (server_hostname, port) -> ssl.SSLSession
+        self._sessions = dict()
+        self._counters = {
+            "handshakes"        : 0,
+            "resumed"           : 0,
+            "sessions_offered"  : 0,
+            "sessions_saved"    : 0,
+        }
+
+    def _key(self, connection):
+        host = getattr(connection, "_tunnel_host", None) or connection.host
+        port = getattr(connection, "_tunnel_port", None) or connection.port
+        return host, port
+
+    def connect(self, connection, ssl_context):
+        """
+        connection
+            an http.client HTTPConnection (or HTTPSConnection)
+
+        ssl_context
+            the SSLContext to wrap the socket with
+
+        connect the connection's socket, then do the TLS handshake,
+        offering the host's cached session
+        """
+        # the plain TCP connection, including any proxy tunnel
+        _PlainHTTPConnection.connect(connection)
+
+        key = self._key(connection)
+        with self._lock:
+            session = self._sessions.get(key)
+        try:
+            connection.sock = ssl_context.wrap_socket(connection.sock,
+                                                      server_hostname=key[0],
+                                                      session=session)
+        except ssl.SSLError:
+            # the server may refuse the session; forget it
+            with self._lock:
+                self._sessions.pop(key, None)
+            raise
+
+        resumed = connection.sock.session_reused
+        with self._lock:
+            if session is not None:
+                self._counters["sessions_offered"] += 1
+            self._counters["resumed" if resumed else "handshakes"] += 1
+        self._log.debug("{0} TLS session {1}".format(
+            key, ("resumed" if resumed else "negotiated")))
+        self.save(connection)
+
+    def save(self, connection):
+        """
+        remember the connection's current session for its host
+        """
+        sock = connection.sock
+        session = getattr(sock, "session", None)
+        if session is None:
+            return
+        key = self._key(connection)
+        with self._lock:
+            if self._sessions.get(key) is not session:
+                self._sessions[key] = session
+                self._counters["sessions_saved"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def stats(self):
+        """
+        return a dict of counters, with resumption_rate: the fraction of
+        handshakes that resumed a session
+        """
+        with self._lock:
+            result = dict(self._counters)
+            result["hosts"] = len(self._sessions)
+        total = result["handshakes"] + result["resumed"]
+        result["resumption_rate"] = \
+            (float(result["resumed"]) / total if total > 0 else 0.0)
+        return result
+
+_default_tls_session_cache = TLSSessionCache()
+
+def default_tls_session_cache():
+    """
+    return the session cache shared by every connection
+    """
+    return _default_tls_session_cache